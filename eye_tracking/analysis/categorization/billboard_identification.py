@@ -22,88 +22,104 @@ def main(json_filepath, output_filepath, detection_threshold, smoothing_threshol
     smoothing_threshold = float(smoothing_threshold)
     with open(json_filepath, 'r') as f:
         frames = json.load(f)
-        avg_conf, max_conf, min_conf = billboard_confidence_stats(frames)
-        print("Average billboard confidence: %f" % avg_conf)
-        print("Max billboard confidence: %f" % max_conf)
-        print("Min billboard confidence: %f" % min_conf)
-
-        smoothed = []
-        original = []
-        frame_num = []
-        history = [] # each entry corresponds to a billboard instance, its value being its last seen location
-        for i, frame in enumerate(frames):
-            original_boxes = []
-            smoothed_boxes = []
-            for j in range(len(frame['detection_class_labels'])):
-                if (frame['detection_class_labels'][j] == '87' and float(frame['detection_scores'][j]) >= detection_threshold and 
-                  float(frame['detection_boxes'][j][2]) - float(frame['detection_boxes'][j][0]) < 0.5 and 
-                  float(frame['detection_boxes'][j][3]) - float(frame['detection_boxes'][j][1]) < 0.5):
-                    box = frame['detection_boxes'][j]
-
-                    best_metric = 0
-                    most_likely_correspondence = None
-                    for h in range(len(history)):
-                        prev_box, last_seen = history[h]
-                        metric = iou(prev_box, box)
-                        time_gap = (i-last_seen)/fps
-                        if metric >= 0.4 and time_gap <= smoothing_threshold and metric > best_metric:
-                            best_metric = metric
-                            most_likely_correspondence = h
-
-                    if most_likely_correspondence is not None:
-                        # print(best_metric)
-                        prev_box, last_seen = history[most_likely_correspondence]
-                        for step in range(1, i-last_seen):
-                            t = step/(i-last_seen)
-                            inter_ymin = (1-t)*float(prev_box[0]) + t*float(box[0])
-                            inter_xmin = (1-t)*float(prev_box[1]) + t*float(box[1])
-                            inter_ymax = (1-t)*float(prev_box[2]) + t*float(box[2])
-                            inter_xmax = (1-t)*float(prev_box[3]) + t*float(box[3])
-                            smoothed[last_seen+step].append([str(inter_ymin), str(inter_xmin), str(inter_ymax), str(inter_xmax)])
-                        history[most_likely_correspondence] = (box, i)
-                    else:
-                        history.append((box, i))
-                    original_boxes.append(box)
-                    smoothed_boxes.append(box)
-            original.append(original_boxes)
-            smoothed.append(smoothed_boxes)
-            frame_num.append(i)
-        columns = ['Frame', 'Original', 'Smoothed']
-        df = pd.DataFrame(zip(frame_num, original, smoothed), columns=columns)
-        df.to_csv(output_filepath)
-
-def billboard_confidence_stats(frames):
-    """Calculates the max, min, and avg confidence
-    of the most likely billboard detections.
+    detections = detection_table(frames)
+    mask = billboard_mask(detections, detection_threshold)
+    billboards = detections[mask]
+
+    avg_conf, max_conf, min_conf = billboard_confidence_stats(billboards)
+    print("Average billboard confidence: %f" % avg_conf)
+    print("Max billboard confidence: %f" % max_conf)
+    print("Min billboard confidence: %f" % min_conf)
+
+    original, smoothed = track_billboards(billboards, len(frames), smoothing_threshold, fps)
+    columns = ['Frame', 'Original', 'Smoothed']
+    df = pd.DataFrame(zip(range(len(frames)), original, smoothed), columns=columns)
+    df.to_csv(output_filepath)
+
+def detection_table(frames):
+    """Flattens the per-frame detector output into one row per detection,
+    parsing the string scores and box coordinates once.
 
     Keyword arguments:
     frames -- json object contains all detections per frame
     """
-    cumulative_sum = 0
-    frames_with_billboards = 0
-    max_conf = float("-inf")
-    min_conf = float("inf")
-    for i, frame in enumerate(frames):
-        bc = billboard_confidence(frame)
-        if bc != 0:
-            cumulative_sum += bc
-            frames_with_billboards += 1
-
-            max_conf = max(max_conf, bc)
-            min_conf = min(min_conf, bc)
-    return cumulative_sum/frames_with_billboards, max_conf, min_conf
-
-def billboard_confidence(frame):
-    """Returns the confidence of the most likely billboard detection
-    if it exists.
+    counts = [len(frame['detection_class_labels']) for frame in frames]
+    boxes = [box for frame in frames for box in frame['detection_boxes']]
+    coords = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    return pd.DataFrame({
+        'frame': np.repeat(np.arange(len(frames)), counts),
+        'label': [label for frame in frames for label in frame['detection_class_labels']],
+        'score': np.array([s for frame in frames for s in frame['detection_scores']], dtype=np.float64),
+        'ymin': coords[:, 0],
+        'xmin': coords[:, 1],
+        'ymax': coords[:, 2],
+        'xmax': coords[:, 3],
+        'box': boxes,
+    })
+
+def billboard_mask(detections, detection_threshold):
+    """Returns a boolean mask selecting the billboard detections (class label '87')
+    with acceptable score and a bounding box smaller than half the frame.
+
+    Keyword arguments:
+    detections -- output of detection_table
+    detection_threshold -- specifies minimum acceptable detection score
+    """
+    return ((detections['label'] == '87').values
+            & (detections['score'] >= detection_threshold).values
+            & ((detections['ymax'] - detections['ymin']) < 0.5).values
+            & ((detections['xmax'] - detections['xmin']) < 0.5).values)
+
+def track_billboards(billboards, n_frames, smoothing_threshold, fps):
+    """Associates billboard detections across frames and linearly interpolates
+    the boxes of frames in between two associated detections.
+    Returns the original and smoothed box lists for every frame.
+
+    Keyword arguments:
+    billboards -- billboard rows of detection_table, ordered by frame
+    n_frames -- total number of video frames
+    smoothing_threshold -- specifies maximum time delay between associated billboards when smoothing
+    fps -- frame rate of original video
+    """
+    original = [[] for _ in range(n_frames)]
+    smoothed = [[] for _ in range(n_frames)]
+    history = [] # each entry corresponds to a billboard instance, its value being its last seen location
+    for i, box in zip(billboards['frame'].values, billboards['box'].values):
+        best_metric = 0
+        most_likely_correspondence = None
+        for h in range(len(history)):
+            prev_box, last_seen = history[h]
+            metric = iou(prev_box, box)
+            time_gap = (i-last_seen)/fps
+            if metric >= 0.4 and time_gap <= smoothing_threshold and metric > best_metric:
+                best_metric = metric
+                most_likely_correspondence = h
+
+        if most_likely_correspondence is not None:
+            prev_box, last_seen = history[most_likely_correspondence]
+            for step in range(1, i-last_seen):
+                t = step/(i-last_seen)
+                inter_ymin = (1-t)*float(prev_box[0]) + t*float(box[0])
+                inter_xmin = (1-t)*float(prev_box[1]) + t*float(box[1])
+                inter_ymax = (1-t)*float(prev_box[2]) + t*float(box[2])
+                inter_xmax = (1-t)*float(prev_box[3]) + t*float(box[3])
+                smoothed[last_seen+step].append([str(inter_ymin), str(inter_xmin), str(inter_ymax), str(inter_xmax)])
+            history[most_likely_correspondence] = (box, i)
+        else:
+            history.append((box, i))
+        original[i].append(box)
+        smoothed[i].append(box)
+    return original, smoothed
+
+def billboard_confidence_stats(billboards):
+    """Calculates the max, min, and avg confidence
+    of the most likely billboard detections.
 
     Keyword arguments:
-    frame -- TFHub detection result dictionary
+    billboards -- billboard rows of detection_table
     """
-    billboard_scores = [float(frame['detection_scores'][i]) for i in range(len(frame['detection_scores'])) if frame['detection_class_entities'][i] == 'Billboard']
-    if len(billboard_scores) > 0:
-        return billboard_scores[0]
-    return 0
+    per_frame = billboards.groupby('frame')['score'].max()
+    return per_frame.mean(), per_frame.max(), per_frame.min()
 
 def iou(box1, box2):
     """Calculates Intersection over Union of two bounding boxes.
@@ -1,36 +1,158 @@
 import sys
 import numpy as np
-import skimage.io as skio 
+import pandas as pd
+import skimage.io as skio
 import os
 import glob
 import utils
-from scipy import interpolate
+from multiprocessing import Pool
+from scipy import ndimage
 
-if __name__ == "__main__":
-	args = sys.argv[1:]
-	assert(len(args) >= 1)
+def frame_index(path):
+	"""Returns the frame index encoded in a frame<index>.png saliency map filename."""
+	return int(os.path.basename(path).split('.')[0][5:])
 
-	saliency_maps_query = args[0]
-	to_process = glob.glob(saliency_maps_query) # modify path as needed
+def load_saliency_map(path):
+	"""Reads a saliency map as a 2D float array."""
+	smap = skio.imread(path).astype(np.float64)
+	if smap.ndim == 3:
+		smap = smap[..., :3].mean(axis=2)
+	return smap
+
+def fixation_pixels(smap, fixations):
+	"""Converts normalized Pupil fixation positions (origin bottom left) into
+	(row, col) pixel coordinates of the saliency map.
+
+	Keyword arguments:
+	smap -- 2D saliency map
+	fixations -- (N, 2) array of normalized x, y positions
+	"""
+	h, w = smap.shape
+	rows = (1 - fixations[:, 1]) * (h - 1)
+	cols = fixations[:, 0] * (w - 1)
+	return np.vstack((rows, cols))
+
+def sample(smap, coords):
+	"""Bilinearly samples the saliency map at all fixation coordinates at once.
+
+	Keyword arguments:
+	smap -- 2D saliency map
+	coords -- (2, N) array of row, col pixel coordinates
+	"""
+	return ndimage.map_coordinates(smap, coords, order=1, mode='nearest')
+
+def fixation_map(shape, coords, sigma):
+	"""Builds the fixation density of a frame: fixation counts at the nearest
+	pixel, blurred with a gaussian and normalized to sum 1.
+
+	Keyword arguments:
+	shape -- shape of the saliency map
+	coords -- (2, N) array of row, col pixel coordinates
+	sigma -- gaussian standard deviation in pixels
+	"""
+	fmap = np.zeros(shape)
+	rows = np.clip(np.round(coords[0]).astype(int), 0, shape[0] - 1)
+	cols = np.clip(np.round(coords[1]).astype(int), 0, shape[1] - 1)
+	np.add.at(fmap, (rows, cols), 1)
+	fmap = ndimage.gaussian_filter(fmap, sigma)
+	return fmap / fmap.sum()
 
-	# fixations = utils.get_fixations_data() 
-	fixations = [(np.random.uniform(0, 1), np.random.uniform(0, 1)) for _ in to_process] # comment this line and uncomment above when running with actual fixation data
+def nss(smap, values):
+	"""Normalized Scanpath Saliency: mean of the standardized map at the fixations."""
+	std = smap.std()
+	if std == 0:
+		return np.nan
+	return np.mean((values - smap.mean()) / std)
 
-	percentage_fixations_explained = 0
-	n = len(to_process)
+def auc_judd(smap, values):
+	"""AUC-Judd: every saliency value at a fixation is used as a threshold, the
+	true positive rate is the fraction of fixations above it and the false
+	positive rate the fraction of the remaining pixels above it.
+	"""
+	thresholds = np.sort(values)[::-1]
+	n_fix = len(values)
+	n_pixels = smap.size
+	pixels = np.sort(smap.ravel())
+	above = n_pixels - np.searchsorted(pixels, thresholds, side='left')
+	tp = np.concatenate(([0], np.arange(1, n_fix + 1) / n_fix, [1]))
+	fp = np.concatenate(([0], (above - np.arange(1, n_fix + 1)) / (n_pixels - n_fix), [1]))
+	return np.sum(np.diff(fp) * (tp[1:] + tp[:-1]) / 2)
 
-	for i in range(n):
-		image_path = to_process[i]
-		smap = skio.imread(image_path)
-		max_value = np.max(smap)
+def cc(smap, fmap):
+	"""Pearson's correlation coefficient between saliency map and fixation density."""
+	if smap.std() == 0:
+		return np.nan
+	return np.corrcoef(smap.ravel(), fmap.ravel())[0, 1]
 
-		h, w = smap.shape
-		fixation_w = fixations[i][0]*w
-		fixation_h = fixations[i][1]*h
+def kld(smap, fmap, eps=np.finfo(np.float64).eps):
+	"""Kullback-Leibler divergence of the saliency distribution from the fixation density."""
+	total = smap.sum()
+	if total == 0:
+		return np.nan
+	p = smap / total
+	return np.sum(fmap * np.log(eps + fmap / (p + eps)))
 
-		interp = interpolate.RectBivariateSpline(np.arange(h), np.arange(w), smap, kx=1, ky=1) # use linear interpolation to retrieve values for floating point fixations
+def evaluate_frame(job):
+	"""Computes all metrics of one saliency map. Runs in a worker process.
+
+	Keyword arguments:
+	job -- tuple of (frame index, saliency map path, (N, 2) normalized fixations, fixation density sigma)
+	"""
+	frame, path, fixations, sigma = job
+	smap = load_saliency_map(path)
+	coords = fixation_pixels(smap, fixations)
+	values = sample(smap, coords)
+	fmap = fixation_map(smap.shape, coords, sigma)
+	max_value = smap.max()
+	return {
+		'frame': frame,
+		'n_fixations': len(fixations),
+		'explained': np.mean(values / max_value) if max_value > 0 else np.nan,
+		'nss': nss(smap, values),
+		'auc_judd': auc_judd(smap, values),
+		'cc': cc(smap, fmap),
+		'kld': kld(smap, fmap),
+	}
+
+def evaluate(smap_paths, fixations, workers=None, sigma=20, chunksize=16):
+	"""Evaluates the saliency maps against the fixations falling on their frame.
+	Maps are read and scored in parallel worker processes; frames without
+	fixations are skipped. Returns one row of metrics per frame.
+
+	Keyword arguments:
+	smap_paths -- paths of frame<index>.png saliency maps
+	fixations -- table with frame, x and y columns, see utils.get_fixations_table
+	workers -- number of worker processes, defaults to the number of CPUs
+	sigma -- gaussian standard deviation of the fixation density in pixels
+	chunksize -- number of maps sent to a worker at a time
+	"""
+	by_frame = {frame: group[['x', 'y']].values for frame, group in fixations.groupby('frame')}
+	jobs = []
+	for path in smap_paths:
+		frame = frame_index(path)
+		if frame in by_frame:
+			jobs.append((frame, path, by_frame[frame], sigma))
+	jobs.sort(key=lambda job: job[0])
+
+	with Pool(workers) as pool:
+		results = list(pool.imap(evaluate_frame, jobs, chunksize=chunksize))
+	return pd.DataFrame(results, columns=['frame', 'n_fixations', 'explained', 'nss', 'auc_judd', 'cc', 'kld'])
+
+if __name__ == "__main__":
+	args = sys.argv[1:]
+	assert(len(args) >= 1)
+
+	saliency_maps_query = args[0]
+	fixations_path = args[1] if len(args) >= 2 else 'fixations.csv'
+	output_path = args[2] if len(args) >= 3 else 'saliency_evaluation.csv'
+	workers = int(args[3]) if len(args) >= 4 else None
+	to_process = [path for path in glob.glob(saliency_maps_query) if not path.endswith('_big.png')] # modify path as needed
 
-		percentage_fixations_explained += (max_value-interp(fixation_h, fixation_w, grid=False))/max_value # treats smap value at coord as percentage explainable by saliency
-		# percentage_fixations_explained += (1 if (max_value-interp(fixation_h, fixation_w, grid=False))/max_value > 0.8 else 0) # binarizes explainability
+	fixations = utils.get_fixations_table(fixations_path)
+	results = evaluate(to_process, fixations, workers=workers)
+	results.to_csv(output_path, index=False)
 
-	print("Percentage of fixations explained by saliency: %f" % (percentage_fixations_explained/len(fixations)))
\ No newline at end of file
+	print("Evaluated %d frames" % len(results))
+	valid = results['explained'].notna()
+	print("Percentage of fixations explained by saliency: %f" % np.average(results['explained'][valid], weights=results['n_fixations'][valid]))
+	print(results[['nss', 'auc_judd', 'cc', 'kld']].mean().to_string())
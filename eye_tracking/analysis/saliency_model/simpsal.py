@@ -0,0 +1,389 @@
+"""Python port of the simpsal saliency model (simpsal/*.m, Jonathan Harel) so that
+saliency maps can be computed without MATLAB. Only the static channels
+(C, D, I, O) are supported; the temporal channels (F, X, M) need frame stacks.
+
+Usage:
+    python simpsal.py PATH_TO_VIDEO_OR_FRAMES OUTPUT_DIR [fast|pami] [N_WORKERS]
+    python simpsal.py benchmark [N_FRAMES] [N_WORKERS]
+"""
+import sys
+import os
+import glob
+import time
+import cv2
+import numpy as np
+import skimage.io as skio
+from multiprocessing import Pool
+from scipy import ndimage
+
+# RGB -> rgb lookup table of rgb2dkl.m
+LUT_RGB = np.array([
+    [0.024935, 0.0076954, 0.042291], [0.024974, 0.0077395, 0.042346], [0.025013, 0.0077836, 0.042401], [0.025052, 0.0078277, 0.042456],
+    [0.025091, 0.0078717, 0.042511], [0.02513, 0.0079158, 0.042566], [0.025234, 0.007992, 0.042621], [0.025338, 0.0080681, 0.042676],
+    [0.025442, 0.0081443, 0.042731], [0.025545, 0.0082204, 0.042786], [0.025649, 0.0082966, 0.042841], [0.025747, 0.0084168, 0.042952],
+    [0.025844, 0.0085371, 0.043062], [0.025942, 0.0086573, 0.043172], [0.026039, 0.0087776, 0.043282], [0.026136, 0.0088978, 0.043392],
+    [0.026234, 0.0090581, 0.043502], [0.026331, 0.0092184, 0.043612], [0.026429, 0.0093788, 0.043722], [0.026526, 0.0095391, 0.043833],
+    [0.026623, 0.0096994, 0.043943], [0.026818, 0.0099198, 0.044141], [0.027013, 0.01014, 0.044339], [0.027208, 0.010361, 0.044537],
+    [0.027403, 0.010581, 0.044736], [0.027597, 0.010802, 0.044934], [0.027857, 0.010994, 0.04522], [0.028117, 0.011186, 0.045507],
+    [0.028377, 0.011379, 0.045793], [0.028636, 0.011571, 0.046079], [0.028896, 0.011764, 0.046366], [0.029104, 0.012068, 0.046652],
+    [0.029312, 0.012373, 0.046938], [0.029519, 0.012677, 0.047225], [0.029727, 0.012982, 0.047511], [0.029935, 0.013287, 0.047797],
+    [0.030273, 0.013663, 0.048326], [0.03061, 0.01404, 0.048855], [0.030948, 0.014417, 0.049383], [0.031286, 0.014794, 0.049912],
+    [0.031623, 0.01517, 0.050441], [0.032156, 0.015707, 0.051035], [0.032688, 0.016244, 0.05163], [0.033221, 0.016782, 0.052225],
+    [0.033753, 0.017319, 0.052819], [0.034286, 0.017856, 0.053414], [0.034961, 0.018693, 0.054493], [0.035636, 0.019531, 0.055573],
+    [0.036312, 0.020369, 0.056652], [0.036987, 0.021206, 0.057731], [0.037662, 0.022044, 0.058811], [0.038623, 0.023246, 0.060044],
+    [0.039584, 0.024449, 0.061278], [0.040545, 0.025651, 0.062511], [0.041506, 0.026854, 0.063744], [0.042468, 0.028056, 0.064978],
+    [0.043857, 0.029659, 0.066806], [0.045247, 0.031263, 0.068634], [0.046636, 0.032866, 0.070463], [0.048026, 0.034469, 0.072291],
+    [0.049416, 0.036072, 0.074119], [0.051221, 0.038156, 0.076476], [0.053026, 0.04024, 0.078833], [0.054831, 0.042325, 0.081189],
+    [0.056636, 0.044409, 0.083546], [0.058442, 0.046493, 0.085903], [0.06039, 0.048737, 0.087996], [0.062338, 0.050982, 0.090088],
+    [0.064286, 0.053226, 0.092181], [0.066234, 0.055471, 0.094273], [0.068182, 0.057715, 0.096366], [0.070519, 0.06012, 0.098921],
+    [0.072857, 0.062525, 0.10148], [0.075195, 0.06493, 0.10403], [0.077532, 0.067335, 0.10659], [0.07987, 0.069739, 0.10914],
+    [0.082208, 0.072345, 0.11176], [0.084545, 0.07495, 0.11438], [0.086883, 0.077555, 0.117], [0.089221, 0.08016, 0.11963],
+    [0.091558, 0.082766, 0.12225], [0.094026, 0.085611, 0.12533], [0.096494, 0.088457, 0.12841], [0.098961, 0.091303, 0.1315],
+    [0.10143, 0.094148, 0.13458], [0.1039, 0.096994, 0.13767], [0.10688, 0.10028, 0.14119], [0.10987, 0.10357, 0.14471],
+    [0.11286, 0.10685, 0.14824], [0.11584, 0.11014, 0.15176], [0.11883, 0.11343, 0.15529], [0.12208, 0.11695, 0.15903],
+    [0.12532, 0.12048, 0.16278], [0.12857, 0.12401, 0.16652], [0.13182, 0.12754, 0.17026], [0.13506, 0.13106, 0.17401],
+    [0.1387, 0.13499, 0.17819], [0.14234, 0.13892, 0.18238], [0.14597, 0.14285, 0.18656], [0.14961, 0.14677, 0.19075],
+    [0.15325, 0.1507, 0.19493], [0.15727, 0.15519, 0.19956], [0.1613, 0.15968, 0.20419], [0.16532, 0.16417, 0.20881],
+    [0.16935, 0.16866, 0.21344], [0.17338, 0.17315, 0.21806], [0.17805, 0.17796, 0.22291], [0.18273, 0.18277, 0.22775],
+    [0.1874, 0.18758, 0.2326], [0.19208, 0.19238, 0.23744], [0.19675, 0.19719, 0.24229], [0.20156, 0.20224, 0.24758],
+    [0.20636, 0.20729, 0.25286], [0.21117, 0.21234, 0.25815], [0.21597, 0.21739, 0.26344], [0.22078, 0.22244, 0.26872],
+    [0.2261, 0.22806, 0.27423], [0.23143, 0.23367, 0.27974], [0.23675, 0.23928, 0.28524], [0.24208, 0.24489, 0.29075],
+    [0.2474, 0.2505, 0.29626], [0.25299, 0.25651, 0.3022], [0.25857, 0.26253, 0.30815], [0.26416, 0.26854, 0.3141],
+    [0.26974, 0.27455, 0.32004], [0.27532, 0.28056, 0.32599], [0.28156, 0.28697, 0.33238], [0.28779, 0.29339, 0.33877],
+    [0.29403, 0.2998, 0.34515], [0.30026, 0.30621, 0.35154], [0.30649, 0.31263, 0.35793], [0.3126, 0.31904, 0.36388],
+    [0.3187, 0.32545, 0.36982], [0.32481, 0.33186, 0.37577], [0.33091, 0.33828, 0.38172], [0.33701, 0.34469, 0.38767],
+    [0.34325, 0.3511, 0.39361], [0.34948, 0.35752, 0.39956], [0.35571, 0.36393, 0.40551], [0.36195, 0.37034, 0.41145],
+    [0.36818, 0.37675, 0.4174], [0.37429, 0.38317, 0.42313], [0.38039, 0.38958, 0.42885], [0.38649, 0.39599, 0.43458],
+    [0.3926, 0.4024, 0.44031], [0.3987, 0.40882, 0.44604], [0.40494, 0.41523, 0.45198], [0.41117, 0.42164, 0.45793],
+    [0.4174, 0.42806, 0.46388], [0.42364, 0.43447, 0.46982], [0.42987, 0.44088, 0.47577], [0.43623, 0.44689, 0.48128],
+    [0.4426, 0.45291, 0.48678], [0.44896, 0.45892, 0.49229], [0.45532, 0.46493, 0.4978], [0.46169, 0.47094, 0.5033],
+    [0.46792, 0.47695, 0.50837], [0.47416, 0.48297, 0.51344], [0.48039, 0.48898, 0.5185], [0.48662, 0.49499, 0.52357],
+    [0.49286, 0.501, 0.52863], [0.49805, 0.50701, 0.53392], [0.50325, 0.51303, 0.53921], [0.50844, 0.51904, 0.54449],
+    [0.51364, 0.52505, 0.54978], [0.51883, 0.53106, 0.55507], [0.52442, 0.53667, 0.55969], [0.53, 0.54228, 0.56432],
+    [0.53558, 0.5479, 0.56894], [0.54117, 0.55351, 0.57357], [0.54675, 0.55912, 0.57819], [0.55182, 0.56433, 0.58304],
+    [0.55688, 0.56954, 0.58789], [0.56195, 0.57475, 0.59273], [0.56701, 0.57996, 0.59758], [0.57208, 0.58517, 0.60242],
+    [0.57675, 0.58998, 0.60639], [0.58143, 0.59479, 0.61035], [0.5861, 0.5996, 0.61432], [0.59078, 0.60441, 0.61828],
+    [0.59545, 0.60922, 0.62225], [0.60065, 0.61403, 0.62709], [0.60584, 0.61884, 0.63194], [0.61104, 0.62365, 0.63678],
+    [0.61623, 0.62846, 0.64163], [0.62143, 0.63327, 0.64648], [0.62584, 0.63808, 0.65088], [0.63026, 0.64289, 0.65529],
+    [0.63468, 0.6477, 0.65969], [0.63909, 0.65251, 0.6641], [0.64351, 0.65731, 0.6685], [0.64857, 0.66132, 0.67269],
+    [0.65364, 0.66533, 0.67687], [0.6587, 0.66934, 0.68106], [0.66377, 0.67335, 0.68524], [0.66883, 0.67735, 0.68943],
+    [0.67273, 0.68136, 0.69361], [0.67662, 0.68537, 0.6978], [0.68052, 0.68938, 0.70198], [0.68442, 0.69339, 0.70617],
+    [0.68831, 0.69739, 0.71035], [0.69221, 0.7022, 0.7141], [0.6961, 0.70701, 0.71784], [0.7, 0.71182, 0.72159],
+    [0.7039, 0.71663, 0.72533], [0.70779, 0.72144, 0.72907], [0.71169, 0.72505, 0.73348], [0.71558, 0.72866, 0.73789],
+    [0.71948, 0.73226, 0.74229], [0.72338, 0.73587, 0.7467], [0.72727, 0.73948, 0.7511], [0.73247, 0.74349, 0.75507],
+    [0.73766, 0.74749, 0.75903], [0.74286, 0.7515, 0.763], [0.74805, 0.75551, 0.76696], [0.75325, 0.75952, 0.77093],
+    [0.75714, 0.76393, 0.77599], [0.76104, 0.76834, 0.78106], [0.76494, 0.77275, 0.78612], [0.76883, 0.77715, 0.79119],
+    [0.77273, 0.78156, 0.79626], [0.77792, 0.78677, 0.80132], [0.78312, 0.79198, 0.80639], [0.78831, 0.79719, 0.81145],
+    [0.79351, 0.8024, 0.81652], [0.7987, 0.80762, 0.82159], [0.80519, 0.81283, 0.82687], [0.81169, 0.81804, 0.83216],
+    [0.81818, 0.82325, 0.83744], [0.82468, 0.82846, 0.84273], [0.83117, 0.83367, 0.84802], [0.83636, 0.83888, 0.85286],
+    [0.84156, 0.84409, 0.85771], [0.84675, 0.8493, 0.86256], [0.85195, 0.85451, 0.8674], [0.85714, 0.85972, 0.87225],
+    [0.86364, 0.86613, 0.87819], [0.87013, 0.87255, 0.88414], [0.87662, 0.87896, 0.89009], [0.88312, 0.88537, 0.89604],
+    [0.88961, 0.89178, 0.90198], [0.8961, 0.8986, 0.90947], [0.9026, 0.90541, 0.91696], [0.90909, 0.91222, 0.92445],
+    [0.91558, 0.91904, 0.93194], [0.92208, 0.92585, 0.93943], [0.92857, 0.93307, 0.94493], [0.93506, 0.94028, 0.95044],
+    [0.94156, 0.94749, 0.95595], [0.94805, 0.95471, 0.96145], [0.95455, 0.96192, 0.96696], [0.96364, 0.96954, 0.97357],
+    [0.97273, 0.97715, 0.98018], [0.98182, 0.98477, 0.98678], [0.99091, 0.99238, 0.99339], [1, 1, 1],
+])
+
+LMS0 = np.array([34.918538957799996, 19.314796676499999, 0.585610818500000])
+
+M_LMS = np.array([
+    [18.32535, 44.60077, 7.46216],
+    [4.09544, 28.20135, 6.66066],
+    [0.02114, 0.10325, 1.05258],
+])
+
+_fac = 1.0 / (LMS0[0] + LMS0[1])
+_norm = np.sqrt(LMS0[0] ** 2 + LMS0[1] ** 2)
+M_DKL = np.array([
+    [np.sqrt(3.0) * _fac, np.sqrt(3.0) * _fac, 0.0],
+    [_norm / LMS0[0] * _fac, -_norm / LMS0[1] * _fac, 0.0],
+    [-_fac, -_fac, (LMS0[0] + LMS0[1]) / LMS0[2] * _fac],
+]) * np.array([[0.5774], [2.7525], [0.4526]])
+
+
+def default_fast_param():
+    """Parameters of default_fast_param.m, see there for their meaning."""
+    return {
+        'mapWidth': 64,
+        'useMultipleCenterScales': 0,
+        'surroundSig': [5],
+        'useNormWeights': 0,
+        'subtractMin': 1,
+        'channels': 'DI',
+        'nGaborAngles': 4,
+        'centerbias': 0,
+        'blurRadius': 0.04,
+    }
+
+
+def default_pami_param():
+    """Parameters of default_pami_param.m, approximating the original Itti algorithm."""
+    param = default_fast_param()
+    param.update({
+        'channels': 'CIO',
+        'useMultipleCenterScales': 1,
+        'surroundSig': [2, 8],
+        'useNormWeights': 1,
+    })
+    return param
+
+
+def mat2gray(m):
+    """Rescales m to [0, 1]."""
+    lo, hi = m.min(), m.max()
+    if hi == lo:
+        return np.zeros_like(m)
+    return (m - lo) / (hi - lo)
+
+
+def mynorm(m, param):
+    if param['subtractMin']:
+        return mat2gray(m)
+    return m / m.max()
+
+
+def imresize(img, shape):
+    """Antialiased resize standing in for MATLAB's imresize: area averaging when
+    shrinking, bicubic when enlarging.
+    """
+    h, w = int(shape[0]), int(shape[1])
+    shrink = h < img.shape[0] or w < img.shape[1]
+    return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA if shrink else cv2.INTER_CUBIC)
+
+
+def gausskernel(std, nstds):
+    """Normalized 1D gaussian kernel of mygausskernel.m."""
+    maxi = int(round(std * nstds))
+    x = np.arange(-maxi, maxi + 1)
+    k = np.exp(-x ** 2 / (2.0 * std ** 2))
+    return k / k.sum()
+
+
+def blur(img, ker):
+    """Separable convolution with replicated borders, as myconv2(myconv2(img, ker), ker')."""
+    img = ndimage.convolve1d(img, ker, axis=1, mode='nearest')
+    return ndimage.convolve1d(img, ker, axis=0, mode='nearest')
+
+
+def conv2(img, ker):
+    """2D convolution with replicated borders (myconv2.m)."""
+    return cv2.filter2D(img, -1, ker[::-1, ::-1], borderType=cv2.BORDER_REPLICATE)
+
+
+def simple_gabor(angle, phase):
+    """Gabor filter of simpleGabor.m."""
+    major_stddev, minor_stddev, max_stddev = 2, 4, 4
+    sz = int(np.ceil(max_stddev * np.sqrt(10)))
+    psi = np.pi / 180 * phase
+    rt = np.pi / 180 * angle
+    omega = 2
+    co = np.cos(rt)
+    si = -np.sin(rt)
+    vec = np.arange(-sz, sz + 1)
+    major = vec[:, None] * co + vec[None, :] * si
+    minor = vec[:, None] * si - vec[None, :] * co
+    result = np.cos(omega * major + psi) * np.exp(-major ** 2 / (2 * major_stddev ** 2) - minor ** 2 / (2 * minor_stddev ** 2))
+    result = result - result.mean()
+    return result / np.sqrt(np.sum(result ** 2))
+
+
+def rgb2dkl(rgb):
+    """Converts an RGB image in [0, 1] to normalized DKL color space (rgb2dkl.m)."""
+    idx = np.clip(np.ceil(rgb * 255), 1, 256).astype(int) - 1
+    aa = np.stack([LUT_RGB[idx[..., c], c] for c in range(3)], axis=-1)
+    lms = aa @ M_LMS.T - LMS0
+    return lms @ M_DKL.T
+
+
+def attenuate_borders(data, border_size):
+    """Linearly attenuates a border region on all sides of data (attenuateBordersGBVS.m)."""
+    result = data.copy()
+    h, w = data.shape
+    border_size = min(border_size, h // 2, w // 2)
+    if border_size < 1:
+        return result
+    coeffs = np.arange(1, border_size + 1) / (border_size + 1)
+    result[:border_size, :] *= coeffs[:, None]
+    result[h - border_size:, :] *= coeffs[::-1, None]
+    result[:, :border_size] *= coeffs[None, :]
+    result[:, w - border_size:] *= coeffs[None, ::-1]
+    return result
+
+
+def peakiness(m):
+    """Map weight from the mean of its local maxima (mypeakiness.m / mexLocalMaximaGBVS.cc)."""
+    g = mat2gray(m)
+    c = g[1:-1, 1:-1]
+    is_max = ((c >= 0.1) & (c >= g[:-2, 1:-1]) & (c >= g[2:, 1:-1])
+              & (c >= g[1:-1, :-2]) & (c >= g[1:-1, 2:]))
+    num = np.count_nonzero(is_max)
+    if num <= 1:
+        return 1.0
+    return (1 - c[is_max].mean()) ** 2
+
+
+def getchan(imgs, channel, param, gabors):
+    """Feature maps of one channel for every center scale (getchan.m)."""
+    chan = []
+    for img in imgs:
+        if channel == 'I':
+            chan.append(img.mean(axis=2))
+        elif channel == 'C':
+            lum = img.mean(axis=2) + 0.01
+            chan.append(np.abs(img[..., 2] - np.minimum(img[..., 0], img[..., 1])) / lum)
+            chan.append(np.abs(img[..., 0] - img[..., 1]) / lum)
+        elif channel == 'D':
+            dkl = rgb2dkl(img)
+            chan.extend(dkl[..., i] for i in range(3))
+        elif channel == 'O':
+            lum = img.mean(axis=2)
+            for g0, g90 in gabors:
+                f0 = conv2(lum, g0)
+                f90 = conv2(lum, g90)
+                chan.append(attenuate_borders(np.abs(f0) + np.abs(f90), 13))
+        else:
+            raise ValueError("Unsupported channel: %s" % channel)
+    return chan
+
+
+def pixsal(img, param):
+    """Center-surround saliency of one feature map (pixsal.m)."""
+    summap = 0
+    for ssig in param['surroundSig']:
+        ker = gausskernel(ssig, 2)
+        map_ = mynorm((img - blur(img, ker)) ** 2, param)
+        wt = peakiness(map_) if param['useNormWeights'] else 1
+        summap = summap + map_ * wt
+    return mynorm(summap, param)
+
+
+def gausswin(n, alpha=1):
+    x = np.arange(n) - (n - 1) / 2.0
+    return np.exp(-0.5 * (alpha * x / ((n - 1) / 2.0)) ** 2)
+
+
+def simpsal(img, param=None):
+    """Computes the saliency map of an RGB image (simpsal.m).
+
+    Keyword arguments:
+    img -- H x W x 3 uint8 or float image in [0, 1]
+    param -- parameter dictionary, defaults to default_pami_param()
+    """
+    if param is None:
+        param = default_pami_param()
+    if img.dtype == np.uint8:
+        img = img / 255.0
+
+    gabors = []
+    if 'O' in param['channels']:
+        angles = np.linspace(0, 180 - 180 / param['nGaborAngles'], param['nGaborAngles'])
+        gabors = [(simple_gabor(ang, 0), simple_gabor(ang, 90)) for ang in angles]
+
+    map_size = np.array([int(round(img.shape[0] / img.shape[1] * param['mapWidth'])), param['mapWidth']])
+    if param['useMultipleCenterScales']:
+        imgs = [imresize(img, map_size * 2), imresize(img, map_size), imresize(img, np.round(map_size / 2).astype(int))]
+    else:
+        imgs = [imresize(img, map_size)]
+
+    channels = param['channels']
+    if img.ndim != 3 or img.shape[2] != 3:
+        channels = ''.join(c for c in channels if c not in 'CD')
+        imgs = [i[..., None].repeat(3, axis=2) if i.ndim == 2 else i for i in imgs]
+
+    chanmaps = []
+    for channel in channels:
+        chanmap = 0
+        sum_w = 0
+        for feature in getchan(imgs, channel, param, gabors):
+            m = pixsal(feature, param)
+            wj = peakiness(m) if param['useNormWeights'] else 1
+            chanmap = chanmap + wj * imresize(m, map_size)
+            sum_w += wj
+        chanmaps.append(chanmap / sum_w)
+
+    smap = 0
+    for chanmap in chanmaps:
+        wt = peakiness(chanmap) if param['useNormWeights'] else 1
+        smap = smap + wt * chanmap
+
+    if param['blurRadius'] > 0:
+        smap = blur(smap, gausskernel(param['blurRadius'] * smap.shape[0], 1.5))
+
+    if param['centerbias']:
+        smap = smap * np.outer(gausswin(smap.shape[0]), gausswin(smap.shape[1]))
+
+    return mynorm(smap, param)
+
+
+def read_frames(source):
+    """Yields (frame index, RGB frame) of a video file or of a directory of frame<index>.png images."""
+    if os.path.isfile(source):
+        video = cv2.VideoCapture(source)
+        index = 0
+        success, frame = video.read()
+        while success:
+            yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            index += 1
+            success, frame = video.read()
+        video.release()
+    else:
+        for path in glob.glob(os.path.join(source, 'frame*.png')):
+            index = int(os.path.basename(path).split('.')[0][5:])
+            yield index, cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+
+
+def _process_frame(job):
+    """Computes and writes the saliency map of one frame. Runs in a worker process."""
+    index, frame, output_dir, param = job
+    smap = simpsal(frame, param)
+    if output_dir is not None:
+        skio.imsave(os.path.join(output_dir, 'frame%d.png' % index), (smap * 255).round().astype(np.uint8), check_contrast=False)
+    return index
+
+
+def run(source, output_dir, param=None, workers=None, chunksize=4):
+    """Writes the saliency map of every frame of source to output_dir as
+    frame<index>.png, the layout consumed by evaluate.py. Frames are decoded in
+    this process and handed to a pool of workers. Returns the frames per second.
+
+    Keyword arguments:
+    source -- path to the world video or to a directory of frame<index>.png images
+    output_dir -- directory for the saliency maps, None to discard them
+    param -- parameter dictionary, defaults to default_fast_param()
+    workers -- number of worker processes, defaults to the number of CPUs
+    chunksize -- number of frames sent to a worker at a time
+    """
+    if param is None:
+        param = default_fast_param()
+    if output_dir is not None and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    jobs = ((index, frame, output_dir, param) for index, frame in source)
+    start = time.perf_counter()
+    with Pool(workers) as pool:
+        n_frames = sum(1 for _ in pool.imap_unordered(_process_frame, jobs, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+    return n_frames / elapsed if elapsed > 0 else float('inf')
+
+
+def benchmark(n_frames=200, workers=None, frame_shape=(720, 1280, 3)):
+    """Prints the frames per second of run() on random frames for both parameter sets."""
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, size=frame_shape, dtype=np.uint8)
+    for name, param in (('fast', default_fast_param()), ('pami', default_pami_param())):
+        fps = run(((i, frame) for i in range(n_frames)), None, param, workers)
+        print("%s: %.1f frames per second" % (name, fps))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    assert(len(args) >= 1)
+    if args[0] == 'benchmark':
+        n_frames = int(args[1]) if len(args) >= 2 else 200
+        workers = int(args[2]) if len(args) >= 3 else None
+        benchmark(n_frames, workers)
+    else:
+        assert(len(args) >= 2)
+        param = default_pami_param() if len(args) >= 3 and args[2] == 'pami' else default_fast_param()
+        workers = int(args[3]) if len(args) >= 4 else None
+        fps = run(read_frames(args[0]), args[1], param, workers)
+        print("Saliency maps computed at %.1f frames per second" % fps)
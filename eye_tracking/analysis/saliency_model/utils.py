@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def get_fixations_data():
@@ -24,4 +25,24 @@ def get_fixations_data():
                 fixations.append((0, 0))
 
         prev_start = row['end_frame_index']
-    return fixations
\ No newline at end of file
+    return fixations
+
+def get_fixations_table(path='fixations.csv', min_confidence=0.8):
+    """Expands the detected fixations into one row per (frame, fixation),
+    without the (0, 0) placeholders used by get_fixations_data.
+    Columns are frame, x and y in normalized Pupil coordinates.
+
+    Keyword arguments:
+    path -- path to the Pupil Player fixations export
+    min_confidence -- fixations below this confidence are dropped
+    """
+    df = pd.read_csv(path, usecols=['start_frame_index', 'end_frame_index', 'norm_pos_x', 'norm_pos_y', 'confidence'])
+    df = df[df['confidence'] > min_confidence]
+    start = df['start_frame_index'].values
+    n_frames = np.maximum(df['end_frame_index'].values - start, 1)
+    offsets = np.arange(n_frames.sum()) - np.repeat(np.cumsum(n_frames) - n_frames, n_frames)
+    return pd.DataFrame({
+        'frame': np.repeat(start, n_frames) + offsets,
+        'x': np.repeat(df['norm_pos_x'].values, n_frames),
+        'y': np.repeat(df['norm_pos_y'].values, n_frames),
+    })
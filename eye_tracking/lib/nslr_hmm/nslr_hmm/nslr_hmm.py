@@ -2,9 +2,10 @@
 # Released under AGPL-3.0, see LICENSE.
 
 import numpy as np
+import scipy.special
 import scipy.stats
 import nslr
-import itertools
+from multiprocessing import Pool
 
 class ObservationModel:
     def __init__(self, dists):
@@ -21,6 +22,11 @@ class ObservationModel:
         scores = []
         scores = [dist.pdf(d) for dist in self.dists]
         return np.array(scores).T
+
+    def log_liks(self, d):
+        """Log-likelihoods of all observations d (T x D) at once, as a T x N array."""
+        d = np.atleast_2d(d)
+        return np.column_stack([np.atleast_1d(dist.logpdf(d)) for dist in self.dists])
     
     def classify(self, d):
         return np.argmax(self.liks(d), axis=1)
@@ -68,38 +74,62 @@ def safelog(x):
     return np.log10(np.clip(x, 1e-6, None))
 
 def viterbi(initial_probs, transition_probs, emissions):
-    n_states = len(initial_probs)
-    emissions = iter(emissions)
-    emission = next(emissions)
-    transition_probs = safelog(transition_probs)
-    probs = safelog(emission) + safelog(initial_probs)
-    state_stack = []
-    
-    for emission in emissions:
-        emission /= np.sum(emission)
-        trans_probs = transition_probs + np.row_stack(probs)
-        most_likely_states = np.argmax(trans_probs, axis=0)
-        probs = safelog(emission) + trans_probs[most_likely_states, np.arange(n_states)]
-        state_stack.append(most_likely_states)
-    
-    state_seq = [np.argmax(probs)]
+    with np.errstate(divide='ignore'):
+        log_emissions = np.log(np.array(list(emissions), dtype=float))
+    return viterbi_log(initial_probs, transition_probs, log_emissions)
+
+def viterbi_log(initial_probs, transition_probs, log_emissions):
+    """Most likely state sequence given the T x N log-likelihoods of the observations.
 
-    while state_stack:
-        most_likely_states = state_stack.pop()
-        state_seq.append(most_likely_states[state_seq[-1]])
+    As in the original likelihood-space implementation, all but the first
+    emission are normalized and all probabilities are floored at 1e-6.
+    """
+    log_emissions = np.asarray(log_emissions, dtype=float)
+    T, n_states = log_emissions.shape
+    floor = np.log(1e-6)
+    log_emissions = log_emissions.copy()
+    log_emissions[1:] -= scipy.special.logsumexp(log_emissions[1:], axis=1, keepdims=True)
+    log_emissions = np.maximum(log_emissions, floor)
+    log_trans = np.log(np.clip(transition_probs, 1e-6, None))
 
-    state_seq.reverse()
+    probs = log_emissions[0] + np.log(np.clip(initial_probs, 1e-6, None))
+    state_stack = np.empty((max(T - 1, 0), n_states), dtype=int)
+    states = np.arange(n_states)
+    for i in range(1, T):
+        trans_probs = log_trans + probs[:, np.newaxis]
+        most_likely_states = np.argmax(trans_probs, axis=0)
+        probs = log_emissions[i] + trans_probs[most_likely_states, states]
+        state_stack[i - 1] = most_likely_states
 
-    return state_seq
+    state_seq = np.empty(T, dtype=int)
+    state_seq[-1] = np.argmax(probs)
+    for i in range(T - 2, -1, -1):
+        state_seq[i] = state_stack[i, state_seq[i + 1]]
+
+    return list(state_seq)
 
 def forward_backward(transition_probs, observations, initial_probs=None):
-    observations = np.array(list(observations))
+    with np.errstate(divide='ignore'):
+        log_observations = np.log(np.array(list(observations), dtype=float))
+    return forward_backward_log(transition_probs, log_observations, initial_probs)
+
+def forward_backward_log(transition_probs, log_observations, initial_probs=None):
+    """Forward-backward pass given the T x N log-likelihoods of the observations.
+
+    Each row of likelihoods is rescaled by its maximum in log space before
+    leaving it, so segments with tiny likelihoods don't underflow. The
+    recursions renormalize at every step, which makes the per-row scale
+    irrelevant to the (normalized) results.
+    """
+    log_observations = np.asarray(log_observations, dtype=float)
     N = len(transition_probs)
-    T = len(observations)
+    T = len(log_observations)
     if initial_probs is None:
         initial_probs = np.ones(N)
         initial_probs /= np.sum(initial_probs)
-    
+
+    observations = np.exp(log_observations - np.max(log_observations, axis=1, keepdims=True))
+
     forward_probs = np.zeros((T, N))
     backward_probs = forward_probs.copy()
     probs = initial_probs
@@ -107,14 +137,14 @@ def forward_backward(transition_probs, observations, initial_probs=None):
         probs = np.dot(probs, transition_probs)*observations[i]
         probs /= np.sum(probs)
         forward_probs[i] = probs
-    
+
     probs = np.ones(N)
     probs /= np.sum(probs)
     for i in range(T-1, -1, -1):
-        probs = np.dot(transition_probs, (probs*observations[i]).T)
+        probs = np.dot(transition_probs, probs*observations[i])
         probs /= np.sum(probs)
         backward_probs[i] = probs
-    
+
     state_probs = forward_probs*backward_probs
     state_probs /= np.sum(state_probs, axis=1).reshape(-1, 1)
     return state_probs, forward_probs, backward_probs
@@ -125,15 +155,25 @@ def dataset_features(data, **nslrargs):
     return features
 
 def transition_estimates(obs, trans, forward, backward):
-    T, N = len(obs), len(trans)
-    ests = np.zeros((T, N, N))
-    for start, end, i in itertools.product(range(N), range(N), range(T)):
-        if i == T - 1:
-            b = 1/N
-        else:
-            b = backward[i+1, end]
-        ests[i,start,end] = forward[i,start]*b*trans[start,end]
-    return ests
+    N = len(trans)
+    next_backward = np.vstack((backward[1:], np.full((1, N), 1/N)))
+    return np.einsum('ts,se,te->tse', forward, trans, next_backward)
+
+def _map_sessions(func, jobs, n_workers):
+    if n_workers is None or n_workers <= 1:
+        return list(map(func, jobs))
+    with Pool(n_workers) as pool:
+        return pool.map(func, jobs)
+
+def _session_forward_backward(job):
+    features, transition_probs, observation_model, initial_probs = job
+    log_liks = observation_model.log_liks(features)
+    probs, forward, backward = forward_backward_log(transition_probs, log_liks, initial_probs)
+    return probs, transition_estimates(log_liks, transition_probs, forward, backward)
+
+def _session_viterbi(job):
+    features, transition_probs, observation_model, initial_probs = job
+    return viterbi_log(initial_probs, transition_probs, observation_model.log_liks(features))
 
 def reestimate_observations_baum_welch(sessions,
         transition_probs=GazeTransitionModel,
@@ -142,8 +182,11 @@ def reestimate_observations_baum_welch(sessions,
         estimate_observation_model=True,
         estimate_transition_model=True,
         n_iterations=30,
-        plot_process=False):
-    
+        plot_process=False,
+        n_workers=None):
+    """Re-estimates the models with Baum-Welch. The forward-backward pass of
+    the sessions runs in n_workers processes when n_workers > 1.
+    """
     all_observations = np.vstack(sessions)
     
     if plot_process:
@@ -164,11 +207,10 @@ def reestimate_observations_baum_welch(sessions,
 
         # Compute state and transition probabilities
         # for all segments using the forward-backward algorithm
-        for features in sessions:
-            liks = np.array([observation_model.liks(f) for f in features])
-            probs, forward, backward = forward_backward(transition_probs, liks, initial_probs)
+        jobs = [(features, transition_probs, observation_model, initial_probs) for features in sessions]
+        for probs, transitions in _map_sessions(_session_forward_backward, jobs, n_workers):
             all_state_probs.extend(probs)
-            all_transition_probs.append(transition_estimates(liks, transition_probs, forward, backward))
+            all_transition_probs.append(transitions)
 
         all_state_probs = np.array(all_state_probs)
         all_transition_probs = np.vstack(all_transition_probs)
@@ -212,8 +254,11 @@ def reestimate_observations_viterbi_robust(
         estimate_observation_model=True,
         estimate_transition_model=True,
         n_iterations=30,
-        plot_process=False):
-        
+        plot_process=False,
+        n_workers=None):
+    """Re-estimates the models from Viterbi paths. The Viterbi pass of the
+    sessions runs in n_workers processes when n_workers > 1.
+    """
     from sklearn.covariance import MinCovDet
     all_observations = np.vstack(sessions)
     
@@ -237,11 +282,9 @@ def reestimate_observations_viterbi_robust(
     for iteration in range(n_iterations):
         all_states = []
         all_transitions = np.zeros((N, N))
-        for features in sessions:
-            liks = np.array([observation_model.liks(f) for f in features])
-            states = viterbi(initial_probs, transition_probs, liks)
-            for i in range(len(states) - 1):
-                all_transitions[states[i], states[i+1]] += 1
+        jobs = [(features, transition_probs, observation_model, initial_probs) for features in sessions]
+        for states in _map_sessions(_session_viterbi, jobs, n_workers):
+            np.add.at(all_transitions, (states[:-1], states[1:]), 1)
             all_states.extend(states)
         all_states = np.array(all_states)
         if plot_process:
@@ -317,9 +360,10 @@ def classify_segments(segments,
     if initial_probabilities is None:
         initial_probabilities = np.ones(len(transition_model))
         initial_probabilities /= np.sum(initial_probabilities)
-    observation_likelihoods = (observation_model.liks(f) for f in segment_features(segments))
+    features = np.array(list(segment_features(segments)))
+    log_likelihoods = observation_model.log_liks(features)
 
-    path = viterbi(initial_probabilities, transition_model, observation_likelihoods)
+    path = viterbi_log(initial_probabilities, transition_model, log_likelihoods)
     return observation_model.idxclass[path]
     
 def classify_gaze(ts, xs, **kwargs):
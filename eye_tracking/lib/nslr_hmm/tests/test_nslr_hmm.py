@@ -0,0 +1,146 @@
+# Numerical equivalence of the array-native HMM core with the original
+# per-step implementation, which is kept here as the reference.
+
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip("nslr")
+
+import nslr_hmm
+from nslr_hmm import safelog
+
+
+def reference_viterbi(initial_probs, transition_probs, emissions):
+    n_states = len(initial_probs)
+    emissions = iter(emissions)
+    emission = next(emissions)
+    transition_probs = safelog(transition_probs)
+    probs = safelog(emission) + safelog(initial_probs)
+    state_stack = []
+
+    for emission in emissions:
+        emission /= np.sum(emission)
+        trans_probs = transition_probs + np.row_stack(probs)
+        most_likely_states = np.argmax(trans_probs, axis=0)
+        probs = safelog(emission) + trans_probs[most_likely_states, np.arange(n_states)]
+        state_stack.append(most_likely_states)
+
+    state_seq = [np.argmax(probs)]
+
+    while state_stack:
+        most_likely_states = state_stack.pop()
+        state_seq.append(most_likely_states[state_seq[-1]])
+
+    state_seq.reverse()
+
+    return state_seq
+
+
+def reference_forward_backward(transition_probs, observations, initial_probs=None):
+    observations = np.array(list(observations))
+    N = len(transition_probs)
+    T = len(observations)
+    if initial_probs is None:
+        initial_probs = np.ones(N)
+        initial_probs /= np.sum(initial_probs)
+
+    forward_probs = np.zeros((T, N))
+    backward_probs = forward_probs.copy()
+    probs = initial_probs
+    for i in range(T):
+        probs = np.dot(probs, transition_probs)*observations[i]
+        probs /= np.sum(probs)
+        forward_probs[i] = probs
+
+    probs = np.ones(N)
+    probs /= np.sum(probs)
+    for i in range(T-1, -1, -1):
+        probs = np.dot(transition_probs, (probs*observations[i]).T)
+        probs /= np.sum(probs)
+        backward_probs[i] = probs
+
+    state_probs = forward_probs*backward_probs
+    state_probs /= np.sum(state_probs, axis=1).reshape(-1, 1)
+    return state_probs, forward_probs, backward_probs
+
+
+def reference_transition_estimates(obs, trans, forward, backward):
+    T, N = len(obs), len(trans)
+    ests = np.zeros((T, N, N))
+    for start, end, i in itertools.product(range(N), range(N), range(T)):
+        if i == T - 1:
+            b = 1/N
+        else:
+            b = backward[i+1, end]
+        ests[i,start,end] = forward[i,start]*b*trans[start,end]
+    return ests
+
+
+def synthetic_session(seed, n_segments=300):
+    """Segment features drawn from the classes of the default observation model."""
+    rng = np.random.RandomState(seed)
+    model = nslr_hmm.GazeObservationModel
+    classes = rng.randint(0, len(model.dists), size=n_segments)
+    return np.array([model.dists[c].rvs(random_state=rng) for c in classes])
+
+
+@pytest.fixture(params=[0, 1, 2])
+def session(request):
+    return synthetic_session(request.param)
+
+
+def test_log_liks_matches_liks(session):
+    model = nslr_hmm.GazeObservationModel
+    liks = np.array([model.liks(f) for f in session])
+    assert np.allclose(np.exp(model.log_liks(session)), liks)
+
+
+def test_viterbi_matches_reference(session):
+    model = nslr_hmm.GazeObservationModel
+    trans = nslr_hmm.GazeTransitionModel
+    initial = np.ones(len(trans)) / len(trans)
+    liks = np.array([model.liks(f) for f in session])
+
+    expected = reference_viterbi(initial, trans, liks.copy())
+    assert nslr_hmm.viterbi(initial, trans, liks.copy()) == expected
+    assert nslr_hmm.viterbi_log(initial, trans, model.log_liks(session)) == expected
+
+
+def test_forward_backward_matches_reference(session):
+    model = nslr_hmm.GazeObservationModel
+    trans = nslr_hmm.GazeTransitionModel
+    liks = np.array([model.liks(f) for f in session])
+
+    expected = reference_forward_backward(trans, liks)
+    for actual in (
+        nslr_hmm.forward_backward(trans, liks),
+        nslr_hmm.forward_backward_log(trans, model.log_liks(session)),
+    ):
+        for a, e in zip(actual, expected):
+            assert np.allclose(a, e)
+
+
+def test_transition_estimates_matches_reference(session):
+    model = nslr_hmm.GazeObservationModel
+    trans = nslr_hmm.GazeTransitionModel
+    liks = np.array([model.liks(f) for f in session])
+    _, forward, backward = reference_forward_backward(trans, liks)
+
+    expected = reference_transition_estimates(liks, trans, forward, backward)
+    assert np.allclose(nslr_hmm.transition_estimates(liks, trans, forward, backward), expected)
+
+
+def test_baum_welch_parallel_matches_serial():
+    sessions = [synthetic_session(seed, 100) for seed in range(4)]
+    serial_trans, serial_model = nslr_hmm.reestimate_observations_baum_welch(
+        sessions, n_iterations=3
+    )
+    parallel_trans, parallel_model = nslr_hmm.reestimate_observations_baum_welch(
+        sessions, n_iterations=3, n_workers=2
+    )
+    assert np.allclose(serial_trans, parallel_trans)
+    for serial, parallel in zip(serial_model.dists, parallel_model.dists):
+        assert np.allclose(serial.mean, parallel.mean)
+        assert np.allclose(serial.cov, parallel.cov)
@@ -9,11 +9,16 @@ See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
 
+import bisect
+import heapq
+import itertools
 import logging
 import multiprocessing as mp
+import os
 import signal
 from ctypes import c_bool
 
+import numpy as np
 import zmq
 
 import zmq_tools
@@ -168,6 +173,132 @@ class IPC_Logging_Task_Proxy(Task_Proxy):
         logger.root.setLevel(logging.NOTSET)
 
 
+class Sharded_Task_Proxy:
+    """Fills a cache in several background tasks that share its index range
+
+    The index range is split into shards, up to `workers` of them are processed at a
+    time. `start_shard(visited_list, seek_idx)` starts the task of a shard: a
+    Task_Proxy that yields `(idx, result)` for every index that is not visited yet,
+    like `surface_tracker.background_tasks.video_processing_generator`. All indices
+    outside of the shard are marked visited in its `visited_list`.
+
+    `fetch()` returns the results of all tasks in index order. Setting
+    `seek_idx.value` reprioritizes the shard that contains the index: its task seeks
+    to the index if it is running, else the shard is started next, preempting the
+    most recently started task if all workers are busy.
+    """
+
+    def __init__(
+        self,
+        start_shard,
+        visited_list,
+        seek_idx,
+        workers=None,
+        min_shard_len=1,
+        shards_per_worker=4,
+        context=...,
+    ):
+        if context is ...:
+            context = mp.get_context()
+        self._start_shard = start_shard
+        self._context = context
+        self._seek_idx = seek_idx
+        self._visited = np.array(visited_list, dtype=bool)
+        self.workers = max(1, workers or os.cpu_count() or 1)
+
+        length = len(self._visited)
+        num_shards = min(
+            self.workers * shards_per_worker, max(1, length // max(1, min_shard_len))
+        )
+        self._shard_starts = np.linspace(0, length, num_shards + 1).astype(int)
+        self._pending = [
+            shard
+            for shard in range(num_shards)
+            if not self._visited[self._shard_slice(shard)].all()
+        ]
+        self._running = {}
+        self._results = []
+        self._counter = itertools.count()
+        self._canceled = False
+
+        self._handle_seek()
+        self._start_pending()
+
+    def _shard_slice(self, shard):
+        return slice(self._shard_starts[shard], self._shard_starts[shard + 1])
+
+    def _start(self, shard, seek_idx=-1):
+        shard_visited = np.ones_like(self._visited)
+        shard_slice = self._shard_slice(shard)
+        shard_visited[shard_slice] = self._visited[shard_slice]
+        shard_seek_idx = self._context.Value("i", seek_idx)
+        task = self._start_shard(shard_visited.tolist(), shard_seek_idx)
+        self._running[shard] = task, shard_seek_idx
+
+    def _start_pending(self):
+        while self._pending and len(self._running) < self.workers:
+            self._start(self._pending.pop(0))
+
+    def _collect(self, shard):
+        task, _ = self._running[shard]
+        for idx, result in task.fetch():
+            self._visited[idx] = True
+            heapq.heappush(self._results, (idx, next(self._counter), result))
+        if task.completed or task.canceled:
+            del self._running[shard]
+
+    def _handle_seek(self):
+        idx = self._seek_idx.value
+        if idx == -1:
+            return
+        self._seek_idx.value = -1
+
+        shard = bisect.bisect_right(self._shard_starts, idx) - 1
+        if idx < 0 or shard >= len(self._shard_starts) - 1:
+            return
+        if shard in self._running:
+            self._running[shard][1].value = idx
+        elif shard in self._pending:
+            self._pending.remove(shard)
+            if len(self._running) >= self.workers:
+                preempted = list(self._running)[-1]
+                self._collect(preempted)
+                if preempted in self._running:
+                    self._running.pop(preempted)[0].cancel()
+                    self._pending.insert(0, preempted)
+            self._start(shard, idx)
+
+    def fetch(self):
+        """Fetches available results from all shards, ordered by index"""
+        if self.completed or self.canceled:
+            return
+
+        self._handle_seek()
+        for shard in list(self._running):
+            self._collect(shard)
+        self._start_pending()
+
+        while self._results:
+            idx, _, result = heapq.heappop(self._results)
+            yield idx, result
+
+    def cancel(self, timeout=1):
+        for task, _ in self._running.values():
+            task.cancel(timeout)
+        self._running.clear()
+        self._pending.clear()
+        self._results.clear()
+        self._canceled = True
+
+    @property
+    def completed(self):
+        return not (self._canceled or self._running or self._pending or self._results)
+
+    @property
+    def canceled(self):
+        return self._canceled
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.DEBUG,
@@ -0,0 +1,611 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+import types
+from multiprocessing import cpu_count
+
+import numpy as np
+import zmq
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    # Make all pupil shared_modules available to this Python session.
+    pupil_base_dir = os.path.abspath(__file__).rsplit("pupil_src", 1)[0]
+    sys.path.append(os.path.join(pupil_base_dir, "pupil_src", "shared_modules"))
+
+# Only modules without GL and pyglui, the exports run without Pupil Player
+import background_helper as bh
+import blink_detection_utils
+import file_methods as fm
+import fixation_detector_utils
+import player_methods as pm
+import raw_data_exporter_utils
+import zmq_tools
+from pupil_recording import RecordingInfoFile
+from surface_tracker import surface_tracker_headless
+from surface_tracker.surface_marker_detector import (
+    DEFAULT_DETECTOR_MODE,
+    MarkerDetectorMode,
+)
+
+
+def is_pupil_rec_dir(data_dir):
+    """True for recordings in the Pupil Player format, i.e. with an info file"""
+    return RecordingInfoFile.does_recording_contain_info_file(data_dir)
+
+
+def get_recording_dirs(data_dir):
+    """
+    You can supply a data folder or any folder
+    - all folders within will be checked for necessary files
+    - in order to make a visualization
+    """
+    if is_pupil_rec_dir(data_dir):
+        yield data_dir
+    for root, dirs, files in os.walk(data_dir):
+        for d in dirs:
+            joined = os.path.join(root, d)
+            if not d.startswith(".") and is_pupil_rec_dir(joined):
+                yield joined
+
+
+EXPORTERS = ("raw_data", "fixations", "blinks", "surfaces")
+EXPORT_MANIFEST_FILE_NAME = "export_manifest.json"
+EXPORT_MANIFEST_VERSION = 1
+
+DEFAULT_EXPORT_SETTINGS = {
+    "min_data_confidence": 0.6,
+    "export_format": "csv",
+    "fixation_max_dispersion": 1.5,
+    "fixation_min_duration": 80,
+    "fixation_max_duration": 220,
+    "blink_history_length": 0.2,
+    "blink_onset_confidence_threshold": 0.5,
+    "blink_offset_confidence_threshold": 0.5,
+    "surface_marker_detector_mode": DEFAULT_DETECTOR_MODE.as_tuple(),
+    "surface_marker_min_perimeter": 60,
+}
+
+
+def export_dir_for_recording(rec_dir, destination_dir=None):
+    """Directory of the batch export of `rec_dir`, in the recording if no
+    `destination_dir` is given."""
+    if destination_dir is None:
+        return os.path.join(rec_dir, "exports", "batch")
+    # make a unique name created from rec_session and dir name
+    rec_session, rec_name = os.path.abspath(rec_dir).rsplit(os.path.sep, 2)[1:]
+    return os.path.join(destination_dir, rec_session + "_" + rec_name)
+
+
+def _json_compatible(data):
+    # e.g. tuples become lists, such that data compares equal to loaded data
+    return json.loads(json.dumps(data))
+
+
+def _write_json(path, data):
+    # write to a temporary file first, readers never see partially written files
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def recording_fingerprint(rec_dir):
+    """Size and modification time of the files in the recording directory"""
+    fingerprint = {}
+    for entry in os.scandir(rec_dir):
+        if entry.is_file() and not entry.name.startswith("."):
+            stat = entry.stat()
+            fingerprint[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def read_export_manifest(export_dir):
+    try:
+        with open(os.path.join(export_dir, EXPORT_MANIFEST_FILE_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_export_manifest(export_dir, rec_dir, exporters, settings):
+    """Record the exported files, the export settings and the state of the
+    recording, see `is_export_complete`."""
+    files = {}
+    for root, _, file_names in os.walk(export_dir):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            files[os.path.relpath(path, export_dir)] = os.path.getsize(path)
+    files.pop(EXPORT_MANIFEST_FILE_NAME, None)
+    manifest = {
+        "version": EXPORT_MANIFEST_VERSION,
+        "rec_dir": os.path.abspath(rec_dir),
+        "exporters": list(exporters),
+        "settings": _json_compatible(settings),
+        "recording": recording_fingerprint(rec_dir),
+        "files": files,
+        "completed": time.time(),
+    }
+    _write_json(os.path.join(export_dir, EXPORT_MANIFEST_FILE_NAME), manifest)
+
+
+def is_export_complete(rec_dir, export_dir, exporters, settings):
+    """True if `export_dir` contains a complete export of `exporters` with the same
+    settings, and neither the recording nor the exported files changed since."""
+    manifest = read_export_manifest(export_dir)
+    if manifest is None or manifest.get("version") != EXPORT_MANIFEST_VERSION:
+        return False
+    if not set(exporters).issubset(manifest["exporters"]):
+        return False
+    if manifest["settings"] != _json_compatible(settings):
+        return False
+    if manifest["recording"] != recording_fingerprint(rec_dir):
+        return False
+    for file_name, size in manifest["files"].items():
+        path = os.path.join(export_dir, file_name)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+    return True
+
+
+class _Recording_Data:
+    """Recording data shared by the exporters, loaded when it is first used"""
+
+    def __init__(self, rec_dir, capture):
+        self.rec_dir = rec_dir
+        self.capture = capture
+        self.timestamps = capture.timestamps
+        self._pupil_positions = None
+        self._gaze_positions = None
+
+    @property
+    def pupil_positions(self):
+        if self._pupil_positions is None:
+            self._pupil_positions = pm.PupilDataBisector(
+                fm.load_pldata_file(self.rec_dir, "pupil")
+            )
+        return self._pupil_positions
+
+    @property
+    def gaze_positions(self):
+        if self._gaze_positions is None:
+            gaze = fm.load_pldata_file(self.rec_dir, "gaze")
+            self._gaze_positions = pm.Bisector(gaze.data, gaze.timestamps)
+        return self._gaze_positions
+
+    def progress_at(self, ts):
+        start, stop = self.timestamps[0], self.timestamps[-1]
+        if stop <= start:
+            return 0.0
+        return min(max(float((ts - start) / (stop - start)), 0.0), 1.0)
+
+
+def _export_raw_data(recording, export_dir, export_window, settings):
+    yield "Exporting pupil positions", 0.0
+    raw_data_exporter_utils.Pupil_Positions_Exporter().export_write(
+        positions_bisector=recording.pupil_positions[..., ...],
+        timestamps=recording.timestamps,
+        export_window=export_window,
+        export_dir=export_dir,
+        export_format=settings["export_format"],
+    )
+    yield "Exporting gaze positions", 0.5
+    raw_data_exporter_utils.Gaze_Positions_Exporter().export_write(
+        positions_bisector=recording.gaze_positions,
+        timestamps=recording.timestamps,
+        export_window=export_window,
+        export_dir=export_dir,
+        export_format=settings["export_format"],
+    )
+    raw_data_exporter_utils.write_field_info(export_dir)
+
+
+def _export_fixations(recording, export_dir, export_window, settings):
+    capture = types.SimpleNamespace(
+        frame_size=recording.capture.frame_size,
+        intrinsics=recording.capture.intrinsics,
+        timestamps=recording.timestamps,
+    )
+    fixations, start_ts, stop_ts = [], [], []
+    for status, fixation_result in fixation_detector_utils.detect_fixations(
+        capture,
+        [gp.serialized for gp in recording.gaze_positions],
+        np.deg2rad(settings["fixation_max_dispersion"]),
+        settings["fixation_min_duration"] / 1000,
+        settings["fixation_max_duration"] / 1000,
+        settings["min_data_confidence"],
+    ):
+        if fixation_result:
+            fixation, fixation_start, fixation_stop = fixation_result
+            fixations.append(fixation)
+            start_ts.append(fixation_start)
+            stop_ts.append(fixation_stop)
+            yield status, recording.progress_at(fixation_stop)
+
+    if not fixations:
+        logger.warning("No fixations in this recording nothing to export")
+        return
+    fixation_detector_utils.write_fixations(
+        pm.Affiliator(fixations, start_ts, stop_ts).by_ts_window(export_window),
+        export_dir,
+        settings["fixation_max_dispersion"],
+        settings["fixation_min_duration"],
+        settings["fixation_max_duration"],
+    )
+
+
+def _export_blinks(recording, export_dir, export_window, settings):
+    yield "Detecting blinks", 0.0
+    pupil_data = blink_detection_utils.blink_pupil_data(recording.pupil_positions)
+    if not pupil_data:
+        logger.warning("No blinks were detected in this recording. Nothing to export.")
+        return
+    filter_response = blink_detection_utils.blink_filter_response(
+        pupil_data, settings["blink_history_length"]
+    )
+    blinks = blink_detection_utils.consolidate_blinks(
+        pupil_data,
+        pupil_data.timestamps,
+        filter_response,
+        blink_detection_utils.classify_blink_response(
+            filter_response,
+            settings["blink_onset_confidence_threshold"],
+            settings["blink_offset_confidence_threshold"],
+        ),
+        recording.timestamps,
+    )
+    if not blinks:
+        logger.warning("No blinks were detected in this recording. Nothing to export.")
+        return
+    blink_detection_utils.write_blinks(
+        blinks.by_ts_window(export_window),
+        export_dir,
+        {
+            "history_length": settings["blink_history_length"],
+            "onset_confidence_threshold": settings["blink_onset_confidence_threshold"],
+            "offset_confidence_threshold": settings[
+                "blink_offset_confidence_threshold"
+            ],
+        },
+    )
+
+
+def _export_surfaces(recording, export_dir, export_window, settings):
+    if not surface_tracker_headless.read_surface_definitions(recording.rec_dir):
+        logger.info("No surfaces defined in {}".format(recording.rec_dir))
+        return
+    yield "Tracking surfaces", 0.0
+    surface_tracker_headless.track_surfaces(
+        recording.rec_dir,
+        export_dir=export_dir,
+        marker_detector_mode=MarkerDetectorMode.from_tuple(
+            settings["surface_marker_detector_mode"]
+        ),
+        marker_min_perimeter=settings["surface_marker_min_perimeter"],
+        min_data_confidence=settings["min_data_confidence"],
+    )
+
+
+_EXPORT_STAGES = {
+    "raw_data": _export_raw_data,
+    "fixations": _export_fixations,
+    "blinks": _export_blinks,
+    "surfaces": _export_surfaces,
+}
+
+
+def export_recording(rec_dir, export_dir, exporters, settings):
+    """Export the data of a recording without Pupil Player and write the export
+    manifest. Yields the status and the progress from 0 to 1."""
+    import video_capture
+
+    yield "Loading recording", 0.0
+    capture = video_capture.File_Source(
+        types.SimpleNamespace(),
+        source_path=os.path.join(rec_dir, "world.mp4"),
+        fill_gaps=True,
+        timing=None,
+    )
+    recording = _Recording_Data(rec_dir, capture)
+    export_window = pm.exact_window(
+        recording.timestamps, (0, len(recording.timestamps))
+    )
+
+    os.makedirs(export_dir, exist_ok=True)
+    for stage_idx, exporter in enumerate(exporters):
+        for status, progress in _EXPORT_STAGES[exporter](
+            recording, export_dir, export_window, settings
+        ):
+            yield status, (stage_idx + progress) / len(exporters)
+
+    # The recording is fingerprinted after the export, since the surface tracker
+    # might migrate the surface definitions in the recording.
+    write_export_manifest(export_dir, rec_dir, exporters, settings)
+    yield "Export complete", 1.0
+
+
+class _Status_Streamer(zmq_tools.Msg_Streamer):
+    """Msg_Streamer that binds its url, such that clients can subscribe to it
+    without a Pupil IPC backbone."""
+
+    def __init__(self, ctx, url):
+        self.socket = zmq.Socket(ctx, zmq.PUB)
+        self.socket.bind(url)
+
+
+class Export_Job:
+    """State of the batch export of a single recording"""
+
+    def __init__(self, rec_dir, export_dir):
+        self.rec_dir = rec_dir
+        self.export_dir = export_dir
+        self.state = "queued"  # others: running, completed, skipped, failed, canceled
+        self.status = "In queue"
+        self.progress = 0.0
+        self.started = None
+        self.finished = None
+        self.process = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def to_dict(self):
+        eta = None
+        if self.state == "running" and self.progress > 0.0:
+            eta = self.elapsed * (1.0 - self.progress) / self.progress
+        return {
+            "rec_dir": self.rec_dir,
+            "export_dir": self.export_dir,
+            "state": self.state,
+            "status": self.status,
+            "progress": self.progress,
+            "elapsed": self.elapsed,
+            "eta": eta,
+        }
+
+
+class Headless_Batch_Exporter:
+    """Exports several recordings in a bounded number of background processes.
+
+    The progress of the exports is written to the JSON file `status_file` and
+    published with the topic `batch_export.status` on a ZMQ PUB socket bound to
+    `status_url`. Recordings with a complete export, see `is_export_complete`, are
+    skipped unless `force` is set.
+    """
+
+    STATUS_TOPIC = "batch_export.status"
+
+    def __init__(
+        self,
+        rec_dirs,
+        destination_dir=None,
+        exporters=EXPORTERS,
+        settings=None,
+        workers=None,
+        status_file=None,
+        status_url=None,
+        force=False,
+    ):
+        unknown = set(exporters).difference(EXPORTERS)
+        if unknown:
+            raise ValueError("Unknown exporters: {}".format(", ".join(sorted(unknown))))
+        self.exporters = tuple(exporters)
+        self.settings = {**DEFAULT_EXPORT_SETTINGS, **(settings or {})}
+        self.workers = max(1, workers or cpu_count() - 1)
+        self.status_file = status_file
+        self.started = time.time()
+
+        self.jobs = []
+        for rec_dir in rec_dirs:
+            export_dir = export_dir_for_recording(rec_dir, destination_dir)
+            if export_dir in (job.export_dir for job in self.jobs):
+                raise ValueError(
+                    "This export setting would try to save {} at least twice please "
+                    "rename dirs to prevent this.".format(export_dir)
+                )
+            job = Export_Job(rec_dir, export_dir)
+            if not force and is_export_complete(
+                rec_dir, export_dir, self.exporters, self.settings
+            ):
+                job.state, job.status, job.progress = "skipped", "Up to date", 1.0
+                logger.info("Skipping {}, the export is up to date.".format(rec_dir))
+            self.jobs.append(job)
+
+        self._status_streamer = None
+        if status_url:
+            self._status_streamer = _Status_Streamer(zmq.Context.instance(), status_url)
+        self._published_status = None
+
+    @property
+    def completed(self):
+        return all(job.state not in ("queued", "running") for job in self.jobs)
+
+    def _start_pending(self):
+        running = sum(job.state == "running" for job in self.jobs)
+        for job in self.jobs:
+            if running >= self.workers:
+                break
+            if job.state == "queued":
+                job.process = bh.Task_Proxy(
+                    "Pupil Batch Export {}".format(job.rec_dir),
+                    export_recording,
+                    args=(job.rec_dir, job.export_dir, self.exporters, self.settings),
+                )
+                job.state, job.started = "running", time.time()
+                running += 1
+
+    def _finish(self, job, state):
+        job.state, job.finished, job.process = state, time.time(), None
+
+    def update(self):
+        """Fetch the progress of the running exports and start queued exports"""
+        for job in self.jobs:
+            if job.state != "running":
+                continue
+            try:
+                recent = [d for d in job.process.fetch()]
+            except Exception as e:
+                job.status = "{}: {}".format(type(e).__name__, e)
+                logger.error("Export of {} failed: {}".format(job.rec_dir, job.status))
+                self._finish(job, "failed")
+                continue
+            if recent:
+                job.status, job.progress = recent[-1]
+            if job.process.completed:
+                logger.info("Exported {} to {}".format(job.rec_dir, job.export_dir))
+                self._finish(job, "completed")
+            elif job.process.canceled:
+                self._finish(job, "canceled")
+        self._start_pending()
+        self.publish_status()
+
+    def run(self, poll_interval=0.25):
+        """Export all recordings, returns the jobs once all exports finished"""
+        try:
+            while not self.completed:
+                self.update()
+                time.sleep(poll_interval)
+        finally:
+            self.cancel()
+        return self.jobs
+
+    def cancel(self):
+        for job in self.jobs:
+            if job.state == "running":
+                job.process.cancel()
+                job.status = "Export has been canceled."
+                self._finish(job, "canceled")
+            elif job.state == "queued":
+                job.status = "Export has been canceled."
+                job.state = "canceled"
+        self.publish_status()
+
+    def status(self):
+        counts = {
+            state: sum(job.state == state for job in self.jobs)
+            for state in ("queued", "running", "completed", "skipped", "failed")
+        }
+        elapsed = time.time() - self.started
+        exported = counts["completed"] + counts["failed"]
+        throughput = exported / elapsed * 3600 if exported else None
+        return {
+            **counts,
+            "recordings": len(self.jobs),
+            "elapsed": elapsed,
+            # recordings per hour, skipped recordings are not included
+            "throughput": throughput,
+            "jobs": [job.to_dict() for job in self.jobs],
+        }
+
+    def publish_status(self):
+        status = self.status()
+        # the elapsed times always change, only publish when the progress changed
+        comparable = {k: v for k, v in status.items() if k != "elapsed"}
+        comparable["jobs"] = [
+            (job["state"], job["status"], job["progress"]) for job in status["jobs"]
+        ]
+        if comparable == self._published_status:
+            return
+        self._published_status = comparable
+
+        if self.status_file:
+            _write_json(self.status_file, status)
+        if self._status_streamer:
+            self._status_streamer.send({"topic": self.STATUS_TOPIC, **status})
+
+
+def main(argv=None):
+    """Batch export the data of recordings without Pupil Player, e.g.
+    `python batch_exporter_headless.py ~/recordings --status-file status.json`"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Export raw data, fixations, blinks and surfaces of Pupil "
+        "recordings in parallel, without Pupil Player."
+    )
+    parser.add_argument(
+        "recordings",
+        nargs="+",
+        help="recording directories or directories that contain recordings",
+    )
+    parser.add_argument(
+        "--destination-dir",
+        help="export all recordings to this directory "
+        "(default: exports/batch in each recording)",
+    )
+    parser.add_argument(
+        "--exporters", nargs="+", choices=EXPORTERS, default=list(EXPORTERS)
+    )
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count() - 1))
+    parser.add_argument("--status-file", help="JSON file with the export progress")
+    parser.add_argument(
+        "--status-url",
+        help="publish the export progress on a ZMQ PUB socket bound to this url, "
+        "e.g. tcp://127.0.0.1:50030",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="export recordings that are up to date"
+    )
+    parser.add_argument(
+        "--min-data-confidence",
+        type=float,
+        default=DEFAULT_EXPORT_SETTINGS["min_data_confidence"],
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=raw_data_exporter_utils.export_formats(),
+        default=DEFAULT_EXPORT_SETTINGS["export_format"],
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(processName)s - [%(levelname)s] %(name)s: %(message)s",
+    )
+
+    rec_dirs = []
+    for path in args.recordings:
+        for rec_dir in get_recording_dirs(os.path.expanduser(path)):
+            if rec_dir not in rec_dirs:
+                rec_dirs.append(rec_dir)
+    if not rec_dirs:
+        logger.error("No recordings found in {}".format(", ".join(args.recordings)))
+        return 1
+
+    batch_exporter = Headless_Batch_Exporter(
+        rec_dirs,
+        destination_dir=args.destination_dir,
+        exporters=args.exporters,
+        settings={
+            "min_data_confidence": args.min_data_confidence,
+            "export_format": args.export_format,
+        },
+        workers=args.workers,
+        status_file=args.status_file,
+        status_url=args.status_url,
+        force=args.force,
+    )
+    jobs = batch_exporter.run()
+    failed = [job for job in jobs if job.state not in ("completed", "skipped")]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
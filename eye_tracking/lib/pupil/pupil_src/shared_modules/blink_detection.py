@@ -9,9 +9,7 @@ See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
 
-import csv
 import logging
-import os
 from collections import deque
 
 import numpy as np
@@ -19,13 +17,17 @@ import OpenGL.GL as gl
 import pyglui.cygl.utils as cygl_utils
 from pyglui import ui
 from pyglui.pyfontstash import fontstash as fs
-from scipy.signal import fftconvolve
 
-import csv_utils
 import data_changed
-import file_methods as fm
 import gl_utils
 import player_methods as pm
+from blink_detection_utils import (
+    blink_filter_response,
+    blink_pupil_data,
+    classify_blink_response,
+    consolidate_blinks,
+    write_blinks,
+)
 from observable import Observable
 from plugin import Analysis_Plugin_Base
 
@@ -219,11 +221,7 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
         )
 
     def _pupil_data(self):
-        data = self.g_pool.pupil_positions[..., "2d"]
-        if not data:
-            # Fall back to 3d data
-            data = self.g_pool.pupil_positions[..., "3d"]
-        return data
+        return blink_pupil_data(self.g_pool.pupil_positions)
 
     def init_ui(self):
         super().init_ui()
@@ -280,47 +278,16 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
             )
             return
 
-        header = (
-            "id",
-            "start_timestamp",
-            "duration",
-            "end_timestamp",
-            "start_frame_index",
-            "index",
-            "end_frame_index",
-            "confidence",
-            "filter_response",
-            "base_data",
+        write_blinks(
+            self.g_pool.blinks.by_ts_window(export_window),
+            export_dir,
+            {
+                "history_length": self.history_length,
+                "onset_confidence_threshold": self.onset_confidence_threshold,
+                "offset_confidence_threshold": self.offset_confidence_threshold,
+            },
         )
 
-        blinks_in_section = self.g_pool.blinks.by_ts_window(export_window)
-
-        with open(
-            os.path.join(export_dir, "blinks.csv"), "w", encoding="utf-8", newline=""
-        ) as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow(header)
-            for b in blinks_in_section:
-                csv_writer.writerow(self.csv_representation_for_blink(b, header))
-            logger.info("Created 'blinks.csv' file.")
-
-        with open(
-            os.path.join(export_dir, "blink_detection_report.csv"),
-            "w",
-            encoding="utf-8",
-            newline="",
-        ) as csvfile:
-            csv_utils.write_key_value_file(
-                csvfile,
-                {
-                    "history_length": self.history_length,
-                    "onset_confidence_threshold": self.onset_confidence_threshold,
-                    "offset_confidence_threshold": self.offset_confidence_threshold,
-                    "blinks_exported": len(blinks_in_section),
-                },
-            )
-            logger.info("Created 'blink_detection_report.csv' file.")
-
     def recalculate(self):
         import time
 
@@ -334,116 +301,30 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
             return
 
         self.timestamps = all_pp.timestamps
-        total_time = self.timestamps[-1] - self.timestamps[0]
-
-        conf_iter = (pp["confidence"] for pp in all_pp)
-        activity = np.fromiter(conf_iter, dtype=float, count=len(all_pp))
-        total_time = all_pp[-1]["timestamp"] - all_pp[0]["timestamp"]
-        filter_size = 2 * round(len(all_pp) * self.history_length / total_time / 2.0)
-        blink_filter = np.ones(filter_size) / filter_size
-
-        # This is different from the online filter. Convolution will flip
-        # the filter and result in a reverse filter response. Therefore
-        # we set the first half of the filter to -1 instead of the second
-        # half such that we get the expected result.
-        blink_filter[: filter_size // 2] *= -1
-
-        # The theoretical response maximum is +-0.5
-        # Response of +-0.45 seems sufficient for a confidence of 1.
-        self.filter_response = fftconvolve(activity, blink_filter, "same") / 0.45
-
-        onsets = self.filter_response > self.onset_confidence_threshold
-        offsets = self.filter_response < -self.offset_confidence_threshold
-
-        self.response_classification = np.zeros(self.filter_response.shape)
-        self.response_classification[onsets] = 1.0
-        self.response_classification[offsets] = -1.0
+        self.filter_response = blink_filter_response(all_pp, self.history_length)
+        self.response_classification = classify_blink_response(
+            self.filter_response,
+            self.onset_confidence_threshold,
+            self.offset_confidence_threshold,
+        )
 
         self.consolidate_classifications()
 
         tm1 = time.time()
         logger.debug(
-            "Recalculating took\n\t{:.4f}sec for {} pp\n\t{} pp/sec\n\tsize: {}".format(
-                tm1 - t0, len(all_pp), len(all_pp) / (tm1 - t0), filter_size
+            "Recalculating took\n\t{:.4f}sec for {} pp\n\t{} pp/sec".format(
+                tm1 - t0, len(all_pp), len(all_pp) / (tm1 - t0)
             )
         )
 
     def consolidate_classifications(self):
-        blink = None
-        state = "no blink"  # others: 'blink started' | 'blink ending'
-        blink_data = deque()
-        blink_start_ts = deque()
-        blink_stop_ts = deque()
-        counter = 1
-
-        # NOTE: Cache result for performance reasons
-        pupil_data = self._pupil_data()
-
-        def start_blink(idx):
-            nonlocal blink
-            nonlocal state
-            nonlocal counter
-            blink = {
-                "topic": "blink",
-                "__start_response_index__": idx,
-                "start_timestamp": self.timestamps[idx],
-                "id": counter,
-            }
-            state = "blink started"
-            counter += 1
-
-        def blink_finished(idx):
-            nonlocal blink
-
-            # get tmp pupil idx
-            start_idx = blink["__start_response_index__"]
-            del blink["__start_response_index__"]
-
-            blink["end_timestamp"] = self.timestamps[idx]
-            blink["timestamp"] = (blink["end_timestamp"] + blink["start_timestamp"]) / 2
-            blink["duration"] = blink["end_timestamp"] - blink["start_timestamp"]
-            blink["base_data"] = pupil_data[start_idx:idx].tolist()
-            blink["filter_response"] = self.filter_response[start_idx:idx].tolist()
-            # blink confidence is the mean of the absolute filter response
-            # during the blink event, clamped at 1.
-            blink["confidence"] = min(
-                float(np.abs(blink["filter_response"]).mean()), 1.0
-            )
-
-            # correlate world indices
-            ts_start, ts_end = blink["start_timestamp"], blink["end_timestamp"]
-
-            idx_start, idx_end = np.searchsorted(
-                self.g_pool.timestamps, [ts_start, ts_end]
-            )
-            # fix `list index out of range` error
-            idx_end = min(idx_end, len(self.g_pool.timestamps) - 1)
-            blink["start_frame_index"] = int(idx_start)
-            blink["end_frame_index"] = int(idx_end)
-            blink["index"] = int((idx_start + idx_end) // 2)
-
-            blink_data.append(fm.Serialized_Dict(python_dict=blink))
-            blink_start_ts.append(ts_start)
-            blink_stop_ts.append(ts_end)
-
-        for idx, classification in enumerate(self.response_classification):
-            if state == "no blink" and classification > 0:
-                start_blink(idx)
-            elif state == "blink started" and classification == -1:
-                state = "blink ending"
-            elif state == "blink ending" and classification >= 0:
-                blink_finished(idx - 1)  # blink ended previously
-                if classification > 0:
-                    start_blink(0)
-                else:
-                    blink = None
-                    state = "no blink"
-
-        if state == "blink ending":
-            # only finish blink if it was already ending
-            blink_finished(idx)  # idx is the last possible idx
-
-        self.g_pool.blinks = pm.Affiliator(blink_data, blink_start_ts, blink_stop_ts)
+        self.g_pool.blinks = consolidate_blinks(
+            self._pupil_data(),
+            self.timestamps,
+            self.filter_response,
+            self.response_classification,
+            self.g_pool.timestamps,
+        )
         self.notify_all({"subject": "blinks_changed", "delay": 0.2})
 
     def cache_activation(self):
@@ -572,17 +453,3 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
                 {"subject": "blink_detection.should_recalculate", "delay": 0.2}
             )
         self._offset_confidence_threshold = val
-
-    def csv_representation_for_blink(self, b, header):
-        data = [b[k] for k in header if k not in ("filter_response", "base_data")]
-        try:
-            resp = " ".join(["{}".format(val) for val in b["filter_response"]])
-            data.insert(header.index("filter_response"), resp)
-        except IndexError:
-            pass
-        try:
-            base = " ".join(["{}".format(pp["timestamp"]) for pp in b["base_data"]])
-            data.insert(header.index("base_data"), base)
-        except IndexError:
-            pass
-        return data
@@ -0,0 +1,211 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import csv
+import logging
+import os
+from collections import deque
+
+import numpy as np
+from scipy.signal import fftconvolve
+
+import csv_utils
+import file_methods as fm
+import player_methods as pm
+
+logger = logging.getLogger(__name__)
+
+
+def blink_pupil_data(pupil_positions):
+    """Pupil data used for the offline blink detection, 2d data if available"""
+    data = pupil_positions[..., "2d"]
+    if not data:
+        # Fall back to 3d data
+        data = pupil_positions[..., "3d"]
+    return data
+
+
+def blink_filter_response(pupil_data, history_length):
+    """Response of the offline blink filter to the confidence of `pupil_data`"""
+    conf_iter = (pp["confidence"] for pp in pupil_data)
+    activity = np.fromiter(conf_iter, dtype=float, count=len(pupil_data))
+    total_time = pupil_data[-1]["timestamp"] - pupil_data[0]["timestamp"]
+    filter_size = 2 * round(len(pupil_data) * history_length / total_time / 2.0)
+    blink_filter = np.ones(filter_size) / filter_size
+
+    # This is different from the online filter. Convolution will flip
+    # the filter and result in a reverse filter response. Therefore
+    # we set the first half of the filter to -1 instead of the second
+    # half such that we get the expected result.
+    blink_filter[: filter_size // 2] *= -1
+
+    # The theoretical response maximum is +-0.5
+    # Response of +-0.45 seems sufficient for a confidence of 1.
+    return fftconvolve(activity, blink_filter, "same") / 0.45
+
+
+def classify_blink_response(
+    filter_response, onset_confidence_threshold, offset_confidence_threshold
+):
+    """Classify the filter response into onsets (1), offsets (-1) and neither (0)"""
+    onsets = filter_response > onset_confidence_threshold
+    offsets = filter_response < -offset_confidence_threshold
+
+    response_classification = np.zeros(filter_response.shape)
+    response_classification[onsets] = 1.0
+    response_classification[offsets] = -1.0
+    return response_classification
+
+
+def consolidate_blinks(
+    pupil_data, timestamps, filter_response, response_classification, world_timestamps
+):
+    """Combine the classified filter response to blinks.
+
+    Returns: pm.Affiliator of the blinks with their start and end timestamps.
+    """
+    blink = None
+    state = "no blink"  # others: 'blink started' | 'blink ending'
+    blink_data = deque()
+    blink_start_ts = deque()
+    blink_stop_ts = deque()
+    counter = 1
+
+    def start_blink(idx):
+        nonlocal blink
+        nonlocal state
+        nonlocal counter
+        blink = {
+            "topic": "blink",
+            "__start_response_index__": idx,
+            "start_timestamp": timestamps[idx],
+            "id": counter,
+        }
+        state = "blink started"
+        counter += 1
+
+    def blink_finished(idx):
+        nonlocal blink
+
+        # get tmp pupil idx
+        start_idx = blink["__start_response_index__"]
+        del blink["__start_response_index__"]
+
+        blink["end_timestamp"] = timestamps[idx]
+        blink["timestamp"] = (blink["end_timestamp"] + blink["start_timestamp"]) / 2
+        blink["duration"] = blink["end_timestamp"] - blink["start_timestamp"]
+        blink["base_data"] = pupil_data[start_idx:idx].tolist()
+        blink["filter_response"] = filter_response[start_idx:idx].tolist()
+        # blink confidence is the mean of the absolute filter response
+        # during the blink event, clamped at 1.
+        blink["confidence"] = min(float(np.abs(blink["filter_response"]).mean()), 1.0)
+
+        # correlate world indices
+        ts_start, ts_end = blink["start_timestamp"], blink["end_timestamp"]
+
+        idx_start, idx_end = np.searchsorted(world_timestamps, [ts_start, ts_end])
+        # fix `list index out of range` error
+        idx_end = min(idx_end, len(world_timestamps) - 1)
+        blink["start_frame_index"] = int(idx_start)
+        blink["end_frame_index"] = int(idx_end)
+        blink["index"] = int((idx_start + idx_end) // 2)
+
+        blink_data.append(fm.Serialized_Dict(python_dict=blink))
+        blink_start_ts.append(ts_start)
+        blink_stop_ts.append(ts_end)
+
+    for idx, classification in enumerate(response_classification):
+        if state == "no blink" and classification > 0:
+            start_blink(idx)
+        elif state == "blink started" and classification == -1:
+            state = "blink ending"
+        elif state == "blink ending" and classification >= 0:
+            blink_finished(idx - 1)  # blink ended previously
+            if classification > 0:
+                start_blink(0)
+            else:
+                blink = None
+                state = "no blink"
+
+    if state == "blink ending":
+        # only finish blink if it was already ending
+        blink_finished(idx)  # idx is the last possible idx
+
+    return pm.Affiliator(blink_data, blink_start_ts, blink_stop_ts)
+
+
+BLINKS_CSV_HEADER = (
+    "id",
+    "start_timestamp",
+    "duration",
+    "end_timestamp",
+    "start_frame_index",
+    "index",
+    "end_frame_index",
+    "confidence",
+    "filter_response",
+    "base_data",
+)
+
+
+def csv_representation_for_blink(b, header):
+    data = [b[k] for k in header if k not in ("filter_response", "base_data")]
+    try:
+        resp = " ".join(["{}".format(val) for val in b["filter_response"]])
+        data.insert(header.index("filter_response"), resp)
+    except IndexError:
+        pass
+    try:
+        base = " ".join(["{}".format(pp["timestamp"]) for pp in b["base_data"]])
+        data.insert(header.index("base_data"), base)
+    except IndexError:
+        pass
+    return data
+
+
+def write_blinks(blinks_in_section, export_dir, detection_params):
+    """Write the blinks and the blink detection report to `export_dir`, see
+    Offline_Blink_Detection.export
+
+    Args:
+        detection_params: history_length, onset_confidence_threshold and
+            offset_confidence_threshold of the blink detection.
+    """
+    header = BLINKS_CSV_HEADER
+    with open(
+        os.path.join(export_dir, "blinks.csv"), "w", encoding="utf-8", newline=""
+    ) as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(header)
+        for b in blinks_in_section:
+            csv_writer.writerow(csv_representation_for_blink(b, header))
+        logger.info("Created 'blinks.csv' file.")
+
+    with open(
+        os.path.join(export_dir, "blink_detection_report.csv"),
+        "w",
+        encoding="utf-8",
+        newline="",
+    ) as csvfile:
+        csv_utils.write_key_value_file(
+            csvfile,
+            {
+                "history_length": detection_params["history_length"],
+                "onset_confidence_threshold": detection_params[
+                    "onset_confidence_threshold"
+                ],
+                "offset_confidence_threshold": detection_params[
+                    "offset_confidence_threshold"
+                ],
+                "blinks_exported": len(blinks_in_section),
+            },
+        )
+        logger.info("Created 'blink_detection_report.csv' file.")
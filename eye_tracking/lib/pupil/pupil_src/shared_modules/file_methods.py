@@ -13,6 +13,7 @@ import collections
 import collections.abc
 import copy
 import logging
+import mmap
 import os
 import pickle
 import traceback as tb
@@ -31,7 +32,102 @@ assert (
 logger = logging.getLogger(__name__)
 UnpicklingError = pickle.UnpicklingError
 
-PLData = collections.namedtuple("PLData", ["data", "timestamps", "topics"])
+
+class PLData(collections.namedtuple("PLData", ["data", "timestamps", "topics"])):
+    __slots__ = ()
+
+    def to_struct_array(self, fields):
+        """See to_struct_array()"""
+        return to_struct_array(self.data, fields)
+
+
+def _parse_field_path(path):
+    """'base_data[*].ellipse.axes' -> ['base_data', '*', 'ellipse', 'axes']"""
+    keys = []
+    for part in path.split("."):
+        name, *indices = part.replace("]", "").split("[")
+        if name:
+            keys.append(name)
+        keys.extend(index if index == "*" else int(index) for index in indices)
+    return keys
+
+
+def _resolve_field(value, keys):
+    for i, key in enumerate(keys):
+        if value is None:
+            return None
+        if key == "*":
+            return [_resolve_field(item, keys[i + 1 :]) for item in value]
+        try:
+            value = value[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+
+def _field_shape(value):
+    if value is None or np.isscalar(value):
+        return ()
+    shapes = [_field_shape(item) for item in value]
+    ndim = max((len(shape) for shape in shapes), default=0)
+    return (len(value),) + tuple(
+        max((shape[d] for shape in shapes if len(shape) > d), default=0)
+        for d in range(ndim)
+    )
+
+
+def _padded_field(value, shape):
+    if not shape:
+        return np.nan if value is None else value
+    padded = np.full(shape, np.nan)
+    for i, item in enumerate(value or ()):
+        padded[i] = _padded_field(item, shape[1:])
+    return padded
+
+
+def to_struct_array(data, fields):
+    """
+    Decodes the numeric `fields` of all datums into a structured array, with
+    one float64 field per entry of `fields`, named like the entry.
+
+    Fields are paths into the datum: 'confidence', 'norm_pos',
+    'base_data[0].id' or 'base_data[*].ellipse.axes', where '*' takes the
+    path of every element. Sequences become subarray fields; sequences of
+    different lengths, e.g. base_data of monocular and binocular gaze, and
+    missing values are padded with nan.
+
+    Every Serialized_Dict is decoded once, without going through the
+    deserialization cache, so this does not evict data other code is using.
+    """
+    paths = [_parse_field_path(field) for field in fields]
+    values = [[] for _ in fields]
+    for datum in data:
+        if isinstance(datum, Serialized_Dict):
+            datum = datum._deep_copy_dict()
+        for field_values, keys in zip(values, paths):
+            field_values.append(_resolve_field(datum, keys))
+
+    columns = []
+    for field_values in values:
+        try:
+            column = np.array(field_values, dtype=np.float64)
+        except ValueError:  # ragged
+            shape = _field_shape(field_values)[1:]
+            column = np.empty((len(field_values),) + shape)
+            for i, value in enumerate(field_values):
+                column[i] = _padded_field(value, shape)
+        columns.append(column.reshape(len(field_values), *column.shape[1:]))
+
+    dtype = np.dtype(
+        [
+            (field, np.float64, column.shape[1:])
+            for field, column in zip(fields, columns)
+        ]
+    )
+    array = np.empty(len(values[0]) if values else 0, dtype=dtype)
+    for field, column in zip(fields, columns):
+        array[field] = column
+    return array
 
 
 class Persistent_Dict(dict):
@@ -154,6 +250,113 @@ def load_pldata_file(directory, topic):
     return PLData(data, data_ts, topics)
 
 
+PLDATA_INDEX_DTYPE = np.dtype(
+    [("offset", "<u8"), ("size", "<u8"), ("timestamp", "<f8")]
+)
+
+
+def _pldata_index_path(directory, topic):
+    return os.path.join(directory, topic + "_pldata_index.npy")
+
+
+def _pldata_index(offsets, sizes, timestamps):
+    index = np.empty(len(offsets), dtype=PLDATA_INDEX_DTYPE)
+    index["offset"] = offsets
+    index["size"] = sizes
+    index["timestamp"] = timestamps
+    return index
+
+
+def build_pldata_index(directory, topic):
+    """
+    Scans `<topic>.pldata` once and saves the byte offset, size and timestamp
+    of every record to `<topic>_pldata_index.npy`. Used for recordings that
+    were made before PLData_Writer wrote the index.
+    """
+    ts_file = os.path.join(directory, topic + "_timestamps.npy")
+    msgpack_file = os.path.join(directory, topic + ".pldata")
+    data_ts = np.load(ts_file)
+    offsets = collections.deque()
+    with open(msgpack_file, "rb") as fh:
+        unpacker = msgpack.Unpacker(fh, raw=False, use_list=False)
+        offset = 0
+        for _ in unpacker:
+            offsets.append(offset)
+            offset = unpacker.tell()
+    offsets = np.fromiter(offsets, dtype=np.uint64, count=len(offsets))
+    if len(offsets) != len(data_ts):
+        raise ValueError(
+            f"{msgpack_file} has {len(offsets)} records"
+            f" but {len(data_ts)} timestamps."
+        )
+    sizes = np.diff(np.append(offsets, np.uint64(offset)))
+    index = _pldata_index(offsets, sizes, data_ts)
+    try:
+        np.save(_pldata_index_path(directory, topic), index)
+    except OSError:
+        logger.debug(f"Could not save the index of {msgpack_file}.")
+    return index
+
+
+def load_pldata_index(directory, topic):
+    """
+    Record index of `<topic>.pldata`, see PLDATA_INDEX_DTYPE. The index is
+    rebuilt if it is missing or does not match the data file.
+    """
+    msgpack_file = os.path.join(directory, topic + ".pldata")
+    index_file = _pldata_index_path(directory, topic)
+    try:
+        index = np.load(index_file)
+    except (FileNotFoundError, ValueError):
+        return build_pldata_index(directory, topic)
+    if index.dtype == PLDATA_INDEX_DTYPE:
+        end = int(index["offset"][-1] + index["size"][-1]) if len(index) else 0
+        if end == os.path.getsize(msgpack_file):
+            return index
+    logger.debug(f"Index of {msgpack_file} is out of date, rebuilding it.")
+    return build_pldata_index(directory, topic)
+
+
+def _load_pldata_records(directory, topic, index):
+    msgpack_file = os.path.join(directory, topic + ".pldata")
+    data = collections.deque()
+    topics = collections.deque()
+    if len(index):
+        with open(msgpack_file, "rb") as fh, mmap.mmap(
+            fh.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            for offset, size in zip(index["offset"].tolist(), index["size"].tolist()):
+                topic, payload = msgpack.unpackb(
+                    mm[offset : offset + size], raw=False, use_list=False
+                )
+                data.append(Serialized_Dict(msgpack_bytes=payload))
+                topics.append(topic)
+    return PLData(data, index["timestamp"].copy(), topics)
+
+
+def load_pldata_window(directory, topic, start_ts, stop_ts):
+    """
+    Loads the records of `<topic>.pldata` with start_ts <= timestamp < stop_ts,
+    the same window as Bisector.by_ts_window. The file is memory-mapped and
+    only the records in the window are read, using the record index.
+    """
+    try:
+        index = load_pldata_index(directory, topic)
+    except FileNotFoundError:
+        return PLData([], [], [])
+    index = index[(index["timestamp"] >= start_ts) & (index["timestamp"] < stop_ts)]
+    return _load_pldata_records(directory, topic, index)
+
+
+def load_pldata_records(directory, topic, start, stop):
+    """Like load_pldata_window, for the records with numbers start to stop - 1."""
+    try:
+        index = load_pldata_index(directory, topic)
+    except FileNotFoundError:
+        return PLData([], [], [])
+    return _load_pldata_records(directory, topic, index[start:stop])
+
+
 class PLData_Writer(object):
     """docstring for PLData_Writer"""
 
@@ -162,8 +365,11 @@ class PLData_Writer(object):
         self.directory = directory
         self.name = name
         self.ts_queue = collections.deque()
+        self.offset_queue = collections.deque()
+        self.size_queue = collections.deque()
         file_name = name + ".pldata"
         self.file_handle = open(os.path.join(directory, file_name), "wb")
+        self._offset = 0
 
     def append(self, datum):
         datum_serialized = msgpack.packb(datum, use_bin_type=True)
@@ -173,6 +379,9 @@ class PLData_Writer(object):
         self.ts_queue.append(timestamp)
         pair = msgpack.packb((topic, datum_serialized), use_bin_type=True)
         self.file_handle.write(pair)
+        self.offset_queue.append(self._offset)
+        self.size_queue.append(len(pair))
+        self._offset += len(pair)
 
     def extend(self, data):
         for datum in data:
@@ -185,7 +394,11 @@ class PLData_Writer(object):
         ts_file = self.name + "_timestamps.npy"
         ts_path = os.path.join(self.directory, ts_file)
         np.save(ts_path, self.ts_queue)
+        index = _pldata_index(self.offset_queue, self.size_queue, self.ts_queue)
+        np.save(_pldata_index_path(self.directory, self.name), index)
         self.ts_queue = None
+        self.offset_queue = None
+        self.size_queue = None
 
     def __enter__(self):
         return self
@@ -212,10 +425,17 @@ class _Empty(object):
         pass
 
 
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "maxsize", "currsize"]
+)
+
+
 class Serialized_Dict(object):
     __slots__ = ["_ser_data", "_data"]
     cache_len = 100
-    _cache_ref = [_Empty()] * cache_len
+    _cache_ref = collections.deque([_Empty()] * cache_len)
+    cache_hits = 0
+    cache_misses = 0
     MSGPACK_EXT_CODE = 13
 
     def __init__(self, python_dict=None, msgpack_bytes=None):
@@ -233,6 +453,7 @@ class Serialized_Dict(object):
 
     def _deser(self):
         if not self._data:
+            Serialized_Dict.cache_misses += 1
             self._data = msgpack.unpackb(
                 self._ser_data,
                 raw=False,
@@ -240,8 +461,45 @@ class Serialized_Dict(object):
                 object_hook=self.unpacking_object_hook,
                 ext_hook=self.unpacking_ext_hook,
             )
-            self._cache_ref.pop(0).purge_cache()
+            self._cache_ref.popleft().purge_cache()
             self._cache_ref.append(self)
+        else:
+            Serialized_Dict.cache_hits += 1
+
+    @staticmethod
+    def set_cache_len(cache_len):
+        """
+        Number of deserialized dicts that are kept. Loops that access more
+        datums than this more than once deserialize them again every time.
+        """
+        if cache_len < 1:
+            raise ValueError("cache_len must be at least 1")
+        cache = Serialized_Dict._cache_ref
+        while len(cache) > cache_len:
+            cache.popleft().purge_cache()
+        cache.extendleft([_Empty()] * (cache_len - len(cache)))
+        Serialized_Dict.cache_len = cache_len
+
+    @staticmethod
+    def cache_info():
+        currsize = sum(
+            not isinstance(ref, _Empty) and ref._data is not None
+            for ref in Serialized_Dict._cache_ref
+        )
+        return CacheInfo(
+            Serialized_Dict.cache_hits,
+            Serialized_Dict.cache_misses,
+            Serialized_Dict.cache_len,
+            currsize,
+        )
+
+    @staticmethod
+    def cache_clear():
+        """Purges the cache and resets the hit and miss counters."""
+        for ref in Serialized_Dict._cache_ref:
+            ref.purge_cache()
+        Serialized_Dict.cache_hits = 0
+        Serialized_Dict.cache_misses = 0
 
     def __getstate__(self):
         return self._ser_data
@@ -26,39 +26,36 @@ Terms
       dispersion threshold?
 """
 
-import csv
-import enum
 import logging
-import os
-import typing as T
 from bisect import bisect_left, bisect_right
 from collections import deque
 from types import SimpleNamespace
 
 import cv2
-import msgpack
 import numpy as np
 from pyglui import ui
 from pyglui.cygl.utils import RGBA, draw_circle
 from pyglui.pyfontstash import fontstash
-from scipy.spatial.distance import pdist
 
 import background_helper as bh
 import data_changed
 import file_methods as fm
 from observable import Observable
 import player_methods as pm
+from fixation_detector_utils import (
+    FixationDetectionMethod,
+    can_use_3d_gaze_mapping,
+    detect_fixations,
+    fixation_from_data,
+    gaze_dispersion,
+    write_fixations,
+)
 from methods import denormalize
 from plugin import Analysis_Plugin_Base
 
 logger = logging.getLogger(__name__)
 
 
-class FixationDetectionMethod(enum.Enum):
-    GAZE_2D = "2d gaze"
-    GAZE_3D = "3d gaze"
-
-
 class Fixation_Detector_Base(Analysis_Plugin_Base):
     icon_chr = chr(0xEC03)
     icon_font = "pupil_icons"
@@ -68,185 +65,6 @@ class Fixation_Detector_Base(Analysis_Plugin_Base):
         return "Fixation Detector"
 
 
-def fixation_from_data(
-    dispersion: float,
-    method: FixationDetectionMethod,
-    base_data: T.Iterable,
-    timestamps=None,
-):
-    norm_pos = np.mean([gp["norm_pos"] for gp in base_data], axis=0).tolist()
-    dispersion = np.rad2deg(dispersion)  # in degrees
-
-    fix = {
-        "topic": "fixations",
-        "norm_pos": norm_pos,
-        "dispersion": dispersion,
-        "method": method.value,
-        "base_data": list(base_data),
-        "timestamp": base_data[0]["timestamp"],
-        "duration": (base_data[-1]["timestamp"] - base_data[0]["timestamp"]) * 1000,
-        "confidence": float(np.mean([gp["confidence"] for gp in base_data])),
-    }
-    if method == FixationDetectionMethod.GAZE_3D:
-        fix["gaze_point_3d"] = np.mean(
-            [gp["gaze_point_3d"] for gp in base_data if "gaze_point_3d" in gp], axis=0
-        ).tolist()
-    if timestamps is not None:
-        start, end = base_data[0]["timestamp"], base_data[-1]["timestamp"]
-        start, end = np.searchsorted(timestamps, [start, end])
-        end = min(end, len(timestamps) - 1)  # fix `list index out of range` error
-        fix["start_frame_index"] = int(start)
-        fix["end_frame_index"] = int(end)
-        fix["mid_frame_index"] = int((start + end) // 2)
-    return fix
-
-
-class Fixation_Result_Factory(object):
-    __slots__ = ("_id_counter",)
-
-    def __init__(self):
-        self._id_counter = 0
-
-    def from_data(self, *args, **kwargs):
-        datum = fixation_from_data(*args, **kwargs)
-        self._set_fixation_id(datum)
-        fixation_start = datum["timestamp"]
-        fixation_stop = fixation_start + (datum["duration"] / 1000)
-        # datum = self._serialize(datum)
-        return (datum, fixation_start, fixation_stop)
-
-    def _set_fixation_id(self, fixation):
-        fixation["id"] = self._id_counter
-        self._id_counter += 1
-
-    def _serialize(self, fixation):
-        serialization_hook = fm.Serialized_Dict.packing_hook
-        fixation_serialized = msgpack.packb(
-            fixation, use_bin_type=True, default=serialization_hook
-        )
-        return fixation_serialized
-
-
-def vector_dispersion(vectors):
-    distances = pdist(vectors, metric="cosine")
-    dispersion = np.arccos(1.0 - distances.max())
-    return dispersion
-
-
-def gaze_dispersion(capture, gaze_subset, method: FixationDetectionMethod) -> float:
-    if method is FixationDetectionMethod.GAZE_3D:
-        vectors = np.array([gp["gaze_point_3d"] for gp in gaze_subset])
-    elif method is FixationDetectionMethod.GAZE_2D:
-        locations = np.array([gp["norm_pos"] for gp in gaze_subset])
-
-        # denormalize
-        width, height = capture.frame_size
-        locations[:, 0] *= width
-        locations[:, 1] = (1.0 - locations[:, 1]) * height
-
-        # undistort onto 3d plane
-        vectors = capture.intrinsics.unprojectPoints(locations)
-    else:
-        raise ValueError(f"Unknown method '{method}'")
-
-    dist = vector_dispersion(vectors)
-    return dist
-
-
-def can_use_3d_gaze_mapping(gaze_data) -> bool:
-    return all("gaze_point_3d" in gp for gp in gaze_data)
-
-
-def detect_fixations(
-    capture, gaze_data, max_dispersion, min_duration, max_duration, min_data_confidence
-):
-    yield "Detecting fixations...", ()
-    gaze_data = (
-        fm.Serialized_Dict(msgpack_bytes=serialized) for serialized in gaze_data
-    )
-    gaze_data = [
-        datum for datum in gaze_data if datum["confidence"] > min_data_confidence
-    ]
-    if not gaze_data:
-        logger.warning("No data available to find fixations")
-        return "Fixation detection failed", ()
-
-    method = (
-        FixationDetectionMethod.GAZE_3D
-        if can_use_3d_gaze_mapping(gaze_data)
-        else FixationDetectionMethod.GAZE_2D
-    )
-    logger.info(f"Starting fixation detection using {method.value} data...")
-    fixation_result = Fixation_Result_Factory()
-
-    working_queue = deque()
-    remaining_gaze = deque(gaze_data)
-
-    while remaining_gaze:
-        # check if working_queue contains enough data
-        if (
-            len(working_queue) < 2
-            or (working_queue[-1]["timestamp"] - working_queue[0]["timestamp"])
-            < min_duration
-        ):
-            datum = remaining_gaze.popleft()
-            working_queue.append(datum)
-            continue
-
-        # min duration reached, check for fixation
-        dispersion = gaze_dispersion(capture, working_queue, method)
-        if dispersion > max_dispersion:
-            # not a fixation, move forward
-            working_queue.popleft()
-            continue
-
-        left_idx = len(working_queue)
-
-        # minimal fixation found. collect maximal data
-        # to perform binary search for fixation end
-        while remaining_gaze:
-            datum = remaining_gaze[0]
-            if datum["timestamp"] > working_queue[0]["timestamp"] + max_duration:
-                break  # maximum data found
-            working_queue.append(remaining_gaze.popleft())
-
-        # check for fixation with maximum duration
-        dispersion = gaze_dispersion(capture, working_queue, method)
-        if dispersion <= max_dispersion:
-            fixation = fixation_result.from_data(
-                dispersion, method, working_queue, capture.timestamps
-            )
-            yield "Detecting fixations...", fixation
-            working_queue.clear()  # discard old Q
-            continue
-
-        slicable = list(working_queue)  # deque does not support slicing
-        right_idx = len(working_queue)
-
-        # binary search
-        while left_idx < right_idx - 1:
-            middle_idx = (left_idx + right_idx) // 2
-            dispersion = gaze_dispersion(capture, slicable[: middle_idx + 1], method,)
-            if dispersion <= max_dispersion:
-                left_idx = middle_idx
-            else:
-                right_idx = middle_idx
-
-        # left_idx-1 is last valid base datum
-        final_base_data = slicable[:left_idx]
-        to_be_placed_back = slicable[left_idx:]
-        dispersion_result = gaze_dispersion(capture, final_base_data, method)
-
-        fixation = fixation_result.from_data(
-            dispersion_result, method, final_base_data, capture.timestamps
-        )
-        yield "Detecting fixations...", fixation
-        working_queue.clear()  # clear queue
-        remaining_gaze.extendleft(reversed(to_be_placed_back))
-
-    yield "Fixation detection complete", ()
-
-
 class Offline_Fixation_Detector(Observable, Fixation_Detector_Base):
     """Dispersion-duration-based fixation detector.
 
@@ -578,44 +396,6 @@ class Offline_Fixation_Detector(Observable, Fixation_Detector_Base):
         )
         self.notify_all({"subject": "fixations_changed", "delay": 1})
 
-    @classmethod
-    def csv_representation_keys(self):
-        return (
-            "id",
-            "start_timestamp",
-            "duration",
-            "start_frame_index",
-            "end_frame_index",
-            "norm_pos_x",
-            "norm_pos_y",
-            "dispersion",
-            "confidence",
-            "method",
-            "gaze_point_3d_x",
-            "gaze_point_3d_y",
-            "gaze_point_3d_z",
-            "base_data",
-        )
-
-    @classmethod
-    def csv_representation_for_fixation(self, fixation):
-        return (
-            fixation["id"],
-            fixation["timestamp"],
-            fixation["duration"],
-            fixation["start_frame_index"],
-            fixation["end_frame_index"],
-            fixation["norm_pos"][0],
-            fixation["norm_pos"][1],
-            fixation["dispersion"],
-            fixation["confidence"],
-            fixation["method"],
-            *fixation.get(
-                "gaze_point_3d", [None] * 3
-            ),  # expanded, hence * at beginning
-            " ".join(["{}".format(gp["timestamp"]) for gp in fixation["base_data"]]),
-        )
-
     def export_fixations(self, export_window, export_dir):
         """
         between in and out mark
@@ -633,33 +413,13 @@ class Offline_Fixation_Detector(Observable, Fixation_Detector_Base):
             logger.warning("No fixations in this recording nothing to export")
             return
 
-        fixations_in_section = self.g_pool.fixations.by_ts_window(export_window)
-
-        with open(
-            os.path.join(export_dir, "fixations.csv"), "w", encoding="utf-8", newline=""
-        ) as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow(self.csv_representation_keys())
-            for f in fixations_in_section:
-                csv_writer.writerow(self.csv_representation_for_fixation(f))
-            logger.info("Created 'fixations.csv' file.")
-
-        with open(
-            os.path.join(export_dir, "fixation_report.csv"),
-            "w",
-            encoding="utf-8",
-            newline="",
-        ) as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow(("fixation classifier", "Dispersion_Duration"))
-            csv_writer.writerow(
-                ("max_dispersion", "{:0.3f} deg".format(self.max_dispersion))
-            )
-            csv_writer.writerow(("min_duration", "{:.0f} ms".format(self.min_duration)))
-            csv_writer.writerow(("max_duration", "{:.0f} ms".format(self.max_duration)))
-            csv_writer.writerow((""))
-            csv_writer.writerow(("fixation_count", len(fixations_in_section)))
-            logger.info("Created 'fixation_report.csv' file.")
+        write_fixations(
+            self.g_pool.fixations.by_ts_window(export_window),
+            export_dir,
+            self.max_dispersion,
+            self.min_duration,
+            self.max_duration,
+        )
 
 
 class Fixation_Detector(Fixation_Detector_Base):
@@ -0,0 +1,298 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import csv
+import enum
+import logging
+import os
+import typing as T
+
+import msgpack
+import numpy as np
+from scipy.spatial.distance import pdist
+
+import file_methods as fm
+
+logger = logging.getLogger(__name__)
+
+
+class FixationDetectionMethod(enum.Enum):
+    GAZE_2D = "2d gaze"
+    GAZE_3D = "3d gaze"
+
+
+def fixation_from_data(
+    dispersion: float,
+    method: FixationDetectionMethod,
+    base_data: T.Iterable,
+    timestamps=None,
+):
+    norm_pos = np.mean([gp["norm_pos"] for gp in base_data], axis=0).tolist()
+    dispersion = np.rad2deg(dispersion)  # in degrees
+
+    fix = {
+        "topic": "fixations",
+        "norm_pos": norm_pos,
+        "dispersion": dispersion,
+        "method": method.value,
+        "base_data": list(base_data),
+        "timestamp": base_data[0]["timestamp"],
+        "duration": (base_data[-1]["timestamp"] - base_data[0]["timestamp"]) * 1000,
+        "confidence": float(np.mean([gp["confidence"] for gp in base_data])),
+    }
+    if method == FixationDetectionMethod.GAZE_3D:
+        fix["gaze_point_3d"] = np.mean(
+            [gp["gaze_point_3d"] for gp in base_data if "gaze_point_3d" in gp], axis=0
+        ).tolist()
+    if timestamps is not None:
+        start, end = base_data[0]["timestamp"], base_data[-1]["timestamp"]
+        start, end = np.searchsorted(timestamps, [start, end])
+        end = min(end, len(timestamps) - 1)  # fix `list index out of range` error
+        fix["start_frame_index"] = int(start)
+        fix["end_frame_index"] = int(end)
+        fix["mid_frame_index"] = int((start + end) // 2)
+    return fix
+
+
+class Fixation_Result_Factory(object):
+    __slots__ = ("_id_counter",)
+
+    def __init__(self):
+        self._id_counter = 0
+
+    def from_data(self, *args, **kwargs):
+        datum = fixation_from_data(*args, **kwargs)
+        self._set_fixation_id(datum)
+        fixation_start = datum["timestamp"]
+        fixation_stop = fixation_start + (datum["duration"] / 1000)
+        # datum = self._serialize(datum)
+        return (datum, fixation_start, fixation_stop)
+
+    def _set_fixation_id(self, fixation):
+        fixation["id"] = self._id_counter
+        self._id_counter += 1
+
+    def _serialize(self, fixation):
+        serialization_hook = fm.Serialized_Dict.packing_hook
+        fixation_serialized = msgpack.packb(
+            fixation, use_bin_type=True, default=serialization_hook
+        )
+        return fixation_serialized
+
+
+def vector_dispersion(vectors):
+    distances = pdist(vectors, metric="cosine")
+    dispersion = np.arccos(1.0 - distances.max())
+    return dispersion
+
+
+def gaze_dispersion(capture, gaze_subset, method: FixationDetectionMethod) -> float:
+    if method is FixationDetectionMethod.GAZE_3D:
+        vectors = np.array([gp["gaze_point_3d"] for gp in gaze_subset])
+    elif method is FixationDetectionMethod.GAZE_2D:
+        locations = np.array([gp["norm_pos"] for gp in gaze_subset])
+
+        # denormalize
+        width, height = capture.frame_size
+        locations[:, 0] *= width
+        locations[:, 1] = (1.0 - locations[:, 1]) * height
+
+        # undistort onto 3d plane
+        vectors = capture.intrinsics.unprojectPoints(locations)
+    else:
+        raise ValueError(f"Unknown method '{method}'")
+
+    dist = vector_dispersion(vectors)
+    return dist
+
+
+def can_use_3d_gaze_mapping(gaze_data) -> bool:
+    return all("gaze_point_3d" in gp for gp in gaze_data)
+
+
+def gaze_vectors(capture, gaze_fields, method: FixationDetectionMethod):
+    """Gaze directions of the `gaze_fields` structured array, see detect_fixations."""
+    if method is FixationDetectionMethod.GAZE_3D:
+        return gaze_fields["gaze_point_3d"]
+    elif method is FixationDetectionMethod.GAZE_2D:
+        locations = gaze_fields["norm_pos"].copy()
+
+        # denormalize
+        width, height = capture.frame_size
+        locations[:, 0] *= width
+        locations[:, 1] = (1.0 - locations[:, 1]) * height
+
+        # undistort onto 3d plane
+        return capture.intrinsics.unprojectPoints(locations)
+    else:
+        raise ValueError(f"Unknown method '{method}'")
+
+
+def detect_fixations(
+    capture, gaze_data, max_dispersion, min_duration, max_duration, min_data_confidence
+):
+    yield "Detecting fixations...", ()
+    gaze_data = [
+        fm.Serialized_Dict(msgpack_bytes=serialized) for serialized in gaze_data
+    ]
+    # decode the fields needed for the dispersion windows once, instead of
+    # deserializing every datum again for every window it is part of
+    gaze_fields = fm.to_struct_array(
+        gaze_data, ["confidence", "timestamp", "norm_pos", "gaze_point_3d"]
+    )
+    confident = gaze_fields["confidence"] > min_data_confidence
+    gaze_data = [datum for datum, keep in zip(gaze_data, confident) if keep]
+    gaze_fields = gaze_fields[confident]
+    if not gaze_data:
+        logger.warning("No data available to find fixations")
+        return "Fixation detection failed", ()
+
+    method = (
+        FixationDetectionMethod.GAZE_3D
+        if gaze_fields["gaze_point_3d"].ndim == 2
+        and not np.isnan(gaze_fields["gaze_point_3d"]).any()
+        else FixationDetectionMethod.GAZE_2D
+    )
+    logger.info(f"Starting fixation detection using {method.value} data...")
+    fixation_result = Fixation_Result_Factory()
+
+    timestamps = gaze_fields["timestamp"]
+    vectors = gaze_vectors(capture, gaze_fields, method)
+
+    def dispersion_of(start, stop):
+        return vector_dispersion(vectors[start:stop])
+
+    # the working queue is gaze_data[start:stop], the remaining gaze follows it
+    start = stop = 0
+    while stop < len(gaze_data):
+        # check if working_queue contains enough data
+        if (
+            stop - start < 2
+            or (timestamps[stop - 1] - timestamps[start]) < min_duration
+        ):
+            stop += 1
+            continue
+
+        # min duration reached, check for fixation
+        dispersion = dispersion_of(start, stop)
+        if dispersion > max_dispersion:
+            # not a fixation, move forward
+            start += 1
+            continue
+
+        left_idx = stop - start
+
+        # minimal fixation found. collect maximal data
+        # to perform binary search for fixation end
+        while stop < len(gaze_data):
+            if timestamps[stop] > timestamps[start] + max_duration:
+                break  # maximum data found
+            stop += 1
+
+        # check for fixation with maximum duration
+        dispersion = dispersion_of(start, stop)
+        if dispersion <= max_dispersion:
+            fixation = fixation_result.from_data(
+                dispersion, method, gaze_data[start:stop], capture.timestamps
+            )
+            yield "Detecting fixations...", fixation
+            start = stop  # discard old Q
+            continue
+
+        right_idx = stop - start
+
+        # binary search
+        while left_idx < right_idx - 1:
+            middle_idx = (left_idx + right_idx) // 2
+            dispersion = dispersion_of(start, start + middle_idx + 1)
+            if dispersion <= max_dispersion:
+                left_idx = middle_idx
+            else:
+                right_idx = middle_idx
+
+        # left_idx-1 is last valid base datum
+        final_base_data = gaze_data[start : start + left_idx]
+        dispersion_result = dispersion_of(start, start + left_idx)
+
+        fixation = fixation_result.from_data(
+            dispersion_result, method, final_base_data, capture.timestamps
+        )
+        yield "Detecting fixations...", fixation
+        # clear queue, the rest of the window is placed back
+        start = stop = start + left_idx
+
+    yield "Fixation detection complete", ()
+
+
+def csv_representation_keys():
+    return (
+        "id",
+        "start_timestamp",
+        "duration",
+        "start_frame_index",
+        "end_frame_index",
+        "norm_pos_x",
+        "norm_pos_y",
+        "dispersion",
+        "confidence",
+        "method",
+        "gaze_point_3d_x",
+        "gaze_point_3d_y",
+        "gaze_point_3d_z",
+        "base_data",
+    )
+
+
+def csv_representation_for_fixation(fixation):
+    return (
+        fixation["id"],
+        fixation["timestamp"],
+        fixation["duration"],
+        fixation["start_frame_index"],
+        fixation["end_frame_index"],
+        fixation["norm_pos"][0],
+        fixation["norm_pos"][1],
+        fixation["dispersion"],
+        fixation["confidence"],
+        fixation["method"],
+        *fixation.get("gaze_point_3d", [None] * 3),  # expanded, hence * at beginning
+        " ".join(["{}".format(gp["timestamp"]) for gp in fixation["base_data"]]),
+    )
+
+
+def write_fixations(
+    fixations_in_section, export_dir, max_dispersion, min_duration, max_duration
+):
+    """Write the fixations and the fixation report files to `export_dir`, see
+    Offline_Fixation_Detector.export_fixations"""
+    with open(
+        os.path.join(export_dir, "fixations.csv"), "w", encoding="utf-8", newline=""
+    ) as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(csv_representation_keys())
+        for f in fixations_in_section:
+            csv_writer.writerow(csv_representation_for_fixation(f))
+        logger.info("Created 'fixations.csv' file.")
+
+    with open(
+        os.path.join(export_dir, "fixation_report.csv"),
+        "w",
+        encoding="utf-8",
+        newline="",
+    ) as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(("fixation classifier", "Dispersion_Duration"))
+        csv_writer.writerow(("max_dispersion", "{:0.3f} deg".format(max_dispersion)))
+        csv_writer.writerow(("min_duration", "{:.0f} ms".format(min_duration)))
+        csv_writer.writerow(("max_duration", "{:.0f} ms".format(max_duration)))
+        csv_writer.writerow((""))
+        csv_writer.writerow(("fixation_count", len(fixations_in_section)))
+        logger.info("Created 'fixation_report.csv' file.")
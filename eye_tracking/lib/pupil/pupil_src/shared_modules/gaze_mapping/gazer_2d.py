@@ -241,9 +241,126 @@ class Gazer2D(GazerBase):
                 }
                 yield gaze_datum
 
+    _batch_pupil_fields = ("id", "timestamp", "confidence", "norm_pos")
+
+    def predict_batch(self, pupil_data, pupil_arrays, matches) -> T.Iterator["Gaze"]:
+        eye0_idc, eye1_idc = matches.T
+        norm_pos = pupil_arrays["norm_pos"]
+        is_binocular = (eye0_idc >= 0) & (eye1_idc >= 0)
+        match_types = (
+            (is_binocular, self.binocular_model, "binocular", "gaze.2d.01."),
+            (eye1_idc < 0, self.right_model, "right", "gaze.2d.0."),
+            (eye0_idc < 0, self.left_model, "left", "gaze.2d.1."),
+        )
+
+        gaze_positions = np.empty((len(matches), 2))
+        topics = [None] * len(matches)
+        for is_type, model, model_name, topic in match_types:
+            if not is_type.any():
+                continue
+            if not model.is_fitted:
+                logger.debug(
+                    f"Prediction failed because {model_name} model is not fitted"
+                )
+                continue
+            if model is self.binocular_model:
+                X = np.hstack(
+                    [norm_pos[eye1_idc[is_type]], norm_pos[eye0_idc[is_type]]]
+                )
+            elif model is self.right_model:
+                X = norm_pos[eye0_idc[is_type]]
+            else:
+                X = norm_pos[eye1_idc[is_type]]
+            gaze_positions[is_type] = model.predict(X)
+            for match_idx in np.flatnonzero(is_type).tolist():
+                topics[match_idx] = topic
+
+        pupil_idc = np.where(matches >= 0, matches, 0)
+        is_matched = matches >= 0
+        confidences = np.where(
+            is_matched, pupil_arrays["confidence"][pupil_idc], 0.0
+        ).sum(axis=1) / is_matched.sum(axis=1)
+        timestamps = np.where(
+            is_matched, pupil_arrays["timestamp"][pupil_idc], 0.0
+        ).sum(axis=1) / is_matched.sum(axis=1)
+
+        for match, topic, gaze_pos, confidence, timestamp in zip(
+            matches.tolist(),
+            topics,
+            gaze_positions.tolist(),
+            confidences.tolist(),
+            timestamps.tolist(),
+        ):
+            if topic is None:
+                continue  # Prediction failed and the reason was logged
+            yield {
+                "topic": topic,
+                "norm_pos": gaze_pos,
+                "confidence": confidence,
+                "timestamp": timestamp,
+                "base_data": [pupil_data[idx] for idx in match if idx >= 0],
+            }
+
     def filter_pupil_data(
         self, pupil_data: T.Iterable, confidence_threshold: T.Optional[float] = None
     ) -> T.Iterable:
         pupil_data = list(filter(lambda p: "2d" in p["method"], pupil_data))
         pupil_data = super().filter_pupil_data(pupil_data, confidence_threshold)
         return pupil_data
+
+
+def bench(duration=600.0, sampling_rate=200.0):
+    """Compare map_pupil_to_gaze() to map_pupil_to_gaze_batch() on synthetic
+    binocular pupil data of `duration` seconds."""
+    import time
+    import types
+
+    import file_methods as fm
+
+    rng = np.random.default_rng(0)
+    pupil_data = []
+    for eye_id in (0, 1):
+        timestamps = np.arange(0.0, duration, 1 / sampling_rate)
+        timestamps += rng.normal(0.0, 0.1 / sampling_rate, timestamps.shape)
+        for ts in timestamps.tolist():
+            datum = {
+                "topic": f"pupil.{eye_id}.2d",
+                "id": eye_id,
+                "method": "2d c++",
+                "timestamp": ts,
+                "confidence": float(rng.uniform(0.5, 1.0)),
+                "norm_pos": rng.uniform(0.3, 0.7, 2).tolist(),
+            }
+            pupil_data.append(fm.Serialized_Dict(python_dict=datum))
+    pupil_data.sort(key=lambda p: p["timestamp"])
+
+    g_pool = types.SimpleNamespace(capture=types.SimpleNamespace(frame_size=(1, 1)))
+    params = {
+        "left_model": {"coef_": rng.normal(size=(2, 6)), "intercept_": [0.5, 0.5]},
+        "right_model": {"coef_": rng.normal(size=(2, 6)), "intercept_": [0.5, 0.5]},
+        "binocular_model": {
+            "coef_": rng.normal(size=(2, 12)),
+            "intercept_": [0.5, 0.5],
+        },
+    }
+    gazer = Gazer2D(g_pool, params=params)
+
+    start = time.perf_counter()
+    gaze_count = sum(1 for _ in gazer.map_pupil_to_gaze(pupil_data))
+    print(
+        "realtime matching: {} gaze in {:.2f}s".format(
+            gaze_count, time.perf_counter() - start
+        )
+    )
+
+    start = time.perf_counter()
+    gaze_count = sum(1 for _ in gazer.map_pupil_to_gaze_batch(pupil_data))
+    print(
+        "batch matching: {} gaze in {:.2f}s".format(
+            gaze_count, time.perf_counter() - start
+        )
+    )
+
+
+if __name__ == "__main__":
+    bench()
@@ -373,6 +373,33 @@ class GazerBase(abc.ABC, Plugin):
 
         yield from self.predict(matches)
 
+    # fields of the pupil data decoded for predict_batch()
+    _batch_pupil_fields = ("id", "timestamp", "confidence")
+
+    def map_pupil_to_gaze_batch(self, pupil_data, chunk_size=10000):
+        """Maps recorded pupil data like map_pupil_to_gaze(), but matches all data
+        at once and predicts the gaze of `chunk_size` matches at a time."""
+        pupil_data = list(self.filter_pupil_data(pupil_data))
+        pupil_arrays = fm.to_struct_array(pupil_data, self._batch_pupil_fields)
+        matches = self.matcher.match_arrays(
+            pupil_arrays["timestamp"], pupil_arrays["id"], pupil_arrays["confidence"]
+        )
+        for start in range(0, len(matches), chunk_size):
+            chunk = matches[start : start + chunk_size]
+            yield from self.predict_batch(pupil_data, pupil_arrays, chunk)
+
+    def predict_batch(self, pupil_data, pupil_arrays, matches):
+        """Predicts the gaze of `matches`, the indices into `pupil_data` returned by
+        RealtimeMatcher.match_arrays(). `pupil_arrays` holds the
+        `_batch_pupil_fields` of `pupil_data`.
+
+        Overwrite to predict all matches at once.
+        """
+        matched_pupil_data = (
+            [pupil_data[idx] for idx in match if idx >= 0] for match in matches.tolist()
+        )
+        yield from self.predict(matched_pupil_data)
+
 
 class Matches(T.NamedTuple):
     left: object
@@ -12,6 +12,7 @@ import typing as T
 from collections import deque
 
 import numpy as np
+from scipy.signal import lfilter
 
 
 class RealtimeMatcher:
@@ -55,6 +56,84 @@ class RealtimeMatcher:
         self._caches = current_caches
         return results
 
+    def match_arrays(self, timestamps, eye_ids, confidences):
+        """Matches recorded pupil data with the rules of on_pupil_datum(), for all
+        data at once.
+
+        Low confidence data is matched monocularly. High confidence data is
+        matched with the next high confidence datum of the other eye, if they are
+        closer than the temporal cutoff, and monocularly otherwise. Unlike
+        map_batch(), the data at the end, which on_pupil_datum() would still
+        hold back, is matched as well.
+
+        Args:
+            timestamps, eye_ids, confidences: Arrays of the pupil data, in any order.
+
+        Returns: Integer array of shape (n_matches, 2) with the indices of the eye0
+            and eye1 datum of each match, -1 for a missing datum, in the order
+            on_pupil_datum() yields the matches.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        eye_ids = np.asarray(eye_ids).astype(int)
+        confident = np.asarray(confidences) >= self.min_pupil_confidence
+
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        eye_ids = eye_ids[order]
+        confident = confident[order]
+        temporal_cutoffs = 2 * self._estimate_framerates_smoothed(timestamps, eye_ids)
+
+        matches = np.full((len(order), 2), -1)
+        matches[np.arange(len(order)), eye_ids] = order
+        for eye_id in (0, 1):
+            # on ties the eye1 datum is popped first
+            side = "right" if eye_id == 0 else "left"
+            is_older = confident & (eye_ids == eye_id)
+            other_eye = np.flatnonzero(confident & (eye_ids != eye_id))
+            older_idc = np.flatnonzero(is_older)
+            if not older_idc.size or not other_eye.size:
+                continue
+            next_idc = np.searchsorted(
+                timestamps[other_eye], timestamps[older_idc], side=side
+            )
+            has_next = next_idc < other_eye.size
+            older_idc = older_idc[has_next]
+            other_idc = other_eye[next_idc[has_next]]
+            # the cutoff is estimated when both data are available
+            cutoffs = temporal_cutoffs[np.maximum(older_idc, other_idc)]
+            is_match = timestamps[other_idc] - timestamps[older_idc] < cutoffs
+            matches[older_idc[is_match], 1 - eye_id] = order[other_idc[is_match]]
+        return matches
+
+    def _estimate_framerates_smoothed(self, timestamps, eye_ids):
+        """Framerate estimates of estimate_framerate_smoothed() after each datum of
+        the sorted `timestamps`, from the last frame interval of each eye."""
+        indices = np.arange(len(timestamps))
+        frame_intervals = np.full((2, len(timestamps)), np.nan)
+        for eye_id in (0, 1):
+            eye_idc = np.flatnonzero(eye_ids == eye_id)
+            intervals = np.full(len(timestamps), np.nan)
+            intervals[eye_idc[1:]] = np.diff(timestamps[eye_idc])
+            # forward fill the interval of the last datum of this eye
+            last_idc = np.maximum.accumulate(np.where(np.isnan(intervals), -1, indices))
+            known = last_idc >= 0
+            frame_intervals[eye_id, known] = intervals[last_idc[known]]
+
+        estimates_raw = np.fmax(frame_intervals[0], frame_intervals[1])
+        # the raw estimate is unknown only before the second datum of either eye
+        known = np.flatnonzero(~np.isnan(estimates_raw))
+        estimates = np.full(len(timestamps), self.recently_estimated_framerate)
+        if known.size:
+            # exponential smoothing of the raw estimates
+            alpha = self.framerate_estimation_smoothing_factor
+            estimates[known], _ = lfilter(
+                [alpha],
+                [1, alpha - 1],
+                estimates_raw[known],
+                zi=[(1 - alpha) * self.recently_estimated_framerate],
+            )
+        return estimates
+
     def on_pupil_datum(self, p) -> T.Iterator:
         """Returns a list with either zero, one or two pupil datums.
         - zero: not enough data in queue
@@ -28,6 +28,7 @@ class GazeMapperController(Observable):
         task_manager,
         get_current_trim_mark_range,
         publish_gaze_bisector,
+        mapping_workers=1,
     ):
         self._gaze_mapper_storage = gaze_mapper_storage
         self._calibration_storage = calibration_storage
@@ -35,6 +36,8 @@ class GazeMapperController(Observable):
         self._task_manager = task_manager
         self._get_current_trim_mark_range = get_current_trim_mark_range
         self._publish_gaze_bisector = publish_gaze_bisector
+        # number of processes mapping time chunks of a gaze mapper in parallel
+        self._mapping_workers = mapping_workers
 
         self._gaze_mapper_storage.add_observer("delete", self.on_gaze_mapper_deleted)
 
@@ -89,7 +92,9 @@ class GazeMapperController(Observable):
         gaze_mapper.precision_result = ""
 
     def _create_mapping_task(self, gaze_mapper, calibration):
-        task = worker.map_gaze.create_task(gaze_mapper, calibration)
+        task = worker.map_gaze.create_task(
+            gaze_mapper, calibration, workers=self._mapping_workers
+        )
 
         def on_yield_gaze(mapped_gaze_ts_and_data):
             gaze_mapper.status = f"Mapping {task.progress * 100:.0f}% complete"
@@ -31,8 +31,9 @@ class GazeFromOfflineCalibration(GazeProducerBase):
     def gaze_data_source_selection_order(cls) -> float:
         return 2.0
 
-    def __init__(self, g_pool):
+    def __init__(self, g_pool, mapping_workers=1):
         super().__init__(g_pool)
+        self._mapping_workers = mapping_workers
 
         self.inject_plugin_dependencies()
 
@@ -68,6 +69,9 @@ class GazeFromOfflineCalibration(GazeProducerBase):
             get_recording_index_range=self._recording_index_range,
         )
 
+    def get_init_dict(self):
+        return {"mapping_workers": self._mapping_workers}
+
     def cleanup(self):
         super().cleanup()
         self._reference_location_storage.save_to_disk()
@@ -99,6 +103,7 @@ class GazeFromOfflineCalibration(GazeProducerBase):
             task_manager=self._task_manager,
             get_current_trim_mark_range=self._current_trim_mark_range,
             publish_gaze_bisector=self._publish_gaze,
+            mapping_workers=self._mapping_workers,
         )
         self._calculate_all_controller = controller.CalculateAllController(
             self._reference_detection_controller,
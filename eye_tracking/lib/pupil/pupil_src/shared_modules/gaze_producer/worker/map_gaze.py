@@ -8,22 +8,39 @@ Lesser General Public License (LGPL v3.0).
 See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
+import numpy as np
+
 import file_methods as fm
 import player_methods as pm
 import tasklib
 from gaze_mapping import gazer_classes_by_class_name, registered_gazer_classes
+from tasklib.parallel import ParallelTaskGroup
 
 from .fake_gpool import FakeGPool
 
 
 g_pool = None  # set by the plugin
 
+# duration of the time chunks mapped in parallel, in seconds
+MAPPING_CHUNK_DURATION = 60.0
+# pupil data before and after a chunk, which is mapped with the chunk to match the
+# data at its borders like in a single task, in seconds
+MAPPING_CHUNK_OVERLAP = 1.0
+
 
 class NotEnoughPupilData(ValueError):
     pass
 
 
-def create_task(gaze_mapper, calibration):
+def create_task(
+    gaze_mapper, calibration, workers=1, chunk_duration=MAPPING_CHUNK_DURATION
+):
+    """Creates the task mapping the pupil data in the mapping range of `gaze_mapper`.
+
+    With more than one worker, the mapping range is split into chunks of
+    `chunk_duration` seconds, which are mapped by `workers` processes in parallel.
+    The gaze is yielded in the order of the chunks in both cases.
+    """
     assert g_pool, "You forgot to set g_pool by the plugin"
     mapping_window = pm.exact_window(g_pool.timestamps, gaze_mapper.mapping_index_range)
     pupil_pos_in_mapping_range = g_pool.pupil_positions.by_ts_window(mapping_window)
@@ -45,9 +62,48 @@ def create_task(gaze_mapper, calibration):
         gaze_mapper.manual_correction_y,
     )
     name = f"Create gaze mapper {gaze_mapper.name}"
-    return tasklib.background.create(
-        name, _map_gaze, args=args, pass_shared_memory=True,
-    )
+    chunk_windows = _chunk_windows(pupil_pos_in_mapping_range, chunk_duration)
+    # skip chunks without pupil data, e.g. in gaps of the recording
+    chunk_windows = [
+        chunk_window
+        for chunk_window in chunk_windows
+        if len(pupil_pos_in_mapping_range.by_ts_window(chunk_window))
+    ]
+    if workers <= 1 or len(chunk_windows) == 1:
+        return tasklib.background.create(
+            name, _map_gaze, args=args, pass_shared_memory=True,
+        )
+
+    tasks = []
+    for chunk_window in chunk_windows:
+        # only the pupil data of the chunk is passed to its process
+        pupil_pos_in_chunk = pupil_pos_in_mapping_range.by_ts_window(
+            (
+                chunk_window[0] - MAPPING_CHUNK_OVERLAP,
+                chunk_window[1] + MAPPING_CHUNK_OVERLAP,
+            )
+        )
+        chunk_args = args[:3] + (pupil_pos_in_chunk,) + args[4:]
+        task = tasklib.background.create(
+            f"{name} ({len(tasks) + 1}/{len(chunk_windows)})",
+            _map_gaze,
+            args=chunk_args,
+            kwargs={"mapped_ts_window": chunk_window},
+            pass_shared_memory=True,
+        )
+        tasks.append(task)
+    return ParallelTaskGroup(tasks, max_parallel=workers)
+
+
+def _chunk_windows(pupil_positions, chunk_duration):
+    """Splits the time range of `pupil_positions` into consecutive windows
+    [start, stop) of `chunk_duration` seconds, the last one ends after the data."""
+    first_ts = pupil_positions.timestamps[0]
+    last_ts = pupil_positions.timestamps[-1]
+    chunk_count = max(1, int(np.ceil((last_ts - first_ts) / chunk_duration)))
+    borders = first_ts + chunk_duration * np.arange(chunk_count + 1)
+    borders[-1] = np.inf
+    return list(zip(borders[:-1].tolist(), borders[1:].tolist()))
 
 
 def _map_gaze(
@@ -58,7 +114,11 @@ def _map_gaze(
     manual_correction_x,
     manual_correction_y,
     shared_memory,
+    mapped_ts_window=None,
 ):
+    """Maps the pupil data to gaze. If `mapped_ts_window` is set, only the gaze of
+    matches whose oldest pupil datum lies in the window [start, stop) is yielded.
+    """
     fake_gpool.import_runtime_plugins()
     gazers_by_name = gazer_classes_by_class_name(registered_gazer_classes())
     gazer_cls = gazers_by_name[gazer_class_name]
@@ -66,13 +126,20 @@ def _map_gaze(
 
     first_ts = pupil_pos_in_mapping_range[0]["timestamp"]
     last_ts = pupil_pos_in_mapping_range[-1]["timestamp"]
+    if mapped_ts_window is not None:
+        first_ts = max(first_ts, mapped_ts_window[0])
+        last_ts = min(last_ts, mapped_ts_window[1])
     ts_span = last_ts - first_ts
 
-    for gaze_datum in gazer.map_pupil_to_gaze(pupil_pos_in_mapping_range):
+    for gaze_datum in gazer.map_pupil_to_gaze_batch(pupil_pos_in_mapping_range):
+        if mapped_ts_window is not None and not _is_gaze_in_window(
+            gaze_datum, mapped_ts_window
+        ):
+            continue
         _apply_manual_correction(gaze_datum, manual_correction_x, manual_correction_y)
 
         curr_ts = gaze_datum["timestamp"]
-        shared_memory.progress = (curr_ts - first_ts) / ts_span
+        shared_memory.progress = (curr_ts - first_ts) / ts_span if ts_span else 1.0
 
         result = (curr_ts, fm.Serialized_Dict(gaze_datum))
         yield [result]
@@ -84,3 +151,8 @@ def _apply_manual_correction(gaze_datum, manual_correction_x, manual_correction_
     gaze_norm_pos[0] += manual_correction_x
     gaze_norm_pos[1] += manual_correction_y
     gaze_datum["norm_pos"] = gaze_norm_pos
+
+
+def _is_gaze_in_window(gaze_datum, ts_window):
+    oldest_pupil_ts = min(pupil["timestamp"] for pupil in gaze_datum["base_data"])
+    return ts_window[0] <= oldest_pupil_ts < ts_window[1]
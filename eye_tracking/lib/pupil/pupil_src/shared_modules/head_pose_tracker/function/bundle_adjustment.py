@@ -17,6 +17,7 @@ import numpy as np
 from scipy import optimize as scipy_optimize
 from scipy import sparse as scipy_sparse
 
+from camera_models import Fisheye_Dist_Camera
 from head_pose_tracker.function import utils
 
 logger = logging.getLogger(__name__)
@@ -38,7 +39,6 @@ class BundleAdjustment:
         self._camera_intrinsics_params_size = 4 + camera_intrinsics.D.size
 
         self._tol = 1e-8
-        self._diff_step = 1e-3
 
         self._marker_ids = []
         self._frame_ids = []
@@ -60,14 +60,12 @@ class BundleAdjustment:
         )
         self._prepare_basic_data(initial_guess_result.key_markers)
 
-        initial_guess_array, bounds, sparsity_matrix = self._prepare_parameters(
+        initial_guess_array, bounds = self._prepare_parameters(
             camera_extrinsics_array, marker_extrinsics_array
         )
 
         try:
-            least_sq_result = self._least_squares(
-                initial_guess_array, bounds, sparsity_matrix
-            )
+            least_sq_result = self._least_squares(initial_guess_array, bounds)
         except ValueError as err:
             logger.debug(
                 f"Value error encountered during optimizing 3d markers model: {err}"
@@ -102,7 +100,7 @@ class BundleAdjustment:
         )
         self._markers_points_2d_detected = np.array(
             [marker.verts for marker in key_markers]
-        )
+        ).reshape(-1, 4, 2)
 
     def _prepare_parameters(self, camera_extrinsics_array, marker_extrinsics_array):
         self._camera_extrinsics_shape = camera_extrinsics_array.shape
@@ -121,11 +119,11 @@ class BundleAdjustment:
 
         bounds = self._calculate_bounds()
 
-        sparsity_matrix = self._construct_sparsity_matrix()
+        self._jacobian_rows, self._jacobian_cols = self._get_jacobian_indices()
 
-        return initial_guess_array, bounds, sparsity_matrix
+        return initial_guess_array, bounds
 
-    def _calculate_bounds(self, eps=np.finfo(np.float).eps, scale=np.inf):
+    def _calculate_bounds(self, eps=np.finfo(float).eps, scale=np.inf):
         """ calculate the lower and upper bounds on independent variables
             fix the first marker at the origin of the coordinate system
         """
@@ -159,62 +157,43 @@ class BundleAdjustment:
 
         return lower_bound, upper_bound
 
-    def _construct_sparsity_matrix(self):
-        """
-        Construct the sparsity structure of the Jacobian matrix for finite difference
-        estimation. If the Jacobian has only few non-zero elements in each row,
-        providing the sparsity structure will greatly speed up the computations. A zero
-        entry means that a corresponding element in the Jacobian is identically zero.
-
-        :return: scipy.sparse.lil_matrix, with shape (n_residuals, n_variables), where
-        n_residuals = markers_points_2d_detected.size,
-        n_variables = camera_extrinsics_array.size + marker_extrinsics_array.size
+    def _get_jacobian_indices(self):
         """
+        Row and column indices of the non-zero elements of the Jacobian matrix. The
+        residuals of an observation depend on the extrinsics of its camera and its
+        marker, and on the camera intrinsics if they are optimized.
 
+        :return: row and column indices, in the order of the values returned by
+        _project_markers()
+        """
         n_samples = len(self._frame_indices)
-
-        mat_camera = np.zeros(
-            (n_samples, self._camera_extrinsics_shape[0]), dtype=np.uint8
-        )
-        mat_camera[np.arange(n_samples), self._frame_indices] = 1
-        mat_camera = cv2.resize(
-            mat_camera,
-            (
-                np.prod(self._camera_extrinsics_shape),
-                self._markers_points_2d_detected.size,
-            ),
-            interpolation=cv2.INTER_NEAREST,
-        )
-
-        mat_marker = np.zeros(
-            (n_samples, self._marker_extrinsics_shape[0]), dtype=np.uint8
-        )
-        mat_marker[np.arange(n_samples), self._marker_indices] = 1
-        mat_marker = cv2.resize(
-            mat_marker,
-            (
-                np.prod(self._marker_extrinsics_shape),
-                self._markers_points_2d_detected.size,
-            ),
-            interpolation=cv2.INTER_NEAREST,
-        )
-
-        sparsity_matrix = np.hstack((mat_camera, mat_marker))
-
+        n_camera_variables = np.prod(self._camera_extrinsics_shape)
+        cols = [
+            6 * self._frame_indices[:, np.newaxis] + np.arange(6),
+            n_camera_variables
+            + 6 * self._marker_indices[:, np.newaxis]
+            + np.arange(6),
+        ]
         if self._optimize_camera_intrinsics and self._enough_samples:
-            mat_camera_intrinsics = np.ones(
-                (
-                    self._markers_points_2d_detected.size,
-                    self._camera_intrinsics_params_size,
-                ),
-                dtype=int,
+            n_extrinsics_variables = n_camera_variables + np.prod(
+                self._marker_extrinsics_shape
+            )
+            intrinsics_cols = n_extrinsics_variables + np.arange(
+                self._camera_intrinsics_params_size
+            )
+            cols.append(
+                np.broadcast_to(intrinsics_cols, (n_samples, intrinsics_cols.size))
             )
-            sparsity_matrix = np.hstack((sparsity_matrix, mat_camera_intrinsics))
+        cols = np.hstack(cols)
 
-        sparsity_matrix = scipy_sparse.lil_matrix(sparsity_matrix)
-        return sparsity_matrix
+        # every observation has 8 residuals, 2 for each of the 4 marker vertices
+        cols = np.broadcast_to(cols[:, np.newaxis], (n_samples, 8, cols.shape[1]))
+        rows = np.broadcast_to(
+            np.arange(8 * n_samples).reshape(n_samples, 8, 1), cols.shape
+        )
+        return rows.ravel(), cols.ravel()
 
-    def _least_squares(self, initial_guess_array, bounds, sparsity_matrix):
+    def _least_squares(self, initial_guess_array, bounds):
         result = scipy_optimize.least_squares(
             fun=self._function_compute_residuals,
             x0=initial_guess_array,
@@ -224,8 +203,7 @@ class BundleAdjustment:
             gtol=self._tol,
             x_scale="jac",
             loss="soft_l1",
-            diff_step=self._diff_step,
-            jac_sparsity=sparsity_matrix,
+            jac=self._function_compute_jacobian,
             max_nfev=100,
         )
         return result
@@ -259,20 +237,18 @@ class BundleAdjustment:
         """ Function which computes the vector of residuals,
         i.e., the minimization proceeds with respect to params
         """
-        camera_extrinsics_array, marker_extrinsics_array = self._get_extrinsics_arrays(
-            variables
-        )
-        if self._optimize_camera_intrinsics and self._enough_samples:
-            self._unload_camera_intrinsics_params(
-                variables[-self._camera_intrinsics_params_size :]
-            )
-
-        markers_points_2d_projected = self._project_markers(
-            camera_extrinsics_array, marker_extrinsics_array
-        )
+        markers_points_2d_projected, _ = self._project_markers(variables)
         residuals = markers_points_2d_projected - self._markers_points_2d_detected
         return residuals.ravel()
 
+    def _function_compute_jacobian(self, variables):
+        """ Function which computes the sparse Jacobian matrix of the residuals """
+        _, jacobian_values = self._project_markers(variables, with_jacobian=True)
+        return scipy_sparse.csr_matrix(
+            (jacobian_values.ravel(), (self._jacobian_rows, self._jacobian_cols)),
+            shape=(self._markers_points_2d_detected.size, variables.size),
+        )
+
     def _get_extrinsics_arrays(self, variables):
         """ reshape 1-dimensional vector into the original shape of
         camera_extrinsics_array and marker_extrinsics_array
@@ -291,23 +267,120 @@ class BundleAdjustment:
 
         return camera_extrinsics_array, marker_extrinsics_array
 
-    def _project_markers(self, camera_extrinsics_array, marker_extrinsics_array):
-        markers_points_3d = np.array(
-            [
-                utils.convert_marker_extrinsics_to_points_3d(extrinsics)
-                for extrinsics in marker_extrinsics_array
-            ]
+    def _project_markers(self, variables, with_jacobian=False):
+        """ project the vertices of all observed markers into their cameras at once
+
+        :return: projected points of shape (n_samples, 4, 2) and, if with_jacobian,
+        the values of the Jacobian matrix, see _get_jacobian_indices()
+        """
+        camera_extrinsics_array, marker_extrinsics_array = self._get_extrinsics_arrays(
+            variables
         )
-        markers_points_2d_projected = np.array(
-            [
-                self._camera_intrinsics.projectPoints(points, cam[0:3], cam[3:6])
-                for cam, points in zip(
-                    camera_extrinsics_array[self._frame_indices],
-                    markers_points_3d[self._marker_indices],
-                )
-            ]
+        if self._optimize_camera_intrinsics and self._enough_samples:
+            self._unload_camera_intrinsics_params(
+                variables[-self._camera_intrinsics_params_size :]
+            )
+
+        (
+            camera_rotations,
+            camera_rotation_derivatives,
+        ) = utils.rotation_vectors_to_matrices(camera_extrinsics_array[:, 0:3])
+        (
+            marker_rotations,
+            marker_rotation_derivatives,
+        ) = utils.rotation_vectors_to_matrices(marker_extrinsics_array[:, 0:3])
+        marker_points_3d_origin = utils.get_marker_points_3d_origin().astype(np.float64)
+
+        # vertices of the markers in the world coordinate system
+        markers_points_3d = np.einsum(
+            "mij,vj->mvi", marker_rotations, marker_points_3d_origin
         )
-        return markers_points_2d_projected
+        markers_points_3d += marker_extrinsics_array[:, np.newaxis, 3:6]
+
+        # vertices of the observed markers in the camera coordinate systems
+        rotations = camera_rotations[self._frame_indices]
+        points_3d = np.einsum(
+            "nij,nvj->nvi", rotations, markers_points_3d[self._marker_indices]
+        )
+        points_3d += camera_extrinsics_array[self._frame_indices, np.newaxis, 3:6]
+
+        points_2d, projection_jacobian = self._project_points(points_3d)
+        if not with_jacobian:
+            return points_2d, None
+
+        # derivatives of the image points by the points in the camera coordinate
+        # systems, (n_samples, 4, 2, 3)
+        jacobian_points_3d = projection_jacobian["points_3d"]
+
+        # derivatives of the points in the camera coordinate systems by the
+        # extrinsics, (n_samples, 4, 3, 3) each
+        by_camera_rotation = np.einsum(
+            "nkij,nvj->nvik",
+            camera_rotation_derivatives[self._frame_indices],
+            markers_points_3d[self._marker_indices],
+        )
+        by_marker_rotation = np.einsum(
+            "nij,nvjk->nvik",
+            rotations,
+            np.einsum(
+                "mkij,vj->mvik", marker_rotation_derivatives, marker_points_3d_origin
+            )[self._marker_indices],
+        )
+        jacobian_values_markers = np.concatenate(
+            (
+                jacobian_points_3d @ by_marker_rotation,
+                jacobian_points_3d @ rotations[:, np.newaxis],
+            ),
+            axis=3,
+        )
+        # the origin marker is fixed by its bounds, the optimizer does not converge
+        # if it is free to move according to the Jacobian matrix
+        jacobian_values_markers[self._marker_indices == 0] = 0
+        jacobian_values = [
+            jacobian_points_3d @ by_camera_rotation,
+            jacobian_points_3d,
+            jacobian_values_markers,
+        ]
+        if self._optimize_camera_intrinsics and self._enough_samples:
+            jacobian_values.append(projection_jacobian["intrinsics"])
+        return points_2d, np.concatenate(jacobian_values, axis=3)
+
+    def _project_points(self, points_3d):
+        """ project points of shape (n_samples, 4, 3) in the camera coordinate systems
+        with one call, which also returns the derivatives of the image points by the
+        points and the camera intrinsics
+
+        :return: image points of shape (n_samples, 4, 2) and dict of derivatives with
+        shapes (n_samples, 4, 2, 3) and (n_samples, 4, 2, n_intrinsics_params)
+        """
+        zeros = np.zeros((1, 1, 3))
+        K, D = self._camera_intrinsics.K, self._camera_intrinsics.D
+        if isinstance(self._camera_intrinsics, Fisheye_Dist_Camera):
+            points_2d, jacobian = cv2.fisheye.projectPoints(
+                points_3d.reshape(1, -1, 3), zeros, zeros, K, D, alpha=0
+            )
+            # columns: focal lengths, principal point, distortion coefficients,
+            # rotation, translation, skew
+            jacobian_intrinsics = jacobian[:, 0:8]
+            jacobian_points_3d = jacobian[:, 11:14]
+        else:
+            points_2d, jacobian = cv2.projectPoints(
+                points_3d.reshape(-1, 3), zeros, zeros, K, D
+            )
+            # columns: rotation, translation, focal lengths, principal point,
+            # distortion coefficients
+            jacobian_intrinsics = jacobian[:, 6:]
+            jacobian_points_3d = jacobian[:, 3:6]
+
+        # the derivatives by the translation of all points are the derivatives by
+        # each point
+        projection_jacobian = {
+            "points_3d": jacobian_points_3d.reshape(-1, 4, 2, 3),
+            "intrinsics": jacobian_intrinsics.reshape(
+                -1, 4, 2, jacobian_intrinsics.shape[1]
+            ),
+        }
+        return points_2d.reshape(-1, 4, 2), projection_jacobian
 
     def _find_failed_indices(self, residuals, thres_frame=8, thres_marker=8):
         """ find out those frame_indices and marker_indices which cause large
@@ -354,3 +427,120 @@ class BundleAdjustment:
 
         self._camera_intrinsics.update_camera_matrix(camera_matrix)
         self._camera_intrinsics.update_dist_coefs(dist_coefs)
+
+
+class _FiniteDifferenceBundleAdjustment(BundleAdjustment):
+    """BundleAdjustment with a Jacobian matrix estimated by finite differences, as
+    a reference for bench()"""
+
+    def _least_squares(self, initial_guess_array, bounds):
+        jac_sparsity = scipy_sparse.csr_matrix(
+            (
+                np.ones(self._jacobian_rows.size),
+                (self._jacobian_rows, self._jacobian_cols),
+            ),
+            shape=(self._markers_points_2d_detected.size, initial_guess_array.size),
+        )
+        return scipy_optimize.least_squares(
+            fun=self._function_compute_residuals,
+            x0=initial_guess_array,
+            bounds=bounds,
+            ftol=self._tol,
+            xtol=self._tol,
+            gtol=self._tol,
+            x_scale="jac",
+            loss="soft_l1",
+            jac_sparsity=jac_sparsity,
+            diff_step=1e-3,
+            max_nfev=100,
+        )
+
+
+def bench(n_markers=20, n_frames=300, markers_per_frame=6, fisheye=False):
+    """Compare the analytic Jacobian matrix to finite differences on a synthetic rig
+    of `n_markers` markers observed in `n_frames` frames, with and without
+    optimizing the camera intrinsics."""
+    import copy
+    import time
+
+    from camera_models import Radial_Dist_Camera
+    from head_pose_tracker.function.get_initial_guess import InitialGuess
+    from head_pose_tracker.function.pick_key_markers import KeyMarker
+
+    rng = np.random.default_rng(0)
+    if fisheye:
+        K = [[400.0, 0.0, 640.0], [0.0, 400.0, 360.0], [0.0, 0.0, 1.0]]
+        D = [[0.05, 0.01, -0.005, 0.001]]
+        camera_intrinsics = Fisheye_Dist_Camera(K, D, (1280, 720), "world")
+    else:
+        K = [[830.0, 0.0, 640.0], [0.0, 830.0, 360.0], [0.0, 0.0, 1.0]]
+        D = [[-0.13, 0.1, 0.0, 0.0, -0.03]]
+        camera_intrinsics = Radial_Dist_Camera(K, D, (1280, 720), "world")
+
+    # marker 0 is the origin, the markers lie roughly in a plane 15 units in front
+    # of the cameras
+    marker_extrinsics = np.zeros((n_markers, 6))
+    marker_extrinsics[1:, 0:3] = rng.normal(0.0, 0.2, (n_markers - 1, 3))
+    marker_extrinsics[1:, 3:5] = rng.uniform(-6.0, 6.0, (n_markers - 1, 2))
+    marker_extrinsics[1:, 5] = rng.normal(0.0, 0.5, n_markers - 1)
+    camera_extrinsics = np.zeros((n_frames, 6))
+    camera_extrinsics[:, 0:3] = rng.normal(0.0, 0.15, (n_frames, 3))
+    camera_extrinsics[:, 3:5] = rng.uniform(-2.0, 2.0, (n_frames, 2))
+    camera_extrinsics[:, 5] = rng.uniform(12.0, 18.0, n_frames)
+
+    key_markers = []
+    for frame_id in range(n_frames):
+        marker_ids = rng.choice(n_markers, markers_per_frame, replace=False)
+        marker_ids[0] = 0
+        for marker_id in marker_ids.tolist():
+            verts = camera_intrinsics.projectPoints(
+                utils.convert_marker_extrinsics_to_points_3d(
+                    marker_extrinsics[marker_id]
+                ).astype(np.float64),
+                camera_extrinsics[frame_id, 0:3],
+                camera_extrinsics[frame_id, 3:6],
+            )
+            verts += rng.normal(0.0, 0.5, verts.shape)
+            key_markers.append(KeyMarker(frame_id, marker_id, verts, None))
+
+    def perturbed(extrinsics):
+        noise = np.hstack((rng.normal(0.0, 0.02, 3), rng.normal(0.0, 0.2, 3)))
+        return extrinsics + noise
+
+    initial_guess = InitialGuess(
+        key_markers,
+        {frame_id: perturbed(e) for frame_id, e in enumerate(camera_extrinsics)},
+        {
+            marker_id: perturbed(e) if marker_id else e
+            for marker_id, e in enumerate(marker_extrinsics)
+        },
+    )
+
+    for optimize_camera_intrinsics in (False, True):
+        for cls in (_FiniteDifferenceBundleAdjustment, BundleAdjustment):
+            bundle_adjustment = cls(
+                copy.deepcopy(camera_intrinsics), optimize_camera_intrinsics
+            )
+            start = time.perf_counter()
+            result = bundle_adjustment.calculate(initial_guess)
+            duration = time.perf_counter() - start
+            marker_error = np.mean(
+                [
+                    np.linalg.norm(extrinsics[3:6] - marker_extrinsics[marker_id, 3:6])
+                    for marker_id, extrinsics in result.marker_id_to_extrinsics.items()
+                ]
+            )
+            print(
+                "{}, optimize intrinsics {}: {:.2f}s, mean marker position error "
+                "{:.4f}, {} failed frames".format(
+                    cls.__name__,
+                    optimize_camera_intrinsics,
+                    duration,
+                    marker_error,
+                    len(result.frame_ids_failed),
+                )
+            )
+
+
+if __name__ == "__main__":
+    bench()
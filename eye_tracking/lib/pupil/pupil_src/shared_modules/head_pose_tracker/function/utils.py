@@ -59,6 +59,57 @@ def convert_matrix_to_extrinsic(extrinsic_matrix):
     return merge_extrinsics(rotation, translation)
 
 
+def _skew(vectors):
+    """Cross product matrices of the vectors in the last axis."""
+    x, y, z = np.moveaxis(vectors, -1, 0)
+    zero = np.zeros_like(x)
+    return np.stack(
+        (
+            np.stack((zero, -z, y), axis=-1),
+            np.stack((z, zero, -x), axis=-1),
+            np.stack((-y, x, zero), axis=-1),
+        ),
+        axis=-2,
+    )
+
+
+def rotation_vectors_to_matrices(rotation_vectors, eps=1e-6):
+    """Vectorized cv2.Rodrigues() of rotation vectors of shape (n, 3).
+
+    Returns: The rotation matrices of shape (n, 3, 3) and their derivatives of shape
+        (n, 3, 3, 3), where [:, k] is the derivative by the k-th vector component
+    """
+    rotation_vectors = np.asarray(rotation_vectors, dtype=np.float64).reshape(-1, 3)
+    angles = np.linalg.norm(rotation_vectors, axis=1)
+    is_small = angles < eps
+    angles_safe = np.where(is_small, 1.0, angles)[:, np.newaxis, np.newaxis]
+
+    skew_vectors = _skew(rotation_vectors)
+    skew_axes = skew_vectors / angles_safe
+    identity = np.eye(3)
+    rotation_matrices = (
+        identity
+        + np.sin(angles_safe) * skew_axes
+        + (1 - np.cos(angles_safe)) * skew_axes @ skew_axes
+    )
+    # first order approximation for small angles
+    rotation_matrices[is_small] = identity + skew_vectors[is_small]
+
+    # dR/dr_k = (r_k [r]x + [r x (I - R) e_k]x) / |r|^2 R, see Gallego and Yezzi,
+    # "A compact formula for the derivative of a 3-D rotation in exponential
+    # coordinates", 2015
+    columns = np.swapaxes(identity - rotation_matrices, 1, 2)
+    crosses = np.cross(rotation_vectors[:, np.newaxis], columns)
+    derivatives = (
+        rotation_vectors[:, :, np.newaxis, np.newaxis] * skew_vectors[:, np.newaxis]
+        + _skew(crosses)
+    ) / angles_safe[:, np.newaxis] ** 2
+    derivatives = derivatives @ rotation_matrices[:, np.newaxis]
+    derivatives[is_small] = _skew(identity)
+
+    return rotation_matrices, derivatives
+
+
 def get_camera_pose(camera_extrinsics):
     if camera_extrinsics is None:
         return get_none_camera_extrinsics()
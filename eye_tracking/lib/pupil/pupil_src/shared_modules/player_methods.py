@@ -92,6 +92,14 @@ class Bisector(object):
     def _start_stop_idc_for_window(self, ts_window):
         return np.searchsorted(self.data_ts, ts_window)
 
+    def window_idc(self, start_ts, stop_ts):
+        """Start and stop indices of the data in each of the windows
+        (start_ts[i], stop_ts[i]), as used by `by_ts_window`."""
+        start_idc, stop_idc = self._start_stop_idc_for_window(
+            (np.asarray(start_ts), np.asarray(stop_ts))
+        )
+        return np.asarray(start_idc), np.asarray(stop_idc)
+
     def __getitem__(self, key):
         return self.data[key]
 
@@ -0,0 +1,709 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import abc
+import collections
+import csv
+import logging
+import os
+import typing
+
+import numpy as np
+
+import csv_utils
+import player_methods as pm
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# logging
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS_TYPE = typing.Dict[csv_utils.CSV_EXPORT_LABEL_TYPE, np.ma.MaskedArray]
+
+
+def export_formats() -> typing.Tuple[str, ...]:
+    if pyarrow is None:
+        return ("csv",)
+    return ("csv", "parquet")
+
+
+def write_columns_csv(export_path: str, labels, columns: EXPORT_COLUMNS_TYPE):
+    """Writes typed columns as csv, missing values as empty fields."""
+    formatted = []
+    for label in labels:
+        column = columns[label]
+        # python scalars, which the csv writer formats like csv.DictWriter does
+        values = np.ma.getdata(column).astype(object)
+        values[np.ma.getmaskarray(column)] = None
+        formatted.append(values)
+
+    with open(export_path, "w", encoding="utf-8", newline="") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(labels)
+        csv_writer.writerows(zip(*formatted))
+
+
+def write_columns_parquet(export_path: str, labels, columns: EXPORT_COLUMNS_TYPE):
+    """Writes typed columns as parquet table, missing values as nulls."""
+    if pyarrow is None:
+        raise RuntimeError("Install pyarrow to export parquet files.")
+    table = pyarrow.table(
+        {
+            label: pyarrow.array(
+                np.ma.getdata(columns[label]), mask=np.ma.getmaskarray(columns[label])
+            )
+            for label in labels
+        }
+    )
+    pyarrow.parquet.write_table(table, export_path)
+
+
+def _block_columns(n, labels, idc, rows, dtype=np.float64):
+    """
+    Columns for the fields in `labels`, filled at the row indices `idc`
+    from `rows` and masked everywhere else and where a field is None.
+    """
+    data = np.zeros((n, len(labels)), dtype=dtype)
+    mask = np.ones((n, len(labels)), dtype=bool)
+    if len(idc):
+        block = np.array(rows, dtype=object).reshape(len(idc), len(labels))
+        missing = np.equal(block, None)
+        block[missing] = 0
+        data[idc] = block.astype(dtype)
+        mask[idc] = missing
+    return {
+        label: np.ma.masked_array(data[:, i], mask=mask[:, i])
+        for i, label in enumerate(labels)
+    }
+
+
+def _object_column(values):
+    data = np.empty(len(values), dtype=object)
+    data[:] = values
+    return np.ma.masked_array(data, mask=np.equal(data, None))
+
+
+# Description of the exported fields, written next to the exported files
+FIELD_INFO = """
+    pupil_positions.csv
+    keys:
+        timestamp - timestamp of the source image frame
+        index - associated_frame: closest world video frame
+        id - 0 or 1 for right and left eye (from the wearer's point of view)
+        confidence - is an assessment by the pupil detector on how sure we can be on this measurement. A value of `0` indicates no confidence. `1` indicates perfect confidence. In our experience usefull data carries a confidence value greater than ~0.6. A `confidence` of exactly `0` means that we don't know anything. So you should ignore the position data.        norm_pos_x - x position in the eye image frame in normalized coordinates
+        norm_pos_x - x position in the eye image frame in normalized coordinates
+        norm_pos_y - y position in the eye image frame in normalized coordinates
+        diameter - diameter of the pupil in image pixels as observed in the eye image frame (is not corrected for perspective)
+
+        method - string that indicates what detector was used to detect the pupil
+
+        --- optional fields depending on detector
+
+        #in 2d the pupil appears as an ellipse available in `3d c++` and `2D c++` detector
+        ellipse_center_x - x center of the pupil in image pixels
+        ellipse_center_y - y center of the pupil in image pixels
+        ellipse_axis_a - first axis of the pupil ellipse in pixels
+        ellipse_axis_b - second axis of the pupil ellipse in pixels
+        ellipse_angle - angle of the ellipse in degrees
+
+
+        #data made available by the `3d c++` detector
+
+        diameter_3d - diameter of the pupil scaled to mm based on anthropomorphic avg eye ball diameter and corrected for perspective.
+        model_confidence - confidence of the current eye model (0-1)
+        model_id - id of the current eye model. When a slippage is detected the model is replaced and the id changes.
+
+        sphere_center_x - x pos of the eyeball sphere is eye pinhole camera 3d space units are scaled to mm.
+        sphere_center_y - y pos of the eye ball sphere
+        sphere_center_z - z pos of the eye ball sphere
+        sphere_radius - radius of the eyeball. This is always 12mm (the anthropomorphic avg.) We need to make this assumption because of the `single camera scale ambiguity`.
+
+        circle_3d_center_x - x center of the pupil as 3d circle in eye pinhole camera 3d space units are mm.
+        circle_3d_center_y - y center of the pupil as 3d circle
+        circle_3d_center_z - z center of the pupil as 3d circle
+        circle_3d_normal_x - x normal of the pupil as 3d circle. Indicates the direction that the pupil points at in 3d space.
+        circle_3d_normal_y - y normal of the pupil as 3d circle
+        circle_3d_normal_z - z normal of the pupil as 3d circle
+        circle_3d_radius - radius of the pupil as 3d circle. Same as `diameter_3d`
+
+        theta - circle_3d_normal described in spherical coordinates
+        phi - circle_3d_normal described in spherical coordinates
+
+        projected_sphere_center_x - x center of the 3d sphere projected back onto the eye image frame. Units are in image pixels.
+        projected_sphere_center_y - y center of the 3d sphere projected back onto the eye image frame
+        projected_sphere_axis_a - first axis of the 3d sphere projection.
+        projected_sphere_axis_b - second axis of the 3d sphere projection.
+        projected_sphere_angle - angle of the 3d sphere projection. Units are degrees.
+
+
+    gaze_positions.csv
+    keys:
+        timestamp - timestamp of the source image frame
+        index - associated_frame: closest world video frame
+        confidence - computed confidence between 0 (not confident) -1 (confident)
+        norm_pos_x - x position in the world image frame in normalized coordinates
+        norm_pos_y - y position in the world image frame in normalized coordinates
+        base_data - "timestamp-id timestamp-id ..." of pupil data that this gaze position is computed from
+
+        #data made available by the 3d vector gaze mappers
+        gaze_point_3d_x - x position of the 3d gaze point (the point the sublejct lookes at) in the world camera coordinate system
+        gaze_point_3d_y - y position of the 3d gaze point
+        gaze_point_3d_z - z position of the 3d gaze point
+        eye_center0_3d_x - x center of eye-ball 0 in the world camera coordinate system (of camera 0 for binocular systems or any eye camera for monocular system)
+        eye_center0_3d_y - y center of eye-ball 0
+        eye_center0_3d_z - z center of eye-ball 0
+        gaze_normal0_x - x normal of the visual axis for eye 0 in the world camera coordinate system (of eye 0 for binocular systems or any eye for monocular system). The visual axis goes through the eye ball center and the object thats looked at.
+        gaze_normal0_y - y normal of the visual axis for eye 0
+        gaze_normal0_z - z normal of the visual axis for eye 0
+        eye_center1_3d_x - x center of eye-ball 1 in the world camera coordinate system (not avaible for monocular setups.)
+        eye_center1_3d_y - y center of eye-ball 1
+        eye_center1_3d_z - z center of eye-ball 1
+        gaze_normal1_x - x normal of the visual axis for eye 1 in the world camera coordinate system (not avaible for monocular setups.). The visual axis goes through the eye ball center and the object thats looked at.
+        gaze_normal1_y - y normal of the visual axis for eye 1
+        gaze_normal1_z - z normal of the visual axis for eye 1
+        """
+
+
+def write_field_info(export_dir):
+    field_info_path = os.path.join(export_dir, "pupil_gaze_positions_info.txt")
+    with open(field_info_path, "w", encoding="utf-8", newline="") as info_file:
+        info_file.write(FIELD_INFO)
+
+
+class _Base_Positions_Exporter(abc.ABC):
+    @classmethod
+    @abc.abstractmethod
+    def csv_export_filename(cls) -> str:
+        pass
+
+    @classmethod
+    @abc.abstractmethod
+    def csv_export_labels(cls) -> typing.Tuple[csv_utils.CSV_EXPORT_LABEL_TYPE, ...]:
+        pass
+
+    @classmethod
+    @abc.abstractmethod
+    def dict_export(
+        cls, raw_value: csv_utils.CSV_EXPORT_RAW_TYPE, world_index: int
+    ) -> dict:
+        pass
+
+    @classmethod
+    @abc.abstractmethod
+    def columns_export(
+        cls,
+        raw_values: typing.Sequence[csv_utils.CSV_EXPORT_RAW_TYPE],
+        world_indices: typing.Sequence[int],
+    ) -> EXPORT_COLUMNS_TYPE:
+        """
+        Same values as dict_export, but as one typed column per label for all
+        `raw_values`, with the missing values masked. Every datum is decoded
+        once and its optional fields are chosen by the detector or mapper
+        that produced it.
+        """
+        pass
+
+    def csv_export_write(
+        self, positions_bisector, timestamps, export_window, export_dir
+    ):
+        self.export_write(positions_bisector, timestamps, export_window, export_dir)
+
+    def export_write(
+        self,
+        positions_bisector,
+        timestamps,
+        export_window,
+        export_dir,
+        export_format="csv",
+    ):
+        export_file = type(self).csv_export_filename()
+        if export_format == "parquet":
+            export_file = os.path.splitext(export_file)[0] + ".parquet"
+            write_columns = write_columns_parquet
+        else:
+            write_columns = write_columns_csv
+        export_path = os.path.join(export_dir, export_file)
+
+        export_section = positions_bisector.init_dict_for_window(export_window)
+        export_world_idc = pm.find_closest(timestamps, export_section["data_ts"])
+
+        columns = type(self).columns_export(export_section["data"], export_world_idc)
+        write_columns(export_path, type(self).csv_export_labels(), columns)
+
+        logger.info(f"Created '{export_file}' file.")
+
+
+class Pupil_Positions_Exporter(_Base_Positions_Exporter):
+    @classmethod
+    def csv_export_filename(cls) -> str:
+        return "pupil_positions.csv"
+
+    @classmethod
+    def csv_export_labels(cls) -> typing.Tuple[csv_utils.CSV_EXPORT_LABEL_TYPE, ...]:
+        return (
+            # 2d data
+            "pupil_timestamp",
+            "world_index",
+            "eye_id",
+            "confidence",
+            "norm_pos_x",
+            "norm_pos_y",
+            "diameter",
+            "method",
+            # ellipse data
+            "ellipse_center_x",
+            "ellipse_center_y",
+            "ellipse_axis_a",
+            "ellipse_axis_b",
+            "ellipse_angle",
+            # 3d data
+            "diameter_3d",
+            "model_confidence",
+            "model_id",
+            "sphere_center_x",
+            "sphere_center_y",
+            "sphere_center_z",
+            "sphere_radius",
+            "circle_3d_center_x",
+            "circle_3d_center_y",
+            "circle_3d_center_z",
+            "circle_3d_normal_x",
+            "circle_3d_normal_y",
+            "circle_3d_normal_z",
+            "circle_3d_radius",
+            "theta",
+            "phi",
+            "projected_sphere_center_x",
+            "projected_sphere_center_y",
+            "projected_sphere_axis_a",
+            "projected_sphere_axis_b",
+            "projected_sphere_angle",
+        )
+
+    @classmethod
+    def dict_export(
+        cls, raw_value: csv_utils.CSV_EXPORT_RAW_TYPE, world_index: int
+    ) -> dict:
+        # 2d data
+        pupil_timestamp = str(raw_value["timestamp"])
+        eye_id = raw_value["id"]
+        confidence = raw_value["confidence"]
+        norm_pos_x = raw_value["norm_pos"][0]
+        norm_pos_y = raw_value["norm_pos"][1]
+        diameter = raw_value["diameter"]
+        method = raw_value["method"]
+
+        # ellipse data
+        try:
+            ellipse_center = raw_value["ellipse"]["center"]
+            ellipse_axis = raw_value["ellipse"]["axes"]
+            ellipse_angle = raw_value["ellipse"]["angle"]
+        except KeyError:
+            ellipse_center = [None, None]
+            ellipse_axis = [None, None]
+            ellipse_angle = None
+
+        # 3d data
+        try:
+            diameter_3d = raw_value["diameter_3d"]
+            model_confidence = raw_value["model_confidence"]
+            model_id = raw_value["model_id"]
+            sphere_center = raw_value["sphere"]["center"]
+            sphere_radius = raw_value["sphere"]["radius"]
+            circle_3d_center = raw_value["circle_3d"]["center"]
+            circle_3d_normal = raw_value["circle_3d"]["normal"]
+            circle_3d_radius = raw_value["circle_3d"]["radius"]
+            theta = raw_value["theta"]
+            phi = raw_value["phi"]
+            projected_sphere_center = raw_value["projected_sphere"]["center"]
+            projected_sphere_axis = raw_value["projected_sphere"]["axes"]
+            projected_sphere_angle = raw_value["projected_sphere"]["angle"]
+        except KeyError:
+            diameter_3d = None
+            model_confidence = None
+            model_id = None
+            sphere_center = [None, None, None]
+            sphere_radius = None
+            circle_3d_center = [None, None, None]
+            circle_3d_normal = [None, None, None]
+            circle_3d_radius = None
+            theta = None
+            phi = None
+            projected_sphere_center = [None, None]
+            projected_sphere_axis = [None, None]
+            projected_sphere_angle = None
+
+        return {
+            # 2d data
+            "pupil_timestamp": pupil_timestamp,
+            "world_index": world_index,
+            "eye_id": eye_id,
+            "confidence": confidence,
+            "norm_pos_x": norm_pos_x,
+            "norm_pos_y": norm_pos_y,
+            "diameter": diameter,
+            "method": method,
+            # ellipse data
+            "ellipse_center_x": ellipse_center[0],
+            "ellipse_center_y": ellipse_center[1],
+            "ellipse_axis_a": ellipse_axis[0],
+            "ellipse_axis_b": ellipse_axis[1],
+            "ellipse_angle": ellipse_angle,
+            # 3d data
+            "diameter_3d": diameter_3d,
+            "model_confidence": model_confidence,
+            "model_id": model_id,
+            "sphere_center_x": sphere_center[0],
+            "sphere_center_y": sphere_center[1],
+            "sphere_center_z": sphere_center[2],
+            "sphere_radius": sphere_radius,
+            "circle_3d_center_x": circle_3d_center[0],
+            "circle_3d_center_y": circle_3d_center[1],
+            "circle_3d_center_z": circle_3d_center[2],
+            "circle_3d_normal_x": circle_3d_normal[0],
+            "circle_3d_normal_y": circle_3d_normal[1],
+            "circle_3d_normal_z": circle_3d_normal[2],
+            "circle_3d_radius": circle_3d_radius,
+            "theta": theta,
+            "phi": phi,
+            "projected_sphere_center_x": projected_sphere_center[0],
+            "projected_sphere_center_y": projected_sphere_center[1],
+            "projected_sphere_axis_a": projected_sphere_axis[0],
+            "projected_sphere_axis_b": projected_sphere_axis[1],
+            "projected_sphere_angle": projected_sphere_angle,
+        }
+
+    @classmethod
+    def columns_export(cls, raw_values, world_indices) -> EXPORT_COLUMNS_TYPE:
+        base_rows, eye_ids, methods = [], [], []
+        ellipse_idc, ellipse_rows = [], []
+        idc_3d, rows_3d, model_ids = [], [], []
+
+        for i, raw_value in enumerate(raw_values):
+            datum = raw_value.copy()
+            norm_pos = datum["norm_pos"]
+            base_rows.append(
+                (
+                    datum["timestamp"],
+                    datum["confidence"],
+                    norm_pos[0],
+                    norm_pos[1],
+                    datum["diameter"],
+                )
+            )
+            eye_ids.append(datum["id"])
+            methods.append(datum["method"])
+
+            ellipse = datum.get("ellipse", None)
+            if ellipse is not None:
+                ellipse_idc.append(i)
+                ellipse_rows.append(
+                    (*ellipse["center"], *ellipse["axes"], ellipse["angle"])
+                )
+
+            # 3d fields exist only for data of the 3d detectors, any missing one
+            # leaves all 3d columns of the datum empty
+            try:
+                row_3d = (
+                    datum["diameter_3d"],
+                    datum["model_confidence"],
+                    *datum["sphere"]["center"],
+                    datum["sphere"]["radius"],
+                    *datum["circle_3d"]["center"],
+                    *datum["circle_3d"]["normal"],
+                    datum["circle_3d"]["radius"],
+                    datum["theta"],
+                    datum["phi"],
+                    *datum["projected_sphere"]["center"],
+                    *datum["projected_sphere"]["axes"],
+                    datum["projected_sphere"]["angle"],
+                )
+                model_id = datum["model_id"]
+            except KeyError:
+                continue
+            idc_3d.append(i)
+            rows_3d.append(row_3d)
+            model_ids.append(model_id)
+
+        n = len(base_rows)
+        columns = {}
+        columns.update(
+            _block_columns(
+                n,
+                (
+                    "pupil_timestamp",
+                    "confidence",
+                    "norm_pos_x",
+                    "norm_pos_y",
+                    "diameter",
+                ),
+                np.arange(n),
+                base_rows,
+            )
+        )
+        columns["world_index"] = np.ma.masked_array(
+            np.asarray(world_indices, dtype=np.int64), mask=np.zeros(n, dtype=bool)
+        )
+        columns["eye_id"] = np.ma.masked_array(
+            np.asarray(eye_ids, dtype=np.int64), mask=np.zeros(n, dtype=bool)
+        )
+        columns["method"] = _object_column(methods)
+        columns.update(
+            _block_columns(
+                n,
+                (
+                    "ellipse_center_x",
+                    "ellipse_center_y",
+                    "ellipse_axis_a",
+                    "ellipse_axis_b",
+                    "ellipse_angle",
+                ),
+                ellipse_idc,
+                ellipse_rows,
+            )
+        )
+        columns.update(
+            _block_columns(
+                n,
+                (
+                    "diameter_3d",
+                    "model_confidence",
+                    "sphere_center_x",
+                    "sphere_center_y",
+                    "sphere_center_z",
+                    "sphere_radius",
+                    "circle_3d_center_x",
+                    "circle_3d_center_y",
+                    "circle_3d_center_z",
+                    "circle_3d_normal_x",
+                    "circle_3d_normal_y",
+                    "circle_3d_normal_z",
+                    "circle_3d_radius",
+                    "theta",
+                    "phi",
+                    "projected_sphere_center_x",
+                    "projected_sphere_center_y",
+                    "projected_sphere_axis_a",
+                    "projected_sphere_axis_b",
+                    "projected_sphere_angle",
+                ),
+                idc_3d,
+                rows_3d,
+            )
+        )
+        columns.update(
+            _block_columns(n, ("model_id",), idc_3d, model_ids, dtype=np.int64)
+        )
+        return collections.OrderedDict(
+            (label, columns[label]) for label in cls.csv_export_labels()
+        )
+
+
+class Gaze_Positions_Exporter(_Base_Positions_Exporter):
+    @classmethod
+    def csv_export_filename(cls) -> str:
+        return "gaze_positions.csv"
+
+    @classmethod
+    def csv_export_labels(cls) -> typing.Tuple[csv_utils.CSV_EXPORT_LABEL_TYPE, ...]:
+        return (
+            "gaze_timestamp",
+            "world_index",
+            "confidence",
+            "norm_pos_x",
+            "norm_pos_y",
+            "base_data",
+            "gaze_point_3d_x",
+            "gaze_point_3d_y",
+            "gaze_point_3d_z",
+            "eye_center0_3d_x",
+            "eye_center0_3d_y",
+            "eye_center0_3d_z",
+            "gaze_normal0_x",
+            "gaze_normal0_y",
+            "gaze_normal0_z",
+            "eye_center1_3d_x",
+            "eye_center1_3d_y",
+            "eye_center1_3d_z",
+            "gaze_normal1_x",
+            "gaze_normal1_y",
+            "gaze_normal1_z",
+        )
+
+    @classmethod
+    def dict_export(
+        cls, raw_value: csv_utils.CSV_EXPORT_RAW_TYPE, world_index: int
+    ) -> dict:
+
+        gaze_timestamp = str(raw_value["timestamp"])
+        confidence = raw_value["confidence"]
+        norm_pos = raw_value["norm_pos"]
+        base_data = None
+        gaze_points_3d = [None, None, None]
+        eye_centers0_3d = [None, None, None]
+        eye_centers1_3d = [None, None, None]
+        gaze_normals0_3d = [None, None, None]
+        gaze_normals1_3d = [None, None, None]
+
+        if raw_value.get("base_data", None) is not None:
+            base_data = raw_value["base_data"]
+            base_data = " ".join(
+                "{}-{}".format(b["timestamp"], b["id"]) for b in base_data
+            )
+
+        # add 3d data if avaiblable
+        if raw_value.get("gaze_point_3d", None) is not None:
+            gaze_points_3d = raw_value["gaze_point_3d"]
+            # binocular
+            if raw_value.get("eye_centers_3d", None) is not None:
+                eye_centers0_3d = raw_value["eye_centers_3d"].get(0, [None, None, None])
+                eye_centers1_3d = raw_value["eye_centers_3d"].get(1, [None, None, None])
+                #
+                gaze_normals0_3d = raw_value["gaze_normals_3d"].get(
+                    0, [None, None, None]
+                )
+                gaze_normals1_3d = raw_value["gaze_normals_3d"].get(
+                    1, [None, None, None]
+                )
+            # monocular
+            elif raw_value.get("eye_center_3d", None) is not None:
+                try:
+                    eye_id = raw_value["base_data"][0]["id"]
+                except (KeyError, IndexError):
+                    logger.warning(
+                        f"Unexpected raw base_data for monocular gaze!"
+                        f" Data: {raw_value.get('base_data', None)}"
+                    )
+                else:
+                    if str(eye_id) == "0":
+                        eye_centers0_3d = raw_value["eye_center_3d"]
+                        gaze_normals0_3d = raw_value["gaze_normal_3d"]
+                    elif str(eye_id) == "1":
+                        eye_centers1_3d = raw_value["eye_center_3d"]
+                        gaze_normals1_3d = raw_value["gaze_normal_3d"]
+
+        return {
+            "gaze_timestamp": gaze_timestamp,
+            "world_index": world_index,
+            "confidence": confidence,
+            "norm_pos_x": norm_pos[0],
+            "norm_pos_y": norm_pos[1],
+            "base_data": base_data,
+            "gaze_point_3d_x": gaze_points_3d[0],
+            "gaze_point_3d_y": gaze_points_3d[1],
+            "gaze_point_3d_z": gaze_points_3d[2],
+            "eye_center0_3d_x": eye_centers0_3d[0],
+            "eye_center0_3d_y": eye_centers0_3d[1],
+            "eye_center0_3d_z": eye_centers0_3d[2],
+            "gaze_normal0_x": gaze_normals0_3d[0],
+            "gaze_normal0_y": gaze_normals0_3d[1],
+            "gaze_normal0_z": gaze_normals0_3d[2],
+            "eye_center1_3d_x": eye_centers1_3d[0],
+            "eye_center1_3d_y": eye_centers1_3d[1],
+            "eye_center1_3d_z": eye_centers1_3d[2],
+            "gaze_normal1_x": gaze_normals1_3d[0],
+            "gaze_normal1_y": gaze_normals1_3d[1],
+            "gaze_normal1_z": gaze_normals1_3d[2],
+        }
+
+    @classmethod
+    def columns_export(cls, raw_values, world_indices) -> EXPORT_COLUMNS_TYPE:
+        base_rows, base_data_strings = [], []
+        idc_3d, rows_3d = [], []
+        eye_idc = {0: [], 1: []}
+        eye_rows = {0: [], 1: []}
+
+        for i, raw_value in enumerate(raw_values):
+            datum = raw_value.copy()
+            norm_pos = datum["norm_pos"]
+            base_rows.append(
+                (datum["timestamp"], datum["confidence"], norm_pos[0], norm_pos[1])
+            )
+            base_data = datum.get("base_data", None)
+            if base_data is not None:
+                base_data_strings.append(
+                    " ".join("{}-{}".format(b["timestamp"], b["id"]) for b in base_data)
+                )
+            else:
+                base_data_strings.append(None)
+
+            # 3d fields exist only for data of the 3d gaze mappers
+            gaze_point_3d = datum.get("gaze_point_3d", None)
+            if gaze_point_3d is None:
+                continue
+            idc_3d.append(i)
+            rows_3d.append(gaze_point_3d)
+
+            eye_centers_3d = datum.get("eye_centers_3d", None)
+            # binocular
+            if eye_centers_3d is not None:
+                gaze_normals_3d = datum["gaze_normals_3d"]
+                for eye_id in (0, 1):
+                    if eye_id in eye_centers_3d:
+                        eye_idc[eye_id].append(i)
+                        eye_rows[eye_id].append(
+                            (*eye_centers_3d[eye_id], *gaze_normals_3d[eye_id])
+                        )
+            # monocular
+            elif datum.get("eye_center_3d", None) is not None:
+                eye_id = base_data[0].get("id", None) if base_data else None
+                if str(eye_id) in ("0", "1"):
+                    eye_idc[int(eye_id)].append(i)
+                    eye_rows[int(eye_id)].append(
+                        (*datum["eye_center_3d"], *datum["gaze_normal_3d"])
+                    )
+                elif eye_id is None:
+                    logger.warning(
+                        f"Unexpected raw base_data for monocular gaze!"
+                        f" Data: {base_data}"
+                    )
+
+        n = len(base_rows)
+        columns = {}
+        columns.update(
+            _block_columns(
+                n,
+                ("gaze_timestamp", "confidence", "norm_pos_x", "norm_pos_y"),
+                np.arange(n),
+                base_rows,
+            )
+        )
+        columns["world_index"] = np.ma.masked_array(
+            np.asarray(world_indices, dtype=np.int64), mask=np.zeros(n, dtype=bool)
+        )
+        columns["base_data"] = _object_column(base_data_strings)
+        columns.update(
+            _block_columns(
+                n,
+                ("gaze_point_3d_x", "gaze_point_3d_y", "gaze_point_3d_z"),
+                idc_3d,
+                rows_3d,
+            )
+        )
+        for eye_id in (0, 1):
+            eye_labels = (
+                f"eye_center{eye_id}_3d_x",
+                f"eye_center{eye_id}_3d_y",
+                f"eye_center{eye_id}_3d_z",
+                f"gaze_normal{eye_id}_x",
+                f"gaze_normal{eye_id}_y",
+                f"gaze_normal{eye_id}_z",
+            )
+            columns.update(
+                _block_columns(n, eye_labels, eye_idc[eye_id], eye_rows[eye_id])
+            )
+        return collections.OrderedDict(
+            (label, columns[label]) for label in cls.csv_export_labels()
+        )
@@ -137,25 +137,118 @@ def decode(square_img, grid):
     return angle, msg_int, soft_msg, msg_img
 
 
-def correct_gradient(gray_img, r):
-    # used just to increase speed - this simple check is still way to slow
-    # lets assume that a marker has a black border
-    # we check two pixels one outside, one inside both close to the border
-    p1, _, p2, _ = r.reshape(4, 2).tolist()
-    vector_across = p2[0] - p1[0], p2[1] - p1[1]
-    ratio = 5.0 / sqrt(
-        vector_across[0] ** 2 + vector_across[1] ** 2
-    )  # we want to measure 5px away from the border
-    vector_across = int(vector_across[0] * ratio), int(vector_across[1] * ratio)
+def _rotation_permutations(size):
+    """Flat indices of the rotated message grids for the 4 marker angles, see
+    `decode`"""
+    idc = np.arange(size * size).reshape(size, size)
+    return np.array(
+        [np.rot90(idc, -angle - 2).transpose().ravel() for angle in range(4)]
+    )
+
+
+def decode_batch(square_imgs, grid):
+    """Decode several marker images at once, like `decode` for each of them.
+
+    Args:
+        square_imgs: Array of square marker images with shape (N, size, size).
+        grid: Number of cells per marker side.
+
+    Returns: List with the result of `decode` for every image.
+    """
+    square_imgs = np.asarray(square_imgs, dtype=np.uint8)
+    n_imgs, size = square_imgs.shape[:2]
+    if n_imgs == 0:
+        return []
+
+    # Resizing the stacked images gives the same result as resizing every image.
+    stacked = square_imgs.reshape(n_imgs * size, size)
+    msg = cv2.resize(stacked, (grid, n_imgs * grid), interpolation=cv2.INTER_LINEAR)
+    msg = msg.reshape(n_imgs, grid, grid) > 50  # threshold
+    soft_msg = cv2.resize(
+        stacked, (grid * 2, n_imgs * grid * 2), interpolation=cv2.INTER_LINEAR
+    )
+    soft_msg = cv2.resize(
+        soft_msg, (grid, n_imgs * grid), interpolation=cv2.INTER_AREA
+    ).reshape(n_imgs, grid, grid)
+
+    border = np.concatenate(
+        (msg[:, 0, :], msg[:, -1, :], msg[:, :, 0], msg[:, :, -1]), axis=1
+    )
+    # strip border to get the message
+    msg = msg[:, 1:-1, 1:-1].reshape(n_imgs, -1)
+    soft_msg = soft_msg[:, 1:-1, 1:-1].reshape(n_imgs, -1)
+    inner = grid - 2
+
+    # orientation corners, see `decode`
+    corners = msg[:, [0, inner * (inner - 1), inner * inner - 1, inner - 1]]
+    white_corners = corners.sum(axis=1)
+    valid = ~border.any(axis=1) & ((white_corners == 3) | (white_corners == 1))
+    msb = (white_corners == 1).astype(np.int64)
+    corners ^= msb.astype(bool)[:, np.newaxis]
+    # angle is number of 90deg rotations, the black corner gives the rotation
+    angle = np.array([3, 0, 1, 2])[np.argmin(corners, axis=1)]
+
+    rotation = _rotation_permutations(inner)[angle]
+    msg = np.take_along_axis(msg, rotation, axis=1)
+    soft_msg = np.take_along_axis(soft_msg, rotation, axis=1)
+    # strip orientation corners from marker
+    data_bits = np.ones(inner * inner, dtype=bool)
+    data_bits[[0, inner - 1, inner * (inner - 1), inner * inner - 1]] = False
+    bits = msg[:, data_bits].astype(np.int64)
+    msg_int = (msb << bits.shape[1]) + bits @ (1 << np.arange(bits.shape[1]))
+
+    decoded = [None] * n_imgs
+    for idx in np.flatnonzero(valid).tolist():
+        soft_bits = [item / 255.0 for item in soft_msg[idx, data_bits].tolist()]
+        decoded[idx] = (
+            int(angle[idx]),
+            int(msg_int[idx]),
+            soft_bits + [float(msb[idx])],
+            soft_msg[idx].reshape(inner, inner),
+        )
+    return decoded
+
+
+def correct_gradients(gray_img, rects):
+    """Check for all marker candidates that they have a dark border.
+
+    This simple check is used just to increase speed. We check two pixels close to
+    the border, one outside and one inside.
+
+    Args:
+        rects: Integer corners of the candidates with shape (N, 4, 1, 2).
+
+    Returns: Boolean array, True for candidates that might be markers.
+    """
+    verts = np.asarray(rects, dtype=np.int64).reshape(-1, 4, 2)
+    p1 = verts[:, 0]
+    vector_across = verts[:, 2] - p1
+    # we want to measure 5px away from the border
+    ratio = 5.0 / np.sqrt((vector_across ** 2).sum(axis=1))
+    vector_across = (vector_across * ratio[:, np.newaxis]).astype(np.int64)
+    outer = p1 - vector_across
+    inner = p1 + vector_across
+
+    # px outside of img frame are accepted, let the other method check
+    height, width = gray_img.shape[:2]
+
+    def in_img(points):
+        # like numpy indexing, negative indices count from the end
+        return (
+            (-width <= points[:, 0])
+            & (points[:, 0] < width)
+            & (-height <= points[:, 1])
+            & (points[:, 1] < height)
+        )
+
+    checked = in_img(outer) & in_img(inner)
     # indecies are flipped because numpy is row major
-    outer = p1[1] - vector_across[1], p1[0] - vector_across[0]
-    inner = p1[1] + vector_across[1], p1[0] + vector_across[0]
-    try:
-        gradient = int(gray_img[outer]) - int(gray_img[inner])
-        return gradient > 20  # at least 20 shades darker inside
-    except Exception:
-        # px outside of img frame, let the other method check
-        return True
+    gradient = gray_img[outer[checked, 1], outer[checked, 0]].astype(
+        np.int64
+    ) - gray_img[inner[checked, 1], inner[checked, 0]].astype(np.int64)
+    correct = np.ones(len(verts), dtype=bool)
+    correct[checked] = gradient > 20  # at least 20 shades darker inside
+    return correct
 
 
 def detect_markers(
@@ -169,13 +262,13 @@ def detect_markers(
         edges, mode=cv2.RETR_TREE, method=cv2.CHAIN_APPROX_SIMPLE, offset=(0, 0)
     )
 
+    if hierarchy is None:
+        return []
     # remove extra encapsulation
     hierarchy = hierarchy[0]
-    contours = np.array(contours)
     # keep only contours                        with parents     and      children
-    contained_contours = contours[
-        np.logical_and(hierarchy[:, 3] >= 0, hierarchy[:, 2] >= 0)
-    ]
+    contained = np.logical_and(hierarchy[:, 3] >= 0, hierarchy[:, 2] >= 0)
+    contained_contours = [c for c, keep in zip(contours, contained) if keep]
     # turn on to debug contours
     # cv2.drawContours(gray_img, contours,-1, (0,255,255))
     # cv2.drawContours(gray_img, aprox_contours,-1, (255,0,0))
@@ -201,71 +294,77 @@ def detect_markers(
     if visualize:
         cv2.drawContours(gray_img, rect_cand, -1, (255, 100, 50))
 
-    markers = []
+    # used just to increase speed, we check that the candidates have a dark border
+    correct = correct_gradients(gray_img, rect_cand)
+    rect_cand = [r for r, ok in zip(rect_cand, correct) if ok]
+    if not rect_cand:
+        return []
+
+    # refine the verts of all candidates at once
+    # define the criteria to stop and refine the marker verts
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 40, 0.001)
+    rects = np.float32(rect_cand).reshape(-1, 1, 2)
+    cv2.cornerSubPix(gray_img, rects, (3, 3), (-1, -1), criteria)
+    rects = rects.reshape(-1, 4, 1, 2)
+
     size = 20 * grid_size
     # top left,bottom left, bottom right, top right in image
     mapped_space = np.array(
         ((0, 0), (size, 0), (size, size), (0, size)), dtype=np.float32
     ).reshape(4, 1, 2)
-    for r in rect_cand:
-        if correct_gradient(gray_img, r):
-            r = np.float32(r)
-            # define the criteria to stop and refine the marker verts
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 40, 0.001)
-            cv2.cornerSubPix(gray_img, r, (3, 3), (-1, -1), criteria)
-
-            M = cv2.getPerspectiveTransform(r, mapped_space)
-            flat_marker_img = cv2.warpPerspective(
-                gray_img, M, (size, size)
-            )  # [, dst[, flags[, borderMode[, borderValue]]]])
-            # Otsu documentation here :
-            # https://opencv-python-tutroals.readthedocs.org/en/latest/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html#thresholding
-            _, otsu = cv2.threshold(
-                flat_marker_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-            )
+    # getting a cleaner display of the rectangle marker
+    kernel = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    otsu_imgs = np.empty((len(rects), size, size), dtype=np.uint8)
+    for r, otsu in zip(rects, otsu_imgs):
+        M = cv2.getPerspectiveTransform(r, mapped_space)
+        flat_marker_img = cv2.warpPerspective(
+            gray_img, M, (size, size)
+        )  # [, dst[, flags[, borderMode[, borderValue]]]])
+        # Otsu documentation here :
+        # https://opencv-python-tutroals.readthedocs.org/en/latest/py_tutorials/py_imgproc/py_thresholding/py_thresholding.html#thresholding
+        cv2.threshold(
+            flat_marker_img, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, otsu
+        )
+        cv2.erode(otsu, kernel, otsu, iterations=3)
+        # kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+        # cv2.dilate(otsu,kernel,otsu, iterations=1)
 
-            # getting a cleaner display of the rectangle marker
-            kernel = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
-            cv2.erode(otsu, kernel, otsu, iterations=3)
-            # kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
-            # cv2.dilate(otsu,kernel,otsu, iterations=1)
-            marker = decode(otsu, grid_size)
-            if marker is not None:
-                angle, msg, soft_msg, msg_img = marker
-
-                centroid = r.sum(axis=0) / 4.0
-                centroid.shape = 2
-                # angle is number of 90deg rotations
-                # roll points such that the marker points correspond with oriented marker
-                # rolling may not make the verts appear as you expect,
-                # but using m_screen_to_marker() will get you the marker with proper rotation.
-                r = np.roll(
-                    r, angle + 1, axis=0
-                )  # np.roll is not the fastest when using these tiny arrays...
-
-                # id_confidence = 2*np.mean (np.abs(np.array(soft_msg)-.5 ))
-                id_confidence = 2 * min(np.abs(np.array(soft_msg) - 0.5))
-
-                marker = {
-                    "id": msg,
-                    "id_confidence": id_confidence,
-                    "verts": r.tolist(),
-                    "soft_id": soft_msg,
-                    "perimeter": cv2.arcLength(r, closed=True),
-                    "centroid": centroid.tolist(),
-                    "frames_since_true_detection": 0,
-                }
-                if visualize:
-                    marker["otsu"] = np.rot90(otsu, -angle - 2).transpose()
-                    marker["img"] = cv2.resize(
-                        msg_img,
-                        (20 * grid_size, 20 * grid_size),
-                        interpolation=cv2.INTER_NEAREST,
-                    )
-                if (
-                    marker["id"] != 32
-                ):  # marker 32 sucks because its just a single white spec.
-                    markers.append(marker)
+    markers = []
+    for r, otsu, marker in zip(rects, otsu_imgs, decode_batch(otsu_imgs, grid_size)):
+        if marker is None:
+            continue
+        angle, msg, soft_msg, msg_img = marker
+        if msg == 32:  # marker 32 sucks because its just a single white spec.
+            continue
+
+        centroid = r.sum(axis=0) / 4.0
+        centroid.shape = 2
+        # angle is number of 90deg rotations
+        # roll points such that the marker points correspond with oriented marker
+        # rolling may not make the verts appear as you expect,
+        # but using m_screen_to_marker() will get you the marker with proper rotation.
+        r = np.roll(r, angle + 1, axis=0)
+
+        # id_confidence = 2*np.mean (np.abs(np.array(soft_msg)-.5 ))
+        id_confidence = 2 * min(np.abs(np.array(soft_msg) - 0.5))
+
+        marker = {
+            "id": msg,
+            "id_confidence": id_confidence,
+            "verts": r.tolist(),
+            "soft_id": soft_msg,
+            "perimeter": cv2.arcLength(r, closed=True),
+            "centroid": centroid.tolist(),
+            "frames_since_true_detection": 0,
+        }
+        if visualize:
+            marker["otsu"] = np.rot90(otsu, -angle - 2).transpose()
+            marker["img"] = cv2.resize(
+                msg_img,
+                (20 * grid_size, 20 * grid_size),
+                interpolation=cv2.INTER_NEAREST,
+            )
+        markers.append(marker)
     return markers
 
 
@@ -494,33 +593,63 @@ def detect_markers_robust(
 #     print detected_count #3106 #3226
 
 
-def bench(folder):
+def _detect_markers_in_frame(gray_img):
+    return len(detect_markers(gray_img, 5))
+
+
+def bench(folder, frame_count=500, workers=None):
+    """Compare sequential detection with tracking to detection in independent
+    frames, which can be distributed over several processes."""
+    import multiprocessing
+    import time
+    import types
     from os.path import join
-    from video_capture.av_file_capture import File_Capture
 
-    cap = File_Capture(join(folder, "marker-test.mp4"))
+    import video_capture
+
+    cap = video_capture.File_Source(
+        types.SimpleNamespace(),
+        source_path=join(folder, "marker-test.mp4"),
+        fill_gaps=True,
+        timing=None,
+    )
+    gray_imgs = []
+    for _ in range(min(frame_count, cap.get_frame_count())):
+        gray_imgs.append(cap.get_frame().gray.copy())
+
+    start = time.perf_counter()
     markers = []
     detected_count = 0
-
-    for x in range(500):
-        frame = cap.get_frame()
-        img = frame.img
-        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    for gray_img in gray_imgs:
         markers = detect_markers_robust(
-            gray_img, 5, prev_markers=markers, true_detect_every_frame=1, visualize=True
+            gray_img, 5, prev_markers=markers, true_detect_every_frame=1
+        )
+        detected_count += len(markers)
+    print(
+        "robust: {} markers in {:.2f}s".format(
+            detected_count, time.perf_counter() - start
         )
+    )  # 2900 #3042 #3021
 
-        draw_markers(img, markers)
-        cv2.imshow("Detected Markers", img)
+    start = time.perf_counter()
+    detected_count = sum(map(_detect_markers_in_frame, gray_imgs))
+    print(
+        "independent frames: {} markers in {:.2f}s".format(
+            detected_count, time.perf_counter() - start
+        )
+    )
 
-        # for m in markers:
-        #     if 'img' in m:
-        #         cv2.imshow('id %s'%m['id'], m['img'])
-        #         cv2.imshow('otsu %s'%m['id'], m['otsu'])
-        if cv2.waitKey(1) == 27:
-            break
-        detected_count += len(markers)
-    print(detected_count)  # 2900 #3042 #3021
+    workers = workers or multiprocessing.cpu_count()
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        detected_count = sum(
+            pool.imap_unordered(_detect_markers_in_frame, gray_imgs, chunksize=8)
+        )
+    print(
+        "independent frames, {} processes: {} markers in {:.2f}s".format(
+            workers, detected_count, time.perf_counter() - start
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -9,5 +9,16 @@ See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
 
-from .surface_tracker_online import Surface_Tracker_Online
-from .surface_tracker_offline import Surface_Tracker_Offline
+
+# The plugins need GL and pyglui. They are imported on first access, such that the
+# headless surface tracker (surface_tracker_headless) works without them.
+def __getattr__(name):
+    if name == "Surface_Tracker_Online":
+        from .surface_tracker_online import Surface_Tracker_Online
+
+        return Surface_Tracker_Online
+    if name == "Surface_Tracker_Offline":
+        from .surface_tracker_offline import Surface_Tracker_Offline
+
+        return Surface_Tracker_Offline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -10,12 +10,12 @@ See COPYING and COPYING.LESSER for license details.
 """
 
 import csv
-import itertools
 import logging
 import os
 import types
 
 import cv2
+import numpy as np
 
 import background_helper
 import player_methods
@@ -34,6 +34,31 @@ def background_video_processor(
     )
 
 
+def background_video_processor_pool(
+    video_file_path, callable, visited_list, seek_idx, mp_context, workers=None
+):
+    """Like `background_video_processor`, with the frames split across `workers`
+    processes that each open the video and seek in their own shard of frames."""
+
+    def start_shard(shard_visited, shard_seek_idx):
+        return background_video_processor(
+            video_file_path,
+            callable,
+            [True if visited else None for visited in shard_visited],
+            shard_seek_idx,
+            mp_context,
+        )
+
+    return background_helper.Sharded_Task_Proxy(
+        start_shard,
+        [x is not None for x in visited_list],
+        seek_idx,
+        workers=workers,
+        min_shard_len=300,
+        context=mp_context,
+    )
+
+
 def video_processing_generator(video_file_path, callable, seek_idx, visited_list):
     import os
     import logging
@@ -137,9 +162,38 @@ def background_data_processor(data, callable, seek_idx, mp_context):
     )
 
 
-def data_processing_generator(data, callable, seek_idx):
-    # We treat frames without marker detections as already processed from the start.
-    visited_list = [x is None for x in data]
+def background_data_processor_pool(data, callable, seek_idx, mp_context, workers=None):
+    """Like `background_data_processor`, with the samples split across `workers`
+    processes."""
+
+    def start_shard(shard_visited, shard_seek_idx):
+        return background_helper.IPC_Logging_Task_Proxy(
+            "Background Data Processor",
+            data_processing_generator,
+            (data, callable, shard_seek_idx, shard_visited),
+            context=mp_context,
+        )
+
+    try:
+        # Marker_Cache, without decoding all markers
+        skipped = [x is None for x in data.visited_list()]
+    except AttributeError:
+        skipped = [x is None for x in data]
+    return background_helper.Sharded_Task_Proxy(
+        start_shard,
+        skipped,
+        seek_idx,
+        workers=workers,
+        min_shard_len=3000,
+        context=mp_context,
+    )
+
+
+def data_processing_generator(data, callable, seek_idx, visited_list=None):
+    if visited_list is None:
+        # We treat frames without marker detections as already processed from the
+        # start.
+        visited_list = [x is None for x in data]
 
     def next_unvisited_idx(sample_idx):
         """
@@ -202,12 +256,36 @@ def gaze_on_surface_generator(
         yield gaze_on_surf
 
 
+def gaze_on_surface_chunk_generator(
+    surfaces,
+    section,
+    all_world_timestamps,
+    all_gaze_events,
+    camera_model,
+    chunk_len=1000,
+):
+    """Map the gaze of `section` onto the surfaces in chunks of `chunk_len` world
+    frames, such that the results can be used while the mapping is still running.
+
+    Yields: Tuples of the index of the surface and an array of dtype
+        MAPPED_EVENTS_DTYPE with the gaze of one chunk.
+    """
+    for start in range(section.start, section.stop, chunk_len):
+        chunk = slice(start, min(start + chunk_len, section.stop))
+        for surf_idx, surface in enumerate(surfaces):
+            gaze_on_surf = surface.map_section(
+                chunk, all_world_timestamps, all_gaze_events, camera_model
+            )
+            if len(gaze_on_surf):
+                yield surf_idx, gaze_on_surf
+
+
 def background_gaze_on_surface(
     surfaces, section, all_world_timestamps, all_gaze_events, camera_model, mp_context
 ):
     return background_helper.IPC_Logging_Task_Proxy(
         "Background Data Processor",
-        gaze_on_surface_generator,
+        gaze_on_surface_chunk_generator,
         (surfaces, section, all_world_timestamps, all_gaze_events, camera_model),
         context=mp_context,
     )
@@ -309,11 +387,10 @@ class Exporter:
         """
         Result: Tuple[events_per_surface, events_per_surface]
         events_per_surface = List[events_surface_0, ..., events_surface_N]
-        events_surface_i = List[events_world_frame_0, ..., events_world_frame_M]
-        events_world_frame_j: List[event, ...]
+        events_surface_i: Array of dtype MAPPED_EVENTS_DTYPE, see
+        Surface_Offline.map_section
 
         N: Number of surfaces
-        M: Number of world frames
         """
         section = slice(*self.export_range)
         gaze_on_surface = list(
@@ -385,9 +462,8 @@ class Exporter:
 
             for surf_idx, surface in enumerate(self.surfaces):
                 gaze_on_surf = self.gaze_on_surfaces[surf_idx]
-                gaze_on_surf = list(itertools.chain.from_iterable(gaze_on_surf))
                 gaze_on_surf_ts = set(
-                    [gp["base_data"][1] for gp in gaze_on_surf if gp["on_surf"]]
+                    gaze_on_surf["timestamp"][gaze_on_surf["on_surf"]].tolist()
                 )
                 not_on_any_surf_ts -= gaze_on_surf_ts
                 csv_writer.writerow((surface.name, len(gaze_on_surf_ts)))
@@ -527,27 +603,26 @@ class Exporter:
                     "confidence",
                 )
             )
-            for idx, gaze_on_surf in enumerate(gazes_on_surface):
-                idx += self.export_range[0]
-                if gaze_on_surf:
-                    for gp in gaze_on_surf:
-                        csv_writer.writerow(
-                            (
-                                self.world_timestamps[idx],
-                                idx,
-                                gp["timestamp"],
-                                gp["norm_pos"][0],
-                                gp["norm_pos"][1],
-                                gp["norm_pos"][0] * surface.real_world_size["x"],
-                                gp["norm_pos"][1] * surface.real_world_size["y"],
-                                gp["on_surf"],
-                                gp["confidence"],
-                            )
-                        )
+            world_idc = gazes_on_surface["world_index"]
+            norm_pos = gazes_on_surface["norm_pos"]
+            csv_writer.writerows(
+                zip(
+                    np.asarray(self.world_timestamps)[world_idc].tolist(),
+                    world_idc.tolist(),
+                    gazes_on_surface["timestamp"].tolist(),
+                    norm_pos[:, 0].tolist(),
+                    norm_pos[:, 1].tolist(),
+                    (norm_pos[:, 0] * surface.real_world_size["x"]).tolist(),
+                    (norm_pos[:, 1] * surface.real_world_size["y"]).tolist(),
+                    gazes_on_surface["on_surf"].tolist(),
+                    gazes_on_surface["confidence"].tolist(),
+                )
+            )
 
     def _export_fixations_on_surface(self, fixations_on_surf, surface, surface_name):
         """
-        fixations_on_surf structure: fixations_on_surf[world_frame_idx][event_idx]
+        fixations_on_surf: Array of dtype MAPPED_EVENTS_DTYPE, the fixation dicts are
+        only materialized here
         """
         with open(
             os.path.join(
@@ -573,22 +648,24 @@ class Exporter:
                     "on_surf",
                 )
             )
-            for world_idx, fixs_for_frame in enumerate(fixations_on_surf):
-                world_idx += self.export_range[0]
-                if fixs_for_frame:
-                    for fix in fixs_for_frame:
-                        csv_writer.writerow(
-                            (
-                                self.world_timestamps[world_idx],
-                                world_idx,
-                                fix["id"],
-                                fix["timestamp"],
-                                fix["duration"],
-                                fix["dispersion"],
-                                fix["norm_pos"][0],
-                                fix["norm_pos"][1],
-                                fix["norm_pos"][0] * surface.real_world_size["x"],
-                                fix["norm_pos"][1] * surface.real_world_size["y"],
-                                fix["on_surf"],
-                            )
-                        )
+            fixations = surface.mapped_events_to_dicts(
+                fixations_on_surf, self.fixations
+            )
+            for world_idx, fix in zip(
+                fixations_on_surf["world_index"].tolist(), fixations
+            ):
+                csv_writer.writerow(
+                    (
+                        self.world_timestamps[world_idx],
+                        world_idx,
+                        fix["id"],
+                        fix["timestamp"],
+                        fix["duration"],
+                        fix["dispersion"],
+                        fix["norm_pos"][0],
+                        fix["norm_pos"][1],
+                        fix["norm_pos"][0] * surface.real_world_size["x"],
+                        fix["norm_pos"][1] * surface.real_world_size["y"],
+                        fix["on_surf"],
+                    )
+                )
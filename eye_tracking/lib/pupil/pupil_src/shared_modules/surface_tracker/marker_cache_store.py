@@ -0,0 +1,471 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import logging
+import os
+import shutil
+
+import numpy as np
+
+import file_methods
+
+from . import offline_utils
+from .surface_marker import Surface_Marker, Surface_Marker_Type
+from .surface_marker_detector import (
+    APRILTAG_HIGH_RES_ON,
+    APRILTAG_SHARPENING_ON,
+    MarkerDetectorMode,
+    MarkerType,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Directory of the marker caches in the recording
+MARKER_CACHE_DIR = "marker_cache"
+# Version of the record format of Marker_Cache_Store
+MARKER_CACHE_FORMAT_VERSION = 1
+
+# One record per world frame. `count` is -1 for frames that have not been processed,
+# otherwise the markers of the frame are `count` marker records starting at `offset`.
+FRAME_RECORD_DTYPE = np.dtype(
+    [("offset", "<i8"), ("count", "<i4"), ("max_perimeter", "<f4")]
+)
+
+# One record per detected marker. Square markers use `id_confidence`, Apriltag
+# markers `tag_family`, `hamming`, `decision_margin`, `center` and `homography`.
+# `verts` are the square marker vertices or the Apriltag corners.
+MARKER_RECORD_DTYPE = np.dtype(
+    [
+        ("marker_type", "u1"),
+        ("tag_family", "S24"),
+        ("tag_id", "<i4"),
+        ("id_confidence", "<f4"),
+        ("hamming", "<i4"),
+        ("decision_margin", "<f4"),
+        ("perimeter", "<f4"),
+        ("verts", "<f4", (4, 2)),
+        ("center", "<f4", (2,)),
+        ("homography", "<f8", (3, 3)),
+    ]
+)
+
+_MARKER_TYPE_CODES = {Surface_Marker_Type.SQUARE: 0, Surface_Marker_Type.APRILTAG_V3: 1}
+
+
+def marker_cache_name(
+    marker_detector_mode, inverted_markers, quad_decimate, sharpening, min_perimeter
+):
+    """Name of the cache of markers detected with the given parameters. Parameters
+    that do not apply to the marker type are not part of the name."""
+    if marker_detector_mode.marker_type == MarkerType.SQUARE_MARKER:
+        params = [
+            marker_detector_mode.marker_type.value,
+            f"inverted{int(bool(inverted_markers))}",
+        ]
+    else:
+        params = [
+            marker_detector_mode.marker_type.value,
+            marker_detector_mode.family.value,
+            f"decimate{quad_decimate:g}",
+            f"sharpening{sharpening:g}",
+        ]
+    params += [f"perimeter{min_perimeter:g}", f"v{MARKER_CACHE_FORMAT_VERSION}"]
+    return "_".join(params)
+
+
+def read_last_used_params(rec_dir):
+    """Detector parameters of the marker cache that was used last in the recording,
+    as dict with keys `marker_detector_mode`, `inverted_markers`, `quad_decimate`
+    and `sharpening`, or None.
+
+    Falls back to the parameters of the legacy `square_marker_cache` file.
+    """
+    info = file_methods.Persistent_Dict(os.path.join(rec_dir, MARKER_CACHE_DIR, "info"))
+    if "marker_detector_mode" in info:
+        return {
+            "marker_detector_mode": MarkerDetectorMode.from_tuple(
+                info["marker_detector_mode"]
+            ),
+            "inverted_markers": info["inverted_markers"],
+            "quad_decimate": info["quad_decimate"],
+            "sharpening": info["sharpening"],
+        }
+
+    legacy_path = os.path.join(rec_dir, "square_marker_cache")
+    if not os.path.exists(legacy_path):
+        return None
+    legacy_cache = file_methods.Persistent_Dict(legacy_path)
+    marker_cache = legacy_cache.get("marker_cache_unfiltered", None) or []
+    first_marker = next(
+        (marker for markers in marker_cache if markers for marker in markers), None
+    )
+    if first_marker is None:
+        return None
+    return {
+        "marker_detector_mode": MarkerDetectorMode.from_marker(
+            Surface_Marker.deserialize(first_marker)
+        ),
+        "inverted_markers": legacy_cache.get("inverted_markers", False),
+        "quad_decimate": legacy_cache.get("quad_decimate", APRILTAG_HIGH_RES_ON),
+        "sharpening": legacy_cache.get("sharpening", APRILTAG_SHARPENING_ON),
+    }
+
+
+def read_legacy_marker_cache(
+    rec_dir, marker_detector_mode, inverted_markers, quad_decimate, sharpening
+):
+    """Load the msgpack marker cache written by earlier versions to
+    `square_marker_cache`.
+
+    Returns None if there is none or it was computed with other detector parameters.
+    Frames that have not been processed yet are None.
+    """
+    previous_cache = file_methods.Persistent_Dict(
+        os.path.join(rec_dir, "square_marker_cache")
+    )
+    cache = previous_cache.get("marker_cache_unfiltered", None)
+    if (
+        cache is None
+        or previous_cache.get("version", 0) != offline_utils.MARKER_CACHE_VERSION
+        or previous_cache.get("inverted_markers", False) != inverted_markers
+        or previous_cache.get("quad_decimate", APRILTAG_HIGH_RES_ON) != quad_decimate
+        or previous_cache.get("sharpening", APRILTAG_SHARPENING_ON) != sharpening
+    ):
+        return None
+
+    marker_cache = []
+    for markers in cache:
+        # Loaded markers are either False, [] or a list of serialized markers.
+        if markers:
+            markers = [
+                Surface_Marker.deserialize(args) if args else None for args in markers
+            ]
+        elif markers is not None:
+            markers = []
+        marker_cache.append(markers)
+
+    first_marker = next(
+        (marker for markers in marker_cache if markers for marker in markers), None
+    )
+    if (
+        first_marker is not None
+        and MarkerDetectorMode.from_marker(first_marker) != marker_detector_mode
+    ):
+        return None
+    return marker_cache
+
+
+def markers_to_records(markers):
+    """Convert Surface_Marker objects into an array of dtype MARKER_RECORD_DTYPE."""
+    records = np.zeros(len(markers), dtype=MARKER_RECORD_DTYPE)
+    for record, marker in zip(records, markers):
+        raw_marker = marker.raw_marker
+        record["marker_type"] = _MARKER_TYPE_CODES[marker.marker_type]
+        record["tag_id"] = marker.tag_id
+        record["perimeter"] = marker.perimeter
+        if marker.marker_type == Surface_Marker_Type.SQUARE:
+            record["id_confidence"] = raw_marker.id_confidence
+            record["verts"] = np.reshape(raw_marker.verts_px, (4, 2))
+        else:
+            record["tag_family"] = raw_marker.tag_family.encode("utf8")
+            record["hamming"] = raw_marker.hamming
+            record["decision_margin"] = raw_marker.decision_margin
+            record["verts"] = raw_marker.corners
+            record["center"] = raw_marker.center
+            record["homography"] = raw_marker.homography
+    return records
+
+
+def records_to_markers(records):
+    """Convert an array of dtype MARKER_RECORD_DTYPE into Surface_Marker objects."""
+    fields = {name: records[name].tolist() for name in MARKER_RECORD_DTYPE.names}
+    markers = []
+    for idx, marker_type in enumerate(fields["marker_type"]):
+        if marker_type == _MARKER_TYPE_CODES[Surface_Marker_Type.SQUARE]:
+            state = (
+                fields["tag_id"][idx],
+                fields["id_confidence"][idx],
+                [[vert] for vert in fields["verts"][idx]],
+                fields["perimeter"][idx],
+                Surface_Marker_Type.SQUARE.value,
+            )
+        else:
+            state = (
+                fields["tag_family"][idx].decode("utf8"),
+                fields["tag_id"][idx],
+                fields["hamming"][idx],
+                fields["decision_margin"][idx],
+                fields["homography"][idx],
+                fields["center"][idx],
+                fields["verts"][idx],
+                None,
+                None,
+                None,
+                Surface_Marker_Type.APRILTAG_V3.value,
+            )
+        markers.append(Surface_Marker.from_tuple(state))
+    return markers
+
+
+class Marker_Cache_Store:
+    """Markers detected in every world frame of a recording with one set of detector
+    parameters, stored in `rec_dir/marker_cache/<marker_cache_name>`.
+
+    The frames are fixed-size records in a memory-mapped file, pointing into an
+    append-only file of fixed-size marker records. Markers are decoded into
+    Surface_Marker objects only when a frame is read, and `save` appends only the
+    frames written since the last save. The caches of other parameters are kept
+    next to it.
+    """
+
+    def __init__(
+        self,
+        rec_dir,
+        frame_count,
+        marker_detector_mode,
+        inverted_markers=False,
+        quad_decimate=APRILTAG_HIGH_RES_ON,
+        sharpening=APRILTAG_SHARPENING_ON,
+        min_perimeter=offline_utils.CACHE_MIN_MARKER_PERIMETER,
+    ):
+        self.rec_dir = rec_dir
+        self.marker_detector_mode = marker_detector_mode
+        self.inverted_markers = inverted_markers
+        self.quad_decimate = quad_decimate
+        self.sharpening = sharpening
+        self.path = os.path.join(
+            rec_dir,
+            MARKER_CACHE_DIR,
+            marker_cache_name(
+                marker_detector_mode,
+                inverted_markers,
+                quad_decimate,
+                sharpening,
+                min_perimeter,
+            ),
+        )
+        self._pending = {}
+        self._open(frame_count)
+
+    @property
+    def _frames_path(self):
+        return os.path.join(self.path, "frames.npy")
+
+    @property
+    def _markers_path(self):
+        return os.path.join(self.path, "markers.bin")
+
+    def _open(self, frame_count):
+        try:
+            self._frames = np.lib.format.open_memmap(self._frames_path, mode="r+")
+            if self._frames.dtype != FRAME_RECORD_DTYPE or self._frames.shape != (
+                frame_count,
+            ):
+                raise ValueError("Marker cache does not match the recording")
+        except (OSError, ValueError) as err:
+            if os.path.exists(self.path):
+                logger.debug(f"Rebuilding marker cache {self.path}: {err}")
+                shutil.rmtree(self.path)
+            os.makedirs(self.path)
+            frames = np.lib.format.open_memmap(
+                self._frames_path,
+                mode="w+",
+                dtype=FRAME_RECORD_DTYPE,
+                shape=(frame_count,),
+            )
+            frames["count"] = -1
+            frames.flush()
+            del frames
+            self._frames = np.lib.format.open_memmap(self._frames_path, mode="r+")
+            open(self._markers_path, "wb").close()
+        self._map_markers()
+
+    def _map_markers(self):
+        file_size = os.path.getsize(self._markers_path)
+        marker_count = file_size // MARKER_RECORD_DTYPE.itemsize
+        if marker_count:
+            self._markers = np.memmap(
+                self._markers_path,
+                dtype=MARKER_RECORD_DTYPE,
+                mode="r",
+                shape=(marker_count,),
+            )
+        else:
+            self._markers = np.empty(0, dtype=MARKER_RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def visited(self):
+        """Boolean array, True for frames that have been processed."""
+        visited = self._frames["count"] >= 0
+        if self._pending:
+            visited[list(self._pending)] = True
+        return visited
+
+    def positive(self, min_perimeter=None):
+        """Boolean array, True for frames with markers of at least `min_perimeter`."""
+        positive = self._frames["count"] > 0
+        if min_perimeter is not None:
+            positive &= self._frames["max_perimeter"] >= min_perimeter
+        for frame_idx, records in self._pending.items():
+            positive[frame_idx] = bool(len(records)) and (
+                min_perimeter is None or records["perimeter"].max() >= min_perimeter
+            )
+        return positive
+
+    def records(self, frame_idx):
+        """Marker records of a frame, or None if it has not been processed."""
+        try:
+            return self._pending[frame_idx]
+        except KeyError:
+            pass
+        offset, count, _ = self._frames[frame_idx].tolist()
+        if count < 0:
+            return None
+        return self._markers[offset : offset + count]
+
+    def markers(self, frame_idx, min_perimeter=None):
+        """Markers of a frame, or None if it has not been processed."""
+        records = self.records(frame_idx)
+        if records is None:
+            return None
+        if min_perimeter is not None:
+            records = records[records["perimeter"] >= min_perimeter]
+        return records_to_markers(records)
+
+    def write(self, frame_idx, markers):
+        """Set the markers of a frame. They are written to disk by `save`."""
+        self._pending[frame_idx] = markers_to_records(markers)
+
+    def save(self):
+        """Append the frames written since the last save to the cache files."""
+        if not self._pending:
+            return
+        frame_idc = sorted(self._pending)
+        records = [self._pending[frame_idx] for frame_idx in frame_idc]
+        counts = np.array([len(r) for r in records], dtype=np.int64)
+        offsets = len(self._markers) + np.cumsum(counts) - counts
+        with open(self._markers_path, "r+b") as f:
+            # drop records of an interrupted save, no frame points to them
+            f.seek(len(self._markers) * MARKER_RECORD_DTYPE.itemsize)
+            if f.tell() < os.path.getsize(self._markers_path):
+                f.truncate()
+            for frame_records in records:
+                f.write(frame_records.tobytes())
+
+        # the frames point to the new markers only once these are on disk
+        frames = np.zeros(len(frame_idc), dtype=FRAME_RECORD_DTYPE)
+        frames["offset"] = offsets
+        frames["count"] = counts
+        frames["max_perimeter"] = [
+            r["perimeter"].max() if len(r) else 0.0 for r in records
+        ]
+        self._frames[frame_idc] = frames
+        self._frames.flush()
+        self._pending = {}
+        self._map_markers()
+
+        info = file_methods.Persistent_Dict(
+            os.path.join(self.rec_dir, MARKER_CACHE_DIR, "info")
+        )
+        info["marker_detector_mode"] = self.marker_detector_mode.as_tuple()
+        info["inverted_markers"] = self.inverted_markers
+        info["quad_decimate"] = self.quad_decimate
+        info["sharpening"] = self.sharpening
+        info.save()
+
+    def import_legacy_cache(self):
+        """Fill the store from a matching legacy `square_marker_cache` file, if the
+        store is still empty. Returns True if markers were imported."""
+        if self.visited.any():
+            return False
+        legacy_cache = read_legacy_marker_cache(
+            self.rec_dir,
+            self.marker_detector_mode,
+            self.inverted_markers,
+            self.quad_decimate,
+            self.sharpening,
+        )
+        if legacy_cache is None or len(legacy_cache) != len(self):
+            return False
+        for frame_idx, markers in enumerate(legacy_cache):
+            if markers is not None:
+                self.write(frame_idx, markers)
+        self.save()
+        return True
+
+
+class Marker_Cache:
+    """List-like view of a Marker_Cache_Store with the interface of `Cache`.
+
+    Frames are decoded on access. Markers smaller than `min_perimeter` are left out,
+    this does not change the store such that views with different perimeters can
+    share it.
+    """
+
+    def __init__(self, store, min_perimeter=None):
+        self.store = store
+        self.min_perimeter = min_perimeter
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def length(self):
+        return len(self.store)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[idx] for idx in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Marker cache index out of range")
+        return self.store.markers(key, self.min_perimeter)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def update(self, key, item, force=False):
+        if item is None:
+            raise ValueError("`None` is not a valid value to be assigned in the cache!")
+        if not force and self.store.records(key) is not None:
+            raise IndexError(
+                "Can not overwrite an already cached position without force!"
+            )
+        self.store.write(key, item)
+
+    @property
+    def visited(self):
+        return self.store.visited
+
+    def visited_list(self):
+        """Like the marker cache list, with True for processed and None for
+        unprocessed frames, without decoding the markers."""
+        return [True if visited else None for visited in self.visited.tolist()]
+
+    @property
+    def visited_ranges(self):
+        return self._ranges(self.store.visited)
+
+    @property
+    def positive_ranges(self):
+        return self._ranges(self.store.positive(self.min_perimeter))
+
+    @staticmethod
+    def _ranges(mask):
+        """Inclusive [start, end] ranges of True values, like Cache.recompute_ranges"""
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask, [0])).astype(int)))
+        return (edges.reshape(-1, 2) - [0, 1]).tolist()
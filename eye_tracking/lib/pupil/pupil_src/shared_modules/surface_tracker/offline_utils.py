@@ -12,6 +12,11 @@ See COPYING and COPYING.LESSER for license details.
 from .surface import Surface
 from .surface_marker_detector import MarkerDetectorController
 
+# Version of the legacy marker cache file "square_marker_cache" in the recording
+MARKER_CACHE_VERSION = 3
+# Also add very small detected markers to cache and filter cache afterwards
+CACHE_MIN_MARKER_PERIMETER = 20
+
 
 class marker_detection_callable(MarkerDetectorController):
     def __call__(self, frame):
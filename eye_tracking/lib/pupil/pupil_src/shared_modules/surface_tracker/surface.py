@@ -30,6 +30,20 @@ Surface_Marker_UID_To_Aggregate_Mapping = typing.Mapping[
     Surface_Marker_UID, Surface_Marker_Aggregate
 ]
 
+# Gaze or fixation events mapped onto a surface by Surface_Offline.map_section.
+# `event_idx` is the index of the event in the mapped events, `world_index` the
+# world frame whose surface location was used.
+MAPPED_EVENTS_DTYPE = np.dtype(
+    [
+        ("world_index", np.int64),
+        ("event_idx", np.int64),
+        ("timestamp", np.float64),
+        ("confidence", np.float64),
+        ("norm_pos", np.float64, (2,)),
+        ("on_surf", np.bool_),
+    ]
+)
+
 
 class Surface(abc.ABC):
     """A Surface is a quadrangle whose position is defined in relation to a set of
@@ -106,6 +120,7 @@ class Surface(abc.ABC):
         self._heatmap_scale = 0.5
         self._heatmap_resolution = 31
         self._heatmap_blur_factor = 0.0
+        self._heatmap_hist = None
 
         # The uid is only used to implement __hash__ and __eq__
         self._uid = uuid.uuid4()
@@ -227,6 +242,34 @@ class Surface(abc.ABC):
         img_points.shape = orig_shape
         return img_points
 
+    @staticmethod
+    def _perspective_transform_points_batch(points, trans_matrices):
+        """Like `cv2.perspectiveTransform`, with one matrix per point.
+
+        Args:
+            points (ndarray): Points with shape (N, 2).
+            trans_matrices (ndarray): Transformation matrices with shape (N, 3, 3).
+        """
+        homogeneous = (
+            np.einsum("nij,nj->ni", trans_matrices[:, :, :2], points)
+            + trans_matrices[:, :, 2]
+        )
+        w = homogeneous[:, 2:]
+        # cv2.perspectiveTransform maps points at infinity to 0
+        at_infinity = np.abs(w) <= np.finfo(np.float64).eps
+        w = np.where(at_infinity, 1.0, w)
+        return np.where(at_infinity, 0.0, homogeneous[:, :2] / w)
+
+    @staticmethod
+    def _events_norm_pos_to_img(norm_pos, camera_model):
+        norm_pos = np.asarray(norm_pos, dtype=np.float64).reshape(-1, 2)
+        width, height = camera_model.resolution
+        return np.column_stack((norm_pos[:, 0] * width, (1 - norm_pos[:, 1]) * height))
+
+    @staticmethod
+    def _on_surf(surf_norm_pos):
+        return np.all((0 <= surf_norm_pos) & (surf_norm_pos <= 1), axis=1)
+
     def map_gaze_and_fixation_events(self, events, camera_model, trans_matrix=None):
         """
         Map a list of gaze or fixation events onto the surface and return the
@@ -243,35 +286,92 @@ class Surface(abc.ABC):
             List of gaze or fixation on surface events.
 
         """
-        results = []
-        for event in events:
-            gaze_norm_pos = event["norm_pos"]
-            gaze_img_point = methods.denormalize(
-                gaze_norm_pos, camera_model.resolution, flip_y=True
-            )
-            gaze_img_point = np.array(gaze_img_point)
-            surf_norm_pos = self.map_to_surf(
-                gaze_img_point,
-                camera_model,
-                compensate_distortion=True,
-                trans_matrix=trans_matrix,
+        if len(events) == 0:
+            return []
+        gaze_img_points = self._events_norm_pos_to_img(
+            [event["norm_pos"] for event in events], camera_model
+        )
+        surf_norm_pos = self.map_to_surf(
+            gaze_img_points,
+            camera_model,
+            compensate_distortion=True,
+            trans_matrix=trans_matrix,
+        )
+        on_surf = self._on_surf(surf_norm_pos)
+        return [
+            self._mapped_event_dict(event, norm_pos, bool(on_srf))
+            for event, norm_pos, on_srf in zip(events, surf_norm_pos.tolist(), on_surf)
+        ]
+
+    @staticmethod
+    def _mapped_event_dict(event, surf_norm_pos, on_surf):
+        mapped_datum = {
+            "topic": f"{event['topic']}_on_surface",
+            "norm_pos": surf_norm_pos,
+            "confidence": event["confidence"],
+            "on_surf": on_surf,
+            "base_data": (event["topic"], event["timestamp"]),
+            "timestamp": event["timestamp"],
+        }
+        if event["topic"] == "fixations":
+            mapped_datum["id"] = event["id"]
+            mapped_datum["duration"] = event["duration"]
+            mapped_datum["dispersion"] = event["dispersion"]
+        return mapped_datum
+
+    @staticmethod
+    def mapped_events_to_dicts(mapped_events, events):
+        """Materialize the gaze/fixation on surface events of a structured array
+        returned by `Surface_Offline.map_section`.
+
+        Args:
+            mapped_events: Array of dtype `MAPPED_EVENTS_DTYPE`.
+            events: The gaze or fixation events that were mapped.
+
+        Returns:
+            List of gaze or fixation on surface events, as returned by
+            `map_gaze_and_fixation_events`.
+        """
+        return [
+            Surface._mapped_event_dict(events[event_idx], norm_pos, on_surf)
+            for event_idx, norm_pos, on_surf in zip(
+                mapped_events["event_idx"].tolist(),
+                mapped_events["norm_pos"].tolist(),
+                mapped_events["on_surf"].tolist(),
             )
-            on_srf = bool((0 <= surf_norm_pos[0] <= 1) and (0 <= surf_norm_pos[1] <= 1))
-
-            mapped_datum = {
-                "topic": f"{event['topic']}_on_surface",
-                "norm_pos": surf_norm_pos.tolist(),
-                "confidence": event["confidence"],
-                "on_surf": on_srf,
-                "base_data": (event["topic"], event["timestamp"]),
-                "timestamp": event["timestamp"],
-            }
-            if event["topic"] == "fixations":
-                mapped_datum["id"] = event["id"]
-                mapped_datum["duration"] = event["duration"]
-                mapped_datum["dispersion"] = event["dispersion"]
-            results.append(mapped_datum)
-        return results
+        ]
+
+    def map_events_batch(self, norm_pos, camera_model, trans_matrices, point_idc=None):
+        """Map gaze or fixation positions onto the surface, each point with its own
+        transformation matrix.
+
+        Args:
+            norm_pos (ndarray): Normalized image positions with shape (N, 2).
+            camera_model: Camera Model object.
+            trans_matrices (ndarray): The img_to_surf transformation matrices with
+            shape (M, 3, 3), one per mapped point.
+            point_idc (ndarray): Index into `norm_pos` of each of the M mapped
+            points, for points that are mapped with several matrices. If `None`,
+            M == N and the points are mapped in order.
+
+        Returns:
+            Tuple of the points in normalized surface space, with shape (M, 2), and
+            the on surface flags, with shape (M,).
+
+        """
+        trans_matrices = np.asarray(trans_matrices, dtype=np.float64)
+        if len(trans_matrices) == 0:
+            return np.empty((0, 2)), np.empty(0, dtype=bool)
+        img_points = self._events_norm_pos_to_img(norm_pos, camera_model)
+        # every point is undistorted once, however often it is mapped
+        img_points = camera_model.undistort_points_on_image_plane(img_points)
+        img_points = np.asarray(img_points, dtype=np.float64).reshape(-1, 2)
+        if point_idc is not None:
+            img_points = img_points[point_idc]
+        surf_norm_pos = self._perspective_transform_points_batch(
+            img_points, trans_matrices
+        )
+        return surf_norm_pos, self._on_surf(surf_norm_pos)
 
     @abc.abstractmethod
     def update_location(self, frame_idx, visible_markers, camera_model):
@@ -597,29 +697,74 @@ class Surface(abc.ABC):
         """Compute the gaze distribution heatmap based on given gaze events."""
 
         heatmap_data = [g["norm_pos"] for g in gaze_on_surf if g["on_surf"]]
+        self.update_heatmap_from_positions(heatmap_data)
+
+    def update_heatmap_from_positions(self, norm_pos):
+        """Compute the gaze distribution heatmap based on gaze on surface positions
+        with shape (N, 2)."""
+
+        self.reset_heatmap()
+        self.accumulate_heatmap(norm_pos)
+        self.render_heatmap()
+
+    @property
+    def heatmap_grid(self):
+        """Number of heatmap (rows, columns), depending on the heatmap resolution
+        and the aspect ratio of the surface."""
         aspect_ratio = self.real_world_size["y"] / self.real_world_size["x"]
-        grid = (
+        return (
             max(1, int(self._heatmap_resolution * aspect_ratio)),
             int(self._heatmap_resolution),
         )
-        if heatmap_data:
-            xvals, yvals = zip(*((x, 1.0 - y) for x, y in heatmap_data))
-            hist, *edges = np.histogram2d(
-                yvals, xvals, bins=grid, range=[[0, 1.0], [0, 1.0]], normed=False
-            )
-            filter_h = 19 + self._heatmap_blur_factor * 15
-            filter_w = filter_h * aspect_ratio
-            filter_h = int(filter_h) // 2 * 2 + 1
-            filter_w = int(filter_w) // 2 * 2 + 1
-
-            hist = cv2.GaussianBlur(hist, (filter_h, filter_w), 0)
-            hist_max = hist.max()
-            hist *= (255.0 / hist_max) if hist_max else 0.0
-            hist = hist.astype(np.uint8)
-        else:
+
+    def reset_heatmap(self):
+        """Drop the gaze accumulated with `accumulate_heatmap`."""
+        self._heatmap_hist = np.zeros(self.heatmap_grid, dtype=np.float64)
+
+    def accumulate_heatmap(self, norm_pos):
+        """Add gaze on surface positions with shape (N, 2) to the gaze distribution.
+
+        Positions outside of the surface are ignored. The accumulated distribution
+        is reset if the heatmap grid has changed since the last call. Call
+        `render_heatmap` to update `within_surface_heatmap`.
+        """
+        grid = self.heatmap_grid
+        if self._heatmap_hist is None or self._heatmap_hist.shape != grid:
+            self.reset_heatmap()
+
+        norm_pos = np.asarray(norm_pos, dtype=np.float64).reshape(-1, 2)
+        rows = (1.0 - norm_pos[:, 1]) * grid[0]
+        cols = norm_pos[:, 0] * grid[1]
+        inside = (rows >= 0) & (rows <= grid[0]) & (cols >= 0) & (cols <= grid[1])
+        if not inside.any():
+            return
+        # like np.histogram2d, positions on the upper edge fall into the last bin
+        rows = np.minimum(rows[inside].astype(np.intp), grid[0] - 1)
+        cols = np.minimum(cols[inside].astype(np.intp), grid[1] - 1)
+        self._heatmap_hist += np.bincount(
+            rows * grid[1] + cols, minlength=grid[0] * grid[1]
+        ).reshape(grid)
+
+    def render_heatmap(self):
+        """Blur and color the accumulated gaze distribution into
+        `within_surface_heatmap`."""
+        if self._heatmap_hist is None or not self._heatmap_hist.any():
+            grid = self.heatmap_grid
             self.within_surface_heatmap = self.get_uniform_heatmap(grid)
             return
 
+        grid = self._heatmap_hist.shape
+        aspect_ratio = self.real_world_size["y"] / self.real_world_size["x"]
+        filter_h = 19 + self._heatmap_blur_factor * 15
+        filter_w = filter_h * aspect_ratio
+        filter_h = int(filter_h) // 2 * 2 + 1
+        filter_w = int(filter_w) // 2 * 2 + 1
+
+        hist = cv2.GaussianBlur(self._heatmap_hist, (filter_h, filter_w), 0)
+        hist_max = hist.max()
+        hist *= (255.0 / hist_max) if hist_max else 0.0
+        hist = hist.astype(np.uint8)
+
         color_map = cv2.applyColorMap(hist, cv2.COLORMAP_JET)
         # reuse allocated memory if possible
         if self.within_surface_heatmap.shape != (*grid, 4):
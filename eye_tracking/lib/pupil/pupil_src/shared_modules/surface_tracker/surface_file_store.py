@@ -209,6 +209,17 @@ class Surface_File_Store(_Surface_File_Store_Base):
     def write_surfaces_to_file(self, surfaces: typing.Iterator[Surface]):
         self.__file_store_latest.write_surfaces_to_file(surfaces=surfaces)
 
+    def read_surfaces_from_file_path(
+        self, file_path: str, surface_class
+    ) -> typing.Iterator[Surface]:
+        """Read surfaces of the latest format from a definitions file that is not
+        necessarily named `file_name`, e.g. one shared between recordings."""
+        return self._read_surfaces_from_file_path(
+            file_path=file_path,
+            serializer=self.serializer,
+            surface_class=surface_class,
+        )
+
     # Private API
 
     @property
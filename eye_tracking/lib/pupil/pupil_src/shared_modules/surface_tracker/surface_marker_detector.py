@@ -27,6 +27,12 @@ __all__ = [
     "MarkerDetectorMode",
     "MarkerType",
     "ApriltagFamily",
+    "DEFAULT_DETECTOR_MODE",
+    "APRILTAG_SHARPENING_ON",
+    "APRILTAG_SHARPENING_OFF",
+    "APRILTAG_HIGH_RES_ON",
+    "APRILTAG_HIGH_RES_OFF",
+    "remove_duplicate_markers",
 ]
 
 
@@ -97,6 +103,28 @@ class MarkerDetectorMode(_MarkerDetectorMode):
         return cls(marker_type, family)
 
 
+DEFAULT_DETECTOR_MODE = MarkerDetectorMode(
+    MarkerType.APRILTAG_MARKER, ApriltagFamily.tag36h11
+)
+
+APRILTAG_SHARPENING_ON = 1.0
+APRILTAG_SHARPENING_OFF = 0.25
+
+APRILTAG_HIGH_RES_OFF = 3.0
+APRILTAG_HIGH_RES_ON = 2.0
+
+
+def remove_duplicate_markers(markers):
+    # if an id shows twice use the bigger marker (usually this is a screen camera
+    # echo artifact.)
+    marker_by_uid = {}
+    for m in markers:
+        if m.uid not in marker_by_uid or m.perimeter > marker_by_uid[m.uid].perimeter:
+            marker_by_uid[m.uid] = m
+
+    return list(marker_by_uid.values())
+
+
 class Surface_Base_Marker_Detector(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def detect_markers_iter(
@@ -116,6 +144,7 @@ class Surface_Square_Marker_Detector(Surface_Base_Marker_Detector):
         marker_min_perimeter: int = ...,
         square_marker_inverted_markers: bool = ...,
         square_marker_use_online_mode: bool = ...,
+        square_marker_use_tracking: bool = ...,
     ):
         self.__marker_min_perimeter = (
             marker_min_perimeter if marker_min_perimeter is not ... else 60
@@ -132,6 +161,13 @@ class Surface_Square_Marker_Detector(Surface_Base_Marker_Detector):
             if square_marker_use_online_mode is not ...
             else False
         )
+        # Without tracking, markers are detected in every frame independently of
+        # the previous frames, such that frames can be processed in any order.
+        self.use_tracking = (
+            square_marker_use_tracking
+            if square_marker_use_tracking is not ...
+            else True
+        )
 
     @property
     def inverted_markers(self) -> bool:
@@ -155,6 +191,23 @@ class Surface_Square_Marker_Detector(Surface_Base_Marker_Detector):
     def detect_markers_iter(
         self, gray_img, frame_index: int
     ) -> T.Iterable[Surface_Marker]:
+        grid_size = 5
+        aperture = 9
+        min_perimeter = self.marker_min_perimeter
+
+        if not self.use_tracking:
+            if self.__inverted_markers:
+                gray_img = 255 - gray_img
+            markers = square_marker_detect.detect_markers(
+                gray_img=gray_img,
+                grid_size=grid_size,
+                min_marker_perimeter=min_perimeter,
+                aperture=aperture,
+            )
+            markers = map(Surface_Marker.from_square_tag_detection, markers)
+            markers = filter(self._surface_marker_filter, markers)
+            return markers
+
         if self.use_online_mode:
             true_detect_every_frame = 3
         else:
@@ -169,10 +222,6 @@ class Surface_Square_Marker_Detector(Surface_Base_Marker_Detector):
             # better marker positions. But if we would not have seeked we could
             # have used this information! This looks like an inconsistency!
 
-        grid_size = 5
-        aperture = 9
-        min_perimeter = self.marker_min_perimeter
-
         markers = square_marker_detect.detect_markers_robust(
             gray_img=gray_img,
             grid_size=grid_size,
@@ -274,6 +323,7 @@ class MarkerDetectorController(Surface_Base_Marker_Detector):
         marker_min_perimeter: int = ...,
         square_marker_inverted_markers: bool = ...,
         square_marker_use_online_mode: bool = ...,
+        square_marker_use_tracking: bool = ...,
         apriltag_nthreads: int = 2,
         apriltag_quad_decimate: float = ...,
         apriltag_decode_sharpening: float = ...,
@@ -283,6 +333,7 @@ class MarkerDetectorController(Surface_Base_Marker_Detector):
 
         self._square_marker_inverted_markers = square_marker_inverted_markers
         self._square_marker_use_online_mode = square_marker_use_online_mode
+        self._square_marker_use_tracking = square_marker_use_tracking
 
         self._apriltag_nthreads = apriltag_nthreads
         self._apriltag_quad_decimate = apriltag_quad_decimate
@@ -311,6 +362,7 @@ class MarkerDetectorController(Surface_Base_Marker_Detector):
                 marker_min_perimeter=self._marker_min_perimeter,
                 square_marker_inverted_markers=self._square_marker_inverted_markers,
                 square_marker_use_online_mode=self._square_marker_use_online_mode,
+                square_marker_use_tracking=self._square_marker_use_tracking,
             )
 
     @property
@@ -13,11 +13,11 @@ import logging
 import multiprocessing
 import platform
 
-import player_methods
+import numpy as np
 
 from . import background_tasks, offline_utils
 from .cache import Cache
-from .surface import Surface, Surface_Location
+from .surface import MAPPED_EVENTS_DTYPE, Surface, Surface_Location
 
 logger = logging.getLogger(__name__)
 
@@ -55,29 +55,73 @@ class Surface_Offline(Surface):
         self.__dict__.update(state)
 
     def map_section(self, section, all_world_timestamps, all_gaze_events, camera_model):
+        """Map the gaze or fixation events of all world frames in `section` onto the
+        surface.
+
+        The events of every frame in which the surface was detected are collected
+        with `Bisector.window_idc`, their positions are undistorted once and
+        transformed with the homography of their frame in one batch.
+
+        Returns:
+            Array of dtype `MAPPED_EVENTS_DTYPE`, ordered by world index. Use
+            `Surface.mapped_events_to_dicts` to get the gaze/fixation on surface
+            events.
+        """
         try:
             location_cache = self.location_cache[section]
         except TypeError:
-            return []
+            return np.empty(0, dtype=MAPPED_EVENTS_DTYPE)
 
-        section_gaze_on_surf = []
+        frame_idc = []
+        trans_matrices = []
         for frame_idx, location in enumerate(location_cache):
-            frame_idx += section.start
             if location and location.detected:
-                frame_window = player_methods.enclosing_window(
-                    all_world_timestamps, frame_idx
-                )
-                gaze_events = all_gaze_events.by_ts_window(frame_window)
+                frame_idc.append(frame_idx + section.start)
+                trans_matrices.append(location.img_to_surf_trans)
+        if not frame_idc or not len(all_gaze_events):
+            return np.empty(0, dtype=MAPPED_EVENTS_DTYPE)
+        frame_idc = np.array(frame_idc)
+
+        # vectorized player_methods.enclosing_window
+        padded_ts = np.concatenate(([-np.inf], all_world_timestamps, [np.inf]))
+        before = padded_ts[frame_idc]
+        now = padded_ts[frame_idc + 1]
+        after = padded_ts[frame_idc + 2]
+        start_idc, stop_idc = all_gaze_events.window_idc(
+            (now + before) / 2.0, (after + now) / 2.0
+        )
 
-                gaze_on_surf = self.map_gaze_and_fixation_events(
-                    gaze_events, camera_model, trans_matrix=location.img_to_surf_trans
-                )
-            else:
-                gaze_on_surf = []
-            section_gaze_on_surf.append(gaze_on_surf)
-        return section_gaze_on_surf
+        # indices of the events of every frame, concatenated
+        counts = np.maximum(stop_idc - start_idc, 0)
+        frame_of_event = np.repeat(np.arange(len(frame_idc)), counts)
+        event_offsets = np.cumsum(counts) - counts
+        event_idc = (
+            np.arange(counts.sum())
+            - np.repeat(event_offsets, counts)
+            + np.repeat(start_idc, counts)
+        )
+
+        # fixations span several frames, every event is read only once
+        unique_idc, inverse = np.unique(event_idc, return_inverse=True)
+        events = [all_gaze_events[idx] for idx in unique_idc.tolist()]
+        norm_pos = np.array([event["norm_pos"] for event in events], dtype=np.float64)
+
+        mapped = np.empty(len(event_idc), dtype=MAPPED_EVENTS_DTYPE)
+        mapped["world_index"] = frame_idc[frame_of_event]
+        mapped["event_idx"] = event_idc
+        mapped["timestamp"] = np.asarray(all_gaze_events.timestamps)[event_idc]
+        mapped["confidence"] = np.array(
+            [event["confidence"] for event in events], dtype=np.float64
+        )[inverse]
+        mapped["norm_pos"], mapped["on_surf"] = self.map_events_batch(
+            norm_pos.reshape(-1, 2),
+            camera_model,
+            np.array(trans_matrices)[frame_of_event],
+            point_idc=inverse,
+        )
+        return mapped
 
-    def update_location(self, frame_idx, marker_cache, camera_model):
+    def update_location(self, frame_idx, marker_cache, camera_model, workers=1):
         if not self.defined:
             self._build_definition_from_cache(camera_model, frame_idx, marker_cache)
 
@@ -87,14 +131,18 @@ class Surface_Offline(Surface):
         except (TypeError, AttributeError):
             # If any event invalidates the location_cache, it will be set to None.
             location = None
-            self._recalculate_location_cache(frame_idx, marker_cache, camera_model)
+            self._recalculate_location_cache(
+                frame_idx, marker_cache, camera_model, workers
+            )
 
         # If location is None the cache was not filled at the current position yet.
         if location is None:
             if not marker_cache[frame_idx] is None:
                 logging.debug("On demand surface cache update!")
-                self.update_location_cache(frame_idx, marker_cache, camera_model)
-                self.update_location(frame_idx, marker_cache, camera_model)
+                self.update_location_cache(
+                    frame_idx, marker_cache, camera_model, workers
+                )
+                self.update_location(frame_idx, marker_cache, camera_model, workers)
                 return
             else:
                 logging.debug("Markers not computed yet!")
@@ -155,8 +203,9 @@ class Surface_Offline(Surface):
                 self.location_cache_filler = None
                 self.on_surface_change(self)
 
-    def update_location_cache(self, frame_idx, marker_cache, camera_model):
-        """ Update a single entry in the location cache."""
+    def update_location_cache(self, frame_idx, marker_cache, camera_model, workers=1):
+        """Update a single entry in the location cache. If the cache was invalidated,
+        it is recalculated in the background with `workers` processes."""
 
         try:
             if not marker_cache[frame_idx]:
@@ -172,17 +221,21 @@ class Surface_Offline(Surface):
                 )
             self.location_cache.update(frame_idx, location, force=True)
         except (TypeError, AttributeError):
-            self._recalculate_location_cache(frame_idx, marker_cache, camera_model)
+            self._recalculate_location_cache(
+                frame_idx, marker_cache, camera_model, workers
+            )
 
-    def _recalculate_location_cache(self, frame_idx, marker_cache, camera_model):
+    def _recalculate_location_cache(
+        self, frame_idx, marker_cache, camera_model, workers=1
+    ):
         logging.debug("Recalculate Surface Cache!")
         if self.location_cache_filler is not None:
             self.location_cache_filler.cancel()
 
         # Reset cache and recalculate.
         self.cache_seek_idx.value = frame_idx
-        self.location_cache = Cache([None for _ in marker_cache])
-        self.location_cache_filler = background_tasks.background_data_processor(
+        self.location_cache = Cache([None] * len(marker_cache))
+        self.location_cache_filler = background_tasks.background_data_processor_pool(
             marker_cache,
             offline_utils.surface_locater_callable(
                 camera_model,
@@ -191,6 +244,7 @@ class Surface_Offline(Surface):
             ),
             self.cache_seek_idx,
             mp_context,
+            workers=workers,
         )
 
     def _update_definition(self, idx, visible_markers, camera_model):
@@ -202,7 +256,7 @@ class Surface_Offline(Surface):
 
         # Reset of marker cache. This does not invoke a recalculation in the background.
         # Full recalculation will happen once the surface corner was released.
-        self.location_cache = Cache([None for _ in marker_cache])
+        self.location_cache = Cache([None] * len(marker_cache))
         self.update_location_cache(frame_idx, marker_cache, camera_model)
 
     def add_marker(self, marker_id, verts_px, camera_model):
@@ -23,22 +23,16 @@ from .surface_file_store import Surface_File_Store
 from .surface_marker_detector import (
     MarkerDetectorController,
     MarkerDetectorMode,
-    MarkerType,
-    ApriltagFamily,
+    DEFAULT_DETECTOR_MODE,
+    APRILTAG_SHARPENING_ON,
+    APRILTAG_SHARPENING_OFF,
+    APRILTAG_HIGH_RES_OFF,
+    APRILTAG_HIGH_RES_ON,
+    remove_duplicate_markers,
 )
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_DETECTOR_MODE = MarkerDetectorMode(
-    MarkerType.APRILTAG_MARKER, ApriltagFamily.tag36h11
-)
-
-APRILTAG_SHARPENING_ON = 1.0
-APRILTAG_SHARPENING_OFF = 0.25
-
-APRILTAG_HIGH_RES_OFF = 3.0
-APRILTAG_HIGH_RES_ON = 2.0
-
 
 class Surface_Tracker(Plugin, metaclass=ABCMeta):
     """
@@ -443,17 +437,7 @@ class Surface_Tracker(Plugin, metaclass=ABCMeta):
         self.markers = self._remove_duplicate_markers(markers)
 
     def _remove_duplicate_markers(self, markers):
-        # if an id shows twice use the bigger marker (usually this is a screen camera
-        # echo artifact.)
-        marker_by_uid = {}
-        for m in markers:
-            if (
-                m.uid not in marker_by_uid
-                or m.perimeter > marker_by_uid[m.uid].perimeter
-            ):
-                marker_by_uid[m.uid] = m
-
-        return list(marker_by_uid.values())
+        return remove_duplicate_markers(markers)
 
     @abstractmethod
     def _update_surface_locations(self, frame_index):
@@ -0,0 +1,298 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import platform
+import sys
+import types
+
+import numpy as np
+
+import file_methods
+import player_methods as pm
+
+from . import background_tasks, offline_utils
+from .cache import Cache
+from .marker_cache_store import Marker_Cache, Marker_Cache_Store
+from .surface import Surface_Location
+from .surface_file_store import Surface_File_Store
+from .surface_marker_detector import (
+    APRILTAG_HIGH_RES_ON,
+    APRILTAG_SHARPENING_ON,
+    DEFAULT_DETECTOR_MODE,
+    ApriltagFamily,
+    MarkerDetectorMode,
+    MarkerType,
+    remove_duplicate_markers,
+)
+from .surface_offline import Surface_Offline
+
+logger = logging.getLogger(__name__)
+
+
+# On macOS, "spawn" is set as default start method in main.py. This is not required
+# here and we set it back to "fork" to improve performance.
+if platform.system() == "Darwin":
+    mp_context = multiprocessing.get_context("fork")
+else:
+    mp_context = multiprocessing.get_context()
+
+
+def read_surface_definitions(path):
+    """Read the surfaces defined in Pupil Player from `path`, either a definitions
+    file or a directory containing one, e.g. a recording."""
+    if os.path.isdir(path):
+        return list(
+            Surface_File_Store(parent_dir=path).read_surfaces_from_file(
+                surface_class=Surface_Offline
+            )
+        )
+    file_store = Surface_File_Store(parent_dir=os.path.dirname(os.path.abspath(path)))
+    return list(
+        file_store.read_surfaces_from_file_path(
+            file_path=path, surface_class=Surface_Offline
+        )
+    )
+
+
+def detect_markers(video_file_path, marker_cache, marker_detection_callable):
+    """Detect the markers of the frames that `marker_cache` does not contain yet, in
+    this process. Frames without an image in the video are left without markers."""
+    seek_idx = types.SimpleNamespace(value=-1)
+    for frame_index, markers in background_tasks.video_processing_generator(
+        video_file_path,
+        marker_detection_callable,
+        seek_idx,
+        marker_cache.visited_list(),
+    ):
+        marker_cache.update(frame_index, remove_duplicate_markers(markers))
+        if frame_index % 1000 == 0:
+            logger.info(
+                "Detected markers in frame {} of {}".format(
+                    frame_index, len(marker_cache)
+                )
+            )
+    for frame_index in np.flatnonzero(~marker_cache.visited).tolist():
+        marker_cache.update(frame_index, [])
+    return marker_cache
+
+
+def track_surfaces(
+    rec_dir,
+    surface_definitions=None,
+    export_dir=None,
+    marker_detector_mode=DEFAULT_DETECTOR_MODE,
+    marker_min_perimeter=60,
+    inverted_markers=False,
+    quad_decimate=APRILTAG_HIGH_RES_ON,
+    sharpening=APRILTAG_SHARPENING_ON,
+    min_data_confidence=0.6,
+):
+    """Track the surfaces in a recording and export the surface data, like the
+    export of Surface_Tracker_Offline in Pupil Player.
+
+    Args:
+        rec_dir: Recording directory.
+        surface_definitions: Surface definitions file, or a directory containing
+            one. Defaults to the definitions made in Pupil Player for the recording.
+        export_dir: The data is exported to `export_dir/surfaces`, defaults to
+            `rec_dir/exports`.
+
+    Returns: Directory of the exported files.
+    """
+    import video_capture
+
+    surfaces = read_surface_definitions(surface_definitions or rec_dir)
+    if not surfaces:
+        raise ValueError(
+            "No surfaces defined in {}".format(surface_definitions or rec_dir)
+        )
+    export_dir = export_dir or os.path.join(rec_dir, "exports")
+
+    video_file_path = os.path.join(rec_dir, "world.mp4")
+    capture = video_capture.File_Source(
+        types.SimpleNamespace(),
+        source_path=video_file_path,
+        fill_gaps=True,
+        timing=None,
+    )
+    world_timestamps = capture.timestamps
+    camera_model = capture.intrinsics
+
+    marker_cache_store = Marker_Cache_Store(
+        rec_dir,
+        len(world_timestamps),
+        marker_detector_mode,
+        inverted_markers=inverted_markers,
+        quad_decimate=quad_decimate,
+        sharpening=sharpening,
+    )
+    marker_cache_store.import_legacy_cache()
+    if not marker_cache_store.visited.all():
+        logger.info("Detecting markers in {}".format(video_file_path))
+        detect_markers(
+            video_file_path,
+            Marker_Cache(marker_cache_store),
+            offline_utils.marker_detection_callable(
+                marker_detector_mode=marker_detector_mode,
+                marker_min_perimeter=offline_utils.CACHE_MIN_MARKER_PERIMETER,
+                square_marker_inverted_markers=inverted_markers,
+                square_marker_use_online_mode=False,
+                square_marker_use_tracking=False,
+                apriltag_quad_decimate=quad_decimate,
+                apriltag_decode_sharpening=sharpening,
+            ),
+        )
+        marker_cache_store.save()
+
+    if marker_detector_mode.marker_type == MarkerType.SQUARE_MARKER:
+        marker_cache = Marker_Cache(marker_cache_store, marker_min_perimeter)
+    else:
+        marker_cache = Marker_Cache(marker_cache_store)
+
+    for surface in surfaces:
+        locate = offline_utils.surface_locater_callable(
+            camera_model,
+            surface.registered_markers_undist,
+            surface.registered_markers_dist,
+        )
+        surface.location_cache = Cache(
+            [
+                locate(markers) if markers else Surface_Location(detected=False)
+                for markers in marker_cache
+            ]
+        )
+
+    gaze = file_methods.load_pldata_file(rec_dir, "gaze")
+    gaze_positions = pm.Bisector(gaze.data, gaze.timestamps)
+    fixations = file_methods.load_pldata_file(
+        os.path.join(rec_dir, "offline_data"), "fixations"
+    )
+    fixations = pm.Affiliator(
+        fixations.data,
+        fixations.timestamps,
+        [fix["timestamp"] + fix["duration"] / 1000 for fix in fixations.data],
+    )
+
+    section = slice(0, len(world_timestamps))
+    for surface, gaze_on_surf in zip(
+        surfaces,
+        background_tasks.gaze_on_surface_generator(
+            surfaces, section, world_timestamps, gaze_positions, camera_model
+        ),
+    ):
+        confident = gaze_on_surf["confidence"] >= min_data_confidence
+        surface.update_heatmap_from_positions(
+            gaze_on_surf["norm_pos"][confident & gaze_on_surf["on_surf"]]
+        )
+
+    os.makedirs(export_dir, exist_ok=True)
+    exporter = background_tasks.Exporter(
+        export_dir,
+        (0, len(world_timestamps)),
+        surfaces,
+        world_timestamps,
+        gaze_positions,
+        fixations,
+        camera_model,
+    )
+    for _ in exporter.save_surface_statisics_to_file():
+        pass
+    return exporter.metrics_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Track surfaces in Pupil recordings and export the gaze on "
+        "surfaces, surface events and heatmaps without Pupil Player."
+    )
+    parser.add_argument("recordings", nargs="+", help="recording directories")
+    parser.add_argument(
+        "--surfaces",
+        help="surface definitions file or directory containing one "
+        "(default: the definitions of each recording)",
+    )
+    parser.add_argument(
+        "--export-dir",
+        default="exports",
+        help="export directory, relative to the recording (default: exports)",
+    )
+    parser.add_argument(
+        "--marker-type",
+        choices=[marker_type.value for marker_type in MarkerType],
+        default=DEFAULT_DETECTOR_MODE.marker_type.value,
+    )
+    parser.add_argument(
+        "--apriltag-family",
+        choices=[family.value for family in ApriltagFamily],
+        default=DEFAULT_DETECTOR_MODE.family.value,
+    )
+    parser.add_argument("--min-marker-perimeter", type=int, default=60)
+    parser.add_argument("--inverted-markers", action="store_true")
+    parser.add_argument("--min-data-confidence", type=float, default=0.6)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of recordings processed in parallel",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(processName)s - [%(levelname)s] %(name)s: %(message)s",
+    )
+
+    kwargs = dict(
+        surface_definitions=args.surfaces,
+        marker_detector_mode=MarkerDetectorMode.from_tuple(
+            (args.marker_type, args.apriltag_family)
+        ),
+        marker_min_perimeter=args.min_marker_perimeter,
+        inverted_markers=args.inverted_markers,
+        min_data_confidence=args.min_data_confidence,
+    )
+    workers = max(1, min(args.workers, len(args.recordings)))
+    if workers == 1:
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=mp_context
+        )
+
+    failed = 0
+    with executor:
+        futures = {
+            executor.submit(
+                track_surfaces,
+                rec_dir,
+                export_dir=os.path.join(rec_dir, args.export_dir),
+                **kwargs,
+            ): rec_dir
+            for rec_dir in args.recordings
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                logger.info("Exported surfaces to {}".format(future.result()))
+            except Exception:
+                failed += 1
+                logger.exception(
+                    "Surface tracking failed for {}".format(futures[future])
+                )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,7 +9,6 @@ See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
 
-import itertools
 import logging
 import multiprocessing
 import os
@@ -23,22 +22,17 @@ import pyglui
 import pyglui.cygl.utils as pyglui_utils
 
 import data_changed
-import file_methods
 import gl_utils
 from observable import Observable
 from plugin import Analysis_Plugin_Base
 
 from . import background_tasks, offline_utils
-from .cache import Cache
 from .gui import Heatmap_Mode
-from .surface_marker import Surface_Marker
-from .surface_marker_detector import MarkerDetectorMode, MarkerType
+from .surface import MAPPED_EVENTS_DTYPE
+from .marker_cache_store import Marker_Cache, Marker_Cache_Store, read_last_used_params
+from .surface_marker_detector import MarkerType
 from .surface_offline import Surface_Offline
-from .surface_tracker import (
-    Surface_Tracker,
-    APRILTAG_HIGH_RES_ON,
-    APRILTAG_SHARPENING_ON,
-)
+from .surface_tracker import Surface_Tracker
 
 logger = logging.getLogger(__name__)
 
@@ -64,23 +58,29 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
     def __init__(self, g_pool, *args, **kwargs):
         super().__init__(g_pool, *args, use_online_detection=False, **kwargs)
 
-        self.MARKER_CACHE_VERSION = 3
-        # Also add very small detected markers to cache and filter cache afterwards
-        self.CACHE_MIN_MARKER_PERIMETER = 20
+        self.CACHE_MIN_MARKER_PERIMETER = offline_utils.CACHE_MIN_MARKER_PERIMETER
         self.cache_seek_idx = mp_context.Value("i", 0)
+        self.marker_cache_store = None
         self.marker_cache = None
         self.marker_cache_unfiltered = None
         self.cache_filler = None
+        # Marker detection processes, one core is left to the player
+        self.CACHE_FILLER_WORKERS = max(1, (os.cpu_count() or 1) - 1)
         self._init_marker_cache()
         self.last_cache_update_ts = time.perf_counter()
         self.CACHE_UPDATE_INTERVAL_SEC = 5
 
-        self._init_marker_detection_modes()
-
-        self.gaze_on_surf_buffer = None
+        # Gaze mapped onto each surface, as lists of arrays of dtype
+        # MAPPED_EVENTS_DTYPE. Kept to update the heatmaps without mapping again.
+        self.gaze_on_surf_buffer = {}
         self.gaze_on_surf_buffer_filler = None
+        self._gaze_on_surf_buffer_filler_surfaces = []
+        self._gaze_on_surf_counts = {}
 
+        # Surfaces whose gaze needs to be mapped again
         self._heatmap_update_requests = set()
+        # Surfaces whose heatmap needs to be rendered again
+        self._heatmap_render_requests = set()
         self.export_proxies = set()
 
         self._gaze_changed_listener = data_changed.Listener(
@@ -115,88 +115,65 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
     def supported_heatmap_modes(self):
         return [Heatmap_Mode.WITHIN_SURFACE, Heatmap_Mode.ACROSS_SURFACES]
 
-    def _init_marker_detection_modes(self):
-        # This method should be called after `_init_marker_cache` to ensure that the cache is filled in.
-        assert self.marker_cache is not None
-
-        # Filter out non-filled frames where the cache entry is None.
-        # Chain the remaining entries (which are lists) to get a flat sequence.
-        filled_out_marker_cache = filter(lambda x: x is not None, self.marker_cache)
-        cached_surface_marker_sequence = itertools.chain.from_iterable(
-            filled_out_marker_cache
-        )
-
-        # Get the first surface marker from the sequence, and set the detection mode according to it.
-        first_cached_surface_marker = next(cached_surface_marker_sequence, None)
-        if first_cached_surface_marker is not None:
-            marker_detector_mode = MarkerDetectorMode.from_marker(
-                first_cached_surface_marker
-            )
-            self.marker_detector.marker_detector_mode = marker_detector_mode
-
     def _init_marker_cache(self):
-        previous_cache = file_methods.Persistent_Dict(
-            os.path.join(self.g_pool.rec_dir, "square_marker_cache")
-        )
-        version = previous_cache.get("version", 0)
-        cache = previous_cache.get("marker_cache_unfiltered", None)
-        self._set_detector_params_from_previous_cache(previous_cache)
-
-        if cache is None:
-            self._recalculate_marker_cache()
-        elif version != self.MARKER_CACHE_VERSION:
-            logger.debug("Marker cache version missmatch. Rebuilding marker cache.")
-            self._recalculate_marker_cache()
-        else:
-            marker_cache_unfiltered = []
-            for markers in cache:
-                # Loaded markers are either False, [] or a list of dictionaries. We
-                # need to convert the dictionaries into Surface_Marker objects.
-                if markers:
-
-                    markers = [
-                        Surface_Marker.deserialize(args) if args else None
-                        for args in markers
-                    ]
-                marker_cache_unfiltered.append(markers)
-
-            self._recalculate_marker_cache(previous_state=marker_cache_unfiltered)
-            logger.debug("Restored previous marker cache.")
-
-    def _set_detector_params_from_previous_cache(self, previous_cache):
-        self.inverted_markers = previous_cache.get("inverted_markers", False)
-        self.quad_decimate = previous_cache.get("quad_decimate", APRILTAG_HIGH_RES_ON)
-        self.sharpening = previous_cache.get("sharpening", APRILTAG_SHARPENING_ON)
-
-    def _recalculate_marker_cache(self, previous_state=None):
-        if previous_state is None:
-            previous_state = [None for _ in self.g_pool.timestamps]
-
-            # If we had a previous_state argument, surface objects had just been
-            # initialized with their previous state, which we do not want to overwrite.
-            # Therefore resetting the marker cache is only done when no previous_state
-            # is defined.
+        previous_params = read_last_used_params(self.g_pool.rec_dir)
+        if previous_params is not None:
+            self._set_detector_params_from_previous_cache(previous_params)
+        # Surface objects had just been initialized with their previous state, which
+        # we do not want to overwrite.
+        self._recalculate_marker_cache(reset_location_caches=False)
+
+    def _set_detector_params_from_previous_cache(self, previous_params):
+        self.marker_detector.marker_detector_mode = previous_params[
+            "marker_detector_mode"
+        ]
+        self.marker_detector.inverted_markers = previous_params["inverted_markers"]
+        self.marker_detector.apriltag_quad_decimate = previous_params["quad_decimate"]
+        self.marker_detector.apriltag_decode_sharpening = previous_params["sharpening"]
+
+    def _recalculate_marker_cache(self, reset_location_caches=True):
+        """Open the marker cache of the current detector parameters and detect the
+        markers in the frames that it does not contain yet. The caches of other
+        parameters are kept on disk and reused when switching back."""
+        if reset_location_caches:
             for surface in self.surfaces:
                 surface.location_cache = None
 
-        self.marker_cache_unfiltered = Cache(previous_state)
+        if self.marker_cache_store is not None:
+            self.marker_cache_store.save()
+        self.marker_cache_store = Marker_Cache_Store(
+            self.g_pool.rec_dir,
+            len(self.g_pool.timestamps),
+            self.marker_detector.marker_detector_mode,
+            inverted_markers=self.marker_detector.inverted_markers,
+            quad_decimate=self.marker_detector.apriltag_quad_decimate,
+            sharpening=self.marker_detector.apriltag_decode_sharpening,
+            min_perimeter=self.CACHE_MIN_MARKER_PERIMETER,
+        )
+        if self.marker_cache_store.import_legacy_cache():
+            logger.debug("Imported previous marker cache.")
+        self.marker_cache_unfiltered = Marker_Cache(self.marker_cache_store)
         self.marker_cache = self._filter_marker_cache(self.marker_cache_unfiltered)
 
         if self.cache_filler is not None:
             self.cache_filler.cancel()
-        self.cache_filler = background_tasks.background_video_processor(
+        self.cache_filler = background_tasks.background_video_processor_pool(
             self.g_pool.capture.source_path,
             offline_utils.marker_detection_callable(
                 marker_detector_mode=self.marker_detector.marker_detector_mode,
                 marker_min_perimeter=self.CACHE_MIN_MARKER_PERIMETER,
-                square_marker_inverted_markers=self.inverted_markers,
+                square_marker_inverted_markers=self.marker_detector.inverted_markers,
                 square_marker_use_online_mode=False,
-                apriltag_quad_decimate=self.quad_decimate,
-                apriltag_decode_sharpening=self.sharpening,
+                square_marker_use_tracking=False,
+                apriltag_quad_decimate=self.marker_detector.apriltag_quad_decimate,
+                apriltag_decode_sharpening=(
+                    self.marker_detector.apriltag_decode_sharpening
+                ),
             ),
-            list(self.marker_cache),
+            self.marker_cache_unfiltered.visited_list(),
             self.cache_seek_idx,
             mp_context,
+            workers=self.CACHE_FILLER_WORKERS,
         )
 
     def _filter_marker_cache(self, cache_to_filter):
@@ -204,20 +181,11 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         if marker_type != MarkerType.SQUARE_MARKER:
             # We only need to filter SQUARE_MARKERs
             return cache_to_filter
-
-        marker_cache = []
-        for markers in cache_to_filter:
-            if markers:
-                markers = self._filter_markers(markers)
-            marker_cache.append(markers)
-        return Cache(marker_cache)
-
-    def _filter_markers(self, markers):
-        return [
-            m
-            for m in markers
-            if m.perimeter >= self.marker_detector.marker_min_perimeter
-        ]
+        # The filtered cache is a view on the same store
+        return Marker_Cache(
+            cache_to_filter.store,
+            min_perimeter=self.marker_detector.marker_min_perimeter,
+        )
 
     def init_ui(self):
         super().init_ui()
@@ -248,16 +216,18 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
             start_time = time.perf_counter()
             did_timeout = False
 
-            for gaze in self.gaze_on_surf_buffer_filler.fetch():
-                self.gaze_on_surf_buffer.append(gaze)
+            for surf_idx, gaze_on_surf in self.gaze_on_surf_buffer_filler.fetch():
+                surface = self._gaze_on_surf_buffer_filler_surfaces[surf_idx]
+                if surface in self.gaze_on_surf_buffer:
+                    self._add_gaze_on_surf(surface, gaze_on_surf)
                 if time.perf_counter() - start_time > 1 / 50:
                     did_timeout = True
                     break
 
             if self.gaze_on_surf_buffer_filler.completed and not did_timeout:
                 self.gaze_on_surf_buffer_filler = None
-                self._update_surface_heatmaps()
-                self.gaze_on_surf_buffer = None
+                self._gaze_on_surf_buffer_filler_surfaces = []
+            self._update_surface_heatmaps()
 
             self._set_timeline_refresh_needed()
 
@@ -287,17 +257,13 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         for frame_index, markers in self.cache_filler.fetch():
             if frame_index is not None:
                 markers = self._remove_duplicate_markers(markers)
+                # `self.marker_cache` is a filtered view of the same store
                 self.marker_cache_unfiltered.update(frame_index, markers)
-                marker_type = self.marker_detector.marker_detector_mode.marker_type
-                if marker_type == MarkerType.SQUARE_MARKER:
-                    markers_filtered = self._filter_markers(markers)
-                    self.marker_cache.update(frame_index, markers_filtered)
-                # In all other cases (see _filter_marker_cache()):
-                # `self.marker_cache is self.marker_cache_unfiltered == True`
 
+                workers = self._location_cache_filler_workers()
                 for surface in self.surfaces:
                     surface.update_location_cache(
-                        frame_index, self.marker_cache, self.camera_model
+                        frame_index, self.marker_cache, self.camera_model, workers
                     )
             if time.perf_counter() - start_time > 1 / 50:
                 did_timeout = True
@@ -319,8 +285,20 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         self._set_timeline_refresh_needed()
 
     def _update_surface_locations(self, frame_index):
+        workers = self._location_cache_filler_workers()
         for surface in self.surfaces:
-            surface.update_location(frame_index, self.marker_cache, self.camera_model)
+            surface.update_location(
+                frame_index, self.marker_cache, self.camera_model, workers
+            )
+
+    def _location_cache_filler_workers(self):
+        """Processes per surface location cache that is recalculated, such that all
+        of them together use CACHE_FILLER_WORKERS."""
+        refilling = sum(
+            surface.location_cache is None or surface.location_cache_filler is not None
+            for surface in self.surfaces
+        )
+        return max(1, self.CACHE_FILLER_WORKERS // max(1, refilling))
 
     def _update_surface_corners(self):
         for surface, corner_idx in self._edit_surf_verts:
@@ -333,47 +311,85 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
                     self.camera_model,
                 )
 
+    def _add_gaze_on_surf(self, surface, gaze_on_surf):
+        self.gaze_on_surf_buffer[surface].append(gaze_on_surf)
+        self._gaze_on_surf_counts[surface] += int(
+            np.count_nonzero(gaze_on_surf["on_surf"])
+        )
+        surface.accumulate_heatmap(self._heatmap_positions(gaze_on_surf))
+        self._heatmap_render_requests.add(surface)
+
+    def _heatmap_positions(self, gaze_on_surf):
+        confident = gaze_on_surf["confidence"] >= self.g_pool.min_data_confidence
+        return gaze_on_surf["norm_pos"][confident & gaze_on_surf["on_surf"]]
+
+    def _gaze_on_surf(self, surface):
+        chunks = self.gaze_on_surf_buffer[surface]
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0] if chunks else np.empty(0, dtype=MAPPED_EVENTS_DTYPE)
+
+    def _rebin_surface_heatmap(self, surface):
+        """Update the heatmap from the buffered gaze, e.g. after the heatmap
+        parameters changed."""
+        if surface not in self.gaze_on_surf_buffer:
+            # not mapped yet, the heatmap is rendered once the gaze is mapped
+            return
+        surface.reset_heatmap()
+        surface.accumulate_heatmap(self._heatmap_positions(self._gaze_on_surf(surface)))
+        self._heatmap_render_requests.add(surface)
+
     def _update_surface_heatmaps(self):
+        if not self._heatmap_render_requests:
+            return
         self._compute_across_surfaces_heatmap()
 
-        for surface in self._heatmap_update_requests:
-            surf_idx = self.surfaces.index(surface)
-            gaze_on_surf = self.gaze_on_surf_buffer[surf_idx]
-            gaze_on_surf = itertools.chain.from_iterable(gaze_on_surf)
-            gaze_on_surf = (
-                g
-                for g in gaze_on_surf
-                if g["confidence"] >= self.g_pool.min_data_confidence
-            )
-            gaze_on_surf = list(gaze_on_surf)
-            surface.update_heatmap(gaze_on_surf)
-
-        self._heatmap_update_requests.clear()
+        for surface in self._heatmap_render_requests:
+            surface.render_heatmap()
+        self._heatmap_render_requests.clear()
 
     def _compute_across_surfaces_heatmap(self):
-        gaze_counts_per_surf = []
-        for gaze in self.gaze_on_surf_buffer:
-            gaze = list(itertools.chain.from_iterable(gaze))
-            gaze = [g for g in gaze if g["on_surf"]]
-            gaze_counts_per_surf.append(len(gaze))
-
-        if gaze_counts_per_surf:
-            max_count = max(gaze_counts_per_surf)
-            results = np.array(gaze_counts_per_surf, dtype=np.float32)
+        gaze_counts_per_surf = np.array(
+            [self._gaze_on_surf_counts.get(surface, 0) for surface in self.surfaces],
+            dtype=np.float32,
+        )
+
+        if len(gaze_counts_per_surf):
+            max_count = gaze_counts_per_surf.max()
             if max_count > 0:
-                results *= 255.0 / max_count
-            results = np.uint8(results)
+                gaze_counts_per_surf *= 255.0 / max_count
+            results = np.uint8(gaze_counts_per_surf).reshape(-1, 1)
             results_color_maps = cv2.applyColorMap(results, cv2.COLORMAP_JET)
 
             for surface, color_map in zip(self.surfaces, results_color_maps):
                 heatmap = np.ones((1, 1, 4), dtype=np.uint8) * 125
                 heatmap[:, :, :3] = color_map
                 surface.across_surface_heatmap = heatmap
-        else:
-            for surface in self.surfaces:
-                surface.across_surface_heatmap = surface.get_uniform_heatmap((1, 1))
 
     def _fill_gaze_on_surf_buffer(self):
+        """Map the gaze onto the surfaces in `_heatmap_update_requests` in the
+        background. The heatmaps are updated as the mapped gaze arrives."""
+        surfaces = [
+            surface
+            for surface in self.surfaces
+            if surface in self._heatmap_update_requests
+            or surface in self._gaze_on_surf_buffer_filler_surfaces
+        ]
+        self._heatmap_update_requests.clear()
+        if self.gaze_on_surf_buffer_filler is not None:
+            self.gaze_on_surf_buffer_filler.cancel()
+            self.gaze_on_surf_buffer_filler = None
+            self._gaze_on_surf_buffer_filler_surfaces = []
+        if not surfaces:
+            return
+
+        for surface in surfaces:
+            self.gaze_on_surf_buffer[surface] = []
+            self._gaze_on_surf_counts[surface] = 0
+            surface.reset_heatmap()
+            # render surfaces that get no gaze at all with an empty heatmap, too
+            self._heatmap_render_requests.add(surface)
+
         in_mark = self.g_pool.seek_control.trim_left
         out_mark = self.g_pool.seek_control.trim_right
         section = slice(in_mark, out_mark)
@@ -381,14 +397,16 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         all_world_timestamps = self.g_pool.timestamps
         all_gaze_events = self.g_pool.gaze_positions
 
-        self._start_gaze_buffer_filler(all_gaze_events, all_world_timestamps, section)
+        self._start_gaze_buffer_filler(
+            surfaces, all_gaze_events, all_world_timestamps, section
+        )
 
-    def _start_gaze_buffer_filler(self, all_gaze_events, all_world_timestamps, section):
-        if self.gaze_on_surf_buffer_filler is not None:
-            self.gaze_on_surf_buffer_filler.cancel()
-        self.gaze_on_surf_buffer = []
+    def _start_gaze_buffer_filler(
+        self, surfaces, all_gaze_events, all_world_timestamps, section
+    ):
+        self._gaze_on_surf_buffer_filler_surfaces = surfaces
         self.gaze_on_surf_buffer_filler = background_tasks.background_gaze_on_surface(
-            self.surfaces,
+            surfaces,
             section,
             all_world_timestamps,
             all_gaze_events,
@@ -463,6 +481,7 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
 
         try:
             self.timeline.content_height += self.TIMELINE_LINE_HEIGHT
+            self._heatmap_update_requests.add(self.surfaces[-1])
             self._fill_gaze_on_surf_buffer()
         except AttributeError:
             pass
@@ -471,10 +490,11 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
 
     def remove_surface(self, surface):
         super().remove_surface(surface)
-        try:
-            self._heatmap_update_requests.remove(surface)
-        except KeyError:
-            pass
+        self._heatmap_update_requests.discard(surface)
+        self._heatmap_render_requests.discard(surface)
+        self.gaze_on_surf_buffer.pop(surface, None)
+        self._gaze_on_surf_counts.pop(surface, None)
+        self._compute_across_surfaces_heatmap()
         self.timeline.content_height -= self.TIMELINE_LINE_HEIGHT
         self._set_timeline_refresh_needed()
 
@@ -496,10 +516,14 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         elif notification["subject"] == "surface_tracker.heatmap_params_changed":
             for surface in self.surfaces:
                 if surface.name == notification["name"]:
-                    self._heatmap_update_requests.add(surface)
-                    surface.within_surface_heatmap = surface.get_placeholder_heatmap()
+                    self._rebin_surface_heatmap(surface)
                     break
-            self._fill_gaze_on_surf_buffer()
+            self._update_surface_heatmaps()
+
+        elif notification["subject"] == "min_data_confidence_changed":
+            for surface in self.surfaces:
+                self._rebin_surface_heatmap(surface)
+            self._update_surface_heatmaps()
 
         elif notification["subject"].startswith("seek_control.trim_indices_changed"):
             for surface in self.surfaces:
@@ -563,19 +587,11 @@ class Surface_Tracker_Offline(Observable, Surface_Tracker, Analysis_Plugin_Base)
         super().cleanup()
         self._save_marker_cache()
 
+        if self.cache_filler is not None:
+            self.cache_filler.cancel()
         for proxy in self.export_proxies.copy():
             proxy.cancel()
             self.export_proxies.remove(proxy)
 
     def _save_marker_cache(self):
-        marker_cache_file = file_methods.Persistent_Dict(
-            os.path.join(self.g_pool.rec_dir, "square_marker_cache")
-        )
-        marker_cache_file["marker_cache_unfiltered"] = list(
-            self.marker_cache_unfiltered
-        )
-        marker_cache_file["version"] = self.MARKER_CACHE_VERSION
-        marker_cache_file["inverted_markers"] = self.inverted_markers
-        marker_cache_file["quad_decimate"] = self.quad_decimate
-        marker_cache_file["sharpening"] = self.sharpening
-        marker_cache_file.save()
+        self.marker_cache_store.save()
@@ -0,0 +1,123 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+
+import functools
+import os
+from collections import deque
+
+from tasklib.interface import TaskInterface
+
+
+class ParallelTaskGroup(TaskInterface):
+    """
+    Runs several tasks in parallel, as a single task.
+
+    At most `max_parallel` of the tasks run at the same time, each in its own
+    background process. The results yielded by the tasks are passed on in the order
+    of `tasks`, i.e. the results of a task are held back until all previous tasks
+    completed. The progress is the mean progress of the tasks.
+
+    If a task raises an exception, the other tasks are killed and the group ends with
+    the exception.
+
+    Since the tasks are started from the foreground, this also works for tasks that
+    could not start worker processes themselves, because background processes are
+    daemons.
+    """
+
+    def __init__(self, tasks, max_parallel=None):
+        super().__init__()
+        if not tasks:
+            raise ValueError("A task group requires at least one task!")
+        self._tasks = list(tasks)
+        self._max_parallel = max_parallel or os.cpu_count() or 1
+        self._yields = [deque() for _ in self._tasks]
+        self._next_task_idx = 0  # index of the task whose results are passed on
+        self._cancel_requested = False
+
+        for task_idx, task in enumerate(self._tasks):
+            task.add_observer(
+                "on_yield", functools.partial(self._on_task_yield, task_idx)
+            )
+            task.add_observer("on_exception", self._on_task_exception)
+
+    @property
+    def progress(self):
+        return sum(
+            1.0 if task.completed else task.progress for task in self._tasks
+        ) / len(self._tasks)
+
+    def start(self):
+        super().start()
+        self._start_tasks()
+
+    def cancel_gracefully(self):
+        super().cancel_gracefully()
+        self._cancel_requested = True
+        for task in self._tasks:
+            if task.running:
+                task.cancel_gracefully()
+
+    def kill(self, grace_period):
+        super().kill(grace_period)
+        self._cancel_requested = True
+        self._kill_running_tasks(grace_period)
+        self.on_canceled_or_killed()
+
+    def update(self):
+        super().update()
+
+        for task in self._tasks:
+            if task.running:
+                task.update()
+            if self.ended:
+                return  # a task raised an exception
+
+        if self._cancel_requested:
+            if not any(task.running for task in self._tasks):
+                self.on_canceled_or_killed()
+            return
+
+        self._pass_on_yields()
+        if self._next_task_idx == len(self._tasks):
+            self.on_completed(None)
+        else:
+            self._start_tasks()
+
+    def _start_tasks(self):
+        running_count = sum(task.running for task in self._tasks)
+        for task in self._tasks:
+            if running_count >= self._max_parallel:
+                break
+            if not task.started:
+                task.start()
+                running_count += 1
+
+    def _pass_on_yields(self):
+        while self._next_task_idx < len(self._tasks):
+            task_yields = self._yields[self._next_task_idx]
+            while task_yields:
+                self.on_yield(task_yields.popleft())
+            if not self._tasks[self._next_task_idx].completed:
+                break
+            self._next_task_idx += 1
+
+    def _on_task_yield(self, task_idx, yield_value):
+        self._yields[task_idx].append(yield_value)
+
+    def _on_task_exception(self, exception):
+        self._kill_running_tasks(grace_period=None)
+        self.on_exception(exception)
+
+    def _kill_running_tasks(self, grace_period):
+        for task in self._tasks:
+            if task.running:
+                task.kill(grace_period)
@@ -0,0 +1,128 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import types
+
+import numpy as np
+import pytest
+
+from gaze_mapping.gazer_2d import Gazer2D
+from gaze_mapping.matching import RealtimeMatcher
+
+
+def _pupil_data(seed, count=1000, offset=0.002):
+    rng = np.random.default_rng(seed)
+    pupil_data = []
+    for eye_id in (0, 1):
+        for idx in range(count):
+            pupil_data.append(
+                {
+                    "id": eye_id,
+                    "method": "2d c++",
+                    "timestamp": idx / 120 + eye_id * offset,
+                    "confidence": float(rng.choice([0.3, 0.9], p=[0.1, 0.9])),
+                    "norm_pos": rng.uniform(0.2, 0.8, 2).tolist(),
+                }
+            )
+    rng.shuffle(pupil_data)
+    return pupil_data
+
+
+def _match_keys(matches):
+    return {tuple((p["id"], p["timestamp"]) for p in match) for match in matches}
+
+
+def _match_arrays(pupil_data):
+    matches = RealtimeMatcher().match_arrays(
+        [p["timestamp"] for p in pupil_data],
+        [p["id"] for p in pupil_data],
+        [p["confidence"] for p in pupil_data],
+    )
+    return [[pupil_data[idx] for idx in match if idx >= 0] for match in matches]
+
+
+@pytest.mark.parametrize("offset", [0.001, 0.004, 0.007])
+def test_match_arrays_matches_like_realtime_matcher(offset):
+    pupil_data = _pupil_data(0, offset=offset)
+    sorted_data = sorted(pupil_data, key=lambda p: p["timestamp"])
+
+    expected = RealtimeMatcher().map_batch(sorted_data)
+    matches = _match_arrays(pupil_data)
+
+    assert any(len(match) == 2 for match in matches)
+    # map_batch() holds back the data at the end
+    assert len(matches) == len(pupil_data) > len(expected)
+    assert _match_keys(expected) <= _match_keys(matches)
+
+
+def test_match_arrays_matches_distant_and_low_confidence_data_monocularly():
+    pupil_data = [
+        {"id": 0, "timestamp": 0.0, "confidence": 1.0},
+        {"id": 1, "timestamp": 0.001, "confidence": 0.1},
+        {"id": 1, "timestamp": 1.0, "confidence": 1.0},
+    ]
+    matches = _match_arrays(pupil_data)
+    assert [[p["timestamp"] for p in match] for match in matches] == [
+        [0.0],
+        [0.001],
+        [1.0],
+    ]
+
+
+def test_match_arrays_without_data():
+    matches = RealtimeMatcher().match_arrays([], [], [])
+    assert matches.shape == (0, 2)
+
+
+@pytest.fixture
+def gazer():
+    rng = np.random.default_rng(0)
+    g_pool = types.SimpleNamespace(capture=types.SimpleNamespace(frame_size=(1, 1)))
+    params = {
+        "left_model": {"coef_": rng.normal(size=(2, 6)), "intercept_": [0.5, 0.5]},
+        "right_model": {"coef_": rng.normal(size=(2, 6)), "intercept_": [0.4, 0.6]},
+        "binocular_model": {
+            "coef_": rng.normal(size=(2, 12)),
+            "intercept_": [0.6, 0.4],
+        },
+    }
+    return Gazer2D(g_pool, params=params)
+
+
+def _gaze_by_base_data(gaze_data):
+    return {
+        tuple((p["id"], p["timestamp"]) for p in gaze["base_data"]): gaze
+        for gaze in gaze_data
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [64, 10000])
+def test_map_pupil_to_gaze_batch_predicts_like_map_pupil_to_gaze(gazer, chunk_size):
+    pupil_data = _pupil_data(1)
+
+    expected = _gaze_by_base_data(gazer.map_pupil_to_gaze(list(pupil_data)))
+    gaze = _gaze_by_base_data(
+        gazer.map_pupil_to_gaze_batch(pupil_data, chunk_size=chunk_size)
+    )
+
+    assert {key[0][0] for key in expected if len(key) == 1} == {0, 1}
+    assert expected.keys() <= gaze.keys()
+    for key, expected_gaze in expected.items():
+        assert gaze[key]["topic"] == expected_gaze["topic"]
+        assert gaze[key]["timestamp"] == expected_gaze["timestamp"]
+        assert gaze[key]["confidence"] == expected_gaze["confidence"]
+        np.testing.assert_allclose(gaze[key]["norm_pos"], expected_gaze["norm_pos"])
+
+
+def test_map_pupil_to_gaze_batch_skips_matches_of_unfitted_models(gazer):
+    gazer.binocular_model._is_fitted = False
+    gaze = list(gazer.map_pupil_to_gaze_batch(_pupil_data(2)))
+    assert gaze
+    assert {g["topic"] for g in gaze} == {"gaze.2d.0.", "gaze.2d.1."}
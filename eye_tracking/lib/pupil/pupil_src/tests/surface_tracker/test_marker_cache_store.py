@@ -0,0 +1,159 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import os
+
+import numpy as np
+import pytest
+
+import file_methods
+from surface_tracker import offline_utils
+from surface_tracker.marker_cache_store import (
+    MARKER_RECORD_DTYPE,
+    Marker_Cache,
+    Marker_Cache_Store,
+    read_last_used_params,
+)
+from surface_tracker.surface_marker import Surface_Marker
+from surface_tracker.surface_marker_detector import (
+    ApriltagFamily,
+    MarkerDetectorMode,
+    MarkerType,
+)
+
+SQUARE_MARKERS = MarkerDetectorMode(MarkerType.SQUARE_MARKER, None)
+APRILTAGS = MarkerDetectorMode(MarkerType.APRILTAG_MARKER, ApriltagFamily.tag36h11)
+
+
+def _square_marker(tag_id, size):
+    verts = [[[10.5, 10.0]], [[10.5 + size, 10.0]], [[10.5 + size, 10.0 + size]]]
+    verts.append([[10.5, 10.0 + size]])
+    return Surface_Marker.from_square_tag_detection(
+        {"id": tag_id, "id_confidence": 0.5, "verts": verts, "perimeter": 4.0 * size}
+    )
+
+
+def _apriltag_marker(tag_id):
+    corners = [[1.0, 2.0], [31.0, 2.0], [31.0, 32.0], [1.0, 32.0]]
+    homography = np.arange(9, dtype=np.float64).reshape(3, 3).tolist()
+    state = ("tag36h11", tag_id, 0, 80.5, homography, [16.0, 17.0], corners)
+    return Surface_Marker.from_tuple((*state, None, None, None, "apriltag_v3"))
+
+
+def _frames(store_path):
+    return np.load(os.path.join(store_path, "frames.npy"))
+
+
+def test_markers_round_trip(tmpdir):
+    store = Marker_Cache_Store(str(tmpdir), 3, APRILTAGS)
+    square, apriltag = _square_marker(3, 20), _apriltag_marker(7)
+    store.write(0, [square, apriltag])
+    store.write(2, [])
+    store.save()
+
+    store = Marker_Cache_Store(str(tmpdir), 3, APRILTAGS)
+    loaded_square, loaded_apriltag = store.markers(0)
+    assert loaded_square == square
+    assert loaded_apriltag.uid == apriltag.uid
+    assert loaded_apriltag.raw_marker._replace(decision_margin=80.5) == tuple(
+        apriltag.raw_marker
+    )
+    assert loaded_apriltag.perimeter == pytest.approx(apriltag.perimeter)
+    assert store.markers(1) is None
+    assert store.markers(2) == []
+    assert store.visited.tolist() == [True, False, True]
+
+
+def test_save_appends_only_written_frames(tmpdir):
+    store = Marker_Cache_Store(str(tmpdir), 4, SQUARE_MARKERS)
+    store.write(1, [_square_marker(1, 20), _square_marker(2, 40)])
+    store.save()
+    markers_path = os.path.join(store.path, "markers.bin")
+    assert os.path.getsize(markers_path) == 2 * MARKER_RECORD_DTYPE.itemsize
+
+    store.save()
+    store.write(3, [_square_marker(3, 20)])
+    store.save()
+    assert os.path.getsize(markers_path) == 3 * MARKER_RECORD_DTYPE.itemsize
+    assert _frames(store.path)["count"].tolist() == [-1, 2, -1, 1]
+    assert [m.tag_id for m in store.markers(1)] == [1, 2]
+
+
+def test_interrupted_save_is_ignored(tmpdir):
+    store = Marker_Cache_Store(str(tmpdir), 2, SQUARE_MARKERS)
+    store.write(0, [_square_marker(1, 20)])
+    store.save()
+    # records appended without updating the frames
+    with open(os.path.join(store.path, "markers.bin"), "ab") as f:
+        f.write(b"\x00" * (MARKER_RECORD_DTYPE.itemsize + 5))
+
+    store = Marker_Cache_Store(str(tmpdir), 2, SQUARE_MARKERS)
+    assert store.markers(1) is None
+    store.write(1, [_square_marker(2, 20)])
+    store.save()
+    store = Marker_Cache_Store(str(tmpdir), 2, SQUARE_MARKERS)
+    assert [m[0].tag_id for m in (store.markers(0), store.markers(1))] == [1, 2]
+
+
+def test_parameter_combinations_are_kept_side_by_side(tmpdir):
+    rec_dir = str(tmpdir)
+    store = Marker_Cache_Store(rec_dir, 2, SQUARE_MARKERS)
+    store.write(0, [_square_marker(1, 20)])
+    store.save()
+    inverted = Marker_Cache_Store(rec_dir, 2, SQUARE_MARKERS, inverted_markers=True)
+    assert not inverted.visited.any()
+    inverted.write(0, [])
+    inverted.save()
+
+    assert read_last_used_params(rec_dir)["inverted_markers"] is True
+    store = Marker_Cache_Store(rec_dir, 2, SQUARE_MARKERS)
+    assert store.markers(0)[0].tag_id == 1
+    # the recording changed
+    store = Marker_Cache_Store(rec_dir, 3, SQUARE_MARKERS)
+    assert not store.visited.any()
+
+
+def test_marker_cache_view(tmpdir):
+    store = Marker_Cache_Store(str(tmpdir), 6, SQUARE_MARKERS)
+    cache = Marker_Cache(store)
+    filtered = Marker_Cache(store, min_perimeter=60)
+    cache.update(0, [_square_marker(1, 10), _square_marker(2, 20)])
+    cache.update(1, [_square_marker(3, 10)])
+    cache.update(2, [])
+    cache.update(4, [_square_marker(4, 20)])
+    with pytest.raises(IndexError):
+        cache.update(4, [])
+
+    assert [m.tag_id for m in filtered[0]] == [2]
+    assert filtered[1] == [] and filtered[3] is None
+    assert cache.visited_list() == [True, True, True, None, True, None]
+    assert cache.visited_ranges == [[0, 2], [4, 4]]
+    assert cache.positive_ranges == [[0, 1], [4, 4]]
+    assert filtered.positive_ranges == [[0, 0], [4, 4]]
+    store.save()
+    assert filtered.positive_ranges == [[0, 0], [4, 4]]
+
+
+def test_legacy_cache_is_imported(tmpdir):
+    rec_dir = str(tmpdir)
+    legacy = file_methods.Persistent_Dict(os.path.join(rec_dir, "square_marker_cache"))
+    legacy["marker_cache_unfiltered"] = [[_square_marker(5, 20)], None, False]
+    legacy["version"] = offline_utils.MARKER_CACHE_VERSION
+    legacy["inverted_markers"] = True
+    legacy.save()
+
+    params = read_last_used_params(rec_dir)
+    assert params["marker_detector_mode"] == SQUARE_MARKERS
+    store = Marker_Cache_Store(rec_dir, 3, SQUARE_MARKERS, inverted_markers=True)
+    assert store.import_legacy_cache()
+    assert store.markers(0)[0].tag_id == 5
+    assert store.visited.tolist() == [True, False, True]
+    other = Marker_Cache_Store(rec_dir, 3, SQUARE_MARKERS)
+    assert not other.import_legacy_cache()
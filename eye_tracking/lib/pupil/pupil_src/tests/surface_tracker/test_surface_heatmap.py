@@ -0,0 +1,73 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import numpy as np
+import pytest
+
+from surface_tracker.surface_offline import Surface_Offline
+
+
+@pytest.fixture
+def surface():
+    surface = Surface_Offline(name="test")
+    surface.real_world_size = {"x": 2.0, "y": 1.0}
+    return surface
+
+
+@pytest.fixture
+def norm_pos():
+    rng = np.random.default_rng(0)
+    norm_pos = rng.uniform(0, 1, (1000, 2))
+    norm_pos[:4] = [[0.0, 0.0], [1.0, 1.0], [1.0, 0.0], [0.5, 1.0]]
+    return norm_pos
+
+
+def test_accumulated_heatmap_matches_histogram(surface, norm_pos):
+    surface.reset_heatmap()
+    surface.accumulate_heatmap(norm_pos)
+
+    expected, *_ = np.histogram2d(
+        1.0 - norm_pos[:, 1],
+        norm_pos[:, 0],
+        bins=surface.heatmap_grid,
+        range=[[0, 1.0], [0, 1.0]],
+    )
+    np.testing.assert_array_equal(surface._heatmap_hist, expected)
+
+
+def test_heatmap_accumulated_in_chunks(surface, norm_pos):
+    surface.update_heatmap_from_positions(norm_pos)
+    expected = surface.within_surface_heatmap.copy()
+
+    surface.reset_heatmap()
+    for chunk in np.array_split(norm_pos, 7):
+        surface.accumulate_heatmap(chunk)
+    surface.render_heatmap()
+
+    assert surface.within_surface_heatmap.shape == (*surface.heatmap_grid, 4)
+    np.testing.assert_array_equal(surface.within_surface_heatmap, expected)
+
+
+def test_heatmap_ignores_positions_outside_of_surface(surface):
+    surface.update_heatmap_from_positions([[1.5, 0.5], [-0.1, 0.5]])
+    np.testing.assert_array_equal(
+        surface.within_surface_heatmap,
+        surface.get_uniform_heatmap(surface.heatmap_grid),
+    )
+
+
+def test_heatmap_reset_when_grid_changes(surface, norm_pos):
+    surface.reset_heatmap()
+    surface.accumulate_heatmap(norm_pos)
+    surface._heatmap_resolution = 10
+    surface.accumulate_heatmap(norm_pos[:10])
+
+    assert surface._heatmap_hist.shape == surface.heatmap_grid == (5, 10)
+    assert surface._heatmap_hist.sum() == 10
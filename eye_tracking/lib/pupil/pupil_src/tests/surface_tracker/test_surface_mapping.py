@@ -0,0 +1,156 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import cv2
+import numpy as np
+import pytest
+
+import player_methods as pm
+from camera_models import Radial_Dist_Camera
+from player_methods import enclosing_window
+from surface_tracker.background_tasks import gaze_on_surface_chunk_generator
+from surface_tracker.cache import Cache
+from surface_tracker.surface import Surface, Surface_Location
+from surface_tracker.surface_offline import Surface_Offline
+
+RESOLUTION = (1280, 720)
+
+
+@pytest.fixture
+def camera_model():
+    K = [[830.0, 0.0, 640.0], [0.0, 830.0, 360.0], [0.0, 0.0, 1.0]]
+    D = [[-0.13, 0.1, 0.0, 0.0, -0.03]]
+    return Radial_Dist_Camera(K, D, RESOLUTION, "test")
+
+
+@pytest.fixture
+def surface():
+    rng = np.random.default_rng(0)
+    surface = Surface_Offline(name="test")
+    locations = []
+    for frame_idx in range(40):
+        if frame_idx % 7 == 3:
+            locations.append(Surface_Location(detected=False))
+            continue
+        corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float32)
+        img_corners = np.array(
+            [[300, 500], [900, 520], [880, 150], [320, 130]], dtype=np.float32
+        ) + rng.normal(0, 20, (4, 2)).astype(np.float32)
+        img_to_surf = cv2.getPerspectiveTransform(img_corners, corners)
+        surf_to_img = np.linalg.inv(img_to_surf)
+        location = Surface_Location(
+            True, img_to_surf, surf_to_img, img_to_surf, surf_to_img, 4
+        )
+        locations.append(location)
+    surface.location_cache = Cache(locations)
+    return surface
+
+
+def _gaze(n, world_timestamps):
+    rng = np.random.default_rng(1)
+    timestamps = rng.uniform(world_timestamps[0] - 0.1, world_timestamps[-1], n)
+    timestamps.sort()
+    data = [
+        {
+            "topic": "gaze.2d.0.",
+            "norm_pos": tuple(rng.uniform(-0.1, 1.1, 2)),
+            "confidence": rng.uniform(),
+            "timestamp": ts,
+        }
+        for ts in timestamps
+    ]
+    return pm.Bisector(data, timestamps)
+
+
+def _fixations(n, world_timestamps):
+    rng = np.random.default_rng(2)
+    # fixations do not overlap
+    durations = rng.uniform(0.08, 0.3, n)
+    start_ts = world_timestamps[0] + np.cumsum(durations + 0.01) - durations
+    data = [
+        {
+            "topic": "fixations",
+            "norm_pos": tuple(rng.uniform(0, 1, 2)),
+            "confidence": 0.9,
+            "timestamp": ts,
+            "id": i,
+            "duration": duration * 1000,
+            "dispersion": 1.0,
+        }
+        for i, (ts, duration) in enumerate(zip(start_ts, durations))
+    ]
+    return pm.Affiliator(data, start_ts, start_ts + durations)
+
+
+def _map_section_per_frame(surface, section, world_timestamps, events, camera_model):
+    result = []
+    for frame_idx, location in enumerate(surface.location_cache[section]):
+        frame_idx += section.start
+        if location and location.detected:
+            window = enclosing_window(world_timestamps, frame_idx)
+            result.extend(
+                (frame_idx, mapped)
+                for mapped in surface.map_gaze_and_fixation_events(
+                    events.by_ts_window(window),
+                    camera_model,
+                    trans_matrix=location.img_to_surf_trans,
+                )
+            )
+    return result
+
+
+@pytest.mark.parametrize("make_events, n_events", [(_gaze, 300), (_fixations, 8)])
+def test_map_section_matches_per_frame_mapping(
+    surface, camera_model, make_events, n_events
+):
+    world_timestamps = np.arange(40) / 30.0
+    events = make_events(n_events, world_timestamps)
+    section = slice(2, 35)
+
+    mapped = surface.map_section(section, world_timestamps, events, camera_model)
+    expected = _map_section_per_frame(
+        surface, section, world_timestamps, events, camera_model
+    )
+
+    assert len(mapped) == len(expected)
+    assert mapped["world_index"].tolist() == [idx for idx, _ in expected]
+    dicts = Surface.mapped_events_to_dicts(mapped, events)
+    for datum, (_, expected_datum) in zip(dicts, expected):
+        assert datum.keys() == expected_datum.keys()
+        np.testing.assert_allclose(datum["norm_pos"], expected_datum["norm_pos"])
+        assert datum["on_surf"] == expected_datum["on_surf"]
+        assert datum["base_data"] == expected_datum["base_data"]
+    assert mapped["on_surf"].any() and not mapped["on_surf"].all()
+
+
+def test_map_section_without_location_cache(camera_model):
+    surface = Surface_Offline(name="test")
+    world_timestamps = np.arange(10) / 30.0
+    mapped = surface.map_section(
+        slice(0, 10), world_timestamps, _gaze(20, world_timestamps), camera_model
+    )
+    assert len(mapped) == 0
+
+
+def test_gaze_on_surface_chunks_match_section(surface, camera_model):
+    world_timestamps = np.arange(40) / 30.0
+    gaze = _gaze(300, world_timestamps)
+    section = slice(2, 35)
+
+    chunks = list(
+        gaze_on_surface_chunk_generator(
+            [surface], section, world_timestamps, gaze, camera_model, chunk_len=7
+        )
+    )
+    mapped = surface.map_section(section, world_timestamps, gaze, camera_model)
+
+    assert len(chunks) > 1
+    assert all(surf_idx == 0 for surf_idx, _ in chunks)
+    np.testing.assert_array_equal(np.concatenate([c for _, c in chunks]), mapped)
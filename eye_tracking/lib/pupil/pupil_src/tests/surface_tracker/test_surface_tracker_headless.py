@@ -0,0 +1,120 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import csv
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import file_methods as fm
+from camera_models import Radial_Dist_Camera
+from surface_tracker import surface_tracker_headless as headless
+from surface_tracker.marker_cache_store import Marker_Cache_Store
+from surface_tracker.surface_file_store import Surface_File_Store
+from surface_tracker.surface_marker import Surface_Marker
+from surface_tracker.surface_marker_detector import MarkerDetectorMode, MarkerType
+from surface_tracker.surface_offline import Surface_Offline
+
+SQUARE_MARKERS = MarkerDetectorMode(MarkerType.SQUARE_MARKER, None)
+WORLD_TIMESTAMPS = np.arange(60) / 30.0
+
+
+@pytest.fixture
+def camera_model():
+    K = [[830.0, 0.0, 640.0], [0.0, 830.0, 360.0], [0.0, 0.0, 1.0]]
+    D = [[-0.13, 0.1, 0.0, 0.0, -0.03]]
+    return Radial_Dist_Camera(K, D, (1280, 720), "world")
+
+
+def _markers(frame_idx):
+    if frame_idx % 20 == 5:
+        return []
+    shift = 10 * np.sin(frame_idx / 10)
+    markers = []
+    for marker_id, (x, y) in enumerate([(300, 150), (900, 150), (900, 550)]):
+        verts = np.array([[x, y], [x + 60, y], [x + 60, y + 60], [x, y + 60]]) + shift
+        detection = {
+            "id": marker_id,
+            "id_confidence": 1.0,
+            "verts": verts.reshape(4, 1, 2).tolist(),
+            "perimeter": 240.0,
+        }
+        markers.append(Surface_Marker.from_square_tag_detection(detection))
+    return markers
+
+
+@pytest.fixture
+def recording(tmpdir, camera_model, monkeypatch):
+    rec_dir = str(tmpdir)
+    marker_cache = [_markers(idx) for idx in range(len(WORLD_TIMESTAMPS))]
+    store = Marker_Cache_Store(rec_dir, len(marker_cache), SQUARE_MARKERS)
+    for frame_idx, markers in enumerate(marker_cache):
+        store.write(frame_idx, markers)
+    store.save()
+
+    surface = Surface_Offline(name="screen")
+    for idx in range(30):
+        markers = {m.uid: m for m in marker_cache[0]}
+        surface._update_definition(idx, markers, camera_model)
+    surface.build_up_status = 1.0
+    surface.prune_markers()
+    Surface_File_Store(parent_dir=rec_dir).write_surfaces_to_file([surface])
+
+    rng = np.random.default_rng(0)
+    with fm.PLData_Writer(rec_dir, "gaze") as writer:
+        for ts in np.arange(0.0, 2.0, 1 / 120):
+            writer.append(
+                {
+                    "topic": "gaze.2d.0.",
+                    "timestamp": ts,
+                    "norm_pos": tuple(rng.uniform(0.3, 0.7, 2)),
+                    "confidence": 1.0,
+                }
+            )
+
+    # marker detection is skipped, the marker cache is complete
+    def File_Source(g_pool, source_path, **kwargs):
+        return types.SimpleNamespace(
+            timestamps=WORLD_TIMESTAMPS, intrinsics=camera_model
+        )
+
+    video_capture = types.SimpleNamespace(File_Source=File_Source)
+    monkeypatch.setitem(sys.modules, "video_capture", video_capture)
+    return rec_dir
+
+
+def test_track_surfaces_exports_surface_data(recording):
+    metrics_dir = headless.track_surfaces(
+        recording, marker_detector_mode=SQUARE_MARKERS, quad_decimate=2.0
+    )
+
+    assert sorted(os.listdir(metrics_dir)) == [
+        "fixations_on_surface_screen.csv",
+        "gaze_positions_on_surface_screen.csv",
+        "heatmap_screen.png",
+        "surf_positions_screen.csv",
+        "surface_events.csv",
+        "surface_gaze_distribution.csv",
+        "surface_visibility.csv",
+    ]
+    with open(os.path.join(metrics_dir, "surface_events.csv")) as f:
+        events = [
+            (int(row["world_index"]), row["event_type"]) for row in csv.DictReader(f)
+        ]
+    assert events[:4] == [(0, "enter"), (4, "exit"), (6, "enter"), (24, "exit")]
+
+    with open(os.path.join(metrics_dir, "gaze_positions_on_surface_screen.csv")) as f:
+        gaze = list(csv.DictReader(f))
+    world_idc = {int(row["world_index"]) for row in gaze}
+    assert world_idc.isdisjoint({5, 25, 45})
+    assert len(gaze) > 200
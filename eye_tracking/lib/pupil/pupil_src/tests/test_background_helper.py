@@ -0,0 +1,93 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import multiprocessing
+import time
+
+import pytest
+
+from background_helper import Sharded_Task_Proxy, Task_Proxy
+from surface_tracker.background_tasks import data_processing_generator
+
+mp_context = multiprocessing.get_context("fork")
+
+
+def _square(x):
+    return x * x
+
+
+def _fetch_all(proxy, timeout=20):
+    results = []
+    start = time.perf_counter()
+    while not proxy.completed:
+        results.extend(proxy.fetch())
+        assert time.perf_counter() - start < timeout
+        time.sleep(0.01)
+    return results
+
+
+@pytest.fixture
+def started_shards():
+    return []
+
+
+@pytest.fixture
+def start_shard(started_shards):
+    data = [None if i % 5 == 0 else i for i in range(200)]
+
+    def start_shard(shard_visited, shard_seek_idx):
+        started_shards.append((shard_visited.index(False), shard_seek_idx.value))
+        return Task_Proxy(
+            "Test Shard",
+            data_processing_generator,
+            (data, _square, shard_seek_idx, shard_visited),
+            context=mp_context,
+        )
+
+    start_shard.data = data
+    return start_shard
+
+
+def test_sharded_task_proxy_fills_every_index_once(start_shard, started_shards):
+    data = start_shard.data
+    seek_idx = mp_context.Value("i", -1)
+    proxy = Sharded_Task_Proxy(
+        start_shard,
+        [x is None for x in data],
+        seek_idx,
+        workers=3,
+        shards_per_worker=2,
+        context=mp_context,
+    )
+    results = _fetch_all(proxy)
+
+    assert len(started_shards) == 6
+    assert sorted(idx for idx, _ in results) == [
+        idx for idx, x in enumerate(data) if x is not None
+    ]
+    assert all(result == data[idx] ** 2 for idx, result in results)
+
+
+def test_sharded_task_proxy_starts_with_seeked_shard(start_shard, started_shards):
+    data = start_shard.data
+    seek_idx = mp_context.Value("i", 171)
+    proxy = Sharded_Task_Proxy(
+        start_shard,
+        [x is None for x in data],
+        seek_idx,
+        workers=1,
+        shards_per_worker=4,
+        context=mp_context,
+    )
+    results = _fetch_all(proxy)
+
+    assert started_shards[0] == (151, 171)
+    assert seek_idx.value == -1
+    assert len(results) == len([x for x in data if x is not None])
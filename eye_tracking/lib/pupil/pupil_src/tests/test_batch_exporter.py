@@ -0,0 +1,178 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+import msgpack
+import numpy as np
+import pytest
+import zmq
+
+import batch_exporter_headless
+import file_methods as fm
+from camera_models import Radial_Dist_Camera
+
+WORLD_TIMESTAMPS = np.arange(0.0, 10.0, 1 / 30)
+
+
+@pytest.fixture
+def recording(tmpdir, monkeypatch):
+    rec_dir = str(tmpdir.mkdir("session").mkdir("000"))
+    with open(os.path.join(rec_dir, "info.player.json"), "w") as f:
+        json.dump({"meta_version": "2.3"}, f)
+
+    rng = np.random.default_rng(0)
+    with fm.PLData_Writer(rec_dir, "pupil") as writer:
+        for ts in np.arange(0.0, 10.0, 1 / 120):
+            # blinks at 3s and 7s
+            blink = any(abs(ts - blink_ts) < 0.1 for blink_ts in (3.0, 7.0))
+            writer.append(
+                {
+                    "topic": "pupil.0.2d",
+                    "id": 0,
+                    "method": "2d c++",
+                    "timestamp": ts,
+                    "confidence": 0.0 if blink else 1.0,
+                    "norm_pos": (0.5, 0.5),
+                    "diameter": 30.0,
+                    "ellipse": {"center": (96, 96), "axes": (30, 30), "angle": 0},
+                }
+            )
+    with fm.PLData_Writer(rec_dir, "gaze") as writer:
+        for ts in np.arange(0.0, 10.0, 1 / 120):
+            # the gaze jumps between fixations every 0.5s
+            target = [0.3, 0.7][int(ts * 2) % 2]
+            writer.append(
+                {
+                    "topic": "gaze.2d.0.",
+                    "timestamp": ts,
+                    "norm_pos": tuple(target + rng.normal(0, 0.001, 2)),
+                    "confidence": 1.0,
+                    "base_data": [],
+                }
+            )
+
+    camera_model = Radial_Dist_Camera(
+        [[830.0, 0.0, 640.0], [0.0, 830.0, 360.0], [0.0, 0.0, 1.0]],
+        [[-0.13, 0.1, 0.0, 0.0, -0.03]],
+        (1280, 720),
+        "world",
+    )
+
+    def File_Source(g_pool, source_path, **kwargs):
+        return types.SimpleNamespace(
+            timestamps=WORLD_TIMESTAMPS,
+            intrinsics=camera_model,
+            frame_size=(1280, 720),
+        )
+
+    video_capture = types.SimpleNamespace(File_Source=File_Source)
+    # the exports run in forked processes which inherit the patched module
+    monkeypatch.setitem(sys.modules, "video_capture", video_capture)
+    return rec_dir
+
+
+def test_batch_export_writes_files_manifest_and_status(recording, tmpdir):
+    status_file = str(tmpdir.join("status.json"))
+    exporter = batch_exporter_headless.Headless_Batch_Exporter(
+        [recording], workers=2, status_file=status_file
+    )
+    jobs = exporter.run(poll_interval=0.01)
+
+    assert [job.state for job in jobs] == ["completed"]
+    export_dir = os.path.join(recording, "exports", "batch")
+    assert sorted(os.listdir(export_dir)) == [
+        "blink_detection_report.csv",
+        "blinks.csv",
+        "export_manifest.json",
+        "fixation_report.csv",
+        "fixations.csv",
+        "gaze_positions.csv",
+        "pupil_gaze_positions_info.txt",
+        "pupil_positions.csv",
+    ]
+    with open(os.path.join(export_dir, "blinks.csv")) as f:
+        assert len(f.readlines()) == 3  # header and two blinks
+
+    with open(status_file) as f:
+        status = json.load(f)
+    assert status["completed"] == 1
+    assert status["jobs"][0]["state"] == "completed"
+    assert status["jobs"][0]["progress"] == 1.0
+
+
+def test_batch_export_skips_up_to_date_recordings(recording):
+    settings = {"min_data_confidence": 0.8}
+    exporters = ("raw_data", "blinks")
+    batch_exporter_headless.Headless_Batch_Exporter(
+        [recording], exporters=exporters, settings=settings
+    ).run(poll_interval=0.01)
+
+    def job_state(**kwargs):
+        exporter = batch_exporter_headless.Headless_Batch_Exporter(
+            [recording], **kwargs
+        )
+        return exporter.jobs[0].state
+
+    assert job_state(exporters=exporters, settings=settings) == "skipped"
+    assert job_state(exporters=exporters[:1], settings=settings) == "skipped"
+    assert job_state(exporters=exporters, settings=settings, force=True) == "queued"
+    assert job_state(exporters=exporters) == "queued"
+    assert (
+        job_state(exporters=batch_exporter_headless.EXPORTERS, settings=settings)
+        == "queued"
+    )
+
+    gaze_path = os.path.join(recording, "gaze.pldata")
+    os.utime(gaze_path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    assert job_state(exporters=exporters, settings=settings) == "queued"
+
+
+def test_batch_export_rejects_duplicate_export_dirs(recording, tmpdir):
+    with pytest.raises(ValueError):
+        batch_exporter_headless.Headless_Batch_Exporter(
+            [recording, recording], destination_dir=str(tmpdir)
+        )
+
+
+def test_batch_export_publishes_status(recording, tmpdir):
+    url = "ipc://{}".format(tmpdir.join("status"))
+    exporter = batch_exporter_headless.Headless_Batch_Exporter(
+        [recording], status_url=url
+    )
+
+    subscriber = zmq.Context.instance().socket(zmq.SUB)
+    subscriber.connect(url)
+    subscriber.subscribe(exporter.STATUS_TOPIC)
+    time.sleep(0.2)  # subscriptions need to propagate before publishing
+    exporter.publish_status()
+
+    assert subscriber.poll(2000)
+    topic, payload = subscriber.recv_multipart()
+    status = msgpack.unpackb(payload, raw=False)
+    assert topic.decode() == exporter.STATUS_TOPIC
+    assert status["queued"] == 1
+    assert status["jobs"][0]["rec_dir"] == recording
+    subscriber.close()
+
+
+def test_headless_batch_export_does_not_import_gl():
+    code = (
+        "import sys; sys.path[:0] = {!r}; import batch_exporter_headless; "
+        "print(sorted({{name.split('.')[0] for name in sys.modules}} & "
+        "{{'OpenGL', 'gl_utils', 'glfw', 'plugin', 'pyglui'}}))"
+    ).format(sys.path)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == "[]"
@@ -0,0 +1,152 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import os
+
+import numpy as np
+import pytest
+
+from file_methods import (
+    PLDATA_INDEX_DTYPE,
+    PLData,
+    PLData_Writer,
+    Serialized_Dict,
+    load_pldata_file,
+    load_pldata_index,
+    load_pldata_window,
+)
+
+
+@pytest.fixture
+def recording(tmpdir):
+    directory = str(tmpdir)
+    with PLData_Writer(directory, "pupil") as writer:
+        for i in range(100):
+            writer.append(
+                {
+                    "topic": "pupil.{}".format(i % 2),
+                    "timestamp": 10.0 + i * 0.1,
+                    "confidence": i / 100,
+                    "label": "x" * (i % 7),
+                }
+            )
+    return directory
+
+
+def _assert_window(directory, start_ts, stop_ts):
+    full = load_pldata_file(directory, "pupil")
+    in_window = [
+        (datum, ts, topic)
+        for datum, ts, topic in zip(full.data, full.timestamps, full.topics)
+        if start_ts <= ts < stop_ts
+    ]
+    window = load_pldata_window(directory, "pupil", start_ts, stop_ts)
+    assert len(window.data) == len(in_window)
+    for datum, ts, topic, expected in zip(
+        window.data, window.timestamps, window.topics, in_window
+    ):
+        assert datum.serialized == expected[0].serialized
+        assert ts == expected[1]
+        assert topic == expected[2]
+
+
+def test_pldata_writer_index(recording):
+    index = load_pldata_index(recording, "pupil")
+    assert len(index) == 100
+    assert index["offset"][0] == 0
+    assert np.all(index["offset"][1:] == index["offset"][:-1] + index["size"][:-1])
+    assert index["offset"][-1] + index["size"][-1] == os.path.getsize(
+        os.path.join(recording, "pupil.pldata")
+    )
+    _assert_window(recording, 12.0, 15.05)
+    _assert_window(recording, 0.0, 100.0)
+    _assert_window(recording, 20.0, 30.0)
+
+
+def test_pldata_index_is_built_for_old_recordings(recording):
+    index_path = os.path.join(recording, "pupil_pldata_index.npy")
+    written = np.load(index_path)
+    os.remove(index_path)
+    _assert_window(recording, 12.0, 15.05)
+    assert os.path.exists(index_path)
+    assert np.array_equal(np.load(index_path), written)
+
+
+def test_stale_pldata_index_is_rebuilt(recording):
+    index_path = os.path.join(recording, "pupil_pldata_index.npy")
+    np.save(index_path, np.load(index_path)[:10])
+    _assert_window(recording, 10.0, 20.0)
+    assert len(np.load(index_path)) == 100
+
+
+def test_foreign_pldata_index_is_rebuilt(recording):
+    index_path = os.path.join(recording, "pupil_pldata_index.npy")
+    np.save(index_path, np.arange(100, dtype=np.int64))
+    _assert_window(recording, 10.0, 20.0)
+    assert np.load(index_path).dtype == PLDATA_INDEX_DTYPE
+
+
+def test_pldata_window_of_missing_topic(tmpdir):
+    window = load_pldata_window(str(tmpdir), "gaze", 0.0, 1.0)
+    assert len(window.data) == 0
+
+
+def test_to_struct_array():
+    data = [
+        Serialized_Dict(
+            python_dict={
+                "norm_pos": (0.1, 0.2),
+                "confidence": 0.9,
+                "base_data": [
+                    {"id": 0, "ellipse": {"axes": (1.0, 2.0)}},
+                    {"id": 1, "ellipse": {"axes": (3.0, 4.0)}},
+                ],
+            }
+        ),
+        Serialized_Dict(
+            python_dict={
+                "norm_pos": (0.3, 0.4),
+                "confidence": 0.8,
+                "base_data": [{"id": 1, "ellipse": {"axes": (5.0, 6.0)}}],
+            }
+        ),
+        {"norm_pos": (0.5, 0.6)},
+    ]
+    fields = PLData(data, [], []).to_struct_array(
+        ["norm_pos", "confidence", "base_data[*].ellipse.axes", "base_data[0].id"]
+    )
+    assert len(fields) == 3
+    assert np.array_equal(fields["norm_pos"], [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]])
+    assert np.array_equal(fields["confidence"], [0.9, 0.8, np.nan], equal_nan=True)
+    assert fields["base_data[*].ellipse.axes"].shape == (3, 2, 2)
+    assert np.array_equal(
+        fields["base_data[*].ellipse.axes"][1], [[5.0, 6.0], [np.nan, np.nan]],
+        equal_nan=True,
+    )
+    assert np.isnan(fields["base_data[*].ellipse.axes"][2]).all()
+    assert np.array_equal(fields["base_data[0].id"], [0, 1, np.nan], equal_nan=True)
+
+
+def test_serialized_dict_cache():
+    cache_len = Serialized_Dict.cache_len
+    try:
+        Serialized_Dict.set_cache_len(2)
+        Serialized_Dict.cache_clear()
+        data = [Serialized_Dict(python_dict={"i": i}) for i in range(3)]
+        data[0]["i"]
+        data[0]["i"]
+        data[1]["i"]
+        data[2]["i"]  # evicts data[0]
+        data[0]["i"]
+        info = Serialized_Dict.cache_info()
+        assert (info.hits, info.misses, info.maxsize, info.currsize) == (1, 4, 2, 2)
+        assert data[1]._data is None
+    finally:
+        Serialized_Dict.set_cache_len(cache_len)
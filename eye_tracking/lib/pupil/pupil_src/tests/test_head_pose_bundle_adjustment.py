@@ -0,0 +1,124 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import cv2
+import numpy as np
+import pytest
+
+from camera_models import Fisheye_Dist_Camera, Radial_Dist_Camera
+from head_pose_tracker.function import utils
+from head_pose_tracker.function.bundle_adjustment import BundleAdjustment
+from head_pose_tracker.function.get_initial_guess import InitialGuess
+from head_pose_tracker.function.pick_key_markers import KeyMarker
+
+
+def _camera_intrinsics(fisheye):
+    if fisheye:
+        K = [[400.0, 0.0, 640.0], [0.0, 400.0, 360.0], [0.0, 0.0, 1.0]]
+        D = [[0.05, 0.01, -0.005, 0.001]]
+        return Fisheye_Dist_Camera(K, D, (1280, 720), "world")
+    K = [[830.0, 0.0, 640.0], [0.0, 830.0, 360.0], [0.0, 0.0, 1.0]]
+    D = [[-0.13, 0.1, 0.0, 0.0, -0.03]]
+    return Radial_Dist_Camera(K, D, (1280, 720), "world")
+
+
+def _initial_guess(camera_intrinsics, n_markers=6, n_frames=12):
+    rng = np.random.default_rng(0)
+    marker_extrinsics = np.zeros((n_markers, 6))
+    marker_extrinsics[1:, 0:3] = rng.normal(0.0, 0.2, (n_markers - 1, 3))
+    marker_extrinsics[1:, 3:5] = rng.uniform(-4.0, 4.0, (n_markers - 1, 2))
+    camera_extrinsics = np.zeros((n_frames, 6))
+    camera_extrinsics[:, 0:3] = rng.normal(0.0, 0.15, (n_frames, 3))
+    camera_extrinsics[:, 5] = rng.uniform(12.0, 18.0, n_frames)
+
+    key_markers = []
+    for frame_id in range(n_frames):
+        for marker_id in range(n_markers):
+            verts = camera_intrinsics.projectPoints(
+                utils.convert_marker_extrinsics_to_points_3d(
+                    marker_extrinsics[marker_id]
+                ).astype(np.float64),
+                camera_extrinsics[frame_id, 0:3],
+                camera_extrinsics[frame_id, 3:6],
+            )
+            key_markers.append(KeyMarker(frame_id, marker_id, verts, None))
+
+    noise = np.hstack((np.full(3, 0.02), np.full(3, 0.2)))
+    return (
+        InitialGuess(
+            key_markers,
+            {frame_id: e + noise for frame_id, e in enumerate(camera_extrinsics)},
+            {
+                marker_id: e + noise if marker_id else e
+                for marker_id, e in enumerate(marker_extrinsics)
+            },
+        ),
+        marker_extrinsics,
+    )
+
+
+def test_rotation_vectors_to_matrices_matches_rodrigues():
+    rng = np.random.default_rng(0)
+    rotation_vectors = np.vstack((rng.normal(0.0, 1.0, (20, 3)), np.zeros((1, 3))))
+
+    matrices, derivatives = utils.rotation_vectors_to_matrices(rotation_vectors)
+
+    for rotation_vector, matrix, derivative in zip(
+        rotation_vectors, matrices, derivatives
+    ):
+        expected_matrix, expected_jacobian = cv2.Rodrigues(rotation_vector)
+        np.testing.assert_allclose(matrix, expected_matrix, atol=1e-12)
+        # cv2 returns the derivatives of the matrix elements in rows of 9
+        np.testing.assert_allclose(
+            derivative.reshape(3, 9), expected_jacobian, atol=1e-6
+        )
+
+
+@pytest.mark.parametrize("fisheye", [False, True])
+@pytest.mark.parametrize("optimize_camera_intrinsics", [False, True])
+def test_jacobian_matches_finite_differences(fisheye, optimize_camera_intrinsics):
+    camera_intrinsics = _camera_intrinsics(fisheye)
+    initial_guess, _ = _initial_guess(camera_intrinsics)
+    bundle_adjustment = BundleAdjustment(camera_intrinsics, optimize_camera_intrinsics)
+    bundle_adjustment.calculate(initial_guess)
+    variables, _ = bundle_adjustment._prepare_parameters(
+        *bundle_adjustment._set_init_array(
+            initial_guess.frame_id_to_extrinsics,
+            initial_guess.marker_id_to_extrinsics,
+        )
+    )
+
+    jacobian = bundle_adjustment._function_compute_jacobian(variables).toarray()
+
+    step = 1e-6 * np.maximum(1.0, np.abs(variables))
+    expected_jacobian = np.empty_like(jacobian)
+    for idx in range(variables.size):
+        delta = np.zeros_like(variables)
+        delta[idx] = step[idx]
+        expected_jacobian[:, idx] = (
+            bundle_adjustment._function_compute_residuals(variables + delta)
+            - bundle_adjustment._function_compute_residuals(variables - delta)
+        ) / (2 * step[idx])
+    # the origin marker is fixed
+    origin_marker_cols = 6 * len(initial_guess.frame_id_to_extrinsics) + np.arange(6)
+    expected_jacobian[:, origin_marker_cols] = 0
+    np.testing.assert_allclose(jacobian, expected_jacobian, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("fisheye", [False, True])
+def test_calculate_recovers_marker_extrinsics(fisheye):
+    camera_intrinsics = _camera_intrinsics(fisheye)
+    initial_guess, marker_extrinsics = _initial_guess(camera_intrinsics)
+
+    result = BundleAdjustment(camera_intrinsics, False).calculate(initial_guess)
+
+    assert result.frame_ids_failed == []
+    for marker_id, extrinsics in result.marker_id_to_extrinsics.items():
+        np.testing.assert_allclose(extrinsics, marker_extrinsics[marker_id], atol=1e-4)
@@ -8,10 +8,16 @@ Lesser General Public License (LGPL v3.0).
 See COPYING and COPYING.LESSER for license details.
 ---------------------------------------------------------------------------~(*)
 """
+import csv
+import io
+
+import numpy as np
 import pytest
 
-from raw_data_exporter import Pupil_Positions_Exporter
-from raw_data_exporter import Gaze_Positions_Exporter
+from file_methods import Serialized_Dict
+from raw_data_exporter_utils import Pupil_Positions_Exporter
+from raw_data_exporter_utils import Gaze_Positions_Exporter
+from raw_data_exporter_utils import write_columns_csv
 
 
 def _test_exporter(exporter, positions, expected_dict_export, world_index=123):
@@ -24,6 +30,70 @@ def _test_exporter(exporter, positions, expected_dict_export, world_index=123):
     assert actual_dict_export == expected_dict_export, "Actual pupil export must be the same as expeted export"
 
 
+def _test_columns_export(exporter, positions, tmpdir):
+    labels = exporter.csv_export_labels()
+    world_indices = list(range(len(positions)))
+    serialized = [Serialized_Dict(python_dict=p) for p in positions]
+    columns = exporter.columns_export(serialized, world_indices)
+    assert tuple(columns.keys()) == tuple(labels)
+
+    expected_rows = [
+        exporter.dict_export(raw_value=p, world_index=i)
+        for p, i in zip(serialized, world_indices)
+    ]
+    for row, expected_row in enumerate(expected_rows):
+        for label in labels:
+            value = columns[label][row]
+            if value is np.ma.masked:
+                value = None
+            elif label.endswith("_timestamp"):
+                value = str(value)
+            assert value == expected_row[label], label
+
+    export_path = str(tmpdir.join("export.csv"))
+    write_columns_csv(export_path, labels, columns)
+    expected_csv = io.StringIO(newline="")
+    dict_writer = csv.DictWriter(expected_csv, fieldnames=labels)
+    dict_writer.writeheader()
+    dict_writer.writerows(expected_rows)
+    with open(export_path, encoding="utf-8", newline="") as csv_file:
+        assert csv_file.read() == expected_csv.getvalue()
+
+
+def test_pupil_positions_columns_export(tmpdir):
+    pupil_2d = {
+        key: PUPIL_CAPTURE_PUPIL_POSITION_0[key]
+        for key in ("topic", "confidence", "timestamp", "ellipse", "norm_pos", "id")
+    }
+    pupil_2d.update({"diameter": 25.0, "method": "2d c++"})
+    _test_columns_export(
+        exporter=Pupil_Positions_Exporter(),
+        positions=[PUPIL_CAPTURE_PUPIL_POSITION_0, pupil_2d],
+        tmpdir=tmpdir,
+    )
+
+
+def test_pupil_positions_columns_export_missing_3d_fields(tmpdir):
+    # incomplete 3d data falls back to empty 3d columns, None values to empty fields
+    pupil_3d_incomplete = dict(PUPIL_CAPTURE_PUPIL_POSITION_0)
+    del pupil_3d_incomplete["projected_sphere"]
+    pupil_3d_none = dict(PUPIL_CAPTURE_PUPIL_POSITION_0)
+    pupil_3d_none.update({"model_confidence": None, "theta": None})
+    _test_columns_export(
+        exporter=Pupil_Positions_Exporter(),
+        positions=[pupil_3d_incomplete, pupil_3d_none],
+        tmpdir=tmpdir,
+    )
+
+
+def test_gaze_positions_columns_export(tmpdir):
+    _test_columns_export(
+        exporter=Gaze_Positions_Exporter(),
+        positions=[PUPIL_CAPTURE_GAZE_POSITION_0, PUPIL_INVISIBLE_GAZE_POSITION_0],
+        tmpdir=tmpdir,
+    )
+
+
 def test_pupil_positions_exporter_capture():
     _test_exporter(
         exporter=Pupil_Positions_Exporter(),
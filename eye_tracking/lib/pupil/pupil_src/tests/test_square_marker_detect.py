@@ -0,0 +1,105 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import cv2
+import numpy as np
+import pytest
+
+import square_marker_detect
+from surface_tracker.surface_marker_detector import Surface_Square_Marker_Detector
+
+ORIENTATION_CORNERS = [(0, 0), (2, 0), (2, 2), (0, 2)]
+
+
+def _marker_img(inner, cell):
+    grid = np.zeros((5, 5), dtype=np.uint8)
+    grid[1:4, 1:4] = np.array(inner) * 255
+    img = cv2.resize(grid, (5 * cell, 5 * cell), interpolation=cv2.INTER_NEAREST)
+    return cv2.copyMakeBorder(
+        img, cell, cell, cell, cell, cv2.BORDER_CONSTANT, value=255
+    )
+
+
+def _scene(seed, marker_count=6, size=(480, 640)):
+    rng = np.random.default_rng(seed)
+    img = np.full(size, 200, dtype=np.uint8)
+    for idx in range(marker_count):
+        inner = rng.integers(0, 2, (3, 3))
+        for corner in ORIENTATION_CORNERS:
+            inner[corner] = 1
+        inner[ORIENTATION_CORNERS[rng.integers(4)]] = 0
+        marker = _marker_img(inner, cell=int(rng.integers(8, 14)))
+
+        height, width = marker.shape
+        src = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+        x, y = (idx % 3) * 200 + 30, (idx // 3) * 220 + 30
+        dst = np.float32([[x, y], [x + 120, y], [x + 120, y + 120], [x, y + 120]])
+        dst += rng.uniform(-10, 10, (4, 2)).astype(np.float32)
+        M = cv2.getPerspectiveTransform(src, dst)
+        warped = cv2.warpPerspective(marker, M, size[::-1])
+        mask = cv2.warpPerspective(np.full_like(marker, 255), M, size[::-1]) > 0
+        img[mask] = warped[mask]
+    noise = rng.normal(0, 4, size)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("grid", [4, 5, 6])
+def test_decode_batch_matches_decode(grid):
+    rng = np.random.default_rng(grid)
+    size = 20 * grid
+    square_imgs = (rng.random((200, size, size)) > 0.5).astype(np.uint8) * 255
+    border = np.ones((size, size), dtype=bool)
+    border[20:-20, 20:-20] = False
+    square_imgs[:, border] = 0
+
+    decoded = square_marker_detect.decode_batch(square_imgs, grid)
+
+    assert any(marker is not None for marker in decoded)
+    for square_img, marker in zip(square_imgs, decoded):
+        expected = square_marker_detect.decode(square_img, grid)
+        if expected is None:
+            assert marker is None
+        else:
+            assert marker[:3] == expected[:3]
+            np.testing.assert_array_equal(marker[3], expected[3])
+
+
+def test_decode_batch_without_images():
+    assert square_marker_detect.decode_batch(np.zeros((0, 100, 100)), 5) == []
+
+
+def test_detect_markers_finds_markers():
+    markers = square_marker_detect.detect_markers(_scene(0), grid_size=5)
+
+    assert len(markers) == 6
+    assert all(marker["id_confidence"] > 0.5 for marker in markers)
+
+
+def test_detect_markers_without_contours():
+    blank = np.full((100, 100), 128, dtype=np.uint8)
+    assert square_marker_detect.detect_markers(blank, grid_size=5) == []
+
+
+def test_detection_without_tracking_is_independent_of_frame_order():
+    frames = [_scene(seed) for seed in range(4)]
+
+    def detect(frame_indices):
+        detector = Surface_Square_Marker_Detector(square_marker_use_tracking=False)
+        return {
+            idx: [
+                (m.tag_id, np.asarray(m.verts_px).tolist())
+                for m in detector.detect_markers(frames[idx], idx)
+            ]
+            for idx in frame_indices
+        }
+
+    in_order = detect([0, 1, 2, 3])
+    assert detect([3, 1, 0, 2]) == in_order
+    assert all(in_order.values())
@@ -0,0 +1,90 @@
+"""
+(*)~---------------------------------------------------------------------------
+Pupil - eye tracking platform
+Copyright (C) 2012-2020 Pupil Labs
+
+Distributed under the terms of the GNU
+Lesser General Public License (LGPL v3.0).
+See COPYING and COPYING.LESSER for license details.
+---------------------------------------------------------------------------~(*)
+"""
+import time
+
+import pytest
+
+import tasklib.background
+from tasklib.parallel import ParallelTaskGroup
+
+
+def _count(start, stop, delay, shared_memory):
+    for value in range(start, stop):
+        time.sleep(delay)
+        shared_memory.progress = (value - start + 1) / (stop - start)
+        yield value
+
+
+def _fail():
+    yield "result of failed task"
+    raise ValueError("task failed")
+
+
+def _create_task(*args):
+    return tasklib.background.create(
+        "count", _count, args=args, pass_shared_memory=True, patches=()
+    )
+
+
+def _run_until_ended(group, timeout=20.0):
+    start = time.monotonic()
+    while group.running and time.monotonic() - start < timeout:
+        group.update()
+        time.sleep(0.01)
+
+
+def _run(group):
+    yields = []
+    group.add_observer("on_yield", yields.append)
+    group.start()
+    _run_until_ended(group)
+    return yields
+
+
+def test_parallel_task_group_yields_in_task_order():
+    # later tasks finish first
+    tasks = [_create_task(0, 5, 0.04), _create_task(5, 10, 0.02)]
+    tasks.append(_create_task(10, 15, 0.0))
+    group = ParallelTaskGroup(tasks, max_parallel=2)
+
+    assert _run(group) == list(range(15))
+    assert group.completed
+    assert group.progress == 1.0
+
+
+def test_parallel_task_group_ends_with_exception_of_task():
+    tasks = [
+        _create_task(0, 100, 0.05),
+        tasklib.background.create("fail", _fail, patches=()),
+    ]
+    group = ParallelTaskGroup(tasks)
+    exceptions = []
+    group.add_observer("on_exception", exceptions.append)
+
+    yields = _run(group)
+
+    assert group.ended and not group.completed
+    assert [str(exception) for exception in exceptions] == ["task failed"]
+    assert not tasks[0].running
+    assert "result of failed task" not in yields
+
+
+def test_parallel_task_group_can_be_canceled():
+    group = ParallelTaskGroup([_create_task(0, 1000, 0.01) for _ in range(3)])
+    group.start()
+    group.cancel_gracefully()
+    _run_until_ended(group)
+    assert group.canceled_or_killed
+
+
+def test_parallel_task_group_requires_tasks():
+    with pytest.raises(ValueError):
+        ParallelTaskGroup([])
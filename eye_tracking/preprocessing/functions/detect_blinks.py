@@ -321,7 +321,7 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
             )
             logger.info("Created 'blink_detection_report.csv' file.")
 
-    def recalculate(self, pupil_positions, directory):
+    def recalculate(self, pupil_positions, directory, confidence=None):
         import time
 
         t0 = time.time()
@@ -337,10 +337,14 @@ class Offline_Blink_Detection(Observable, Blink_Detection):
 
         # self.timestamps = all_pp.timestamps
         total_time = pupil_positions.timestamps[-1] - pupil_positions.timestamps[0]
-        conf_iter = [pp["confidence"] for pp in all_pp]
-        # for pp in all_pp:
-        #     conf_iter.append(pp["confidence"])
-        activity = np.fromiter(conf_iter, dtype=float, count=len(all_pp))
+        if confidence is None:
+            conf_iter = [pp["confidence"] for pp in all_pp]
+            # for pp in all_pp:
+            #     conf_iter.append(pp["confidence"])
+            activity = np.fromiter(conf_iter, dtype=float, count=len(all_pp))
+        else:
+            # already decoded, e.g. by et_recording.RecordingData
+            activity = np.asarray(confidence, dtype=float)
         total_time = all_pp[-1]["timestamp"] - all_pp[0]["timestamp"]
         history_length = 0.2
         filter_size = 2 * round(len(all_pp) * history_length / total_time / 2.0)
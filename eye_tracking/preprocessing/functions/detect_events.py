@@ -7,12 +7,13 @@ from . import detect_fixations
 from . import surface_detection as pl_surface
 from . import detect_saccades as saccades
 from . import detect_blinks
+from .et_recording import RecordingWindow
 from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods
 
 
 # unnecessary et in parameter but linked to next function which also is unnecessary
 # unecessary subject, datapath, surfaceMap in parameter
-def make_saccades(etsamples, etevents, subject, datapath, surfaceMap, engbert_lambda=5):
+def make_saccades(etsamples, etevents, subject, datapath, surfaceMap, engbert_lambda=5, recording=None):
     saccadeevents = saccades.detect_saccades_engbert_mergenthaler(etsamples, etevents,
                                                                   engbert_lambda=engbert_lambda)
 
@@ -35,44 +36,51 @@ def make_saccades(etsamples, etevents, subject, datapath, surfaceMap, engbert_la
 
 
 # unnecessary et in parameter
-def make_fixations(etsamples, etevents, subject, datapath, surfaceMap):
+def make_fixations(etsamples, etevents, subject, datapath, surfaceMap, recording=None):
     # detect fixations calling pupil lab's api
     directory = os.path.join(datapath, subject)
-    fixations_base_data, fixations_data = detect_fixations.fixation_detection(directory)
+    fixations_base_data, fixations_data = detect_fixations.fixation_detection(directory, recording=recording)
     # reformat into PLData object
     fixations = detect_fixations.pl_data_fixation(fixations_base_data)
 
-    if surfaceMap:
-        # create surfaces dataframe from existing csv file
-        preprocessed_path = os.path.join(datapath, subject, 'preprocessed')
-        surfaces_df = pd.read_csv(preprocessed_path + '/surface_coordinates.csv')
-        surfaces_df = surfaces_df.apply(pd.to_numeric, errors='coerce')
-
-        # extract fixation data that falls within surface
-        print('Detecting fixation on surface ...')
-        fixation_gaze_on_srf = pl_surface.surface_map_data(surfaces_df, fixations)
-        fixations = fixation_gaze_on_srf
-
-    # variable to classify which fixations fall in surface, if applicable
-    fixation_match_check = fixations.data
-
-    fixationevents = []
-    i = 0
-    # iterate through original fixation data
-    for data in fixations_data:
-        start_time = data['timestamp']
-
-        # match fixation timestamp to surface timestamp, if applicable
-        while (i < len(fixation_match_check) - 1) and (start_time > fixation_match_check[i + 1]['timestamp']):
-            i = i + 1
-
-        # match fixation timestamp to surface timestamp, if applicable (pt 2)
-        if start_time >= fixation_match_check[i]['timestamp']:
-            surface = "unknown" if not surfaceMap else True
-        else:
-            surface = "unknown" if not surfaceMap else False
-        fixation = detect_fixations.fixationevent(data, surface)
-        fixationevents.append(fixation)
+    if isinstance(surfaceMap, str):
+        # surfaces tracked by the headless Pupil surface tracker, surfaceMap is the surface name
+        gaze_on_surface = pl_surface.load_surface_export(directory, surfaceMap)
+        on_surface = pl_surface.fixations_on_surface_export(fixations_data, gaze_on_surface)
+        fixationevents = [detect_fixations.fixationevent(data, bool(surface))
+                          for data, surface in zip(fixations_data, on_surface)]
+    else:
+        if surfaceMap:
+            # create surfaces dataframe from existing csv file
+            preprocessed_path = os.path.join(datapath, subject, 'preprocessed')
+            surfaces_df = pd.read_csv(preprocessed_path + '/surface_coordinates.csv')
+            surfaces_df = surfaces_df.apply(pd.to_numeric, errors='coerce')
+
+            # extract fixation data that falls within surface
+            print('Detecting fixation on surface ...')
+            fixation_gaze_on_srf = pl_surface.surface_map_data(surfaces_df, fixations)
+            fixations = fixation_gaze_on_srf
+
+        # variable to classify which fixations fall in surface, if applicable
+        fixation_match_check = fixations.data
+
+        fixationevents = []
+        i = 0
+        # iterate through original fixation data
+        for data in fixations_data:
+            start_time = data['timestamp']
+
+            # match fixation timestamp to surface timestamp, if applicable
+            while (i < len(fixation_match_check) - 1) and (start_time > fixation_match_check[i + 1]['timestamp']):
+                i = i + 1
+
+            # match fixation timestamp to surface timestamp, if applicable (pt 2)
+            if start_time >= fixation_match_check[i]['timestamp']:
+                surface = "unknown" if not surfaceMap else True
+            else:
+                surface = "unknown" if not surfaceMap else False
+            fixation = detect_fixations.fixationevent(data, surface)
+            fixationevents.append(fixation)
 
     # convert into pandas df
     fixationevents = pd.DataFrame(fixationevents)
@@ -86,25 +94,22 @@ def make_fixations(etsamples, etevents, subject, datapath, surfaceMap):
 
 
 # unecessary et, surfaceMap in parameter
-def make_blinks(etsamples, etevents, subject, datapath, surfaceMap):
+def make_blinks(etsamples, etevents, subject, datapath, surfaceMap, recording=None):
     print('Detecting blinks ...')
     directory = os.path.join(datapath, subject)
-    pupil_positions = file_methods.load_pldata_file(directory, 'pupil')
+    if recording is not None:
+        pupil_positions = recording.pldata('pupil')
+        confidence = recording.fields('pupil', ['confidence'])['confidence']
+    else:
+        pupil_positions = file_methods.load_pldata_file(directory, 'pupil')
+        confidence = None
     blinks = detect_blinks.Offline_Blink_Detection.recalculate(detect_blinks.Offline_Blink_Detection, pupil_positions,
-                                                               directory)
-
-    # filepath for preprocessed folder
-    preprocessed_path = os.path.join(datapath, subject, 'preprocessed')
-
-    # create new folder if there is none
-    if not os.path.exists(preprocessed_path):
-        os.makedirs(preprocessed_path)
+                                                               directory, confidence=confidence)
 
     # create csv file of blinks
-    csv_file = preprocessed_path + '/blinks.csv'
     csv_columns = ['topic', 'start_timestamp', 'id', 'end_timestamp', 'timestamp', 'duration', 'base_data',
                    'filter_response', 'confidence', 'start_frame_index', 'end_frame_index', 'index']
-    event_csv(csv_file, csv_columns, blinks.data)
+    save_event_csv(directory, 'blinks', csv_columns, blinks.data, 'start_timestamp', recording=recording)
 
     # iterate through blink data to append to events
     blinkevents = []
@@ -126,6 +131,23 @@ def make_blinks(etsamples, etevents, subject, datapath, surfaceMap):
     return etsamples, etevents
 
 
+def save_event_csv(directory, name, csv_columns, eventdata, time_key, recording=None):
+    # Input:      name: the events are written to <directory>/preprocessed/<name>.csv
+    #             time_key: field of the start time of an event
+    #             recording: a RecordingWindow of the chunked mode keeps the events of its window in
+    #                        recording.events instead, preprocess_chunked writes the csv file of all chunks
+    eventdata = list(eventdata)
+    if isinstance(recording, RecordingWindow):
+        recording.events[name] = (csv_columns, eventdata, time_key)
+        return
+
+    # create new folder if there is none
+    preprocessed_path = os.path.join(directory, 'preprocessed')
+    if not os.path.exists(preprocessed_path):
+        os.makedirs(preprocessed_path)
+    event_csv(os.path.join(preprocessed_path, name + '.csv'), csv_columns, eventdata)
+
+
 def event_csv(filepath, csv_columns, eventdata):
     try:
         import csv
@@ -11,9 +11,12 @@ import os
 import collections
 
 
-def fixation_detection(directory):
+def fixation_detection(directory, recording=None):
     # gaze_data parameter
-    gaze = file_methods.load_pldata_file(directory, 'gaze')
+    if recording is not None:
+        gaze = recording.pldata('gaze')
+    else:
+        gaze = file_methods.load_pldata_file(directory, 'gaze')
     gaze_data = [gp.serialized for gp in gaze.data]
 
     # capture parameter
@@ -32,16 +35,9 @@ def fixation_detection(directory):
     fixations = list(fixation_detector.detect_fixations(cap, gaze_data, np.deg2rad(max_dispersion), min_duration / 1000,
                                                         max_duration / 1000, confidence))
 
-    # filepath for preprocessed folder
-    preprocessed_path = os.path.join(directory, 'preprocessed')
-
-    # create new folder if there is none
-    if not os.path.exists(preprocessed_path):
-        os.makedirs(preprocessed_path)
-
     fixations_data = []
     fixations_base_data = []
-    # extract fixation data to create csv
+    # extract fixation data to create csv, the first and last item are the status messages of the detector
     for data in fixations[1:-1]:
         # extract fixation base data
         for datum in data[1][0]['base_data']:
@@ -50,10 +46,10 @@ def fixation_detection(directory):
         fixations_data.append(data[1][0])
 
     # create csv file of fixations
-    csv_file = preprocessed_path + '/fixations.csv'
     csv_columns = ['topic', 'norm_pos', 'dispersion', 'method', 'base_data', 'timestamp', 'duration', 'confidence',
                    'gaze_point_3d', 'start_frame_index', 'end_frame_index', 'mid_frame_index', 'id']
-    detect_events.event_csv(csv_file, csv_columns, fixations_data)
+    detect_events.save_event_csv(directory, 'fixations', csv_columns, fixations_data, 'timestamp',
+                                 recording=recording)
 
     return fixations_base_data, fixations_data
 
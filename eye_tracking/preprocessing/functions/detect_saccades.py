@@ -17,6 +17,7 @@ from scipy.interpolate import PchipInterpolator
 import pandas as pd
 import numpy.linalg as LA
 from .et_helper import append_eventtype_to_sample
+from .et_detect_bad_samples import BAD_OUTSIDE
 from . import et_make_df as make_df
 import logging
 
@@ -42,9 +43,9 @@ def detect_saccades_engbert_mergenthaler(etsamples, etevents=None, engbert_lambd
         etsamples = append_eventtype_to_sample(etsamples, etevents, eventtype='blink')
         etsamples.loc[etsamples.type == 'blink', ['gx', 'gy']] = np.nan
 
-    if 'outside' in etsamples:
+    if 'bad' in etsamples:
         logger.debug('removing bad-samples for saccade detection')
-        etsamples.loc[etsamples.outside == True, ['gx', 'gy']] = np.nan
+        etsamples.loc[(etsamples.bad & BAD_OUTSIDE) != 0, ['gx', 'gy']] = np.nan
 
     # for pl the gaze needs to be interpolated first
     fs = 240
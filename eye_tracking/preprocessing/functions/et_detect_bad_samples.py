@@ -5,87 +5,116 @@ Created on Fri May 18 19:01:13 2018
 
 @author: kgross
 """
+import json
+
 import pandas as pd
 import numpy as np
 import logging
-from . import et_helper as helper
-
-
-# %% Detect bad samples
 
-def detect_bad_samples(etsamples):
-    # adds columns for bad samples (out of monitor, sampling frequency)
 
-    # get a logger
-    logger = logging.getLogger(__name__)
+# %% Bad sample flags, packed into the 'bad' column
 
-    logger.info("Removing bad samples ...")
+BAD_OUTSIDE = 1  # gaze position is outside the displays
+BAD_FREQUENCY = 2  # sampling frequency worse than 120 Hz since the previous sample
+BAD_ZERO_PA = 4  # pupil area is NaN
+BAD_NEG_TIME = 8  # negative sample time
+BAD_SAMPLE_FLAGS = {'outside': BAD_OUTSIDE, 'bad_freq': BAD_FREQUENCY, 'zero_pa': BAD_ZERO_PA,
+                    'neg_time': BAD_NEG_TIME}
 
-    # create df to store index of marked samples
-    marked_samples = pd.DataFrame()
+# flags remove_bad_samples drops by default; a bad sampling frequency is only reported
+REMOVE_FLAGS = BAD_OUTSIDE | BAD_ZERO_PA | BAD_NEG_TIME
 
-    # Gaze Position
-    # is out of the range of the monitor
-    # The monitor has a size of 1920 x 1080 pixels
-    # we give tolerance of 500 px and we convert into visual degrees
-    # VD 
-    ix_outside_samples = (etsamples.gx < (helper.px2deg(-500, 'horizontal'))) | (
-            etsamples.gx > (helper.px2deg(2420, 'horizontal'))) | (
-                                 etsamples.gy < (helper.px2deg(-500, 'vertical'))) | (
-                                 etsamples.gy > (helper.px2deg(1580, 'vertical')))
-    percentage_outside = np.mean(ix_outside_samples) * 100
-    logger.warning("Caution: %.2f%% samples got marked as the calculated gazeposition is outside the monitor" % (
-        percentage_outside))
+# Display geometry of the driving simulator: three screens side by side, without gap.
+# gx, gy are the gaze in the world camera image and say nothing about the displays. The outside check runs on
+# sx, sy instead, the gaze mapped onto a surface tracked with the headless Pupil surface tracker
+# (see surface_detection.annotate_surface_export), which has to span all screens, (0, 0) bottom left and (1, 1)
+# top right. Gaze up to tolerance_px beyond the displays still counts as inside.
+SIMULATOR_DISPLAY = {'screens': 3, 'width_px': 1920, 'height_px': 1080, 'bezel_px': 0, 'tolerance_px': 500}
 
-    if percentage_outside > 40:
-        raise NameError('More than 40% of the data got marked because the gaze is outside the monitor.')
 
-    marked_samples['outside'] = ix_outside_samples
+def load_display_geometry(display=None):
+    # Input:      display: None for SIMULATOR_DISPLAY, a dict or the path of a json file
+    #             with (some of) the keys of SIMULATOR_DISPLAY
+    # Output:     complete display geometry dict
+    if isinstance(display, str):
+        with open(display) as f:
+            display = json.load(f)
+    geometry = dict(SIMULATOR_DISPLAY)
+    geometry.update(display or {})
+    return geometry
 
-    # Sampling Frequency
-    # check how many samples there are with a fs worse than 120 Hz
-    tmp = pd.DataFrame()
-    tmp['fs'] = etsamples.smpl_time.diff()
-    ix_bad_freq = tmp.fs > (1. / 120.)
-    percentage_bad_freq = np.mean(ix_bad_freq) * 100
-    logger.warning("Caution: %.2f%% samples have a sampling frequency worse than 120 Hz" % percentage_bad_freq)
 
-    # Pupil Area is NaN
-    ix_zero_pa = np.isnan(etsamples.pa)
-    percentage_zero_pa = np.mean(ix_zero_pa) * 100
-    logger.warning("Caution: %.2f%% samples got marked as the pupil area is NaN in the samples" % percentage_zero_pa)
-    marked_samples['zero_pa'] = ix_zero_pa
+# %% Detect bad samples
 
-    # Negative sample time    
-    ix_neg_time = (etsamples.smpl_time < 0)
-    percentage_neg_time = np.mean(ix_neg_time) * 100
-    logger.warning("Caution: %.2f%% samples got marked as they have negative time stamps" % percentage_neg_time)
-    marked_samples['neg_time'] = ix_neg_time
+def detect_bad_samples(etsamples, display=None, min_fs=120., max_outside=40):
+    # Input:      etsamples df
+    #             display:     display geometry, see load_display_geometry
+    #             min_fs:      samples following a gap longer than 1 / min_fs are flagged BAD_FREQUENCY
+    #             max_outside: raise if more than this percentage of the gaze is outside the displays
+    # Output:     etsamples with the column 'bad', the BAD_* flags of every sample or'ed together
+    #             BAD_OUTSIDE is only set for etsamples with the surface coordinates sx, sy
 
-    # concatenate bad sample column(s)
-    marked_samples.index = etsamples.index
-    annotated_samples = pd.concat([etsamples, marked_samples], axis=1)
+    # get a logger
+    logger = logging.getLogger(__name__)
 
-    return annotated_samples
+    logger.info("Marking bad samples ...")
+    geometry = load_display_geometry(display)
+
+    # tolerance in normalized units of the surface spanning all displays
+    width = geometry['screens'] * geometry['width_px'] + (geometry['screens'] - 1) * geometry['bezel_px']
+    tol_x = geometry['tolerance_px'] / width
+    tol_y = geometry['tolerance_px'] / geometry['height_px']
+
+    smpl_time = etsamples['smpl_time'].to_numpy(dtype=float)
+    pa = etsamples['pa'].to_numpy(dtype=float)
+
+    bad = np.zeros(len(etsamples), dtype=np.uint8)
+    if 'sx' in etsamples and 'sy' in etsamples:
+        # samples without a detected surface are NaN and not flagged
+        sx = etsamples['sx'].to_numpy(dtype=float)
+        sy = etsamples['sy'].to_numpy(dtype=float)
+        bad[(sx < -tol_x) | (sx > 1 + tol_x) | (sy < -tol_y) | (sy > 1 + tol_y)] |= BAD_OUTSIDE
+    else:
+        logger.info("No surface mapped gaze, skipping the check for gaze outside the displays")
+    bad[1:][np.diff(smpl_time) > 1. / min_fs] |= BAD_FREQUENCY
+    bad[np.isnan(pa)] |= BAD_ZERO_PA
+    bad[smpl_time < 0] |= BAD_NEG_TIME
+
+    percentage_outside = np.mean((bad & BAD_OUTSIDE) != 0) * 100 if len(bad) else 0.
+    if percentage_outside > max_outside:
+        raise NameError('More than %i%% of the data got marked because the gaze is outside the monitor.' % max_outside)
+
+    return etsamples.assign(bad=bad)
+
+
+def qc_summary(etsamples, flags=REMOVE_FLAGS):
+    # Input:      etsamples marked by detect_bad_samples (and with events)
+    #             flags: BAD_* flags remove_bad_samples drops
+    # Output:     df with the number and percentage of samples per flag, of blink samples
+    #             and of the samples remove_bad_samples drops
+    bad = etsamples['bad'].to_numpy()
+    blink = (etsamples['type'] == 'blink').to_numpy() if 'type' in etsamples else np.zeros(len(bad), dtype=bool)
+    marked = {name: (bad & flag) != 0 for name, flag in BAD_SAMPLE_FLAGS.items()}
+    marked['blink'] = blink
+    marked['removed'] = ((bad & flags) != 0) | blink
+
+    n = len(bad)
+    counts = np.array([np.count_nonzero(ix) for ix in marked.values()])
+    return pd.DataFrame({'flag': list(marked.keys()),
+                         'samples': counts,
+                         'percentage': counts * 100. / n if n else np.zeros(len(counts))})
 
 
 # %% Remove bad samples
 
-def remove_bad_samples(marked_samples):
-    # Input:      samples df that has columns that mark bad samples with 'True'
-    # Output:     cleaned sample df where rows th
+def remove_bad_samples(marked_samples, flags=REMOVE_FLAGS):
+    # Input:      samples df marked by detect_bad_samples, with events
+    #             flags: BAD_* flags of the samples to drop
+    # Output:     cleaned sample df without the flagged samples and blinks
 
     # check if columns that mark bad samples exist
-    assert ('outside' in marked_samples)
-    marked_samples = marked_samples[marked_samples['outside'] == False]
-
+    assert ('bad' in marked_samples)
     assert ('type' in marked_samples)
-    marked_samples = marked_samples[~(marked_samples['type'] == 'blink')]
-
-    assert ('zero_pa' in marked_samples)
-    marked_samples = marked_samples[marked_samples['zero_pa'] == False]
-
-    assert ('neg_time' in marked_samples)
-    marked_samples = marked_samples[marked_samples['neg_time'] == False]
+    keep = ((marked_samples['bad'].to_numpy() & flags) == 0) & (marked_samples['type'] != 'blink').to_numpy()
 
-    return marked_samples
+    return marked_samples[keep]
@@ -12,41 +12,47 @@ import logging
 # %% put PUPIL LABS data into PANDAS DF
 
 
-def gaze_to_pandas(gaze):
+def gaze_sample_fields(gaze):
     # Input: gaze data as dictionary
+    # Output: (path of the pupil base data, fields gaze_to_pandas needs), see file_methods.to_struct_array
+    if len(gaze.data) > 0 and 'surface' in gaze.data[0]['topic']:
+        # we have a surface mapped dictionary. We have to get the real base_data
+        # the schachtelung is: surfacemapped => base_data World Mapped => base_data pupil
+        basedata = 'base_data.base_data[*]'
+    else:
+        basedata = 'base_data[*]'
+    return basedata, ['norm_pos', 'confidence', 'timestamp', basedata + '.diameter', basedata + '.ellipse.axes']
+
+
+def gaze_to_pandas(gaze, fields=None):
+    # Input: gaze data as dictionary
+    #        fields: gaze_sample_fields() already decoded, e.g. by et_recording.RecordingData
     # Output: pandas dataframe with gx, gy, confidence, smpl_time pupillabsdata, diameter and (calculated) pupil area (pa)
     import pandas as pd
-
-    list_diam = []
-    list_pa = []
-    gaze = gaze.data # filter only for data
-    for idx, p in enumerate(gaze):
-
-        if p:
-            if 'surface' in gaze[0]['topic']:
-                # we have a surface mapped dictionary. We have to get the real base_data
-                # the schachtelung is: surfacemapped => base_data World Mapped => base_data pupil
-                p_basedata = p['base_data']['base_data']
-            else:
-                p_basedata = p['base_data']
-
-            # take the mean over all pupil-diameters
-            diam = 0
-            pa = 0
-            for idx_bd, bd in enumerate(p_basedata):
-                pa = convert_diam_to_pa(bd['ellipse']['axes'][0], bd['ellipse']['axes'][1])
-                diam = diam + bd['diameter']
-            diam = diam / (idx_bd + 1)
-
-            list_diam.append(diam)
-            list_pa.append(pa)
-
-    df = pd.DataFrame({'gx': [p['norm_pos'][0] for p in gaze if p],
-                       'gy': [p['norm_pos'][1] for p in gaze if p],
-                       'confidence': [p['confidence'] for p in gaze if p],
-                       'smpl_time': [p['timestamp'] for p in gaze if p],
-                       'diameter': list_diam,
-                       'pa': list_pa
+    from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods as pl_file_methods
+
+    basedata, field_names = gaze_sample_fields(gaze)
+    if fields is None:
+        # decode all fields in one pass instead of going through the per datum cache
+        fields = pl_file_methods.to_struct_array(gaze.data, field_names)
+    n_bd = max(1, int(np.prod(fields.dtype[basedata + '.diameter'].shape)))
+    bd_diam = fields[basedata + '.diameter'].reshape(len(fields), n_bd)
+    bd_axes = fields[basedata + '.ellipse.axes'].reshape(len(fields), n_bd, 2)
+
+    # take the mean over all pupil-diameters, the pupil area is the one of the last pupil
+    valid = ~np.isnan(bd_diam)
+    diam = np.nansum(bd_diam, axis=1) / np.maximum(valid.sum(axis=1), 1)
+    last = bd_diam.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    last_axes = bd_axes[np.arange(len(fields)), last]
+    pa = math.pi * last_axes[:, 0] * last_axes[:, 1] * 0.25
+
+    norm_pos = fields['norm_pos'].reshape(len(fields), 2)
+    df = pd.DataFrame({'gx': norm_pos[:, 0],
+                       'gy': norm_pos[:, 1],
+                       'confidence': fields['confidence'],
+                       'smpl_time': fields['timestamp'],
+                       'diameter': diam,
+                       'pa': pa
                        })
     return df
 
@@ -194,12 +200,16 @@ def save_file(data, subject, datapath, outputprefix=''):
     filename_msgs = str(et) + '_msgs.csv'
     filename_events = str(et) + '_events.csv'
     filename_timestamps = str(et) + '_timestamps.csv'
+    filename_qc = str(et) + '_qc.csv'
 
     # make separate csv file for every df 
     data[0].to_csv(os.path.join(preprocessed_path, filename_samples), index=False)
     data[1].to_csv(os.path.join(preprocessed_path, filename_cleaned_samples), index=False)
     data[2].to_csv(os.path.join(preprocessed_path, filename_msgs), index=False)
     data[3].to_csv(os.path.join(preprocessed_path, filename_events), index=False)
+    # optional bad sample summary, see et_detect_bad_samples.qc_summary
+    if len(data) > 4:
+        data[4].to_csv(os.path.join(preprocessed_path, filename_qc), index=False)
 
     # save timestamps as csv
     timestamps_path = os.path.join(datapath, subject, 'world_timestamps.npy')
@@ -10,13 +10,14 @@ import logging
 from . import et_make_df as make_df
 from . import et_parse as parse
 from . import surface_detection as pl_surface
-from .et_helper import gaze_to_pandas
+from .et_helper import gaze_to_pandas, gaze_sample_fields
 from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods as pl_file_methods
 
 ########
 
-def raw_pl_data(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-driveratt'):
+def raw_pl_data(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-driveratt', recording=None):
     # Input:    subjectname, datapath
+    #           recording:       (et_recording.RecordingData) already loaded data of the recording, optional
     # Output:   Returns pupillabs dictionary
 
     if subject == '':
@@ -24,6 +25,9 @@ def raw_pl_data(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-drive
     else:
         datapath = os.path.join(datapath, subject)
 
+    if recording is not None:
+        return recording.pldata('pupil'), recording.pldata('annotation'), recording.pldata('gaze')
+
     original_pldata = pl_file_methods.load_pldata_file(datapath, 'pupil')
     annotations = pl_file_methods.load_pldata_file(datapath, 'annotation')
     gaze = pl_file_methods.load_pldata_file(datapath, 'gaze')
@@ -39,14 +43,40 @@ def raw_pl_data(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-drive
     return original_pldata, annotations, gaze
 
 
-def import_pl(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-driveratt', surfaceMap=True, parsemsg=True):
+def load_clock_sync(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-driveratt', recording=None):
+    # Input:    subjectname, datapath
+    #           recording:       (et_recording.RecordingData) already loaded data of the recording, optional
+    # Output:   clock model logged into the recording by the stimulus computer
+    #           (see et_parse.clock_sync_model), None if the recording has none
+
+    if recording is not None:
+        return parse.clock_sync_model(recording.pldata('annotation').data)
+    if subject != '':
+        datapath = os.path.join(datapath, subject)
+    annotations = pl_file_methods.load_pldata_file(datapath, 'annotation')
+    return parse.clock_sync_model(annotations.data)
+
+
+def parse_pl_msgs(annotations):
+    # Input:    annotations: annotation PLData
+    # Output:   msgs df, one row per parsed annotation
+
+    # Get msgs df
+    msgs = [parse.parse_message(note) for note in annotations.data]
+    return pd.DataFrame([msg for msg in msgs if not msg.empty]).reset_index(drop=True)
+
+
+def import_pl(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-driveratt', surfaceMap=True, parsemsg=True,
+              recording=None):
     # Input:    subject:         (str) name
     #           datapath:        (str) location where data is stored
-    #           surfaceMap:      (boolean) extract surface info for mapping purposes
+    #           surfaceMap:      (boolean) extract surface info for mapping purposes, or (str) name of a surface
+    #                            tracked with the headless Pupil surface tracker, see surface_detection.load_surface_export
     #           parsemsg:        (boolean)
+    #           recording:       (et_recording.RecordingData) already loaded data of the recording, optional
     # Output:   Returns 2 dfs (plsamples and plmsgs)
 
-    if surfaceMap:
+    if surfaceMap and not isinstance(surfaceMap, str):
         logging.warning(
             'Make sure detect_tags_and_surfaces() arguments, (1) tags and (2) tags_corner_attribute, are correctly '
             'defined in surface_detection.py. If you want to continue without surface detector, please turn '
@@ -54,12 +84,20 @@ def import_pl(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-drivera
 
     # Get samples df
     # (is still a dictionary here)
-    original_pldata, annotations, gaze = raw_pl_data(subject=subject, datapath=datapath)
+    original_pldata, annotations, gaze = raw_pl_data(subject=subject, datapath=datapath, recording=recording)
 
     # use pupilhelper func to make samples df (confidence, gx, gy, smpl_time, diameter)
-    pldata = gaze_to_pandas(gaze)
+    if recording is not None:
+        pldata = gaze_to_pandas(gaze, fields=recording.fields('gaze', gaze_sample_fields(gaze)[1]))
+    else:
+        pldata = gaze_to_pandas(gaze)
+
+    if isinstance(surfaceMap, str):
+        # mark the samples on the surface exported by the headless Pupil surface tracker
+        gaze_on_surface = pl_surface.load_surface_export(os.path.join(datapath, subject), surfaceMap)
+        pldata = pl_surface.annotate_surface_export(pldata, gaze_on_surface)
 
-    if surfaceMap:
+    elif surfaceMap:
         folder = os.path.join(datapath, subject)  # before it was taking subject, 'raw' as args
 
         # define surface coordinates per frame
@@ -79,16 +117,9 @@ def import_pl(subject='', datapath='/media/whitney/New Volume/Teresa/bdd-drivera
     plsamples = make_df.make_samples_df(pldata)
 
     if parsemsg:
-        annotations = annotations._asdict()
-        # Get msgs df
-        annot_msg = [annot for annot in annotations['data']]
-        plmsgs = pd.DataFrame()
-        for note in annot_msg:
-            msg = parse.parse_message(note)
-            if not msg.empty:
-                plmsgs = plmsgs.append(msg, ignore_index=True)
+        plmsgs = parse_pl_msgs(annotations)
     else:
-        plmsgs = annotations['data']
+        plmsgs = annotations.data
 
     plevents = pd.DataFrame()
     return plsamples, plmsgs, plevents
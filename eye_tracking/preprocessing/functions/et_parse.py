@@ -58,6 +58,33 @@ def parse_message(msg):
     return pd.Series(parsedmsg)
 
 
+def clock_sync_model(annotations):
+    # Input:  annotation dicts (e.g. pldata['annotation'].data)
+    # Output: dict with offset, drift and reference of the last 'clock_sync'
+    #         annotation (see recording/python/clock_sync.py), None if there is none
+
+    models = [note for note in annotations if note.get('label', None) == 'clock_sync' and 'offset' in note.keys()]
+    if not models:
+        return None
+    last = models[-1]
+    return {'offset': last['offset'], 'drift': last.get('drift', 0.0), 'reference': last.get('reference', 0.0)}
+
+
+def apply_clock_sync(plmsgs, model):
+    # Input:  plmsgs df with a 'timestamp' column in the stimulus computer's clock
+    #         model from clock_sync_model()
+    # Output: plmsgs with timestamps in eye tracker time,
+    #         the uncorrected ones are kept as 'timestamp_local'
+
+    if model is None or plmsgs.empty:
+        return plmsgs
+    plmsgs = plmsgs.copy()
+    local = plmsgs['timestamp'].astype(float)
+    plmsgs['timestamp_local'] = local
+    plmsgs['timestamp'] = local + model['offset'] + model['drift'] * (local - model['reference'])
+    return plmsgs
+
+
 def remove_punctuation(s):
     string_punctuation = ".,;"
     no_punct = ""
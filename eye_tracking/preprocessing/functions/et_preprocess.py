@@ -10,21 +10,46 @@ Modified: Saturday Fri Feb 15
 @author: teresa-canasbajo, dhakshib
 """
 
-from .et_import import import_pl
-from .detect_events import make_blinks, make_saccades, make_fixations
-from .et_detect_bad_samples import detect_bad_samples, remove_bad_samples
+from .et_import import import_pl, load_clock_sync, parse_pl_msgs
+from .et_parse import apply_clock_sync
+from .detect_events import make_blinks, make_saccades, make_fixations, event_csv
+from .et_detect_bad_samples import detect_bad_samples, remove_bad_samples, qc_summary, load_display_geometry
 from .et_helper import add_events_to_samples
 from .et_helper import load_file, save_file
 from .et_make_df import make_events_df
+from .et_recording import RecordingData, RecordingWindow
+from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods as pl_file_methods
 
+import csv
+import glob
+import json
 import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+# Context the event detectors need around an event, in seconds
+BLINK_FILTER_LENGTH = 0.2  # history_length of detect_blinks
+SACCADE_EXPANSION = 50 / 240.  # saccade ends are expanded by up to 50 samples of the 240 Hz interpolated gaze
+MAX_FIXATION_DURATION = 0.22  # max_duration of detect_fixations.fixation_detection
+# a chunk is padded with the longest event plus the widest detector context on both sides
+CHUNK_OVERLAP = MAX_FIXATION_DURATION + max(BLINK_FILTER_LENGTH, SACCADE_EXPANSION)
 
 
 # %%
 
 def preprocess_et(subject, datapath='/media/whitney/New Volume/Teresa/bdd-driveratt', surfaceMap=True, load=False,
-                  save=True, eventfunctions=(make_fixations, make_blinks, make_saccades), outputprefix='', **kwargs):
+                  save=True, clockSync=True, eventfunctions=(make_fixations, make_blinks, make_saccades), outputprefix='',
+                  workers=None, chunkDuration=None, chunkOverlap=CHUNK_OVERLAP, resume=True, display=None, **kwargs):
+    # Input:      workers: number of processes decoding the recording, see et_recording.RecordingData
+    #             display: display geometry for the bad sample detection, see et_detect_bad_samples.load_display_geometry
+    #             eventfunctions are called with the keyword argument recording (the shared RecordingData)
+    #             chunkDuration: seconds of gaze processed at once, None processes the whole recording at once
+    #             chunkOverlap:  seconds each chunk is padded with on both sides, see CHUNK_OVERLAP
+    #             resume:        continue an interrupted chunked run from its checkpoints
     # Output:     3 cleaned dfs: etsamples, etmsgs, etevents   
+    #             the bad sample summary (see et_detect_bad_samples.qc_summary) is saved as <outputprefix>pl_qc.csv
     # get a logger for the preprocess function    
     logger = logging.getLogger(__name__)
 
@@ -37,21 +62,67 @@ def preprocess_et(subject, datapath='/media/whitney/New Volume/Teresa/bdd-driver
         except:
             logger.warning('Error: Could not read file')
 
+    if chunkDuration is None:
+        # read every topic of the recording once, all stages share it
+        recording = RecordingData(os.path.join(datapath, subject), workers=workers).preload()
+        etsamples, etmsgs, etevents = preprocess_recording(subject, datapath, recording, surfaceMap=surfaceMap,
+                                                           clockSync=clockSync, eventfunctions=eventfunctions,
+                                                           display=display)
+    else:
+        etsamples, etmsgs, etevents = preprocess_chunked(subject, datapath, chunkDuration, chunkOverlap=chunkOverlap,
+                                                         surfaceMap=surfaceMap, clockSync=clockSync,
+                                                         eventfunctions=eventfunctions, outputprefix=outputprefix,
+                                                         resume=resume, display=display)
+
+    # Samples get removed from the samples df
+    # because of outside monitor, pupilarea Nan, negative sample time
+    logger.info('Removing bad samples')
+    cleaned_etsamples = remove_bad_samples(etsamples)
+    qc = qc_summary(etsamples)
+    logger.info('Bad samples of %s:\n%s', subject, qc.to_string(index=False))
+
+    # in case you want to save the calculated results
+    if save:
+        logger.info('Saving preprocessed et data')
+        save_file([etsamples, cleaned_etsamples, etmsgs, etevents, qc], subject, datapath, outputprefix=outputprefix)
+
+    return cleaned_etsamples, etmsgs, etevents
+
+
+def preprocess_recording(subject, datapath, recording, surfaceMap=True, clockSync=True,
+                         eventfunctions=(make_fixations, make_blinks, make_saccades), display=None):
+    # Input:      recording: RecordingData (or RecordingWindow) the stages read from
+    #             clockSync: True to load the clock model from the recording, or an already loaded model
+    # Output:     3 dfs: etsamples with bad samples and events marked, etmsgs, etevents
+    logger = logging.getLogger(__name__)
+
     # import pl data
     logger.debug("Importing et data")
     logger.debug('Caution: etevents might be empty')
-    etsamples, etmsgs, etevents = import_pl(subject=subject, datapath=datapath, surfaceMap=surfaceMap)
+    etsamples, etmsgs, etevents = import_pl(subject=subject, datapath=datapath, surfaceMap=surfaceMap,
+                                            recording=recording)
+
+    # Annotations are timestamped by the stimulus computer; move them into
+    # eye tracker time with the clock model it logged into the recording
+    if clockSync is True:
+        clockSync = load_clock_sync(subject=subject, datapath=datapath, recording=recording)
+        if clockSync is None:
+            logger.warning('No clock_sync annotation found, annotation timestamps are not corrected')
+    if clockSync:
+        logger.info('Correcting annotation timestamps with clock model %s', clockSync)
+        etmsgs = apply_clock_sync(etmsgs, clockSync)
 
     # Mark bad samples
     logger.debug('Marking bad et samples')
-    etsamples = detect_bad_samples(etsamples)
+    etsamples = detect_bad_samples(etsamples, display=display)
 
     # Detect events
     # by our default first blinks, then saccades, then fixations
     logger.debug('Making event df')
     for evtfunc in eventfunctions:
         logger.debug('Events: calling %s', evtfunc.__name__)
-        etsamples, etevents = evtfunc(etsamples, etevents, subject=subject, datapath=datapath, surfaceMap=surfaceMap)
+        etsamples, etevents = evtfunc(etsamples, etevents, subject=subject, datapath=datapath, surfaceMap=surfaceMap,
+                                      recording=recording)
 
     # Make a nice etevent df
     etevents = make_events_df(etevents)
@@ -61,14 +132,123 @@ def preprocess_et(subject, datapath='/media/whitney/New Volume/Teresa/bdd-driver
     logger.debug('Add events to each sample')
     etsamples = add_events_to_samples(etsamples, etevents)
 
-    # Samples get removed from the samples df
-    # because of outside monitor, pupilarea Nan, negative sample time
-    logger.info('Removing bad samples')
-    cleaned_etsamples = remove_bad_samples(etsamples)
-
-    # in case you want to save the calculated results
-    if save:
-        logger.info('Saving preprocessed et data')
-        save_file([etsamples, cleaned_etsamples, etmsgs, etevents], subject, datapath, outputprefix=outputprefix)
-
-    return cleaned_etsamples, etmsgs, etevents
+    return etsamples, etmsgs, etevents
+
+
+# %% chunked preprocessing of long recordings
+
+def chunk_bounds(timestamps, chunkDuration):
+    # Input:      timestamps of the gaze samples, chunkDuration in seconds
+    # Output:     list of (start, stop) times of the chunks; together they cover all times,
+    #             the first one starts at -inf and the last one ends at inf
+    if len(timestamps) == 0:
+        return [(-np.inf, np.inf)]
+    first, last = np.min(timestamps), np.max(timestamps)
+    edges = first + chunkDuration * np.arange(1, max(1, int(np.ceil((last - first) / chunkDuration))))
+    edges = [-np.inf] + edges.tolist() + [np.inf]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def preprocess_chunked(subject, datapath, chunkDuration, chunkOverlap=CHUNK_OVERLAP, surfaceMap=True, clockSync=True,
+                       eventfunctions=(make_fixations, make_blinks, make_saccades), outputprefix='', resume=True,
+                       display=None):
+    # Processes the recording in chunks of chunkDuration seconds, so that only the data of one chunk is in memory.
+    # Every chunk is padded with chunkOverlap seconds on both sides, so that the detectors see the context of
+    # the events at its borders. A chunk keeps the samples of its own time span, marked with all events it detected,
+    # and the events that start in its own time span; so every event is reported by exactly one chunk.
+    # The result of every chunk is checkpointed in preprocessed/<outputprefix>pl_chunks, an interrupted run resumes
+    # after the last finished chunk. The csv files of the detectors (blinks.csv, fixations.csv) are written once
+    # from the events of all chunks.
+    # Note: the saccade threshold is estimated per chunk, chunks should span at least a few minutes
+    # Output:     3 dfs: etsamples with bad samples and events marked, etmsgs, etevents
+    logger = logging.getLogger(__name__)
+    directory = os.path.join(datapath, subject)
+
+    # the annotations are small: messages and clock model come from the whole recording
+    annotations = RecordingData(directory)
+    etmsgs = parse_pl_msgs(annotations.pldata('annotation'))
+    if clockSync:
+        model = load_clock_sync(subject=subject, datapath=datapath, recording=annotations)
+        if model is None:
+            logger.warning('No clock_sync annotation found, annotation timestamps are not corrected')
+        else:
+            logger.info('Correcting annotation timestamps with clock model %s', model)
+            etmsgs = apply_clock_sync(etmsgs, model)
+
+    # the record index has the timestamps of all gaze samples without decoding them
+    timestamps = pl_file_methods.load_pldata_index(directory, 'gaze')['timestamp']
+    bounds = chunk_bounds(timestamps, chunkDuration)
+
+    checkpoint_path = os.path.join(directory, 'preprocessed', outputprefix + 'pl_chunks')
+    os.makedirs(checkpoint_path, exist_ok=True)
+    manifest_file = os.path.join(checkpoint_path, 'manifest.json')
+    settings = {'chunkDuration': chunkDuration, 'chunkOverlap': chunkOverlap, 'bounds': [list(b) for b in bounds],
+                'surfaceMap': surfaceMap, 'eventfunctions': [evtfunc.__name__ for evtfunc in eventfunctions],
+                'display': load_display_geometry(display)}
+    manifest = dict(settings, done=[])
+    if resume and os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            previous = json.load(f)
+        if {key: previous.get(key) for key in settings} == settings:
+            manifest = previous
+            logger.info('Resuming after %i of %i chunks', len(manifest['done']), len(bounds))
+        else:
+            logger.warning('Checkpoints in %s are of other settings, starting over', checkpoint_path)
+
+    def chunk_file(i, name, ext='pkl'):
+        return os.path.join(checkpoint_path, 'chunk_%04i_%s.%s' % (i, name, ext))
+
+    for i, (start, stop) in enumerate(bounds):
+        if i in manifest['done']:
+            continue
+        logger.info('Preprocessing chunk %i of %i (%.1f to %.1f)', i + 1, len(bounds), start, stop)
+        for filename in glob.glob(chunk_file(i, '*', 'csv')):
+            os.remove(filename)
+
+        if np.any((timestamps >= start) & (timestamps < stop)):
+            # the messages are already imported, the chunk reads no annotations
+            window = RecordingWindow(directory, start - chunkOverlap, stop + chunkOverlap,
+                                     topic_windows={'annotation': (0., 0.)})
+            etsamples, _, etevents = preprocess_recording(subject, datapath, window, surfaceMap=surfaceMap,
+                                                          clockSync=False, eventfunctions=eventfunctions,
+                                                          display=display)
+            etsamples = etsamples[(etsamples.smpl_time >= start) & (etsamples.smpl_time < stop)]
+            etevents = etevents[(etevents.start_time >= start) & (etevents.start_time < stop)]
+            # the event csv files of the detectors are cut the same way
+            for name, (csv_columns, eventdata, time_key) in window.events.items():
+                event_csv(chunk_file(i, name, 'csv'), csv_columns,
+                          [event for event in eventdata if start <= event[time_key] < stop])
+        else:
+            etsamples, etevents = pd.DataFrame(), pd.DataFrame()
+
+        etsamples.to_pickle(chunk_file(i, 'samples'))
+        etevents.to_pickle(chunk_file(i, 'events'))
+        # the chunk only counts as done once its results are on disk
+        manifest['done'].append(i)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    etsamples = pd.concat([pd.read_pickle(chunk_file(i, 'samples')) for i in range(len(bounds))], ignore_index=True,
+                          sort=False)
+    etevents = pd.concat([pd.read_pickle(chunk_file(i, 'events')) for i in range(len(bounds))], ignore_index=True,
+                         sort=False)
+
+    # the event csv files of the chunks, concatenated in order
+    chunk_csvs = {}
+    for i in range(len(bounds)):
+        for filename in sorted(glob.glob(chunk_file(i, '*', 'csv'))):
+            name = os.path.basename(filename)[len('chunk_0000_'):-len('.csv')]
+            chunk_csvs.setdefault(name, []).append(filename)
+    for name, filenames in chunk_csvs.items():
+        with open(os.path.join(directory, 'preprocessed', name + '.csv'), 'w', newline='') as out:
+            writer = csv.writer(out)
+            for n, filename in enumerate(filenames):
+                with open(filename, newline='') as f:
+                    rows = csv.reader(f)
+                    # every chunk file starts with the same header
+                    header = next(rows, None)
+                    if n == 0 and header is not None:
+                        writer.writerow(header)
+                    writer.writerows(rows)
+    return etsamples, etmsgs, etevents
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+
+from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods as pl_file_methods
+
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _decode_chunk(directory, topic, start, stop, fields):
+    # Input:    directory, topic: the <topic>.pldata file
+    #           start, stop:      record numbers to decode, stop excluded
+    #           fields:           field paths, see file_methods.to_struct_array
+    # Output:   structured array with the fields of the records
+    records = pl_file_methods.load_pldata_records(directory, topic, start, stop)
+    return pl_file_methods.to_struct_array(records.data, fields)
+
+
+def concatenate_fields(chunks):
+    # Input:    structured arrays of to_struct_array with the same fields
+    # Output:   one structured array; subarray fields that differ in shape between chunks
+    #           (e.g. chunks with and without binocular base_data) are padded with nan
+    names = chunks[0].dtype.names
+    shapes = []
+    for name in names:
+        chunk_shapes = [chunk.dtype[name].shape for chunk in chunks]
+        ndim = max(len(shape) for shape in chunk_shapes)
+        shapes.append(tuple(max(shape[d] for shape in chunk_shapes if len(shape) > d) for d in range(ndim)))
+    dtype = np.dtype([(name, np.float64, shape) for name, shape in zip(names, shapes)])
+
+    result = np.empty(sum(len(chunk) for chunk in chunks), dtype=dtype)
+    start = 0
+    for chunk in chunks:
+        stop = start + len(chunk)
+        for name, shape in zip(names, shapes):
+            block = result[name][start:stop]
+            block[...] = np.nan
+            chunk_shape = chunk.dtype[name].shape
+            # a chunk without any value has a scalar field, which broadcasts as nan
+            values = chunk[name].reshape((len(chunk),) + chunk_shape + (1,) * (len(shape) - len(chunk_shape)))
+            block[(slice(None),) + tuple(slice(0, n) for n in values.shape[1:])] = values
+        start = stop
+    return result
+
+
+class RecordingData:
+    """
+    Data of one recording for a preprocess_et run.
+
+    Every topic is read from disk once and handed to all stages (import,
+    blinks, fixations, saccades) instead of each stage loading it again.
+    pldata() returns the PLData of a topic, fields() the numeric fields of
+    all its datums as one structured array. Large topics are decoded in
+    chunks by worker processes, which read their records straight from the
+    memory-mapped .pldata file through its record index.
+    """
+
+    def __init__(self, directory, workers=None, chunk_size=50000):
+        """
+        Parameters:
+        directory (str): Recording directory.
+        workers (int): Number of decoding processes, defaults to the number of usable CPUs. 1 decodes in this process.
+        chunk_size (int): Number of records decoded by one worker task.
+        """
+        self.directory = directory
+        self.workers = workers or _available_cpus()
+        self.chunk_size = chunk_size
+        self._pldata = {}
+        self._fields = {}
+
+    def preload(self, topics=('pupil', 'gaze', 'annotation')):
+        """Reads ``topics`` in parallel threads."""
+        with concurrent.futures.ThreadPoolExecutor(len(topics)) as pool:
+            list(pool.map(self.pldata, topics))
+        return self
+
+    def pldata(self, topic):
+        if topic not in self._pldata:
+            logging.getLogger(__name__).debug('Loading %s.pldata', topic)
+            self._pldata[topic] = pl_file_methods.load_pldata_file(self.directory, topic)
+        return self._pldata[topic]
+
+    def fields(self, topic, fields):
+        """
+        Parameters:
+        topic (str): Topic, e.g. 'gaze'.
+        fields (list): Field paths, see file_methods.to_struct_array.
+
+        Returns:
+        Structured array with the fields of all datums of the topic, in file order.
+        """
+        key = (topic, tuple(fields))
+        if key not in self._fields:
+            self._fields[key] = self._decode(topic, list(fields))
+        return self._fields[key]
+
+    def _decode(self, topic, fields):
+        data = self.pldata(topic).data
+        if self.workers < 2 or len(data) <= self.chunk_size:
+            return pl_file_methods.to_struct_array(data, fields)
+        try:
+            # builds the index of old recordings once, before the workers need it
+            n_records = len(pl_file_methods.load_pldata_index(self.directory, topic))
+        except (OSError, ValueError):
+            return pl_file_methods.to_struct_array(data, fields)
+
+        bounds = [(start, min(start + self.chunk_size, n_records)) for start in range(0, n_records, self.chunk_size)]
+        with self._pool(min(self.workers, len(bounds))) as pool:
+            chunks = list(pool.map(_decode_chunk, *zip(*[(self.directory, topic, start, stop, fields)
+                                                          for start, stop in bounds])))
+        return concatenate_fields(chunks)
+
+    @staticmethod
+    def _pool(workers):
+        # fork, so that scripts calling preprocess_et at module level are not re-run by the workers;
+        # threads where fork is not available
+        if 'fork' in multiprocessing.get_all_start_methods():
+            return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        return concurrent.futures.ThreadPoolExecutor(workers)
+
+
+class RecordingWindow(RecordingData):
+    """
+    RecordingData restricted to a time window of the recording, for the
+    chunked mode of preprocess_et. Only the records of the window are read,
+    through the record index of the memory-mapped .pldata files.
+
+    The event detectors keep the raw data of their events in ``events``
+    (name -> (csv columns, events, start time field)) instead of writing
+    preprocessed/<name>.csv, see detect_events.save_event_csv.
+    """
+
+    def __init__(self, directory, start_ts, stop_ts, topic_windows=None):
+        """
+        Parameters:
+        directory (str): Recording directory.
+        start_ts, stop_ts (float): Window, start_ts <= timestamp < stop_ts.
+        topic_windows (dict): (start_ts, stop_ts) of topics with a different window, e.g. 'annotation'.
+        """
+        # a window is small, it is decoded in this process
+        super().__init__(directory, workers=1)
+        self.start_ts = start_ts
+        self.stop_ts = stop_ts
+        self.topic_windows = topic_windows or {}
+        self.events = {}
+
+    def pldata(self, topic):
+        if topic not in self._pldata:
+            start_ts, stop_ts = self.topic_windows.get(topic, (self.start_ts, self.stop_ts))
+            logging.getLogger(__name__).debug('Loading %s.pldata from %s to %s', topic, start_ts, stop_ts)
+            self._pldata[topic] = pl_file_methods.load_pldata_window(self.directory, topic, start_ts, stop_ts)
+        return self._pldata[topic]
@@ -5,7 +5,7 @@ import pandas as pd
 import os
 import shutil
 from .manual_detection import extract_frames, detect_tags_and_surfaces
-from .utils import print_progress_bar
+from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods as pl_file_methods
 
 
 # %%
@@ -63,66 +63,86 @@ def map_surface(folder, deleteFrames=False):
 
 
 def surface_map_data(surface, gaze):
-    # initialize variables
-    PLData = collections.namedtuple("PLData", ["data", "timestamps", "topics"])
-    data_gaze = []
-    data_ts_gaze = []
-    topics_gaze = []
-
-    # extract gaze info
-    data_dict = gaze._asdict()
-    data = [t for t in data_dict['data']]
-    time = [t for t in data_dict['timestamps']]
-    topics = [t for t in data_dict['topics']]
-
-    # iterate through gaze data
-    i = 0
-    n = 0
-
-    while n < len(data):
-
-        # define gaze position
-        try:
-            pupil1_pos = data[n]['base_data'][1]['norm_pos']
-            pupil0_pos = data[n]['base_data'][0]['norm_pos']
-            gaze_pos = ((pupil0_pos[0] + pupil1_pos[0]) / 2, (pupil0_pos[1] + pupil1_pos[1]) / 2)
-        except IndexError:
-            gaze_pos = data[n]['base_data'][0]['norm_pos']
-
-        # match gaze timestamp to surface timestamp
-        while (i < (len(surface.timestamp) - 1)) and (time[n] >= surface.timestamp[i + 1]):
-            i = i + 1
-
-        #  check whether gaze falls within surface
-        tl_x = surface.norm_top_left_x[i]
-        bl_x = surface.norm_bottom_left_x[i]
-        br_x = surface.norm_bottom_right_x[i]
-        tr_x = surface.norm_top_right_x[i]
-
-        left = tl_x if tl_x < bl_x else bl_x
-        right = br_x if br_x > tr_x else tr_x
-
-        if (gaze_pos[0] > left) and (gaze_pos[0] < right):
-            tl_y = surface.norm_top_left_y[i]
-            bl_y = surface.norm_bottom_left_y[i]
-            br_y = surface.norm_bottom_right_y[i]
-            tr_y = surface.norm_top_right_y[i]
-
-            top = tl_y if tl_y < tr_y else tr_y
-            bottom = br_y if br_y > bl_y else bl_y
-
-            if (gaze_pos[1] > top) and (gaze_pos[1] < bottom):
-                data_gaze.append(data[n])
-                data_ts_gaze.append(time[n])
-                topics_gaze.append(topics[n])
-        n = n + 1
-        print_progress_bar(n, len(data), prefix='Progress:', suffix='Complete', length=50)
+    # Input:    surface:      (df) surface coordinates per world frame, see map_surface()
+    #           gaze:         (PLData) gaze or fixation data
+    # Output:   Returns PLData with the datums whose position falls within the surface
+
+    data = list(gaze.data)
+    time = np.asarray(gaze.timestamps, dtype=float)
+    topics = list(gaze.topics)
+
+    # define gaze position: mean of the pupil positions, decoded in one pass
+    base_pos = pl_file_methods.to_struct_array(data, ['base_data[0].norm_pos', 'base_data[1].norm_pos'])
+    pupil0_pos = base_pos['base_data[0].norm_pos'].reshape(len(data), 2)
+    pupil1_pos = base_pos['base_data[1].norm_pos'].reshape(len(data), 2)
+    gaze_pos = np.where(np.isnan(pupil1_pos), pupil0_pos, (pupil0_pos + pupil1_pos) / 2)
+
+    # match gaze timestamp to surface timestamp (last surface at or before the gaze)
+    surface_ts = surface.timestamp.to_numpy()
+    i = np.clip(np.searchsorted(surface_ts, time, side='right') - 1, 0, len(surface_ts) - 1)
+
+    #  check whether gaze falls within surface
+    tl_x, bl_x = surface.norm_top_left_x.to_numpy()[i], surface.norm_bottom_left_x.to_numpy()[i]
+    br_x, tr_x = surface.norm_bottom_right_x.to_numpy()[i], surface.norm_top_right_x.to_numpy()[i]
+    tl_y, bl_y = surface.norm_top_left_y.to_numpy()[i], surface.norm_bottom_left_y.to_numpy()[i]
+    br_y, tr_y = surface.norm_bottom_right_y.to_numpy()[i], surface.norm_top_right_y.to_numpy()[i]
+
+    left = np.where(tl_x < bl_x, tl_x, bl_x)
+    right = np.where(br_x > tr_x, br_x, tr_x)
+    top = np.where(tl_y < tr_y, tl_y, tr_y)
+    bottom = np.where(br_y > bl_y, br_y, bl_y)
+    on_surface = ((gaze_pos[:, 0] > left) & (gaze_pos[:, 0] < right) &
+                  (gaze_pos[:, 1] > top) & (gaze_pos[:, 1] < bottom))
     print('success!')
 
-    gaze_on_srf = PLData(collections.deque(data_gaze), np.asarray(data_ts_gaze), collections.deque(topics_gaze))
+    on_surface = np.flatnonzero(on_surface)
+    gaze_on_srf = pl_file_methods.PLData(collections.deque(data[n] for n in on_surface), time[on_surface],
+                                         collections.deque(topics[n] for n in on_surface))
     return gaze_on_srf
 
 
+def load_surface_export(folder, surfaceName, exportDir='exports'):
+    # Input:    folder:       (str) recording directory, exported with the headless Pupil surface tracker
+    #                         (lib/pupil/pupil_src/shared_modules/surface_tracker/surface_tracker_headless.py)
+    #           surfaceName:  (str) name of the surface definition
+    #           exportDir:    (str) export directory of the surface tracker, relative to folder
+    # Output:   Returns df of gaze_positions_on_surface_<surfaceName>.csv, one row per gaze datum and world frame
+    #           in which the surface was detected
+
+    path = os.path.join(folder, exportDir, 'surfaces', 'gaze_positions_on_surface_%s.csv' % surfaceName.replace('/', ''))
+    return pd.read_csv(path)
+
+
+def annotate_surface_export(etsamples, gaze_on_surface):
+    # Input:    etsamples df
+    #           gaze_on_surface: (df) see load_surface_export()
+    # Output:   etsamples with the column 'surface', True for the gaze samples on the surface, and the columns
+    #           'sx', 'sy', the gaze in normalized surface coordinates (NaN for samples without a detected surface)
+
+    on_surface = gaze_on_surface.gaze_timestamp[gaze_on_surface.on_surf.astype(bool)]
+    # a gaze sample is exported once per world frame it falls into
+    surface_pos = gaze_on_surface.groupby('gaze_timestamp')[['x_norm', 'y_norm']].mean()
+    return etsamples.assign(surface=etsamples.smpl_time.isin(on_surface).to_numpy(),
+                            sx=etsamples.smpl_time.map(surface_pos.x_norm).to_numpy(dtype=float),
+                            sy=etsamples.smpl_time.map(surface_pos.y_norm).to_numpy(dtype=float))
+
+
+def fixations_on_surface_export(fixations_data, gaze_on_surface):
+    # Input:    fixations_data:  fixation dicts with timestamp and duration (ms)
+    #           gaze_on_surface: (df) see load_surface_export()
+    # Output:   boolean array, True for the fixations with most of their gaze on the surface
+
+    order = np.argsort(gaze_on_surface.gaze_timestamp.to_numpy(), kind='stable')
+    gaze_ts = gaze_on_surface.gaze_timestamp.to_numpy()[order]
+    on_surface = np.concatenate(([0], np.cumsum(gaze_on_surface.on_surf.to_numpy(dtype=bool)[order])))
+
+    start = np.array([fix['timestamp'] for fix in fixations_data], dtype=float)
+    stop = start + np.array([fix['duration'] for fix in fixations_data], dtype=float) / 1000
+    first = np.searchsorted(gaze_ts, start, side='left')
+    last = np.searchsorted(gaze_ts, stop, side='right')
+    return 2 * (on_surface[last] - on_surface[first]) > last - first
+
+
 def annotate_surface(etsamples, gaze_on_srf):
     # create df to store index of marked samples
     marked_samples = pd.DataFrame()
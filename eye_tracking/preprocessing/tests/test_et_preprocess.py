@@ -0,0 +1,80 @@
+# The chunked mode of preprocess_et has to report every event exactly once,
+# in the data frames as well as in the csv files of the detectors.
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the preprocessing imports the Pupil modules like debug/add_path.py sets them up
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+sys.path.append(root)
+sys.path.append(os.path.join(root, 'eye_tracking', 'lib', 'pupil', 'pupil_src', 'shared_modules'))
+
+pytest.importorskip("pyglui")
+pytest.importorskip("OpenGL")
+pytest.importorskip("pupil_apriltags")
+
+from eye_tracking.lib.pupil.pupil_src.shared_modules import file_methods
+from eye_tracking.preprocessing.functions.detect_events import make_blinks, make_fixations
+from eye_tracking.preprocessing.functions.et_preprocess import preprocess_et
+
+DURATION = 40.
+RATE = 200.
+
+
+def write_recording(directory):
+    # gaze jumps to a new position every 0.4 s, the pupil is lost for 0.15 s every 3 s
+    rng = np.random.default_rng(0)
+    timestamps = 100. + np.arange(0, DURATION, 1 / RATE)
+    targets = rng.uniform(0.2, 0.8, (int(DURATION / 0.4) + 1, 2))
+    with file_methods.PLData_Writer(directory, 'pupil') as pupil, \
+            file_methods.PLData_Writer(directory, 'gaze') as gaze:
+        for t in timestamps:
+            confidence = 0. if (t - 100.) % 3. > 2.85 else 0.99
+            x, y = targets[int((t - 100.) / 0.4)] + rng.normal(0, 0.001, 2)
+            datum = {'topic': 'pupil.0.2d', 'timestamp': float(t), 'confidence': confidence, 'diameter': 40.,
+                     'id': 0, 'norm_pos': (0.5, 0.5), 'method': '2d c++',
+                     'ellipse': {'axes': (30., 40.), 'center': (1., 1.), 'angle': 0.}}
+            pupil.append(datum)
+            gaze.append({'topic': 'gaze.2d.0.', 'timestamp': float(t), 'confidence': confidence,
+                         'norm_pos': (float(x), float(y)), 'base_data': [datum]})
+    with file_methods.PLData_Writer(directory, 'annotation') as annotation:
+        for k, t in enumerate(np.arange(101., 100. + DURATION, 5.)):
+            annotation.append({'topic': 'annotation', 'label': 'Begin trial %d' % k, 'timestamp': float(t),
+                               'duration': 0.})
+    np.save(os.path.join(directory, 'world_timestamps.npy'), np.arange(timestamps[0], timestamps[-1], 1 / 30.))
+
+
+def read_event_csv(directory):
+    return (pd.read_csv(os.path.join(directory, 'preprocessed', 'blinks.csv')),
+            pd.read_csv(os.path.join(directory, 'preprocessed', 'fixations.csv')))
+
+
+def test_chunked_event_csv(tmp_path):
+    directory = tmp_path / 's1'
+    directory.mkdir()
+    write_recording(str(directory))
+    kwargs = dict(subject='s1', datapath=str(tmp_path), surfaceMap=False, clockSync=False, save=False,
+                  eventfunctions=(make_blinks, make_fixations))
+
+    _, _, etevents = preprocess_et(**kwargs)
+    blinks, fixations = read_event_csv(str(directory))
+    _, _, chunked_etevents = preprocess_et(chunkDuration=DURATION / 4, **kwargs)
+    chunked_blinks, chunked_fixations = read_event_csv(str(directory))
+
+    # the csv files hold the events of all chunks, and only once
+    assert len(blinks) > 4
+    assert len(chunked_blinks) == len(blinks)
+    assert len(chunked_fixations) == len(fixations)
+    assert not chunked_blinks.start_timestamp.duplicated().any()
+    assert not chunked_fixations.timestamp.duplicated().any()
+    # the blink filter sees less data at the start of a chunk, its edges may move by a sample
+    np.testing.assert_allclose(chunked_blinks.start_timestamp, blinks.start_timestamp, atol=1.5 / RATE)
+    np.testing.assert_allclose(chunked_fixations.timestamp, fixations.timestamp)
+    # and agree with the events of the data frame
+    np.testing.assert_allclose(np.sort(chunked_etevents[chunked_etevents.type == 'blink'].start_time),
+                               chunked_blinks.start_timestamp)
+    assert (etevents.type == 'blink').sum() == len(blinks)
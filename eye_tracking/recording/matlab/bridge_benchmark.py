@@ -0,0 +1,64 @@
+"""
+Replays synthetic display computer traffic against the TriggerBridge.
+
+A local Pupil Remote stand-in (recording/python/pupil_remote_stub.py) answers
+the forwarded triggers, so no eye tracker is needed. Triggers are sent over
+UDP in bursts; the latency histograms of the run are printed and written to
+CSV.
+
+    python bridge_benchmark.py [N_TRIGGERS] [RATE_PER_SECOND] [BURST] [REPLY_DELAY_SECONDS]
+"""
+import os
+import socket
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from mm_modules.bridge import TriggerBridge, LATENCIES, HISTOGRAM_BINS_MS
+from pupil_remote_stub import PupilRemoteStub
+
+
+def replay(n_triggers=10000, rate=1000., burst=1, delay=0.0, payloads=(b'0', b'1', b'2', b'3', b'4')):
+    """
+    Sends ``n_triggers`` numbered triggers at ``rate`` per second, ``burst``
+    datagrams back to back at a time, and returns the bridge after it has
+    forwarded all of them.
+    """
+    with PupilRemoteStub(delay=delay) as stub:
+        bridge = TriggerBridge(pupil_port=stub.port, udp_address=('127.0.0.1', 0))
+        bridge.start()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        interval = burst / rate
+        start = time.perf_counter()
+        sent = 0
+        while sent < n_triggers:
+            for _ in range(min(burst, n_triggers - sent)):
+                sender.sendto(payloads[sent % len(payloads)], bridge.udp_address)
+                sent += 1
+            time.sleep(max(0., start + (sent // burst) * interval - time.perf_counter()))
+        sender.sendto(b'NOT_A_TRIGGER', bridge.udp_address)
+        elapsed = time.perf_counter() - start
+        bridge.stop(timeout=max(5.0, n_triggers * delay * 2))
+        sender.close()
+    print('Sent {} triggers in {:.2f}s ({:.0f}/s), Pupil Remote received {}.'.format(
+        n_triggers, elapsed, n_triggers / elapsed, stub.forwarded))
+    return bridge
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    n_triggers = int(args[0]) if len(args) >= 1 else 10000
+    rate = float(args[1]) if len(args) >= 2 else 1000.
+    burst = int(args[2]) if len(args) >= 3 else 1
+    delay = float(args[3]) if len(args) >= 4 else 0.0
+
+    bridge = replay(n_triggers, rate, burst, delay)
+    stats = bridge.latency_stats()
+    print('Batches: {}, unknown payloads: {}, errors: {}'.format(stats['batches'], stats['unknown'], stats['errors']))
+    for name in LATENCIES:
+        print('{:>20} ms: {}'.format(name, ', '.join('p{}={:.3f}'.format(p, v) for p, v in stats[name + '_ms'].items())))
+    histograms = bridge.latency_histograms()
+    print('{:>10} {}'.format('<= ms', ' '.join('{:>20}'.format(name) for name in LATENCIES)))
+    for i, upper in enumerate(HISTOGRAM_BINS_MS):
+        print('{:>10} {}'.format(upper, ' '.join('{:>20}'.format(histograms[name][i]) for name in LATENCIES)))
+    bridge.export_latencies('bridge_benchmark_triggers.csv', 'bridge_benchmark_histogram.csv')
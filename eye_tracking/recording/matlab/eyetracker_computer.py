@@ -1,12 +1,23 @@
-from mm_modules import pupilsocket, pytcp, pyudp
 import logging
-from time import time
+import os
+import sys
+from time import time, sleep
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from clock_sync import ClockSyncClient
+from mm_modules.bridge import TriggerBridge
 
 time_fn = time
 
+# Port of Pupil Capture's Time Sync master (shown in the Time Sync plugin), None to skip clock sync
+clock_sync_port = None
+# Seconds between clock models logged into the recording
+clock_log_interval = 30
+
 # Begin runtime with entry of ppID
 # This is used later for setting dir/file names
 participantID = input('Participant ID: ')
+session = time_fn()
 
 ## Establish Logger
 logger = logging.getLogger()
@@ -14,7 +25,7 @@ logger.setLevel(logging.DEBUG)
 
 formatter = logging.Formatter('%(asctime)s:%(name)s:%(message)s')
 
-fileHandler = logging.FileHandler('{}_{}.log'.format(participantID, time_fn()))
+fileHandler = logging.FileHandler('{}_{}.log'.format(participantID, session))
 fileHandler.setLevel(logging.DEBUG)
 fileHandler.setFormatter(formatter)
 
@@ -26,70 +37,62 @@ logger.addHandler(fileHandler)
 logger.info('Logging initialised at {}.'.format(fileHandler))
 
 ## Connect sockets
-# udp sock
-udpListeningSock = pyudp.UDPsocket('192.168.0.113', 8008)
-udpListeningSock.sock_bind()
-
-pupilLink = pupilsocket.ZMQsocket('192.168.0.113', 8008)
-pupilLink.zmq_connect()
+# The bridge listens for the display computer's triggers on UDP and TCP at
+# the same time and forwards them to Pupil Remote (default port 50020).
+bridge = TriggerBridge(pupil_ip='192.168.0.113', pupil_port=50020,
+                       udp_address=('192.168.0.113', 8008),
+                       tcp_address=('192.168.0.113', 8009),
+                       time_fn=time_fn)
+bridge.start()
 logger.info('Pupil socket connected.')
 
-pupilLink.notify({'subject': 'start_plugin',
-                    'name': 'Log_History',
-                    'args': {}})
-pupilLink.notify({'subject': 'start_plugin',
-                    'name': 'Annotation_Capture',
-                    'args': {}})
+bridge.notify({'subject': 'start_plugin',
+               'name': 'Log_History',
+               'args': {}}).result()
+bridge.notify({'subject': 'start_plugin',
+               'name': 'Annotation_Capture',
+               'args': {}}).result()
 logger.info('Pupil-Recorder Annotations plugin prompted.')
 
 ## The Pupil developers recommend using their Sync system
 ## Time() here will work but won't be millisecond accurate.
-pupilLink.set_time(time_fn())
+bridge.set_time(time_fn)
 logger.info('Pupil-Recorder time set.')
-pupilLink.send_trigger('Dummy Trigger', timestamp=time_fn())
-
-## Define Triggers using a dict for pseudo switch cases
-## Note that this solution will not handle mixed cases
-# Commands
-def startrec():
-    # This is currently set to receive input from stimuli code 
-    # you may want to just change recTitle input to ParticipantID
-    pupilLink.start_recording(recTitle=data[10:len(data)])
-def stoprec():
-    pupilLink.stop_recording()
-def startcal():
-    pupilLink.start_calibration()
-def stopcal():
-    pupilLink.stop_calibration()
-# Triggers
-def trig0():
-    pupilLink.send_trigger('Event0', timestamp=time_fn())
-def trig1():
-    pupilLink.send_trigger('Event1', timestamp=time_fn())
-def trig2():
-    pupilLink.send_trigger('Event2', timestamp=time_fn())
-def trig3():
-    pupilLink.send_trigger('Event3', timestamp=time_fn())
-def trig4():
-    pupilLink.send_trigger('Event4', timestamp=time_fn())
-
-triggerDict = {
-    # Commands
-    b'START_REC' : startrec,
-    b'STOP_REC' : stoprec,
-    b'START_CAL' : startcal,
-    b'STOP_CAL' : stopcal,
-    # Triggers
-    b'0': trig0,
-    b'1': trig1,
-    b'2': trig2,
-    b'3': trig3,
-    b'4': trig4
-    }
-
-## start listening to udpListeningSock
-while True:
-    data, time = udpListeningSock.sock_listen()
-    print(data, time)
-    if data:
-        triggerDict[data]()
\ No newline at end of file
+bridge.annotation('Dummy Trigger').result()
+
+## set_time() only aligns the clocks once. The clock sync client keeps
+## estimating offset and drift against Pupil's Time Sync master, and the
+## model is logged into the recording as a 'clock_sync' annotation, which
+## preprocess_et uses to correct the annotation timestamps.
+clock = None
+if clock_sync_port:
+    clock = ClockSyncClient('192.168.0.113', clock_sync_port, time_fn=time_fn)
+    logger.info('Clock sync: {}'.format(clock.sync()))
+    clock.start()
+
+
+def log_clock_model():
+    annotation = clock.annotation()
+    annotation.update({'subject': 'annotation', 'record': True})
+    bridge.notify(annotation)
+    logger.info('Clock sync: {}'.format(clock.model()))
+
+## Triggers (START_REC <title>, STOP_REC, START_CAL, STOP_CAL and the numbered
+## events) are dispatched by the bridge; unknown payloads are only logged.
+## Forwarding latencies are written next to the log when the bridge stops.
+try:
+    last_clock_log = time_fn()
+    while True:
+        sleep(1)
+        if clock is not None and time_fn() - last_clock_log > clock_log_interval:
+            log_clock_model()
+            last_clock_log = time_fn()
+except KeyboardInterrupt:
+    pass
+finally:
+    if clock is not None:
+        clock.stop()
+    bridge.stop()
+    bridge.export_latencies('{}_{}_triggers.csv'.format(participantID, session),
+                            '{}_{}_latency_histogram.csv'.format(participantID, session))
+    logger.info('Trigger latencies: {}'.format(bridge.latency_stats()))
@@ -0,0 +1,319 @@
+import asyncio
+import bisect
+import csv
+import logging
+import threading
+import time
+
+# async_zmq_socket is in recording/python, the scripts add it to sys.path
+from async_zmq_socket import AsyncZMQsocket, TriggerRecord
+
+# Upper bin edges of the latency histograms in milliseconds
+HISTOGRAM_BINS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+
+
+class BridgeRecord(TriggerRecord):
+    """
+    Bookkeeping of a single trigger passing through the bridge.
+
+    receive_time is taken when the datagram (or TCP chunk) was read,
+    forward_time when the trigger left for Pupil Remote and ack_time when
+    Pupil Remote replied. All three use the clock of the TriggerBridge.
+    Requests of the bridge itself have the source 'local'.
+    """
+
+    LATENCIES = {
+        'receive_to_forward': ('enqueue_time', 'send_time'),
+        'forward_to_ack': ('send_time', 'ack_time'),
+        'receive_to_ack': ('enqueue_time', 'ack_time'),
+    }
+
+    __slots__ = ('source', 'payload', 'batch')
+
+    def __init__(self, topic, frames, acked, enqueue_time, future=None, source='local', payload=None):
+        super().__init__(topic, frames, acked, enqueue_time, future)
+        self.source = source
+        self.payload = topic if payload is None else payload
+        self.batch = None
+
+    @property
+    def receive_time(self):
+        return self.enqueue_time
+
+    @property
+    def forward_time(self):
+        return self.send_time
+
+    def as_dict(self):
+        return {
+            'source': self.source,
+            'payload': self.payload,
+            'topic': self.topic,
+            'receive_time': self.receive_time,
+            'forward_time': self.forward_time,
+            'ack_time': self.ack_time,
+            'batch': self.batch,
+            'reply': self.reply,
+            'error': self.error,
+            'retries': self.retries,
+        }
+
+
+LATENCIES = tuple(BridgeRecord.LATENCIES)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+
+    def datagram_received(self, data, addr):
+        self.bridge.receive(data, 'udp', addr)
+
+
+class TriggerBridge(AsyncZMQsocket):
+    """
+    Event-driven replacement of the blocking UDP -> Pupil Remote loop.
+
+    The asyncio loop of AsyncZMQsocket also listens on a UDP and a TCP port
+    and forwards the triggers of the display computer to Pupil Remote.
+    Triggers are not sent one REQ round trip at a time: whatever has queued
+    up since the last send goes out as one batch over the DEALER socket, and
+    the replies are matched to the triggers in order.
+
+    Payloads are 'START_REC [title]', 'STOP_REC', 'START_CAL', 'STOP_CAL' or
+    a number n, which becomes the annotation 'Event<n>'. Unknown payloads are
+    logged and counted. Every trigger keeps its receive, forward and ack
+    timestamps for latency_histograms() and export_latencies().
+    """
+
+    record_class = BridgeRecord
+
+    def __init__(self, pupil_ip='127.0.0.1', pupil_port=50020, udp_address=None, tcp_address=None,
+                 buffersize=1024, max_batch=64, timeout=1.0, max_retries=3, history=100000,
+                 time_fn=time.time, clock=time.perf_counter):
+        """
+        Parameters:
+        pupil_ip (str): Address of the Pupil Capture computer.
+        pupil_port (int): Pupil Remote port.
+        udp_address (tuple): (ip, port) to receive UDP triggers on, None to disable.
+        tcp_address (tuple): (ip, port) to accept TCP connections on, None to disable.
+        buffersize (int): Maximum size of a datagram or TCP read.
+        max_batch (int): Maximum number of triggers sent in one batch.
+        timeout (float): Seconds to wait for a reply before reconnecting.
+        max_retries (int): How often an unanswered trigger is resent.
+        history (int): Number of finished BridgeRecords kept for statistics.
+        time_fn (callable): Clock of the annotation timestamps, as set with set_time().
+        clock (callable): Clock used for the receive, forward and ack timestamps.
+        """
+        super().__init__(ip=pupil_ip, port=pupil_port, timeout=timeout, max_retries=max_retries,
+                         history=history, clock=clock)
+        self.udp_address = udp_address
+        self.tcp_address = tcp_address
+        self.buffersize = buffersize
+        self.max_batch = max_batch
+        self.time_fn = time_fn
+        self.unknown = 0
+        self.batches = 0
+        self.logger = logging.getLogger(__name__)
+        self._unknown_lock = threading.Lock()
+
+        self.commands = {
+            b'START_REC': lambda arg, timestamp: ['R {}'.format(arg).strip()],
+            b'STOP_REC': lambda arg, timestamp: ['r'],
+            b'START_CAL': lambda arg, timestamp: ['C'],
+            b'STOP_CAL': lambda arg, timestamp: ['c'],
+        }
+
+        self._transports = []
+
+    # connection handling
+
+    def start(self, timeout=5.0):
+        """
+        Starts the bridge loop in a background thread. Blocks until Pupil
+        Remote answered and the listening sockets are bound.
+        """
+        self.connect(timeout)
+        return self
+
+    def stop(self, timeout=5.0):
+        """
+        Closes the listening sockets, waits until the queued triggers have been
+        acknowledged (or `timeout` passed) and stops the loop.
+        """
+        self.close(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    async def _start(self):
+        pub_port = await super()._start()
+        if self.udp_address is not None:
+            transport, _ = await self._loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=self.udp_address)
+            self.udp_address = transport.get_extra_info('sockname')[:2]
+            self._transports.append(transport)
+            self.logger.info('Listening for UDP triggers on {}:{}.'.format(*self.udp_address))
+        if self.tcp_address is not None:
+            server = await asyncio.start_server(self._tcp_client, *self.tcp_address)
+            self.tcp_address = server.sockets[0].getsockname()[:2]
+            self._transports.append(server)
+            self.logger.info('Listening for TCP triggers on {}:{}.'.format(*self.tcp_address))
+        return pub_port
+
+    async def _stop(self, timeout):
+        for transport in self._transports:
+            transport.close()
+        await super()._stop(timeout)
+
+    def _reconnect(self):
+        self.logger.warning('Pupil Remote did not answer within {}s, reconnecting.'.format(self.timeout))
+        super()._reconnect()
+
+    # receiving
+
+    async def _tcp_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        self.logger.info('TCP connection from {}.'.format(addr))
+        try:
+            while True:
+                chunk = await reader.read(self.buffersize)
+                if not chunk:
+                    break
+                receive_time = self.clock()
+                # MATLAB's fwrite does not delimit messages, so a read is a
+                # message unless the sender separates them with newlines
+                for line in chunk.splitlines():
+                    self.receive(line, 'tcp', addr, receive_time)
+        finally:
+            writer.close()
+            self.logger.info('TCP connection from {} closed.'.format(addr))
+
+    def receive(self, data, source='udp', addr=None, receive_time=None):
+        """
+        Parses a trigger payload and queues it for forwarding. Safe to call
+        from any thread, the record is handed over to the bridge loop.
+
+        Returns:
+        BridgeRecord of the trigger, or None if the payload is unknown.
+        """
+        if receive_time is None:
+            receive_time = self.clock()
+        timestamp = self.time_fn()
+        self.logger.debug('Received buffer {} from {} {}.'.format(data, source, addr))
+        data = data.strip()
+        if not data:
+            return None
+        command, _, arg = data.partition(b' ')
+        arg = arg.decode(errors='replace').strip()
+        if command in self.commands:
+            frames = [frame.encode() for frame in self.commands[command](arg, timestamp)]
+        elif command.isdigit():
+            frames = self._annotation_frames('Event{}'.format(command.decode()), timestamp)
+        else:
+            with self._unknown_lock:
+                self.unknown += 1
+            self.logger.warning('Ignoring unknown trigger {} from {} {}.'.format(data, source, addr))
+            return None
+        record = BridgeRecord(frames[0].decode(), frames, True, receive_time, source=source,
+                              payload=data.decode(errors='replace'))
+        return self._put(record)
+
+    def _annotation_frames(self, label, timestamp, duration=0.):
+        notification = {'subject': 'annotation', 'label': label,
+                        'timestamp': timestamp, 'duration': duration,
+                        'source': 'homelabs framework', 'record': True}
+        return self._notification_frames(notification)
+
+    # forwarding
+
+    async def _next_batch(self):
+        batch = []
+        if not self._requeue:
+            batch.append(await self._queue.get())
+            # one loop iteration lets datagrams that are already readable join the batch
+            await asyncio.sleep(0)
+        while self._requeue and len(batch) < self.max_batch:
+            batch.append(self._requeue.popleft())
+        while not self._queue.empty() and len(batch) < self.max_batch:
+            batch.append(self._queue.get_nowait())
+        batch = [record for record in batch if record is not None]
+        if batch:
+            self.batches += 1
+            for record in batch:
+                record.batch = len(batch)
+            self.logger.debug('Forwarding a batch of {} triggers.'.format(len(batch)))
+        return batch
+
+    def _finish(self, record, reply=None, error=None):
+        if error is not None:
+            self.logger.error('Trigger {} failed: {}.'.format(record.payload, error))
+        else:
+            self.logger.debug('Trigger {} acknowledged: {}.'.format(record.payload, reply))
+        super()._finish(record, reply, error)
+
+    # commands, safe to call from any thread
+
+    def annotation(self, label, duration=0.):
+        """Sends an annotation timestamped with ``time_fn()``, returns a Future of the reply."""
+        return self._request('notify.annotation', self._annotation_frames(label, self.time_fn(), duration))
+
+    def set_time(self, time_fn=None):
+        """
+        Sets the Pupil clock to ``time_fn()`` and waits for the reply. Annotation
+        timestamps are taken with the same function afterwards.
+        """
+        return super().set_time(time_fn or self.time_fn)
+
+    # statistics
+
+    def _finished_records(self):
+        return [record for record in list(self.history) if record.source != 'local']
+
+    def latency_histograms(self, bins=HISTOGRAM_BINS_MS):
+        """
+        Histograms of the receive -> forward, forward -> ack and
+        receive -> ack latencies of the finished triggers.
+
+        Parameters:
+        bins (sequence): Ascending upper bin edges in milliseconds.
+
+        Returns:
+        dict of latency name -> list of counts, one per bin.
+        """
+        histograms = {name: [0] * len(bins) for name in LATENCIES}
+        for record in self._finished_records():
+            for name in LATENCIES:
+                latency = record.latency(name)
+                if latency is not None:
+                    histograms[name][min(bisect.bisect_left(bins, latency), len(bins) - 1)] += 1
+        return histograms
+
+    def export_latencies(self, records_path, histogram_path=None, bins=HISTOGRAM_BINS_MS):
+        """
+        Writes the per-trigger timestamps to ``records_path`` and, if given, the
+        latency histograms to ``histogram_path`` (both CSV).
+        """
+        fields = list(BridgeRecord('', [], True, 0).as_dict())
+        with open(records_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields + ['{}_ms'.format(name) for name in LATENCIES])
+            writer.writeheader()
+            for record in list(self.history):
+                row = record.as_dict()
+                row.update({'{}_ms'.format(name): record.latency(name) for name in LATENCIES})
+                writer.writerow(row)
+        if histogram_path is not None:
+            histograms = self.latency_histograms(bins)
+            with open(histogram_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['lower_ms', 'upper_ms'] + list(LATENCIES))
+                for i, upper in enumerate(bins):
+                    lower = bins[i - 1] if i else 0
+                    writer.writerow([lower, upper] + [histograms[name][i] for name in LATENCIES])
+
+    def latency_stats(self, percentiles=(50, 90, 99, 100)):
+        """Latency percentiles in milliseconds of the finished triggers."""
+        stats = super().latency_stats(percentiles)
+        stats.update(unknown=self.unknown, batches=self.batches)
+        return stats
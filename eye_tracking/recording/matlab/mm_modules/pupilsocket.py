@@ -45,8 +45,8 @@ class ZMQsocket:
     
     def set_time(self, time='0.0'):
         """
-        Placeholder time-setting. Pupil-Sync is probably superior.
-        Default is ``0.0``.
+        Placeholder time-setting. Pupil-Sync is probably superior,
+        see recording/python/clock_sync.py. Default is ``0.0``.
         """
         self.socket.send_string('T {}'.format(time))
         self.logger.info(self.socket.recv_string())
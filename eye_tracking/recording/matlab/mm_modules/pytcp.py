@@ -25,8 +25,8 @@ class TCPsocket:
         """
         self.sock.listen(backlog)
         self.conn, self.addr = self.sock.accept()
-        self.data = self.conn.recv(BUFFER_SIZE)
-        self.logger.info("Received buffer: {}.".format(self.data))
+        self.data = self.conn.recv(self.buffersize)
+        self.logger.debug("Received buffer: {}.".format(self.data))
         return (self.data)
 
     def sock_close(self):
@@ -23,7 +23,7 @@ class UDPsocket:
         listen to the socket via recvfrom(), 
         which only runs once, thus requiring iteration.
         """
-        self.data, self.addr = self.sock.recvfrom(1024)
+        self.data, self.addr = self.sock.recvfrom(self.buffersize)
         self.t1s = int(round(time.time()*1000))
-        self.logger.info("Received buffer: {}.".format(self.data))
+        self.logger.debug("Received buffer: {}.".format(self.data))
         return (self.data, self.t1s)
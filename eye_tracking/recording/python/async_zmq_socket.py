@@ -0,0 +1,401 @@
+import asyncio
+import collections
+import concurrent.futures
+import threading
+import time
+
+import msgpack as serializer
+import zmq
+import zmq.asyncio
+
+
+class TriggerRecord:
+    """
+    Bookkeeping of a single message sent to Pupil Remote.
+
+    All timestamps are taken with the clock of the AsyncZMQsocket:
+    enqueue_time when the caller handed the message over, send_time when it
+    left the host and ack_time when Pupil Remote replied (None for
+    messages sent over the PUB socket, which are never acknowledged).
+    """
+
+    # latency name -> (start, end) timestamp attributes
+    LATENCIES = {
+        'queueing': ('enqueue_time', 'send_time'),
+        'round_trip': ('send_time', 'ack_time'),
+    }
+
+    __slots__ = ('topic', 'frames', 'acked', 'enqueue_time', 'send_time',
+                 'ack_time', 'reply', 'error', 'retries', 'future')
+
+    def __init__(self, topic, frames, acked, enqueue_time, future=None):
+        self.topic = topic
+        self.frames = frames
+        self.acked = acked
+        self.enqueue_time = enqueue_time
+        self.send_time = None
+        self.ack_time = None
+        self.reply = None
+        self.error = None
+        self.retries = 0
+        self.future = future
+
+    def latency(self, name):
+        """Latency ``name`` (see LATENCIES) in milliseconds, None if not available."""
+        start, end = (getattr(self, attr) for attr in self.LATENCIES[name])
+        if start is None or end is None:
+            return None
+        return 1000 * (end - start)
+
+    def as_dict(self):
+        return {
+            'topic': self.topic,
+            'enqueue_time': self.enqueue_time,
+            'send_time': self.send_time,
+            'ack_time': self.ack_time,
+            'reply': self.reply,
+            'error': self.error,
+            'retries': self.retries,
+        }
+
+
+class AsyncZMQsocket:
+    """
+    Non-blocking counterpart of ZMQsocket.
+
+    An asyncio loop in a background thread owns the sockets. Callers only
+    enqueue messages, so a slow Pupil Capture reply never stalls the
+    simulator loop. Requests go through a DEALER socket to Pupil Remote's
+    REP socket, which allows many requests in flight while the replies
+    still arrive in order. If the oldest request is not answered within
+    `timeout` seconds, the DEALER socket is reconnected and the
+    unanswered requests are resent, up to `max_retries` times.
+
+    Commands (C, R, T, notifications, ...) return a concurrent.futures.Future
+    of the reply string. Annotations return their TriggerRecord right away.
+
+    Subclasses can send other records (record_class) and send several
+    records at a time (_next_batch()).
+    """
+
+    record_class = TriggerRecord
+
+    def __init__(self, ip='127.0.0.1', port='50020', timeout=1.0, max_retries=3,
+                 max_in_flight=1000, max_queue=100000, history=100000, clock=time.perf_counter):
+        """
+        Parameters:
+        ip (str): Address of the Pupil Capture computer.
+        port (str): Pupil Remote port. Defaults to 50020.
+        timeout (float): Seconds to wait for a reply before reconnecting.
+        max_retries (int): How often an unanswered request is resent.
+        max_in_flight (int): Maximum number of unanswered requests.
+        max_queue (int): Maximum number of messages waiting to be sent.
+        history (int): Number of finished TriggerRecords kept for statistics.
+        clock (callable): Clock used for the enqueue, send and ack timestamps.
+        """
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.clock = clock
+        self.history = collections.deque(maxlen=history)
+        self.dropped = 0
+        self.time_fn = None
+
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._thread = None
+        self._queue = None
+        self._in_flight = collections.deque()
+        self._requeue = collections.deque()
+        self._ctx = None
+        self._dealer = None
+        self._pub_socket = None
+        self._tasks = []
+
+    # connection handling
+
+    def connect(self, timeout=5.0):
+        """
+        Starts the background loop and connects to Pupil Remote. Blocks until
+        the PUB port is known.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='AsyncZMQsocket', daemon=True)
+        self._thread.start()
+        started = asyncio.run_coroutine_threadsafe(self._start(), self._loop)
+        self.pub_port = started.result(timeout)
+
+    def close(self, timeout=5.0):
+        """
+        Waits until everything queued has been sent and acknowledged (or
+        `timeout` passed), then stops the background loop.
+        """
+        if self._loop is None:
+            return
+        stopped = asyncio.run_coroutine_threadsafe(self._stop(timeout), self._loop)
+        stopped.result(timeout + 1.0)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        # records put while stopping are still waiting in the loop, finish them
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _start(self):
+        self._ctx = zmq.asyncio.Context()
+        self._queue = asyncio.Queue()
+        self._in_flight_free = asyncio.Semaphore(self.max_in_flight)
+        self._open_dealer()
+        await self._dealer.send_multipart([b'', b'PUB_PORT'])
+        if not await self._dealer.poll(self.timeout * 1000 * (self.max_retries + 1)):
+            raise TimeoutError(f'Pupil Remote at {self.ip}:{self.port} did not answer')
+        _, pub_port = await self._dealer.recv_multipart()
+        pub_port = pub_port.decode()
+        self._pub_socket = self._ctx.socket(zmq.PUB)
+        self._pub_socket.connect(f'tcp://{self.ip}:{pub_port}')
+        self._tasks = [
+            asyncio.ensure_future(self._sender()),
+            asyncio.ensure_future(self._receiver()),
+        ]
+        return pub_port
+
+    async def _stop(self, timeout):
+        deadline = self.clock() + timeout
+        while (self._queue.qsize() or self._requeue or self._in_flight) and self.clock() < deadline:
+            await asyncio.sleep(0.005)
+        for task in self._tasks:
+            task.cancel()
+        for record in list(self._in_flight) + self._drain_queue():
+            self._finish(record, error='closed')
+        self._in_flight.clear()
+        self._queue = None
+        self._dealer.close(linger=0)
+        self._pub_socket.close(linger=0)
+        self._ctx.term()
+
+    def _drain_queue(self):
+        records = list(self._requeue)
+        self._requeue.clear()
+        while not self._queue.empty():
+            records.append(self._queue.get_nowait())
+        return [record for record in records if record is not None]
+
+    def _open_dealer(self):
+        self._dealer = self._ctx.socket(zmq.DEALER)
+        self._dealer.setsockopt(zmq.LINGER, 0)
+        self._dealer.connect(f'tcp://{self.ip}:{self.port}')
+
+    def _reconnect(self):
+        """
+        Replaces the DEALER socket and resends all unanswered requests. Replies
+        that arrive late on the old socket are discarded with it.
+        """
+        self._dealer.close(linger=0)
+        self._open_dealer()
+        unanswered = list(self._in_flight)
+        self._in_flight.clear()
+        for record in reversed(unanswered):
+            self._in_flight_free.release()
+            record.retries += 1
+            if record.retries > self.max_retries:
+                self._finish(record, error='timeout')
+            else:
+                self._requeue.appendleft(record)
+        # wake up the sender in case it is waiting on an empty queue
+        self._queue.put_nowait(None)
+
+    # background coroutines
+
+    async def _next_batch(self):
+        """Waits for the next records to send, resent records first."""
+        if self._requeue:
+            record = self._requeue.popleft()
+        else:
+            record = await self._queue.get()
+        return [] if record is None else [record]
+
+    async def _sender(self):
+        while True:
+            batch = await self._next_batch()
+            for i, record in enumerate(batch):
+                if record.acked:
+                    await self._in_flight_free.acquire()
+                    try:
+                        await self._dealer.send_multipart([b''] + record.frames)
+                    except zmq.ZMQError:
+                        # the socket was replaced by _reconnect() while sending
+                        self._in_flight_free.release()
+                        self._requeue.extendleft(reversed(batch[i:]))
+                        break
+                    record.send_time = self.clock()
+                    self._in_flight.append(record)
+                else:
+                    await self._pub_socket.send_multipart(record.frames)
+                    record.send_time = self.clock()
+                    self._finish(record)
+
+    async def _receiver(self):
+        while True:
+            dealer = self._dealer
+            if await dealer.poll(self.timeout * 1000 / 4):
+                _, reply = await dealer.recv_multipart()
+                ack_time = self.clock()
+                if dealer is not self._dealer or not self._in_flight:
+                    continue
+                record = self._in_flight.popleft()
+                self._in_flight_free.release()
+                record.ack_time = ack_time
+                self._finish(record, reply=reply.decode())
+            elif self._in_flight and self.clock() - self._in_flight[0].send_time > self.timeout:
+                self._reconnect()
+
+    def _finish(self, record, reply=None, error=None):
+        record.reply = reply
+        record.error = error
+        self.history.append(record)
+        if record.future is not None and not record.future.done():
+            if error is None:
+                record.future.set_result(reply)
+            else:
+                record.future.set_exception(TimeoutError(error))
+
+    # enqueueing, safe to call from any thread
+
+    def _put(self, record):
+        if threading.current_thread() is self._thread:
+            # called from a callback of the loop, e.g. a received datagram
+            self._put_nowait(record)
+            return record
+        with self._loop_lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._put_nowait, record)
+                return record
+        self._finish(record, error='closed')
+        return record
+
+    def _put_nowait(self, record):
+        # runs on the loop, the queue is gone once close() has drained it
+        if self._queue is None:
+            self._finish(record, error='closed')
+        elif self._queue.qsize() >= self.max_queue:
+            self.dropped += 1
+            self._finish(record, error='queue full')
+        else:
+            self._queue.put_nowait(record)
+
+    def _enqueue(self, topic, frames, acked, future=None):
+        return self._put(self.record_class(topic, frames, acked, self.clock(), future))
+
+    def _request(self, topic, frames):
+        future = concurrent.futures.Future()
+        self._enqueue(topic, frames, True, future)
+        return future
+
+    @staticmethod
+    def _notification_frames(notification):
+        topic = 'notify.' + notification['subject']
+        return [topic.encode(), serializer.dumps(notification, use_bin_type=True)]
+
+    def request(self, command):
+        """
+        Sends a Pupil Remote command string (e.g. 'C', 'R', 'T 0.0').
+
+        Returns:
+        concurrent.futures.Future resolving to Pupil Remote's reply.
+        """
+        return self._request(command, [command.encode()])
+
+    def start_calibration(self):
+        return self.request('C')
+
+    def stop_calibration(self):
+        return self.request('c')
+
+    def start_recording(self, dir_name=None):
+        return self.request(f'R {dir_name}' if dir_name else 'R')
+
+    def stop_recording(self):
+        return self.request('r')
+
+    def set_time(self, time_fn):
+        """
+        Sets the time in pupil. Unlike the other commands this waits for the reply,
+        since new_trigger() timestamps are only meaningful afterwards.
+        """
+        self.time_fn = time_fn
+        return self.request(f'T {time_fn()}').result()
+
+    def notify(self, notification):
+        """Sends ``notification`` to Pupil Remote, returns a Future of the reply."""
+        return self._request('notify.' + notification['subject'],
+                             self._notification_frames(notification))
+
+    def send_trigger(self, trigger, acked=True):
+        """
+        Queues a trigger object. Acknowledged triggers travel through Pupil
+        Remote, which forwards them to the IPC backbone and replies; the
+        others go out on the PUB socket.
+
+        Returns:
+        TriggerRecord of the trigger, filled in as it is sent and acknowledged.
+        """
+        payload = serializer.dumps(trigger, use_bin_type=True)
+        return self._enqueue(trigger['topic'], [trigger['topic'].encode(), payload], acked)
+
+    def new_trigger(self, topic, label, duration):
+        """
+        Creates a trigger dictionary object (make sure set_time() has been invoked)
+        """
+        return {
+            "topic": topic,
+            "label": label,
+            "timestamp": self.time_fn(),
+            "duration": duration,
+        }
+
+    def annotation(self, label, duration, acked=True):
+        """
+        Shortcut to queueing an annotation (make sure set_time() has been invoked)
+        """
+        return self.send_trigger(self.new_trigger('annotation', label, duration), acked)
+
+    # statistics
+
+    def records(self):
+        """Finished TriggerRecords as a list of dictionaries."""
+        return [record.as_dict() for record in list(self.history)]
+
+    def _finished_records(self):
+        """Finished records that count for the latency statistics."""
+        return list(self.history)
+
+    def latency_stats(self, percentiles=(50, 90, 99, 100)):
+        """
+        Latency percentiles in milliseconds of the finished records, by
+        default queueing (enqueue -> send) and round trip (send -> ack).
+        """
+        finished = self._finished_records()
+        stats = {
+            'n': len(finished),
+            'errors': sum(r.error is not None for r in finished),
+        }
+        for name in self.record_class.LATENCIES:
+            values = sorted(v for v in (r.latency(name) for r in finished) if v is not None)
+            stats[name + '_ms'] = {p: values[min(len(values) - 1, int(len(values) * p / 100))]
+                                   for p in percentiles} if values else {}
+        return stats
@@ -0,0 +1,256 @@
+import collections
+import socket
+import struct
+import threading
+import time
+
+
+class ClockModel:
+    """
+    Linear model of the eye tracker clock as seen from the local clock:
+
+        pupil_time = local_time + offset + drift * (local_time - reference)
+
+    `jitter` is the residual standard deviation of the fitted offsets and
+    `rtt` the median best round trip time of the probe rounds, both in seconds.
+    """
+
+    __slots__ = ('offset', 'drift', 'reference', 'jitter', 'rtt', 'n')
+
+    def __init__(self, offset=0.0, drift=0.0, reference=0.0, jitter=0.0, rtt=0.0, n=0):
+        self.offset = offset
+        self.drift = drift
+        self.reference = reference
+        self.jitter = jitter
+        self.rtt = rtt
+        self.n = n
+
+    def to_pupil(self, local_time):
+        """Converts a local timestamp to eye tracker time."""
+        return local_time + self.offset + self.drift * (local_time - self.reference)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return 'ClockModel(offset={:.6f}s, drift={:.3f}ppm, jitter={:.3f}ms, rtt={:.3f}ms, n={})'.format(
+            self.offset, self.drift * 1e6, self.jitter * 1e3, self.rtt * 1e3, self.n)
+
+
+def fit_clock_model(estimates):
+    """
+    Least squares fit of offset and drift to (local_time, offset, rtt)
+    estimates. A single estimate gives a model without drift.
+    """
+    n = len(estimates)
+    if n == 0:
+        return ClockModel()
+    local_times = [t for t, _, _ in estimates]
+    offsets = [o for _, o, _ in estimates]
+    rtts = sorted(r for _, _, r in estimates)
+    reference = sum(local_times) / n
+    mean_offset = sum(offsets) / n
+    spread = sum((t - reference) ** 2 for t in local_times)
+    drift = 0.0
+    if n > 1 and spread > 0:
+        drift = sum((t - reference) * (o - mean_offset) for t, o in zip(local_times, offsets)) / spread
+    residuals = [o - mean_offset - drift * (t - reference) for t, o in zip(local_times, offsets)]
+    jitter = (sum(r * r for r in residuals) / max(1, n - 2)) ** 0.5 if n > 2 else 0.0
+    return ClockModel(mean_offset, drift, reference, jitter, rtts[n // 2], n)
+
+
+class ClockSyncClient:
+    """
+    Client of the echo protocol of Pupil's network_time_sync.Clock_Sync_Master.
+
+    Every `interval` seconds a round of `n_probes` requests is sent to the
+    master: the client writes b'sync' at local time t0, the master answers
+    with its own time t1 as a little endian double and the answer arrives at
+    t2. Only the probe with the smallest round trip time t2 - t0 of a round is
+    kept, since it is the least affected by queueing in the network stack; its
+    offset t1 - (t0 + t2) / 2 is attributed to the local time (t0 + t2) / 2.
+    Offset and drift are then fitted to the last `window` rounds.
+
+    The master's port is shown in Pupil Capture's Time Sync plugin.
+    """
+
+    def __init__(self, host='127.0.0.1', port=None, time_fn=time.time, n_probes=60, interval=5.0,
+                 window=120, timeout=1.0):
+        """
+        Parameters:
+        host (str): Address of the Pupil Capture computer.
+        port (int): Port of the Clock_Sync_Master echo server.
+        time_fn (callable): Local clock, the one used for annotation timestamps.
+        n_probes (int): Number of requests per round.
+        interval (float): Seconds between rounds in the background thread.
+        window (int): Number of rounds the model is fitted to.
+        timeout (float): Socket timeout in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.time_fn = time_fn
+        self.n_probes = n_probes
+        self.interval = interval
+        self.timeout = timeout
+        self.estimates = collections.deque(maxlen=window)
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def probe(self):
+        """
+        Runs one round of probes.
+
+        Returns:
+        (local_time, offset, rtt) of the probe with the smallest round trip time.
+        """
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        best = None
+        try:
+            for _ in range(self.n_probes):
+                t0 = self.time_fn()
+                sock.sendall(b'sync')
+                message = b''
+                while len(message) < 8:
+                    chunk = sock.recv(8 - len(message))
+                    if not chunk:
+                        raise ConnectionError('Clock sync master closed the connection')
+                    message += chunk
+                t2 = self.time_fn()
+                t1 = struct.unpack('<d', message)[0]
+                if best is None or t2 - t0 < best[2]:
+                    best = ((t0 + t2) / 2, t1 - (t0 + t2) / 2, t2 - t0)
+        finally:
+            sock.close()
+        with self._lock:
+            self.estimates.append(best)
+        return best
+
+    def model(self):
+        """Current ClockModel fitted to the kept rounds."""
+        with self._lock:
+            estimates = list(self.estimates)
+        return fit_clock_model(estimates)
+
+    def sync(self, rounds=5, pause=0.1):
+        """Runs ``rounds`` probe rounds in the calling thread and returns the model."""
+        for i in range(rounds):
+            if i:
+                time.sleep(pause)
+            self.probe()
+        return self.model()
+
+    def start(self):
+        """Keeps probing every `interval` seconds in a background thread."""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='ClockSyncClient', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.probe()
+            except OSError:
+                self.failures += 1
+            self._stop_event.wait(self.interval)
+
+    def annotation(self, model=None):
+        """
+        Annotation carrying the clock model, to be sent with send_trigger() so
+        that it ends up in the recording. preprocess_et reads the last one to
+        correct the annotation timestamps.
+        """
+        model = self.model() if model is None else model
+        trigger = {
+            'topic': 'annotation',
+            'label': 'clock_sync',
+            'timestamp': self.time_fn(),
+            'duration': 0.0,
+        }
+        trigger.update(model.as_dict())
+        return trigger
+
+
+class ClockEchoServer:
+    """
+    Local stand-in for Clock_Sync_Master. Answers every 4 byte request with
+    ``time_fn()`` as a little endian double; pass a time_fn with an offset
+    and drift to test ClockSyncClient.
+    """
+
+    def __init__(self, time_fn=time.time, host='127.0.0.1', port=0):
+        self.time_fn = time_fn
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(5)
+        self._server.settimeout(0.1)
+        self.host, self.port = self._server.getsockname()[:2]
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='ClockEchoServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._server.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            threading.Thread(target=self._echo, args=(conn,), daemon=True).start()
+
+    def _echo(self, conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with conn:
+            while self._running:
+                try:
+                    data = conn.recv(4)
+                except OSError:
+                    return
+                if not data:
+                    return
+                conn.sendall(struct.pack('<d', self.time_fn()))
+
+
+if __name__ == '__main__':
+    # Self check against a local echo server whose clock runs 2.5 s ahead and 50 ppm fast
+    true_offset, true_drift = 2.5, 50e-6
+    start = time.time()
+
+    def master_time():
+        now = time.time()
+        return now + true_offset + true_drift * (now - start)
+
+    with ClockEchoServer(master_time) as server:
+        client = ClockSyncClient(server.host, server.port, window=50)
+        for _ in range(20):
+            client.probe()
+            time.sleep(0.05)
+        model = client.model()
+    now = time.time()
+    print(model)
+    print('Error at now: {:.3f} ms'.format(1000 * (model.to_pupil(now) - master_time())))
@@ -1,9 +1,12 @@
 from zmq_socket import ZMQsocket
+from clock_sync import ClockSyncClient
 from time import sleep, time
 
 remote_ip = '10.142.20.154'
 print('Make sure the ports match with Pupil Capture Remote Plugin and the one in zmq_pocket.py')
 port = '50020'
+# Port of Pupil Capture's Time Sync master (shown in the Time Sync plugin), None to skip clock sync
+clock_sync_port = None
 socket = ZMQsocket()
 socket.connect()
 # socket.start_calibration()
@@ -14,6 +17,12 @@ time_fn = time
 # Sync time
 print(socket.set_time(time_fn))
 
+# set_time() only aligns the clocks once; keep estimating the remaining offset and drift
+if clock_sync_port:
+    clock = ClockSyncClient('127.0.0.1', clock_sync_port, time_fn=time_fn)
+    print(clock.sync())
+    clock.start()
+
 # # Start the notifications puglin
 socket.notify({'subject': 'start_plugin', 'name': 'Annotation_Capture', 'args': {}})
 #
@@ -29,5 +38,11 @@ socket.annotation('end_trial', 0)
 sleep(1.)
 
 # Finish up
+# log the clock model into the recording, preprocess_et uses it to correct the annotation timestamps
+if clock_sync_port:
+    clock.stop()
+    print(clock.model())
+    socket.send_trigger(clock.annotation())
+    sleep(0.5)
 socket.stop_recording()
 print('Script completed.')
@@ -0,0 +1,466 @@
+"""
+Live quality monitor for drives.
+
+Subscribes to the gaze and pupil data on Pupil Capture's IPC backbone, keeps
+the most recent samples in ring buffers and runs incremental versions of the
+checks of preprocessing/functions while the subject is driving:
+
+- blinks: the confidence filter of detect_blinks.Blink_Detection
+- saccades: the Engbert & Mergenthaler velocity threshold of detect_saccades
+- bad samples: the out of monitor and sampling frequency checks of
+  et_detect_bad_samples, plus low confidence and tracking loss
+
+Detected events and periodic quality metrics are published back to Pupil
+Capture as annotations, so they end up in the recording.
+
+    python live_monitor.py [PUPIL_REMOTE_IP] [PUPIL_REMOTE_PORT]
+"""
+import collections
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import zmq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib', 'pupil', 'pupil_src',
+                             'shared_modules'))
+import zmq_tools
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of the most recent samples, one float column per field.
+    Appending never allocates; last() returns the newest samples in order.
+    """
+
+    def __init__(self, fields, capacity=4096):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.data = np.full((len(self.fields), capacity), np.nan)
+        self.count = 0  # number of samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def extend(self, rows):
+        """Appends a (n, len(fields)) array of samples."""
+        rows = np.asarray(rows, dtype=float).reshape(-1, len(self.fields))[-self.capacity:]
+        n = len(rows)
+        start = self.count % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[:, start:start + first] = rows[:first].T
+        self.data[:, :n - first] = rows[first:].T
+        self.count += n
+
+    def last(self, n=None):
+        """
+        Returns the newest ``n`` samples (all buffered ones if None) as a
+        dict of field name -> array, oldest first.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        end = self.count % self.capacity
+        idx = np.arange(end - n, end) % self.capacity
+        block = self.data[:, idx]
+        return dict(zip(self.fields, block))
+
+
+class OnlineBlinkDetector:
+    """
+    Incremental version of the Blink_Detection confidence filter. For every
+    new pupil sample, the confidence of the last `history_length` seconds
+    is convolved with a step filter (first half positive, second half
+    negative); strong positive responses mark a blink onset, strong negative
+    responses its offset. A blink is reported once the response recovers
+    after the offset, as in Offline_Blink_Detection.
+    """
+
+    def __init__(self, history_length=0.2, onset_confidence_threshold=0.5, offset_confidence_threshold=0.5):
+        self.history_length = history_length
+        self.onset_confidence_threshold = onset_confidence_threshold
+        self.offset_confidence_threshold = offset_confidence_threshold
+        self.state = 'no blink'
+        self.start = None
+        self.last_ts = None
+        self.responses = []
+
+    def filter_response(self, ts, confidence, n_new):
+        """
+        Filter responses of the newest ``n_new`` samples of ``ts`` and
+        ``confidence``; NaN where the history is shorter than history_length.
+        """
+        n = len(ts)
+        new = np.arange(n - n_new, n)
+        start = np.searchsorted(ts, ts[new] - self.history_length, side='right') - 1
+        valid = (start >= 0) & (new - start >= 1)
+        start = np.clip(start, 0, None)
+        size = new - start + 1
+        cumsum = np.concatenate(([0.], np.cumsum(confidence)))
+        half = size // 2
+        # first half weighted +1/size, second half -1/size, middle sample 0 for odd sizes
+        first = cumsum[start + half] - cumsum[start]
+        second = cumsum[new + 1] - cumsum[start + half + size % 2]
+        response = (first - second) / size / 0.45
+        response[~valid] = np.nan
+        return response
+
+    def update(self, ts, confidence, n_new):
+        """
+        Processes the newest ``n_new`` of the buffered pupil samples.
+
+        Returns:
+        list of finished blinks as dicts with start_timestamp, end_timestamp,
+        duration and confidence.
+        """
+        response = self.filter_response(ts, confidence, n_new)
+        new_ts = ts[len(ts) - n_new:]
+        blinks = []
+        for t, r in zip(new_ts, response):
+            if np.isnan(r):
+                continue
+            classification = 1 if r > self.onset_confidence_threshold else \
+                -1 if r < -self.offset_confidence_threshold else 0
+            if self.state == 'no blink' and classification > 0:
+                self._start_blink(t)
+            elif self.state == 'blink started' and classification == -1:
+                self.state = 'blink ending'
+            elif self.state == 'blink ending' and classification >= 0:
+                blinks.append(self._finish_blink(self.last_ts))
+                if classification > 0:
+                    self._start_blink(t)
+                else:
+                    self.state = 'no blink'
+            if self.state != 'no blink':
+                self.responses.append(abs(r))
+            self.last_ts = t
+        return blinks
+
+    def _start_blink(self, t):
+        self.state = 'blink started'
+        self.start = t
+        self.responses = []
+
+    def _finish_blink(self, t):
+        return {
+            'start_timestamp': self.start,
+            'end_timestamp': t,
+            'duration': t - self.start,
+            'confidence': min(float(np.mean(self.responses)) if self.responses else 0., 1.0),
+        }
+
+
+class OnlineSaccadeDetector:
+    """
+    Incremental version of the Engbert & Mergenthaler detector of
+    detect_saccades.apply_engbert_mergenthaler. Velocities are scaled by the
+    median based deviation of the last `threshold_window` seconds; a saccade
+    is a run of samples whose scaled velocity exceeds `l`, lasts longer than
+    `minimum_saccade_duration` and contains no low confidence samples.
+    """
+
+    def __init__(self, l=5, threshold_window=2.0, minimum_saccade_duration=0.0075, min_confidence=0.6):
+        self.l = l
+        self.threshold_window = threshold_window
+        self.minimum_saccade_duration = minimum_saccade_duration
+        self.min_confidence = min_confidence
+        self.current = None
+
+    def velocities(self, ts, gx, gy, confidence):
+        """Velocity of every sample against its predecessor, NaN around low confidence samples."""
+        dt = np.diff(ts)
+        dt[dt <= 0] = np.nan
+        vel = np.full((len(ts), 2), np.nan)
+        vel[1:, 0] = np.diff(gx) / dt
+        vel[1:, 1] = np.diff(gy) / dt
+        bad = confidence < self.min_confidence
+        vel[bad] = np.nan
+        vel[1:][bad[:-1]] = np.nan
+        return vel
+
+    def update(self, ts, gx, gy, confidence, n_new):
+        """
+        Processes the newest ``n_new`` of the buffered gaze samples.
+
+        Returns:
+        list of finished saccades as dicts with start_timestamp, end_timestamp,
+        duration, amplitude and peak_velocity (normalized units per second).
+        """
+        vel = self.velocities(ts, gx, gy, confidence)
+        window = vel[ts >= ts[-1] - self.threshold_window]
+        window = window[~np.isnan(window).any(axis=1)]
+        if len(window) < 3:
+            return []
+        med = np.median(window, axis=0)
+        std = np.mean(np.abs(window - med), axis=0)
+        if not np.all(std > 0):
+            return []
+        start = len(ts) - n_new
+        scaled = np.sqrt(np.sum((vel[start:] / std) ** 2, axis=1))
+        speed = np.sqrt(np.sum(vel[start:] ** 2, axis=1))
+        saccades = []
+        for i, (s, v) in enumerate(zip(scaled, speed)):
+            j = start + i
+            if np.isnan(s):
+                # samples lost in a blink invalidate the saccade, as in the offline detector
+                self.current = None
+            elif s > self.l:
+                if self.current is None:
+                    self.current = {'start_timestamp': ts[j - 1], 'start_x': gx[j - 1], 'start_y': gy[j - 1],
+                                    'peak_velocity': v}
+                else:
+                    self.current['peak_velocity'] = max(self.current['peak_velocity'], v)
+            elif self.current is not None:
+                saccade = self.current
+                self.current = None
+                duration = ts[j - 1] - saccade['start_timestamp']
+                if duration > self.minimum_saccade_duration:
+                    saccades.append({
+                        'start_timestamp': saccade['start_timestamp'],
+                        'end_timestamp': ts[j - 1],
+                        'duration': duration,
+                        'amplitude': float(np.hypot(gx[j - 1] - saccade.pop('start_x'),
+                                                    gy[j - 1] - saccade.pop('start_y'))),
+                        'peak_velocity': float(saccade['peak_velocity']),
+                    })
+        return saccades
+
+
+class QualityMonitor:
+    """
+    Running counts of the bad sample checks of et_detect_bad_samples, on
+    normalized gaze positions: the monitor tolerance of 500 px on a
+    1920 x 1080 display becomes a margin of 500/1920 and 500/1080.
+    """
+
+    def __init__(self, margin=(500 / 1920, 500 / 1080), min_sampling_rate=120., min_confidence=0.6):
+        self.margin = margin
+        self.min_sampling_rate = min_sampling_rate
+        self.min_confidence = min_confidence
+        self.reset()
+
+    def reset(self):
+        self.counts = collections.Counter()
+        self.confidence_sum = 0.
+        self.first_ts = None
+        self.last_ts = None
+
+    def update(self, ts, gx, gy, confidence, previous_ts=None):
+        """Adds a batch of gaze samples to the counts."""
+        if not len(ts):
+            return
+        outside = (gx < -self.margin[0]) | (gx > 1 + self.margin[0]) | \
+                  (gy < -self.margin[1]) | (gy > 1 + self.margin[1])
+        prior = ts[:1] if previous_ts is None else [previous_ts]
+        dt = np.diff(np.concatenate((prior, ts)))
+        self.counts['samples'] += len(ts)
+        self.counts['outside'] += int(np.sum(outside))
+        self.counts['bad_freq'] += int(np.sum(dt > 1. / self.min_sampling_rate))
+        self.counts['neg_time'] += int(np.sum(ts < 0))
+        self.counts['low_confidence'] += int(np.sum(confidence < self.min_confidence))
+        self.confidence_sum += float(np.sum(confidence))
+        if self.first_ts is None:
+            self.first_ts = ts[0]
+        self.last_ts = ts[-1]
+
+    def report(self):
+        """Quality metrics since the last reset()."""
+        n = self.counts['samples']
+        span = (self.last_ts - self.first_ts) if n > 1 else 0.
+        metrics = {
+            'samples': n,
+            'sampling_rate': (n - 1) / span if span > 0 else 0.,
+            'mean_confidence': self.confidence_sum / n if n else 0.,
+        }
+        for name in ('outside', 'bad_freq', 'neg_time', 'low_confidence'):
+            metrics[name] = self.counts[name] / n if n else 0.
+        return metrics
+
+
+class LiveMonitor:
+    """
+    Subscribes to gaze and pupil data on the IPC backbone and publishes the
+    online events and quality metrics back as annotations:
+
+    - 'live blink' and 'live saccade' for every detected event,
+    - 'live quality' every `report_interval` seconds of eye tracker time,
+    - 'live tracking lost' when no gaze arrives for `tracking_timeout` seconds.
+
+    Every batch of messages drained from the socket is processed at once;
+    the receive and processing times of each batch are kept in `batch_times`.
+    """
+
+    def __init__(self, ctx, sub_url, pub_url, capacity=4096, report_interval=1.0, tracking_timeout=0.5,
+                 latency_budget=0.02, max_batch=1000, pupil_detector='2d', publish=True):
+        """
+        Parameters:
+        ctx (zmq.Context): Context for the sockets.
+        sub_url (str): Url of the IPC backbone's SUB port.
+        pub_url (str): Url of the IPC backbone's PUB port, for the annotations.
+        capacity (int): Samples kept per ring buffer.
+        report_interval (float): Seconds between quality annotations.
+        tracking_timeout (float): Seconds without gaze before tracking counts as lost.
+        latency_budget (float): Processing time per batch above which a warning is logged.
+        max_batch (int): Maximum number of messages drained per batch.
+        pupil_detector (str): Pupil topics used for blink detection end with it, None for all.
+        publish (bool): Send annotations to Pupil Capture.
+        """
+        self.receiver = zmq_tools.Msg_Receiver(ctx, sub_url, topics=('gaze', 'pupil'), hwm=0)
+        self.streamer = zmq_tools.Msg_Streamer(ctx, pub_url) if publish else None
+        self.gaze = RingBuffer(('timestamp', 'x', 'y', 'confidence'), capacity)
+        self.pupil = RingBuffer(('timestamp', 'confidence', 'diameter'), capacity)
+        self.blinks = OnlineBlinkDetector()
+        self.saccades = OnlineSaccadeDetector()
+        self.quality = QualityMonitor()
+        self.report_interval = report_interval
+        self.tracking_timeout = tracking_timeout
+        self.latency_budget = latency_budget
+        self.max_batch = max_batch
+        self.pupil_detector = pupil_detector
+        self.batch_times = collections.deque(maxlen=100000)
+        self.events = collections.deque(maxlen=100000)
+        self.tracking_lost = False
+        self._last_gaze_wall = None
+        self._last_report_ts = None
+        self._last_gaze_ts = None
+
+    def drain(self):
+        """Receives all messages waiting on the socket, up to max_batch."""
+        gaze, pupil = [], []
+        for _ in range(self.max_batch):
+            if not self.receiver.new_data:
+                break
+            topic, datum = self.receiver.recv()
+            if topic.startswith('gaze'):
+                gaze.append((datum['timestamp'], datum['norm_pos'][0], datum['norm_pos'][1], datum['confidence']))
+            elif self.pupil_detector is None or topic.endswith(self.pupil_detector):
+                pupil.append((datum['timestamp'], datum['confidence'], datum.get('diameter', np.nan)))
+        return gaze, pupil
+
+    def process(self, gaze, pupil):
+        """
+        Runs the online checks on a batch of new samples.
+
+        Returns:
+        list of annotations published for this batch.
+        """
+        annotations = []
+        if pupil:
+            pupil.sort()
+            self.pupil.extend(pupil)
+            buffered = self.pupil.last()
+            for blink in self.blinks.update(buffered['timestamp'], buffered['confidence'], len(pupil)):
+                annotations.append(self._annotation('live blink', blink))
+        if gaze:
+            gaze.sort()
+            self.gaze.extend(gaze)
+            buffered = self.gaze.last()
+            n = len(gaze)
+            for saccade in self.saccades.update(buffered['timestamp'], buffered['x'], buffered['y'],
+                                                buffered['confidence'], min(n, len(buffered['timestamp']) - 1)):
+                annotations.append(self._annotation('live saccade', saccade))
+            self.quality.update(buffered['timestamp'][-n:], buffered['x'][-n:], buffered['y'][-n:],
+                                buffered['confidence'][-n:], self._last_gaze_ts)
+            self._last_gaze_ts = buffered['timestamp'][-1]
+            self._last_gaze_wall = time.perf_counter()
+            if self.tracking_lost:
+                self.tracking_lost = False
+                annotations.append(self._annotation('live tracking regained', {'start_timestamp': self._last_gaze_ts}))
+            if self._last_report_ts is None:
+                self._last_report_ts = self._last_gaze_ts
+            elif self._last_gaze_ts - self._last_report_ts >= self.report_interval:
+                metrics = self.quality.report()
+                metrics['start_timestamp'] = self._last_report_ts
+                metrics['duration'] = self._last_gaze_ts - self._last_report_ts
+                annotations.append(self._annotation('live quality', metrics))
+                self.quality.reset()
+                self._last_report_ts = self._last_gaze_ts
+        elif (not self.tracking_lost and self._last_gaze_wall is not None
+              and time.perf_counter() - self._last_gaze_wall > self.tracking_timeout):
+            self.tracking_lost = True
+            annotations.append(self._annotation('live tracking lost', {'start_timestamp': self._last_gaze_ts}))
+        for annotation in annotations:
+            self.events.append(annotation)
+            if self.streamer is not None:
+                self.streamer.send(annotation)
+        return annotations
+
+    def _annotation(self, label, event):
+        annotation = {
+            'topic': 'annotation',
+            'label': label,
+            'timestamp': event.get('start_timestamp'),
+            'duration': event.get('duration', 0.),
+        }
+        annotation.update((key, value) for key, value in event.items() if key not in ('start_timestamp', 'duration'))
+        logger.debug('{}: {}'.format(label, annotation))
+        return annotation
+
+    def step(self, timeout=0.1):
+        """Waits up to ``timeout`` seconds for data, then processes everything that arrived."""
+        self.receiver.socket.poll(timeout * 1000)
+        start = time.perf_counter()
+        gaze, pupil = self.drain()
+        received = time.perf_counter()
+        annotations = self.process(gaze, pupil)
+        end = time.perf_counter()
+        if gaze or pupil:
+            self.batch_times.append((len(gaze) + len(pupil), received - start, end - received))
+            if end - start > self.latency_budget:
+                logger.warning('Batch of {} samples took {:.1f} ms'.format(len(gaze) + len(pupil), (end - start) * 1000))
+        return annotations
+
+    def run(self, duration=None):
+        """Processes batches until interrupted or for ``duration`` seconds."""
+        end = None if duration is None else time.perf_counter() + duration
+        while end is None or time.perf_counter() < end:
+            self.step()
+
+    def latency_stats(self, percentiles=(50, 90, 99, 100)):
+        """
+        Time per batch in milliseconds: receiving and deserializing the
+        messages, running the checks, and both together.
+        """
+        if not self.batch_times:
+            return {}
+        sizes, receive, check = (np.array(column) for column in zip(*self.batch_times))
+        total = receive + check
+        stats = {
+            'batches': len(sizes),
+            'mean_batch_size': float(sizes.mean()),
+            'over_budget': int(np.sum(total > self.latency_budget)),
+        }
+        for name, times in (('receive_ms', receive), ('check_ms', check), ('total_ms', total)):
+            stats[name] = {p: float(1000 * np.percentile(times, p)) for p in percentiles}
+        return stats
+
+
+def connect(ip='127.0.0.1', port='50020', **kwargs):
+    """Asks Pupil Remote for the IPC ports and returns a LiveMonitor subscribed to them."""
+    ctx = zmq.Context.instance()
+    remote = ctx.socket(zmq.REQ)
+    remote.connect(f'tcp://{ip}:{port}')
+    remote.send_string('SUB_PORT')
+    sub_port = remote.recv_string()
+    remote.send_string('PUB_PORT')
+    pub_port = remote.recv_string()
+    remote.close()
+    return LiveMonitor(ctx, f'tcp://{ip}:{sub_port}', f'tcp://{ip}:{pub_port}', **kwargs)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    args = sys.argv[1:]
+    ip = args[0] if len(args) >= 1 else '127.0.0.1'
+    port = args[1] if len(args) >= 2 else '50020'
+
+    monitor = connect(ip, port)
+    try:
+        while True:
+            for annotation in monitor.step():
+                if annotation['label'] != 'live saccade':
+                    print(annotation)
+    except KeyboardInterrupt:
+        print(monitor.latency_stats())
@@ -0,0 +1,47 @@
+"""
+Load test of AsyncZMQsocket against the local Pupil Remote stand-in.
+
+Usage: python load_test.py [N_TRIGGERS] [RATE_PER_SECOND] [REPLY_DELAY_SECONDS]
+"""
+import sys
+import time
+
+from async_zmq_socket import AsyncZMQsocket
+from pupil_remote_stub import PupilRemoteStub
+
+
+def load_test(n_triggers=10000, rate=5000.0, delay=0.0):
+    with PupilRemoteStub(delay=delay) as remote:
+        with AsyncZMQsocket(port=remote.port) as socket:
+            socket.set_time(time.time)
+
+            # The enqueue cost is what the simulator loop pays per trigger.
+            interval = 1.0 / rate
+            enqueue_times = []
+            start = time.perf_counter()
+            for i in range(n_triggers):
+                t0 = time.perf_counter()
+                socket.annotation(f'trigger_{i}', 0)
+                enqueue_times.append(time.perf_counter() - t0)
+                ahead = start + (i + 1) * interval - time.perf_counter()
+                if ahead > 0:
+                    time.sleep(ahead)
+            elapsed = time.perf_counter() - start
+        stats = socket.latency_stats()
+
+    enqueue_times.sort()
+    print(f'Sent {n_triggers} triggers in {elapsed:.2f} s ({n_triggers / elapsed:.0f} triggers/s)')
+    print(f'Pupil Remote received {remote.forwarded} forwarded messages')
+    print(f'Enqueue cost: median {1e6 * enqueue_times[len(enqueue_times) // 2]:.1f} us, '
+          f'max {1e6 * enqueue_times[-1]:.1f} us')
+    print(f'Errors: {stats["errors"]}')
+    for name in ('queueing_ms', 'round_trip_ms'):
+        print(name, ', '.join(f'p{p}={v:.2f}' for p, v in stats[name].items()))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    n_triggers = int(args[0]) if len(args) >= 1 else 10000
+    rate = float(args[1]) if len(args) >= 2 else 5000.0
+    delay = float(args[2]) if len(args) >= 3 else 0.0
+    load_test(n_triggers, rate, delay)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import zmq
+
+
+class PupilRemoteStub:
+    """
+    Local stand-in for Pupil Capture's Pupil Remote plugin, for testing the
+    socket clients without an eye tracker.
+
+    It answers the same commands as Pupil Remote (PUB_PORT, SUB_PORT, R, r, C,
+    c, T, t, v and forwarded multipart messages) and counts the messages it
+    receives on its REP socket and on the PUB port. `delay` seconds are
+    added to every reply to simulate a busy Pupil Capture.
+    """
+
+    def __init__(self, ip='127.0.0.1', port=None, delay=0.0):
+        """
+        Parameters:
+        ip (str): Interface to bind to.
+        port (int): Pupil Remote port, a free one is picked if None.
+        delay (float): Seconds to wait before each reply.
+        """
+        self.ip = ip
+        self.delay = delay
+        self.requests = 0
+        self.forwarded = 0
+        self.published = 0
+        self.timebase = 0.0
+        self._ctx = zmq.Context()
+        self._remote = self._ctx.socket(zmq.REP)
+        self._sub = self._ctx.socket(zmq.SUB)
+        self._sub.setsockopt(zmq.SUBSCRIBE, b'')
+        if port is None:
+            self.port = str(self._remote.bind_to_random_port(f'tcp://{ip}'))
+        else:
+            self.port = str(port)
+            self._remote.bind(f'tcp://{ip}:{self.port}')
+        self.pub_port = str(self._sub.bind_to_random_port(f'tcp://{ip}'))
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='PupilRemoteStub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._remote.close(linger=0)
+        self._sub.close(linger=0)
+        self._ctx.term()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        poller = zmq.Poller()
+        poller.register(self._remote, zmq.POLLIN)
+        poller.register(self._sub, zmq.POLLIN)
+        while self._running:
+            for socket, _ in poller.poll(50):
+                if socket is self._remote:
+                    self._on_request(self._remote.recv_multipart())
+                else:
+                    self._sub.recv_multipart()
+                    self.published += 1
+
+    def _on_request(self, frames):
+        self.requests += 1
+        msg = frames[0].decode()
+        if len(frames) > 1:
+            self.forwarded += 1
+            response = 'Message forwarded.'
+        elif msg == 'SUB_PORT':
+            response = self.pub_port
+        elif msg == 'PUB_PORT':
+            response = self.pub_port
+        elif msg[0] in 'RrCc':
+            response = 'OK'
+        elif msg[0] == 'T':
+            try:
+                self.timebase = time.monotonic() - float(msg[2:])
+                response = 'Timesync successful.'
+            except ValueError:
+                response = f"'{msg[2:]}' cannot be converted to float."
+        elif msg[0] == 't':
+            response = repr(time.monotonic() - self.timebase)
+        elif msg[0] == 'v':
+            response = 'stub'
+        else:
+            response = 'Unknown command.'
+        if self.delay:
+            time.sleep(self.delay)
+        self._remote.send_string(response)
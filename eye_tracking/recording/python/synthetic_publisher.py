@@ -0,0 +1,218 @@
+"""
+Synthetic stand-in for Pupil Capture's IPC backbone, for testing
+live_monitor.py without an eye tracker.
+
+    python synthetic_publisher.py [DURATION_SECONDS] [RATE_HZ] [SAMPLES_PER_BATCH]
+
+runs a LiveMonitor against it and compares the detected events with the
+ones that were injected.
+"""
+import logging
+import multiprocessing
+import sys
+import threading
+import time
+
+import msgpack as serializer
+import numpy as np
+import zmq
+
+
+def synthetic_signal(duration, rate=200., seed=0):
+    """
+    Generates ``duration`` seconds of fixations, saccades, blinks, gaze
+    outside the display and a tracking loss.
+
+    Returns:
+    (timestamps, x, y, confidence, injected); samples during the tracking
+    loss are dropped and injected maps each event kind to (start, end) times.
+    """
+    rng = np.random.default_rng(seed)
+    injected = {'saccade': [], 'blink': [], 'outside': [], 'tracking_lost': []}
+    n = int(duration * rate)
+    ts = np.arange(n) / rate
+    x = np.empty(n)
+    y = np.empty(n)
+    confidence = np.clip(rng.normal(0.95, 0.02, n), 0, 1)
+    pos = np.array([0.5, 0.5])
+    i = 0
+    while i < n:
+        fixation = int(rng.uniform(0.2, 0.5) * rate)
+        x[i:i + fixation] = pos[0] + rng.normal(0, 0.002, len(x[i:i + fixation]))
+        y[i:i + fixation] = pos[1] + rng.normal(0, 0.002, len(y[i:i + fixation]))
+        i += fixation
+        if i >= n:
+            break
+        target = rng.uniform(0.1, 0.9, 2)
+        length = int(0.03 * rate)
+        profile = (1 - np.cos(np.linspace(0, np.pi, length))) / 2
+        path = pos + np.outer(profile, target - pos)[:n - i]
+        x[i:i + len(path)], y[i:i + len(path)] = path.T
+        if i + length < n:
+            injected['saccade'].append((ts[i], ts[i + length - 1]))
+        pos = target
+        i += length
+
+    for start in np.arange(2.0, duration - 1, 3.0):
+        blink = (ts >= start) & (ts < start + 0.15)
+        confidence[blink] = rng.uniform(0, 0.05, blink.sum())
+        injected['blink'].append((start, start + 0.15))
+    for start in np.arange(4.5, duration - 1, 10.0):
+        outside = (ts >= start) & (ts < start + 0.5)
+        x[outside] = 1.5
+        injected['outside'].append((start, start + 0.5))
+    keep = np.ones(n, dtype=bool)
+    if duration > 8:
+        lost = (ts >= 7.0) & (ts < 8.0)
+        keep[lost] = False
+        injected['tracking_lost'].append((7.0, 8.0))
+    return ts[keep], x[keep], y[keep], confidence[keep], injected
+
+
+class SyntheticPublisher:
+    """
+    Publishes synthetic gaze ('gaze.2d.0.') and pupil ('pupil.0.2d') data in
+    real time and collects the annotations sent back.
+
+    The signal alternates between fixations with a little noise and
+    saccades to a new position, and contains blinks (confidence drops to 0),
+    stretches where gaze is outside the display and one tracking loss
+    (nothing is sent). The injected events are kept in `injected`.
+
+    Publishing runs in its own process, so that it does not compete with
+    the monitor under test for the interpreter; the annotations are
+    collected by a thread of the calling process.
+    """
+
+    def __init__(self, rate=200., batch=1, seed=0, ip='127.0.0.1'):
+        """
+        Parameters:
+        rate (float): Sampling rate in Hz.
+        batch (int): Number of samples sent back to back.
+        seed (int): Seed of the random signal.
+        ip (str): Interface to bind to.
+        """
+        self.rate = rate
+        self.batch = batch
+        self.seed = seed
+        self.ip = ip
+        self.injected = {}
+        self.annotations = []
+        self.sent = 0
+        self.sub_url = None
+        self._ctx = zmq.Context()
+        self._sub = self._ctx.socket(zmq.SUB)
+        self._sub.setsockopt(zmq.SUBSCRIBE, b'annotation')
+        self.pub_url = 'tcp://{}:{}'.format(ip, self._sub.bind_to_random_port('tcp://' + ip))
+        self._process = None
+        self._conn = None
+        self._collecting = False
+        self._collector = None
+
+    def signal(self, duration):
+        """
+        Generates ``duration`` seconds of samples and fills `injected`.
+
+        Returns:
+        (timestamps, x, y, confidence) arrays; samples during the tracking loss are dropped.
+        """
+        *samples, self.injected = synthetic_signal(duration, self.rate, self.seed)
+        return samples
+
+    def start(self, duration, delay=0.5):
+        """
+        Starts publishing ``duration`` seconds of data after ``delay`` seconds,
+        which leaves time to connect the subscriber to `sub_url`.
+        """
+        self.signal(duration)
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.get_context('spawn').Process(
+            target=_publish, args=(child_conn, self.ip, self.rate, self.batch, self.seed, duration, delay),
+            name='SyntheticPublisher', daemon=True)
+        self._process.start()
+        self.sub_url = self._conn.recv()
+        # the SUB socket has to be serviced for its subscription to reach the monitor
+        self._collecting = True
+        self._collector = threading.Thread(target=self._collect, name='AnnotationCollector', daemon=True)
+        self._collector.start()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.join()
+            self.sent = self._conn.recv()
+        self._collecting = False
+        self._collector.join()
+        self._sub.close(linger=0)
+        self._ctx.term()
+
+    def _collect(self):
+        while self._collecting or self._sub.poll(0):
+            if self._sub.poll(50):
+                topic, payload = self._sub.recv_multipart()
+                self.annotations.append(serializer.unpackb(payload, raw=False))
+
+
+def _publish(conn, ip, rate, batch, seed, duration, delay):
+    """Publishing loop of SyntheticPublisher, runs in a separate process."""
+    ctx = zmq.Context()
+    pub = ctx.socket(zmq.PUB)
+    pub.set_hwm(0)
+    conn.send('tcp://{}:{}'.format(ip, pub.bind_to_random_port('tcp://' + ip)))
+    ts, x, y, confidence, _ = synthetic_signal(duration, rate, seed)
+    time.sleep(delay)
+    sent = 0
+    start = time.perf_counter()
+    for i in range(0, len(ts), batch):
+        # pace by the timestamp of the batch, so the tracking loss is a gap in time
+        time.sleep(max(0., start + ts[i] - time.perf_counter()))
+        for j in range(i, min(i + batch, len(ts))):
+            for topic, datum in (
+                    ('pupil.0.2d', {'topic': 'pupil.0.2d', 'timestamp': ts[j], 'confidence': confidence[j],
+                                    'diameter': 40.0, 'id': 0, 'method': '2d c++'}),
+                    ('gaze.2d.0.', {'topic': 'gaze.2d.0.', 'timestamp': ts[j], 'confidence': confidence[j],
+                                    'norm_pos': (x[j], y[j])})):
+                pub.send_string(topic, flags=zmq.SNDMORE)
+                pub.send(serializer.packb(datum, use_bin_type=True))
+            sent += 1
+    conn.send(sent)
+    pub.close(linger=1000)
+    ctx.term()
+
+
+def overlaps(interval, events, slack=0.05):
+    """Whether any (start, end) of ``events`` overlaps ``interval`` within ``slack`` seconds."""
+    return any(start - slack <= interval[1] and interval[0] <= end + slack for start, end in events)
+
+
+if __name__ == '__main__':
+    from live_monitor import LiveMonitor
+
+    logging.basicConfig(level=logging.WARNING)
+    args = sys.argv[1:]
+    duration = float(args[0]) if len(args) >= 1 else 20.
+    rate = float(args[1]) if len(args) >= 2 else 200.
+    batch = int(args[2]) if len(args) >= 3 else 1
+
+    publisher = SyntheticPublisher(rate=rate, batch=batch).start(duration)
+    monitor = LiveMonitor(zmq.Context.instance(), publisher.sub_url, publisher.pub_url)
+    monitor.run(duration + 0.8)
+    publisher.stop()
+
+    print('Sent {} samples, received {} annotations'.format(publisher.sent, len(publisher.annotations)))
+    for kind, label in (('blink', 'live blink'), ('saccade', 'live saccade')):
+        detected = [(a['timestamp'], a['timestamp'] + a['duration']) for a in publisher.annotations
+                    if a['label'] == label]
+        injected = publisher.injected[kind]
+        hits = sum(overlaps(event, detected) for event in injected)
+        true = sum(overlaps(event, injected + publisher.injected['blink']) for event in detected)
+        print('{:>8}: {}/{} injected found, {}/{} detected match an injected event'.format(
+            kind, hits, len(injected), true, len(detected)))
+    quality = [a for a in publisher.annotations if a['label'] == 'live quality']
+    outside = [a for a in quality if a['outside'] > 0]
+    print('quality reports: {}, with gaze outside the display: {} (injected {})'.format(
+        len(quality), len(outside), len(publisher.injected['outside'])))
+    print('tracking lost: {} (injected {})'.format(
+        sum(a['label'] == 'live tracking lost' for a in publisher.annotations),
+        len(publisher.injected['tracking_lost'])))
+    print('Processing time per batch (ms): {}'.format(monitor.latency_stats()))
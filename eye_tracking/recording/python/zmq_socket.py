@@ -63,7 +63,8 @@ class ZMQsocket:
 
     def set_time(self, time_fn):
         """
-        Sets the time in pupil.
+        Sets the time in pupil. This only aligns the clocks once, use
+        clock_sync.ClockSyncClient to track the remaining offset and drift.
 
         Parameters:
         time (float): Time to set to. 